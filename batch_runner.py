@@ -0,0 +1,557 @@
+"""
+バッチ処理（OpenAI Batch API）
+大量の求人票をオフラインで一括処理する。各レイヤーのリクエストをバッチ入力ファイル（JSONL）に変換して投入し、
+完了をポーリングして結果を次のレイヤーのバッチへ受け渡す
+
+使い方:
+    python batch_runner.py run --input postings.jsonl [--run-id RUN_ID]
+    python batch_runner.py status --run-id RUN_ID
+    python batch_runner.py local --input postings.jsonl [--run-id RUN_ID] [--workers 4]
+
+入力ファイルは1行1求人のJSONL（{"id": "...", "job_text": "...", "job_category": "..."}）。
+同じ run-id で再実行すると、完了済みステージをスキップし投入済みバッチのポーリングから再開する。
+
+local は Batch API を使わず、UI と同じパイプライン（ステージグラフ）で求人ごとに同期実行する（少量の求人・Batch API の待ち時間を避けたい場合）。
+同じ run-id で再実行すると完了済みの求人を省き、失敗した求人はチェックポイントから再開する。
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from utils import (
+    append_token_usage,
+    build_chat_request_body,
+    get_openai_client,
+    parse_json_with_retry,
+    validate_comparison_data,
+    logger
+)
+from layer1 import _build_layer1_prompt, _postprocess_layer1_response
+from layer2 import (
+    STEP1_MAX_TOKENS,
+    STEP3_MAX_TOKENS,
+    _build_step1_prompt,
+    _build_step3_prompt,
+    _decide_web_search,
+    _record_search,
+    execute_dual_search
+)
+from layer3 import (
+    TECH_SPECIALIZATION_MAX_TOKENS,
+    _apply_tech_specialization,
+    _build_layer3_prompt,
+    _build_tech_specialization_prompt,
+    _postprocess_layer3_response
+)
+from category_knowledge import get_profile_context
+from model_routing import resolve_model, route_of_model
+
+# ステージは順に実行され、各ステージの出力が次のステージの入力になる
+STAGES = ["layer1", "layer2_step1", "layer2_step3", "layer3", "layer3_tech"]
+
+# Batch API の終了ステータス
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# 1つのバッチ入力ファイルに含める最大リクエスト数（Batch APIの上限は50,000）
+MAX_REQUESTS_PER_FILE = 50000
+
+
+class BatchRun:
+    """
+    1回のバッチ処理（複数求人 × 全ステージ）の状態を管理するクラス
+
+    状態は Config.BATCH_DIR/<run_id>/ 以下に保存される:
+      - manifest.json: 求人ごとの進捗と、投入したバッチの一覧
+      - <stage>.jsonl: ステージごとの処理結果（求人ID → 出力 or エラー）
+      - <stage>_input_<n>.jsonl / <stage>_output_<n>.jsonl: バッチ入出力ファイル
+      - results.jsonl: 最終出力
+    """
+
+    def __init__(self, run_id: str, client=None, poll_interval: float = None, max_wait: float = None):
+        self.run_id = run_id
+        self.run_dir = Config.BATCH_DIR / run_id
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.run_dir / "manifest.json"
+        self.client = client or get_openai_client()
+        self.poll_interval = Config.BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.max_wait = Config.BATCH_MAX_WAIT if max_wait is None else max_wait
+        self.manifest = self._load_manifest()
+
+    # ==================== マニフェスト ====================
+    def _load_manifest(self) -> Dict[str, Any]:
+        if self.manifest_path.exists():
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        return {
+            "run_id": self.run_id,
+            "created_at": datetime.now().isoformat(),
+            "model": Config.OPENAI_MODEL,
+            "postings": {},
+            "stages": {},
+            "submissions": [],
+        }
+
+    def _save_manifest(self) -> None:
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp.replace(self.manifest_path)
+
+    def add_postings(self, postings: List[Dict[str, Any]]) -> None:
+        """求人を登録（既に登録済みのIDは無視）"""
+        for i, p in enumerate(postings):
+            posting_id = str(p.get("id") or f"posting-{i + 1}")
+            if posting_id in self.manifest["postings"]:
+                continue
+            if not p.get("job_text") or not p.get("job_category"):
+                logger.warning(f"バッチ: 求人 {posting_id} は job_text / job_category が無いためスキップします")
+                continue
+            self.manifest["postings"][posting_id] = {
+                "job_text": p["job_text"],
+                "job_category": p["job_category"],
+                "status": "pending",
+                "stage": None,
+                "error": None,
+            }
+        self._save_manifest()
+
+    # ==================== ステージ結果 ====================
+    def _stage_results_path(self, stage: str) -> Path:
+        return self.run_dir / f"{stage}.jsonl"
+
+    def _load_stage_results(self, stage: str) -> Dict[str, Dict[str, Any]]:
+        path = self._stage_results_path(stage)
+        results = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as fh:
+                for line in fh:
+                    if line.strip():
+                        rec = json.loads(line)
+                        results[rec["posting_id"]] = rec
+        return results
+
+    def _write_stage_results(self, stage: str, results: Dict[str, Dict[str, Any]]) -> None:
+        with open(self._stage_results_path(stage), "w", encoding="utf-8") as fh:
+            for rec in results.values():
+                fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def _active_inputs(self, stage: str) -> Dict[str, Any]:
+        """前ステージで成功した求人の出力（layer1の場合は求人そのもの）を返す"""
+        index = STAGES.index(stage)
+        if index == 0:
+            return {pid: p for pid, p in self.manifest["postings"].items()}
+        prev = self._load_stage_results(STAGES[index - 1])
+        return {pid: rec["value"] for pid, rec in prev.items() if rec.get("ok")}
+
+    # ==================== リクエスト構築 ====================
+    def _build_requests(self, stage: str, inputs: Dict[str, Any]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+        """
+        ステージのバッチリクエストを構築
+
+        Returns:
+            (custom_id → リクエスト行, LLM呼び出し不要で次ステージへ素通しする求人ID → 出力)
+        """
+        requests_by_id: Dict[str, Dict[str, Any]] = {}
+        passthrough: Dict[str, Any] = {}
+        # 同期実行と同じステップタグでモデルを振り分ける（バッチ応答は後から届くため、大きいモデルへのやり直しはしない）
+        _, model = resolve_model(stage.replace("_", "."))
+
+        for pid, value in inputs.items():
+            if stage == "layer1":
+                body = build_chat_request_body(_build_layer1_prompt(value["job_text"]), 1, Config.MAX_TOKENS_LAYER1, model=model)
+            elif stage == "layer2_step1":
+                job_category = self.manifest["postings"][pid]["job_category"]
+                prompt = _build_step1_prompt(value, job_category, get_profile_context(job_category))
+                body = build_chat_request_body(prompt, 1, STEP1_MAX_TOKENS, model=model)
+            elif stage == "layer2_step3":
+                comparison_v1 = value["comparison_v1"]
+                job_category = self.manifest["postings"][pid]["job_category"]
+                should_search_web, reason, triggers = _decide_web_search(comparison_v1, job_category, value["structured_data"])
+                if not should_search_web:
+                    passthrough[pid] = value
+                    continue
+                # Web検索は同期で実行（SerpAPIにはバッチエンドポイントが無いため）
+                logger.info(f"バッチ: 求人 {pid} でWeb検索を実行: {reason}")
+                web_context, has_web_results = execute_dual_search(job_category, value["structured_data"])
+                # 応答の処理時に自信度の変化を記録するため、検索理由と結果の有無をマニフェストに残す
+                self.manifest["postings"][pid]["search_record"] = {"triggers": triggers, "web_results": has_web_results}
+                body = build_chat_request_body(_build_step3_prompt(comparison_v1, web_context), 1, STEP3_MAX_TOKENS, model=model)
+            elif stage == "layer3":
+                body = build_chat_request_body(_build_layer3_prompt(value), 1, Config.MAX_TOKENS_LAYER3, model=model)
+            elif stage == "layer3_tech":
+                prompt = _build_tech_specialization_prompt(value)
+                if prompt is None:
+                    passthrough[pid] = value
+                    continue
+                body = build_chat_request_body(prompt, 1, TECH_SPECIALIZATION_MAX_TOKENS, model=model)
+            else:
+                raise ValueError(f"未知のステージです: {stage}")
+
+            custom_id = f"{pid}::{stage}"
+            requests_by_id[custom_id] = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }
+
+        return requests_by_id, passthrough
+
+    # ==================== 応答処理 ====================
+    def _process_response(self, stage: str, pid: str, inputs: Dict[str, Any], content: str) -> Any:
+        """バッチ応答1件をステージごとの後処理にかけ、次ステージへの入力を返す"""
+        if stage == "layer1":
+            return _postprocess_layer1_response(content)
+        if stage == "layer2_step1":
+            comparison_v1 = parse_json_with_retry(content)
+            validate_comparison_data(comparison_v1)
+            return {"structured_data": inputs[pid], "comparison_v1": comparison_v1}
+        if stage == "layer2_step3":
+            comparison_v2 = parse_json_with_retry(content)
+            validate_comparison_data(comparison_v2)
+            comparison_v1 = inputs[pid]["comparison_v1"]
+            posting = self.manifest["postings"][pid]
+            _record_search(
+                posting["job_category"], posting.get("search_record"),
+                comparison_v1["confidence_score"], comparison_v2["confidence_score"]
+            )
+            return {**inputs[pid], "comparison_v2": comparison_v2}
+        if stage == "layer3":
+            return _postprocess_layer3_response(content, inputs[pid], specialize_tech=False)
+        if stage == "layer3_tech":
+            return _apply_tech_specialization(inputs[pid], content)
+        raise ValueError(f"未知のステージです: {stage}")
+
+    @staticmethod
+    def _finalize_comparison(value: Dict[str, Any]) -> Dict[str, Any]:
+        """layer2 の結果を layer2_build_comparison_smart と同じ形に整える"""
+        if "comparison_v2" in value:
+            comparison_final = value["comparison_v2"]
+            comparison_final["web_search_performed"] = True
+        else:
+            comparison_final = value["comparison_v1"]
+            comparison_final["web_search_performed"] = False
+        comparison_final["content_a"] = value["structured_data"]
+        return comparison_final
+
+    # ==================== 投入・ポーリング ====================
+    def _submit(self, stage: str, chunk_index: int, lines: List[Dict[str, Any]]) -> Dict[str, Any]:
+        input_path = self.run_dir / f"{stage}_input_{chunk_index}.jsonl"
+        with open(input_path, "w", encoding="utf-8") as fh:
+            for line in lines:
+                fh.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+        with open(input_path, "rb") as fh:
+            input_file = self.client.files.create(file=fh, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=Config.BATCH_COMPLETION_WINDOW,
+            metadata={"run_id": self.run_id, "stage": stage},
+        )
+        submission = {
+            "stage": stage,
+            "chunk": chunk_index,
+            "batch_id": batch.id,
+            "input_file_id": input_file.id,
+            "request_count": len(lines),
+            "status": batch.status,
+            "submitted_at": datetime.now().isoformat(),
+            "output_file_id": None,
+            "error_file_id": None,
+            "completed_at": None,
+        }
+        self.manifest["submissions"].append(submission)
+        self._save_manifest()
+        logger.info(f"バッチ投入: stage={stage}, batch_id={batch.id}, requests={len(lines)}")
+        return submission
+
+    def _submitted_requests(self, stage: str, submissions: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """投入済みのバッチ入力ファイルのリクエスト（custom_id → リクエスト行）"""
+        requests_by_id: Dict[str, Dict[str, Any]] = {}
+        for submission in submissions:
+            input_path = self.run_dir / f"{stage}_input_{submission['chunk']}.jsonl"
+            with open(input_path, encoding="utf-8") as fh:
+                for line in fh:
+                    if line.strip():
+                        request = json.loads(line)
+                        requests_by_id[request["custom_id"]] = request
+        return requests_by_id
+
+    def _poll(self, submission: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.time()
+        while True:
+            batch = self.client.batches.retrieve(submission["batch_id"])
+            if batch.status != submission["status"]:
+                logger.info(f"バッチ状態: {submission['batch_id']} {submission['status']} → {batch.status}")
+            submission["status"] = batch.status
+            if batch.status in TERMINAL_STATUSES:
+                submission["output_file_id"] = batch.output_file_id
+                submission["error_file_id"] = batch.error_file_id
+                submission["completed_at"] = datetime.now().isoformat()
+                self._save_manifest()
+                return submission
+            self._save_manifest()
+            if time.time() - started > self.max_wait:
+                raise Exception(f"バッチの完了待ちがタイムアウトしました: {submission['batch_id']}")
+            time.sleep(self.poll_interval)
+
+    def _download_lines(self, file_id: Optional[str], dest: Path) -> List[Dict[str, Any]]:
+        if not file_id:
+            return []
+        text = self.client.files.content(file_id).text
+        dest.write_text(text, encoding="utf-8")
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    # ==================== ステージ実行 ====================
+    def run_stage(self, stage: str) -> None:
+        """1ステージ分のバッチを構築・投入・ポーリングし、結果を保存"""
+        if self.manifest["stages"].get(stage) == "completed":
+            logger.info(f"バッチ: ステージ {stage} は完了済みのためスキップします")
+            return
+
+        logger.info("=" * 60)
+        logger.info(f"バッチ: ステージ {stage} 開始")
+
+        inputs = self._active_inputs(stage)
+        if stage == "layer3":
+            inputs = {pid: self._finalize_comparison(v) for pid, v in inputs.items()}
+
+        # 投入済み（再開時）のバッチがあればそれを使い、リクエストは作り直さない
+        # （layer2_step3 の Web検索をやり直さず、投入したバッチと同じ検索の判断を使うため）
+        submissions = [s for s in self.manifest["submissions"] if s["stage"] == stage]
+        if submissions:
+            requests_by_id = self._submitted_requests(stage, submissions)
+            passthrough = {pid: v for pid, v in inputs.items() if f"{pid}::{stage}" not in requests_by_id}
+            logger.info(f"バッチ: ステージ {stage} は投入済みのバッチから再開します（{len(requests_by_id)}件）")
+        else:
+            requests_by_id, passthrough = self._build_requests(stage, inputs)
+            lines = list(requests_by_id.values())
+            for n, start in enumerate(range(0, len(lines), MAX_REQUESTS_PER_FILE)):
+                submissions.append(self._submit(stage, n, lines[start:start + MAX_REQUESTS_PER_FILE]))
+        results = {pid: {"posting_id": pid, "ok": True, "value": v} for pid, v in passthrough.items()}
+
+        for submission in submissions:
+            if submission["status"] not in TERMINAL_STATUSES or not submission.get("output_file_id"):
+                self._poll(submission)
+            if submission["status"] != "completed":
+                logger.error(f"バッチが完了しませんでした: {submission['batch_id']} status={submission['status']}")
+
+            n = submission["chunk"]
+            output_lines = self._download_lines(submission.get("output_file_id"), self.run_dir / f"{stage}_output_{n}.jsonl")
+            error_lines = self._download_lines(submission.get("error_file_id"), self.run_dir / f"{stage}_errors_{n}.jsonl")
+
+            for line in output_lines:
+                pid = line["custom_id"].rsplit("::", 1)[0]
+                response = line.get("response") or {}
+                body = response.get("body") or {}
+                try:
+                    if response.get("status_code") != 200:
+                        raise Exception(f"HTTP {response.get('status_code')}: {body.get('error')}")
+                    choice = body["choices"][0]
+                    usage = body.get("usage") or {}
+                    append_token_usage({
+                        # 求人1件 = 1 run として同期実行と同じキーで集計できるようにする
+                        'run_id': f"batch:{self.run_id}:{pid}",
+                        'run_kind': "batch",
+                        'step': stage.replace("_", "."),
+                        'model': body.get("model", Config.OPENAI_MODEL),
+                        'route': route_of_model(body.get("model", Config.OPENAI_MODEL)),
+                        'prompt_tokens': usage.get("prompt_tokens"),
+                        'completion_tokens': usage.get("completion_tokens"),
+                        'total_tokens': usage.get("total_tokens"),
+                        'cached_tokens': (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0,
+                        'finish_reason': choice.get("finish_reason"),
+                        'batch': True,
+                        'batch_run_id': self.run_id,
+                        'stage': stage,
+                        'posting_id': pid
+                    })
+                    value = self._process_response(stage, pid, inputs, choice["message"]["content"] or "")
+                    results[pid] = {"posting_id": pid, "ok": True, "value": value}
+                except Exception as e:
+                    logger.warning(f"バッチ: 求人 {pid} のステージ {stage} 処理に失敗: {str(e)}")
+                    results[pid] = {"posting_id": pid, "ok": False, "error": str(e)}
+
+            for line in error_lines:
+                pid = line["custom_id"].rsplit("::", 1)[0]
+                results[pid] = {"posting_id": pid, "ok": False, "error": json.dumps(line.get("error"), ensure_ascii=False)}
+
+        # 応答が返らなかった（期限切れ等の）リクエストも失敗として記録
+        for custom_id in requests_by_id:
+            pid = custom_id.rsplit("::", 1)[0]
+            if pid not in results:
+                results[pid] = {"posting_id": pid, "ok": False, "error": "バッチ応答がありません"}
+
+        self._write_stage_results(stage, results)
+        for pid, rec in results.items():
+            posting = self.manifest["postings"][pid]
+            posting["stage"] = stage
+            if not rec["ok"]:
+                posting["status"] = "failed"
+                posting["error"] = f"{stage}: {rec['error']}"
+            else:
+                posting["status"] = "running"
+        self.manifest["stages"][stage] = "completed"
+        self._save_manifest()
+
+        ok = sum(1 for r in results.values() if r["ok"])
+        logger.info(f"バッチ: ステージ {stage} 完了（成功 {ok}件 / 失敗 {len(results) - ok}件）")
+        logger.info("=" * 60)
+
+    def run(self) -> Path:
+        """全ステージを順に実行し、最終出力を results.jsonl に書き出す"""
+        for stage in STAGES:
+            self.run_stage(stage)
+
+        final = self._load_stage_results(STAGES[-1])
+        results_path = self.run_dir / "results.jsonl"
+        with open(results_path, "w", encoding="utf-8") as fh:
+            for pid, rec in final.items():
+                fh.write(json.dumps({"id": pid, "output": rec["value"]}, ensure_ascii=False) + "\n")
+        for pid in final:
+            self.manifest["postings"][pid]["status"] = "completed"
+        self._save_manifest()
+
+        logger.info(f"バッチ処理完了: {len(final)}/{len(self.manifest['postings'])}件 → {results_path}")
+        return results_path
+
+    def summary(self) -> Dict[str, Any]:
+        """進捗の概要を返す"""
+        counts: Dict[str, int] = {}
+        for p in self.manifest["postings"].values():
+            counts[p["status"]] = counts.get(p["status"], 0) + 1
+        return {
+            "run_id": self.run_id,
+            "postings": len(self.manifest["postings"]),
+            "status_counts": counts,
+            "stages": self.manifest["stages"],
+            "submissions": [
+                {k: s[k] for k in ("stage", "batch_id", "status", "request_count")}
+                for s in self.manifest["submissions"]
+            ],
+        }
+
+
+# ==================== ローカル実行（ステージグラフ） ====================
+def run_local(postings: List[Dict[str, Any]], run_id: str, workers: int = None) -> Path:
+    """
+    求人ごとにパイプライン（pipeline.run_pipeline）を同期実行し、最終出力を results.jsonl に書き出す
+
+    Args:
+        postings: 求人のリスト
+        run_id: 実行ID（Config.BATCH_DIR/<run_id>/ に結果を保存する）
+        workers: 同時に処理する求人数（省略時は ADMISSION_MAX_IN_FLIGHT）
+
+    Returns:
+        results.jsonl のパス
+    """
+    from pipeline import run_pipeline
+
+    run_dir = Config.BATCH_DIR / run_id
+    run_dir.mkdir(parents=True, exist_ok=True)
+    results_path = run_dir / "results.jsonl"
+    errors_path = run_dir / "errors.jsonl"
+
+    completed = set()
+    if results_path.exists():
+        with open(results_path, encoding="utf-8") as fh:
+            completed = {json.loads(line)["id"] for line in fh if line.strip()}
+    # BatchRun.add_postings と同じく、id の無い求人は入力ファイルでの順番から posting-<n> とする
+    postings = [{**p, "id": str(p.get("id") or f"posting-{i + 1}")} for i, p in enumerate(postings)]
+    remaining = [p for p in postings if p["id"] not in completed]
+    logger.info(f"ローカル実行: {len(remaining)}件を処理します（完了済み {len(completed)}件をスキップ）")
+
+    write_lock = threading.Lock()
+
+    def _append(path: Path, record: Dict[str, Any]) -> None:
+        with write_lock, open(path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _process(posting: Dict[str, Any]) -> None:
+        pid = posting["id"]
+        output = run_pipeline(
+            posting["job_text"], posting["job_category"],
+            run_id=f"{run_id}:{pid}", save_result=Config.RESULT_STORE_ENABLED, resume=True
+        )
+        _append(results_path, {"id": pid, "output": output})
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers or Config.ADMISSION_MAX_IN_FLIGHT) as executor:
+        futures = {executor.submit(_process, posting): posting["id"] for posting in remaining}
+        for future in as_completed(futures):
+            pid = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                logger.warning(f"ローカル実行: 求人 {pid} の処理に失敗: {str(e)}")
+                _append(errors_path, {"id": pid, "error": str(e), "timestamp": datetime.now().isoformat()})
+
+    logger.info(f"ローカル実行完了: 成功 {len(remaining) - failed}件 / 失敗 {failed}件 → {results_path}")
+    return results_path
+
+
+def load_postings(path: Path) -> List[Dict[str, Any]]:
+    """JSONLの求人ファイルを読み込む"""
+    postings = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                postings.append(json.loads(line))
+    return postings
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="OpenAI Batch API による求人票の一括処理")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="バッチ処理を実行（同じrun-idなら再開）")
+    p_run.add_argument("--input", type=Path, help="求人JSONL（新規実行時は必須）")
+    p_run.add_argument("--run-id", default=None, help="実行ID（省略時は日時から生成）")
+    p_run.add_argument("--poll-interval", type=float, default=None, help="ポーリング間隔（秒）")
+
+    p_status = sub.add_parser("status", help="進捗を表示")
+    p_status.add_argument("--run-id", required=True)
+
+    p_local = sub.add_parser("local", help="Batch API を使わずパイプライン（ステージグラフ）で同期実行（同じrun-idなら再開）")
+    p_local.add_argument("--input", type=Path, required=True, help="求人JSONL")
+    p_local.add_argument("--run-id", default=None, help="実行ID（省略時は日時から生成）")
+    p_local.add_argument("--workers", type=int, default=None, help="同時に処理する求人数")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "local":
+        run_id = args.run_id or datetime.now().strftime("local_%Y%m%d_%H%M%S")
+        results_path = run_local(load_postings(args.input), run_id, workers=args.workers)
+        print(f"結果: {results_path}")
+        return 0
+
+    if args.command == "status":
+        if not (Config.BATCH_DIR / args.run_id / "manifest.json").exists():
+            print(f"実行IDが見つかりません: {args.run_id}")
+            return 1
+        print(json.dumps(BatchRun(args.run_id).summary(), ensure_ascii=False, indent=2))
+        return 0
+
+    run_id = args.run_id or datetime.now().strftime("batch_%Y%m%d_%H%M%S")
+    batch_run = BatchRun(run_id, poll_interval=args.poll_interval)
+    if args.input:
+        batch_run.add_postings(load_postings(args.input))
+    if not batch_run.manifest["postings"]:
+        print("処理対象の求人がありません（--input を指定してください）")
+        return 1
+
+    results_path = batch_run.run()
+    print(json.dumps(batch_run.summary(), ensure_ascii=False, indent=2))
+    print(f"結果: {results_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+"""
+同時利用の負荷試験（採用担当者N人が朝に一斉に「生成」するケースの再現）
+
+仮想ユーザーがシンク時間を挟みながら「生成 → 修正依頼 → QA」のセッションを繰り返し、
+各操作は --workers 個のワーカー（Streamlitサーバーの処理能力に相当）で実行する。
+LLMは合成応答（対数正規分布のレイテンシ）で置き換え、APIティアの RPM / TPM / 同時実行数の
+制限と一時的なサーバーエラーを注入できる。
+
+計測項目:
+- 操作別のスループット・レイテンシ（p50/p95/p99）・ワーカー待ち時間（キューイング遅延）
+- ワーカー待ち行列の深さ、APIへの同時リクエスト数
+- レート制限（RPM/TPM/同時実行数）・サーバーエラーの発生数と、操作が失敗に至った件数
+
+使い方:
+    python benchmarks/load_test.py --users 20 --workers 4 --duration 120
+    python benchmarks/load_test.py --users 30 --workers 8 --rpm 60 --tpm 200000 --latency-scale 0.2
+    python benchmarks/load_test.py --users 20 --workers 8 --latency-jitter 0.8 --hedge   # 遅い応答へのヘッジの効果
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from llm_transport import (  # noqa: E402
+    HedgedTransport,
+    LatencyModel,
+    MockSearchTransport,
+    MockTransport,
+    RateLimitedTransport,
+    set_llm_transport,
+    set_search_transport,
+)
+from modification import handle_modification_request  # noqa: E402
+from pipeline import run_pipeline  # noqa: E402
+from utils import answer_question, logger  # noqa: E402
+
+from run_benchmarks import FIXTURE_PATH, RESULTS_DIR, load_fixtures, percentiles  # noqa: E402
+
+OPERATIONS = ["generate", "modify", "qa"]
+
+MODIFICATION_REQUESTS = [
+    "内容Aをもう少し具体的にしてください",
+    "内容Bに業界の一般的な例を追加してください",
+    "専門用語に短い説明を添えてください",
+]
+QA_QUESTIONS = [
+    "この求人で想定される主なステークホルダーは誰ですか？",
+    "未経験者が最初につまずきやすい点は何ですか？",
+    "必須スキルと歓迎スキルの違いを教えてください",
+]
+
+
+# ==================== 計測 ====================
+class LoadStats:
+    """操作ごとの計測値とワーカー待ち行列の状態を集める"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records: List[Dict[str, Any]] = []
+        self.queued = 0
+        self.running = 0
+        self.samples: List[Dict[str, Any]] = []
+
+    def on_submit(self) -> None:
+        with self._lock:
+            self.queued += 1
+
+    def on_start(self) -> None:
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+
+    def on_finish(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self.running -= 1
+            self.records.append(record)
+
+    def sample(self, elapsed: float, api_in_flight: int) -> None:
+        with self._lock:
+            self.samples.append({
+                "t": round(elapsed, 1),
+                "queued": self.queued,
+                "running": self.running,
+                "api_in_flight": api_in_flight
+            })
+
+
+def _classify_error(message: str) -> str:
+    if "レート制限" in message or "rate_limit" in message.lower():
+        return "rate_limit"
+    if "server_error" in message:
+        return "server_error"
+    return "other"
+
+
+def run_operation(pool: ThreadPoolExecutor, stats: LoadStats, name: str, func: Callable, started_at: float) -> Any:
+    """
+    操作をワーカーに投入し、完了まで待つ（ブラウザが応答を待つのと同じ）
+
+    Returns:
+        操作の戻り値（失敗時は None）
+    """
+    submitted = time.perf_counter()
+    stats.on_submit()
+
+    def task():
+        began = time.perf_counter()
+        stats.on_start()
+        result, error = None, None
+        try:
+            result = func()
+        except Exception as e:
+            error = str(e)
+        finished = time.perf_counter()
+        stats.on_finish({
+            "operation": name,
+            "submitted_at": round(submitted - started_at, 3),
+            "queue_seconds": began - submitted,
+            "service_seconds": finished - began,
+            "total_seconds": finished - submitted,
+            "error": _classify_error(error) if error else None
+        })
+        return result
+
+    return pool.submit(task).result()
+
+
+def virtual_user(
+    user_id: int,
+    args: argparse.Namespace,
+    pool: ThreadPoolExecutor,
+    stats: LoadStats,
+    postings: List[Dict[str, Any]],
+    started_at: float,
+    deadline: float
+) -> None:
+    rng = random.Random(args.seed + user_id)
+
+    def think() -> bool:
+        # シンク時間は指数分布。終了時刻を過ぎる場合はセッションを打ち切る
+        wait = rng.expovariate(1.0 / args.think_time) if args.think_time > 0 else 0.0
+        if time.perf_counter() + wait >= deadline:
+            return False
+        time.sleep(wait)
+        return True
+
+    # 出社時刻のばらつき（ランプアップ）
+    time.sleep(args.ramp_up * user_id / max(args.users, 1))
+    while time.perf_counter() < deadline:
+        posting = rng.choice(postings)
+        output = run_operation(
+            pool, stats, "generate",
+            lambda: run_pipeline(posting["job_text"], posting["job_category"]),
+            started_at
+        )
+        if output is None:
+            if not think():
+                return
+            continue
+
+        for _ in range(args.modifications):
+            if rng.random() >= args.modify_prob or not think():
+                break
+            request = rng.choice(MODIFICATION_REQUESTS)
+            response = run_operation(
+                pool, stats, "modify",
+                lambda: handle_modification_request(output, request),
+                started_at
+            )
+            if response:
+                output = response.get("modified_output", output)
+
+        history: List[Dict[str, str]] = []
+        for _ in range(args.questions):
+            if rng.random() >= args.qa_prob or not think():
+                break
+            question = rng.choice(QA_QUESTIONS)
+            result = run_operation(
+                pool, stats, "qa",
+                lambda: answer_question(output, question, history),
+                started_at
+            )
+            if result:
+                history = result.get("updated_history", history)
+
+        if not think():
+            return
+
+
+# ==================== 実行 ====================
+def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    postings = load_fixtures(Path(args.fixtures))
+    latency = LatencyModel(
+        base=args.latency_base * args.latency_scale,
+        per_1k_tokens=args.latency_per_1k * args.latency_scale,
+        jitter=args.latency_jitter,
+        seed=args.seed
+    )
+    transport = RateLimitedTransport(
+        MockTransport(latency=latency, seed=args.seed),
+        rpm=args.rpm,
+        tpm=args.tpm,
+        max_concurrency=args.api_concurrency,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    hedged = HedgedTransport(transport) if args.hedge else None
+    set_llm_transport(hedged or transport)
+    set_search_transport(MockSearchTransport(latency=LatencyModel(base=args.search_latency * args.latency_scale, seed=args.seed)))
+
+    stats = LoadStats()
+    started_at = time.perf_counter()
+    deadline = started_at + args.duration
+    stop_sampler = threading.Event()
+
+    def sampler():
+        while not stop_sampler.wait(1.0):
+            stats.sample(time.perf_counter() - started_at, transport.in_flight)
+
+    sampler_thread = threading.Thread(target=sampler, daemon=True)
+    sampler_thread.start()
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="worker") as pool:
+            users = [
+                threading.Thread(
+                    target=virtual_user,
+                    args=(i, args, pool, stats, postings, started_at, deadline),
+                    name=f"user-{i}"
+                )
+                for i in range(args.users)
+            ]
+            for u in users:
+                u.start()
+            for u in users:
+                u.join()
+    finally:
+        stop_sampler.set()
+        sampler_thread.join()
+        set_llm_transport(None)
+        set_search_transport(None)
+
+    wall_seconds = time.perf_counter() - started_at
+    result = summarize(stats, transport.snapshot(), wall_seconds, args)
+    if hedged is not None:
+        result["hedge"] = hedged.snapshot()
+    return result
+
+
+def summarize(stats: LoadStats, api: Dict[str, int], wall_seconds: float, args: argparse.Namespace) -> Dict[str, Any]:
+    operations = {}
+    for name in OPERATIONS:
+        records = [r for r in stats.records if r["operation"] == name]
+        ok = [r for r in records if r["error"] is None]
+        errors: Dict[str, int] = {}
+        for r in records:
+            if r["error"]:
+                errors[r["error"]] = errors.get(r["error"], 0) + 1
+        operations[name] = {
+            "count": len(records),
+            "succeeded": len(ok),
+            "errors": errors,
+            "throughput_per_min": round(len(ok) * 60 / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+            "latency": percentiles([r["total_seconds"] for r in ok]),
+            "service": percentiles([r["service_seconds"] for r in ok]),
+            "queue_delay": percentiles([r["queue_seconds"] for r in records])
+        }
+
+    queued = [s["queued"] for s in stats.samples]
+    rate_limited = api["rate_limited_rpm"] + api["rate_limited_tpm"] + api["rate_limited_concurrency"]
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "verbose")},
+        "wall_seconds": round(wall_seconds, 2),
+        "operations": operations,
+        "queue": {
+            "max_depth": max(queued) if queued else 0,
+            "mean_depth": round(sum(queued) / len(queued), 2) if queued else 0.0,
+            "max_api_in_flight": api["max_in_flight"]
+        },
+        "api": {
+            **api,
+            "rate_limited": rate_limited,
+            "rate_limited_ratio": round(rate_limited / api["calls"], 4) if api["calls"] else 0.0
+        },
+        "timeline": stats.samples
+    }
+
+
+def print_summary(result: Dict[str, Any]) -> None:
+    print("\n==================== 負荷試験結果 ====================")
+    print(f"実行時間: {result['wall_seconds']}s")
+    for name, op in result["operations"].items():
+        if not op["count"]:
+            continue
+        lat, queue = op["latency"], op["queue_delay"]
+        print(f"  {name:<8} 件数={op['count']} 成功={op['succeeded']} 失敗={op['errors'] or 0} "
+              f"スループット={op['throughput_per_min']}/分")
+        print(f"           応答 p50={lat['p50']:.2f}s p95={lat['p95']:.2f}s p99={lat['p99']:.2f}s  "
+              f"待ち p50={queue['p50']:.2f}s p95={queue['p95']:.2f}s")
+    q, api = result["queue"], result["api"]
+    print(f"  待ち行列: 最大={q['max_depth']} 平均={q['mean_depth']}  API同時実行: 最大={q['max_api_in_flight']}")
+    print(f"  API呼び出し={api['calls']} 成功={api['succeeded']} "
+          f"レート制限={api['rate_limited']}（RPM {api['rate_limited_rpm']} / TPM {api['rate_limited_tpm']} / "
+          f"同時実行 {api['rate_limited_concurrency']}） サーバーエラー={api['server_errors']}")
+    if result.get("hedge"):
+        h = result["hedge"]
+        print(f"  ヘッジ: 送信={h['fired']}（{h['requests']}件中） 勝ち={h['won']} 負け={h['lost']} 上限で見送り={h['denied']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="同時利用の負荷試験（合成LLM応答）")
+    parser.add_argument("--users", type=int, default=10, help="仮想ユーザー数")
+    parser.add_argument("--workers", type=int, default=4, help="ワーカー数（同時に処理できる操作数）")
+    parser.add_argument("--duration", type=float, default=60.0, help="試験時間（秒）")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="全ユーザーが開始するまでの秒数")
+    parser.add_argument("--think-time", type=float, default=5.0, help="操作間のシンク時間の平均（秒）")
+    parser.add_argument("--modifications", type=int, default=2, help="1セッションあたりの最大修正依頼回数")
+    parser.add_argument("--modify-prob", type=float, default=0.5, help="修正依頼を行う確率")
+    parser.add_argument("--questions", type=int, default=2, help="1セッションあたりの最大QA回数")
+    parser.add_argument("--qa-prob", type=float, default=0.5, help="QAを行う確率")
+    parser.add_argument("--latency-base", type=float, default=1.5, help="LLM応答の基本レイテンシ（秒）")
+    parser.add_argument("--latency-per-1k", type=float, default=12.0, help="出力1kトークンあたりのレイテンシ（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.35, help="レイテンシの対数正規ノイズ（σ）")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="レイテンシ全体の倍率（短時間で試す場合に縮小）")
+    parser.add_argument("--search-latency", type=float, default=1.0, help="Web検索のレイテンシ（秒）")
+    parser.add_argument("--rpm", type=int, default=0, help="APIティアのRPM上限（0で無制限）")
+    parser.add_argument("--tpm", type=int, default=0, help="APIティアのTPM上限（0で無制限）")
+    parser.add_argument("--api-concurrency", type=int, default=0, help="APIの同時実行数上限（0で無制限）")
+    parser.add_argument("--hedge", action="store_true", help="遅い応答に重複リクエストを送る（HedgedTransport。HEDGE_* の設定を使う）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="サーバーエラーを返す確率")
+    parser.add_argument("--fixtures", default=str(FIXTURE_PATH), help="求人フィクスチャ（JSONL）")
+    parser.add_argument("--seed", type=int, default=42, help="乱数シード")
+    parser.add_argument("--output", default=None, help="結果JSONの出力先（省略時は benchmarks/results/load_<日時>.json）")
+    parser.add_argument("--verbose", action="store_true", help="アプリケーションログを表示する")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        # 失敗は集計結果に含めるため、個々のエラーログは抑制する
+        logger.setLevel(logging.CRITICAL)
+
+    result = run_load_test(args)
+    print_summary(result)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"load_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output}")
+
+
+if __name__ == "__main__":
+    main()
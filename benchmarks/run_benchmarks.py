@@ -0,0 +1,418 @@
+"""
+レイヤーパイプラインのエンドツーエンド・ベンチマーク
+
+求人フィクスチャ（benchmarks/fixtures/postings_ja.jsonl）に対して
+レイヤー①→②→③をオフライン（合成応答 or カセット再生）で実行し、以下を計測する。
+
+- レイヤー別・ステージ別（ステージグラフ）・エンドツーエンドのレイテンシ（p50/p95/p99）
+- レイヤー別のプロンプト/完了トークン数
+- JSON解析のリトライ率
+- parse_json_with_retry / normalize_table_data_structure / 業務プロセス正規化 のCPU時間
+
+結果は benchmarks/results/ にJSONで保存する。--baseline を指定すると
+トークン数・CPU時間の悪化を検出し、閾値を超えた場合は終了コード1を返す。
+
+使い方:
+    python benchmarks/run_benchmarks.py --iterations 3
+    python benchmarks/run_benchmarks.py --baseline benchmarks/results/bench_20250101_000000.json
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+import layer1  # noqa: E402
+import layer2  # noqa: E402
+import layer3  # noqa: E402
+import pipeline  # noqa: E402
+from config import Config  # noqa: E402
+from llm_transport import (  # noqa: E402
+    LatencyModel,
+    LLMTransport,
+    MockSearchTransport,
+    MockTransport,
+    ReplaySearchTransport,
+    ReplayTransport,
+    Cassette,
+    cassette_path,
+    set_llm_transport,
+    set_search_transport,
+)
+from telemetry import current_step  # noqa: E402
+from utils import logger  # noqa: E402
+
+FIXTURE_PATH = Path(__file__).resolve().parent / "fixtures" / "postings_ja.jsonl"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+LAYERS = ["layer1", "layer2", "layer3"]
+CPU_TARGETS = ["parse_json_with_retry", "normalize_table_data_structure", "normalize_business_process"]
+
+
+# ==================== 計測 ====================
+class Recorder:
+    """レイヤー・ステージ・関数単位の計測値を集める（トークンは呼び出し時のステップタグのレイヤーに帰属させる）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.layer_latency: Dict[str, float] = {}
+        self.stage_latency: Dict[str, float] = {}
+        self._layer_spans: Dict[str, List[float]] = {}
+        self.tokens = {layer: {"prompt": 0, "completion": 0, "calls": 0} for layer in LAYERS}
+        self.cpu = {name: {"seconds": 0.0, "calls": 0} for name in CPU_TARGETS}
+        self.parse_calls = 0
+        self.parse_retries = 0
+
+    @property
+    def current_layer(self) -> Optional[str]:
+        step_tag = current_step()
+        return step_tag.split(".", 1)[0] if step_tag else None
+
+    def on_stage(self, stage: str, layer: str, started: float, ended: float) -> None:
+        """ステージグラフのステージ完了の通知（レイヤーの所要時間は最初の開始から最後の終了まで）"""
+        with self._lock:
+            self.stage_latency[stage] = ended - started
+            span = self._layer_spans.setdefault(layer, [started, ended])
+            span[0], span[1] = min(span[0], started), max(span[1], ended)
+            self.layer_latency[layer] = span[1] - span[0]
+
+    def add_tokens(self, prompt_tokens: int, completion_tokens: int) -> None:
+        layer = self.current_layer
+        if layer not in self.tokens:
+            return
+        with self._lock:
+            bucket = self.tokens[layer]
+            bucket["prompt"] += prompt_tokens
+            bucket["completion"] += completion_tokens
+            bucket["calls"] += 1
+
+    def add_cpu(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.cpu[name]["seconds"] += seconds
+            self.cpu[name]["calls"] += 1
+
+
+class CountingTransport(LLMTransport):
+    """内側のトランスポートの usage を実行中のレイヤーに帰属させる"""
+
+    def __init__(self, inner: LLMTransport, recorder: Recorder):
+        self.inner = inner
+        self.recorder = recorder
+        self.name = inner.name
+
+    def chat_completion(self, body: Dict[str, Any]) -> Any:
+        response = self.inner.chat_completion(body)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.recorder.add_tokens(
+                getattr(usage, "prompt_tokens", 0) or 0,
+                getattr(usage, "completion_tokens", 0) or 0
+            )
+        return response
+
+
+def _cpu_timed(func: Callable, name: str, recorder: Recorder) -> Callable:
+    def wrapper(*args, **kwargs):
+        started = time.thread_time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            recorder.add_cpu(name, time.thread_time() - started)
+    return wrapper
+
+
+def _counting_parse(func: Callable, recorder: Recorder) -> Callable:
+    def wrapper(response_text, *args, **kwargs):
+        # 初回の json.loads で解析できない応答は「リトライ経路に入った」と数える
+        try:
+            json.loads(response_text)
+            retried = False
+        except (TypeError, ValueError):
+            retried = True
+        with recorder._lock:
+            recorder.parse_calls += 1
+            recorder.parse_retries += int(retried)
+        return func(response_text, *args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def instrumented(recorder: Recorder):
+    """パイプラインの各関数を計測用ラッパーに差し替える（終了時に元へ戻す）"""
+    originals = []
+
+    def patch(module, attr: str, wrapper: Callable) -> None:
+        originals.append((module, attr, getattr(module, attr)))
+        setattr(module, attr, wrapper)
+
+    for module in (layer1, layer2, layer3):
+        parse = _cpu_timed(module.parse_json_with_retry, "parse_json_with_retry", recorder)
+        patch(module, "parse_json_with_retry", _counting_parse(parse, recorder))
+    patch(layer3, "normalize_table_data_structure",
+          _cpu_timed(layer3.normalize_table_data_structure, "normalize_table_data_structure", recorder))
+    patch(layer1, "_normalize_business_process",
+          _cpu_timed(layer1._normalize_business_process, "normalize_business_process", recorder))
+    try:
+        yield recorder
+    finally:
+        for module, attr, original in reversed(originals):
+            setattr(module, attr, original)
+
+
+# ==================== 実行 ====================
+def load_fixtures(path: Path = FIXTURE_PATH) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def build_transports(args: argparse.Namespace):
+    latency = LatencyModel(base=args.latency_base, per_1k_tokens=args.latency_per_1k, jitter=args.latency_jitter, seed=args.seed)
+    if args.transport == "replay":
+        cassette = Cassette(cassette_path(args.cassette))
+        return (
+            ReplayTransport(cassette, latency_scale=args.latency_scale),
+            ReplaySearchTransport(cassette, latency_scale=args.latency_scale)
+        )
+    return (
+        MockTransport(latency=latency, markdown_ratio=args.markdown_ratio, seed=args.seed),
+        MockSearchTransport(latency=LatencyModel(base=0.0, per_1k_tokens=0.0, jitter=0.0))
+    )
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "n": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        # 最近傍順位法（サンプル数が少なくても実測値を返す）
+        index = max(0, min(len(ordered) - 1, int(round(q * len(ordered) + 0.5)) - 1))
+        return ordered[index]
+
+    return {
+        "p50": round(pick(0.50), 4),
+        "p95": round(pick(0.95), 4),
+        "p99": round(pick(0.99), 4),
+        "mean": round(statistics.fmean(ordered), 4),
+        "n": len(ordered)
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    postings = load_fixtures(Path(args.fixtures))
+    llm, search = build_transports(args)
+    recorder = Recorder()
+    set_llm_transport(CountingTransport(llm, recorder))
+    set_search_transport(search)
+
+    samples: List[Dict[str, Any]] = []
+    try:
+        with instrumented(recorder):
+            for iteration in range(args.iterations):
+                for posting in postings:
+                    recorder.reset()
+                    started = time.perf_counter()
+                    error = None
+                    try:
+                        pipeline.run_pipeline(posting["job_text"], posting["job_category"], on_stage=recorder.on_stage)
+                    except Exception as e:
+                        error = str(e)
+                    samples.append({
+                        "iteration": iteration,
+                        "id": posting["id"],
+                        "size": posting.get("size", ""),
+                        "chars": len(posting["job_text"]),
+                        "total_seconds": time.perf_counter() - started,
+                        "layer_seconds": dict(recorder.layer_latency),
+                        "stage_seconds": dict(recorder.stage_latency),
+                        "tokens": {k: dict(v) for k, v in recorder.tokens.items()},
+                        "cpu": {k: dict(v) for k, v in recorder.cpu.items()},
+                        "parse_calls": recorder.parse_calls,
+                        "parse_retries": recorder.parse_retries,
+                        "error": error
+                    })
+                    print(f"[{iteration + 1}/{args.iterations}] {posting['id']}: "
+                          f"{samples[-1]['total_seconds']:.2f}s{' ERROR: ' + error if error else ''}")
+    finally:
+        set_llm_transport(None)
+        set_search_transport(None)
+
+    return summarize(samples, args)
+
+
+def summarize(samples: List[Dict[str, Any]], args: argparse.Namespace) -> Dict[str, Any]:
+    ok = [s for s in samples if s["error"] is None]
+    postings_ok = max(len(ok), 1)
+
+    tokens = {}
+    for layer in LAYERS:
+        prompt = sum(s["tokens"][layer]["prompt"] for s in ok)
+        completion = sum(s["tokens"][layer]["completion"] for s in ok)
+        tokens[layer] = {
+            "prompt_per_posting": round(prompt / postings_ok, 1),
+            "completion_per_posting": round(completion / postings_ok, 1),
+            "calls_per_posting": round(sum(s["tokens"][layer]["calls"] for s in ok) / postings_ok, 2)
+        }
+    tokens["total"] = {
+        "prompt_per_posting": round(sum(t["prompt_per_posting"] for t in tokens.values()), 1),
+        "completion_per_posting": round(sum(t["completion_per_posting"] for t in tokens.values()), 1)
+    }
+
+    cpu = {}
+    for name in CPU_TARGETS:
+        seconds = sum(s["cpu"][name]["seconds"] for s in ok)
+        calls = sum(s["cpu"][name]["calls"] for s in ok)
+        cpu[name] = {
+            "ms_per_posting": round(seconds * 1000 / postings_ok, 3),
+            "ms_per_call": round(seconds * 1000 / calls, 3) if calls else 0.0,
+            "calls": calls
+        }
+
+    parse_calls = sum(s["parse_calls"] for s in ok)
+    by_size: Dict[str, List[float]] = {}
+    for s in ok:
+        by_size.setdefault(s["size"] or "unknown", []).append(s["total_seconds"])
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "settings": {
+            "transport": args.transport,
+            "iterations": args.iterations,
+            "markdown_ratio": args.markdown_ratio,
+            "fixtures": str(args.fixtures),
+            "model": Config.OPENAI_MODEL
+        },
+        "postings": len(samples),
+        "errors": len(samples) - len(ok),
+        "latency": {
+            "end_to_end": percentiles([s["total_seconds"] for s in ok]),
+            **{layer: percentiles([s["layer_seconds"][layer] for s in ok if layer in s["layer_seconds"]]) for layer in LAYERS},
+            "stages": {
+                name: percentiles([s["stage_seconds"][name] for s in ok if name in s.get("stage_seconds", {})])
+                for name in pipeline.PIPELINE_GRAPH.order
+            },
+            "by_size": {size: percentiles(values) for size, values in sorted(by_size.items())}
+        },
+        "tokens": tokens,
+        "parse": {
+            "calls": parse_calls,
+            "retries": sum(s["parse_retries"] for s in ok),
+            "retry_rate": round(sum(s["parse_retries"] for s in ok) / parse_calls, 4) if parse_calls else 0.0
+        },
+        "cpu": cpu,
+        "samples": samples
+    }
+
+
+# ==================== ベースライン比較 ====================
+def compare_with_baseline(
+    result: Dict[str, Any],
+    baseline: Dict[str, Any],
+    max_regression: float,
+    min_cpu_delta_ms: float = 0.05
+) -> List[str]:
+    """
+    トークン数・CPU時間がベースラインから max_regression を超えて悪化した項目を返す
+    レイテンシは実行環境の揺らぎが大きいため比較対象にしない
+
+    Args:
+        result: 今回の結果
+        baseline: 比較対象の結果
+        max_regression: 許容する悪化率
+        min_cpu_delta_ms: CPU時間の悪化とみなす最小差分（計測誤差の吸収用）
+
+    Returns:
+        悪化した項目の説明リスト（空なら悪化なし）
+    """
+    regressions = []
+
+    def check(label: str, current: float, previous: float, min_delta: float = 0.0) -> None:
+        if current - previous <= min_delta:
+            return
+        if previous > 0 and (current - previous) / previous > max_regression:
+            regressions.append(f"{label}: {previous} → {current} (+{(current - previous) / previous:.1%})")
+
+    for layer, values in result["tokens"].items():
+        previous = baseline.get("tokens", {}).get(layer, {})
+        for key in ("prompt_per_posting", "completion_per_posting"):
+            check(f"tokens.{layer}.{key}", values[key], previous.get(key, 0))
+    for name, values in result["cpu"].items():
+        previous = baseline.get("cpu", {}).get(name, {})
+        check(f"cpu.{name}.ms_per_call", values["ms_per_call"], previous.get("ms_per_call", 0), min_cpu_delta_ms)
+    return regressions
+
+
+def print_summary(result: Dict[str, Any]) -> None:
+    print("\n==================== ベンチマーク結果 ====================")
+    print(f"求人数: {result['postings']}  エラー: {result['errors']}")
+    for name in ["end_to_end"] + LAYERS:
+        p = result["latency"][name]
+        print(f"  {name:<12} p50={p['p50']:.3f}s p95={p['p95']:.3f}s p99={p['p99']:.3f}s")
+    for name, p in result["latency"]["stages"].items():
+        if p["n"]:
+            print(f"  stage {name:<10} p50={p['p50']:.3f}s p95={p['p95']:.3f}s")
+    for layer, t in result["tokens"].items():
+        print(f"  tokens {layer:<6} prompt={t['prompt_per_posting']} completion={t['completion_per_posting']}")
+    print(f"  JSON解析リトライ率: {result['parse']['retry_rate']:.1%} ({result['parse']['retries']}/{result['parse']['calls']})")
+    for name, c in result["cpu"].items():
+        print(f"  cpu {name:<32} {c['ms_per_call']:.3f}ms/call ({c['calls']} calls)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="レイヤーパイプラインのベンチマーク（オフライン実行）")
+    parser.add_argument("--transport", choices=["mock", "replay"], default="mock", help="LLM/検索の応答元")
+    parser.add_argument("--cassette", default=None, help="--transport replay 時のカセット名")
+    parser.add_argument("--fixtures", default=str(FIXTURE_PATH), help="求人フィクスチャ（JSONL）")
+    parser.add_argument("--iterations", type=int, default=3, help="フィクスチャ全体の繰り返し回数")
+    parser.add_argument("--markdown-ratio", type=float, default=0.2, help="合成応答を```jsonで囲む確率（リトライ経路の再現）")
+    parser.add_argument("--seed", type=int, default=42, help="合成応答・レイテンシの乱数シード")
+    parser.add_argument("--latency-base", type=float, default=0.0, help="合成応答の基本レイテンシ（秒）")
+    parser.add_argument("--latency-per-1k", type=float, default=0.0, help="出力1kトークンあたりのレイテンシ（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.25, help="レイテンシの対数正規ノイズ（σ）")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="カセット再生時のレイテンシ倍率")
+    parser.add_argument("--output", default=None, help="結果JSONの出力先（省略時は benchmarks/results/bench_<日時>.json）")
+    parser.add_argument("--baseline", default=None, help="比較対象の結果JSON")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="許容する悪化率（0.15 = 15%%）")
+    parser.add_argument("--min-cpu-delta-ms", type=float, default=0.05, help="CPU時間の悪化とみなす最小差分（ミリ秒）")
+    parser.add_argument("--verbose", action="store_true", help="アプリケーションログを表示する")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.setLevel(logging.ERROR)
+
+    result = run_benchmark(args)
+    print_summary(result)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(result, baseline, args.max_regression, args.min_cpu_delta_ms)
+        if regressions:
+            print(f"\n❌ ベースラインから{args.max_regression:.0%}を超える悪化を検出しました:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\n✅ ベースラインからの悪化はありません")
+
+
+if __name__ == "__main__":
+    main()
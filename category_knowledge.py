@@ -0,0 +1,369 @@
+"""
+職種ナレッジキャッシュ（職種ごとの業界標準）
+レイヤー②は求人ごとに職種の「業界標準」（典型的な業務フロー・使用技術）を推察し直し、
+Web検索（execute_dual_search）も同じ職種で何度も実行している。職種単位で次の2つを保存して使い回す:
+- 検索結果: execute_dual_search の2つの検索の結果（KNOWLEDGE_SEARCH_TTL_HOURS の間は SerpAPI を呼ばない）。
+  プロンプト用の整形は求人ごとに context_packing で行うため、整形前の結果を保存する
+- 標準プロファイル: 検索結果から1回だけ要約した職種の業界標準（KNOWLEDGE_PROFILE_TTL_HOURS の間有効）。
+  レイヤー②の Step 2-1 のプロンプトに短い参考情報として渡す
+
+職種名は正規化したキー（NFKC・空白除去・小文字）で引くため、「法人営業」「法人 営業」は同じ職種として扱う。
+プロファイルの要約は検索結果を取得した時点でバックグラウンドで行い、リクエストは待たせない。
+保存先は生成結果ストアと同じ SQLite（Config.RESULT_DB）。
+
+使い方（CLI）:
+    python category_knowledge.py list                      # 保存済みの職種
+    python category_knowledge.py show 法人営業               # 検索結果とプロファイル
+    python category_knowledge.py refresh 法人営業            # 検索・要約をやり直す
+    python category_knowledge.py purge --days 90            # 90日以上更新されていない職種を削除
+"""
+import argparse
+import contextvars
+import json
+import sys
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import Config
+from metrics import KNOWLEDGE_CACHE_LOOKUPS
+from result_store import connect
+from telemetry import step
+from tracing import start_span
+from utils import call_openai_routed, logger, parse_json_with_retry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS category_knowledge (
+    category_key TEXT PRIMARY KEY,
+    job_category TEXT NOT NULL,
+    search_results TEXT,
+    search_fetched_at TEXT,
+    profile TEXT,
+    profile_built_at TEXT,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+);
+"""
+
+# 標準プロファイルの項目（レイヤー②で業界標準として参照するもの）
+PROFILE_ITEMS = ["標準的な業務フロー", "標準的な使用技術", "典型的なステークホルダー", "業界動向"]
+
+
+def normalize_category(job_category: str) -> str:
+    """職種名をキャッシュのキーに正規化（全角/半角・空白・大文字小文字の違いを吸収）"""
+    text = unicodedata.normalize("NFKC", job_category or "")
+    return "".join(text.split()).lower()
+
+
+def _now() -> datetime:
+    return datetime.now()
+
+
+def _is_fresh(timestamp: Optional[str], ttl_hours: float) -> bool:
+    if not timestamp:
+        return False
+    return _now() - datetime.fromisoformat(timestamp) < timedelta(hours=ttl_hours)
+
+
+# ==================== 標準プロファイルの要約 ====================
+def _build_profile_prompt(job_category: str, web_context: str) -> str:
+    """標準プロファイル要約のプロンプトを構築"""
+    return f"""
+あなたは採用コンサルタントです。
+
+【職種】
+{job_category}
+
+【Web検索で得た情報】
+{web_context}
+
+【タスク】
+上記の情報から、この職種の「業界標準」を新人リクルーター向けに要約した職種の業界標準プロファイルを作成してください。
+個別企業の情報ではなく、この職種に一般的に当てはまる内容だけを書いてください。
+
+【出力形式】
+以下のJSON形式のみで応答してください（各項目150文字以内）。
+
+{{
+  "標準的な業務フロー": "工程A → 工程B → 工程C（各工程の要点）",
+  "標準的な使用技術": "カテゴリごとの代表的なツール・技術",
+  "典型的なステークホルダー": "社内外の主な関係者",
+  "業界動向": "採用需要や技術の変化など"
+}}
+"""
+
+
+def distill_profile(job_category: str, web_context: str) -> Dict[str, str]:
+    """
+    検索コンテキストから職種の標準プロファイルを要約
+
+    Args:
+        job_category: 職種名
+        web_context: 整形済みの検索結果（serpapi_utils.format_search_results）
+
+    Returns:
+        PROFILE_ITEMS をキーとする辞書
+
+    Raises:
+        Exception: LLM呼び出し・JSON解析に失敗した場合
+    """
+    prompt = _build_profile_prompt(job_category, web_context)
+    with step("knowledge_profile"), start_span("knowledge.profile", job_category=job_category):
+        return call_openai_routed(
+            prompt=prompt,
+            temperature=Config.TEMP_LAYER2,
+            max_completion_tokens=Config.MAX_TOKENS_KNOWLEDGE_PROFILE,
+            postprocess=_parse_profile
+        )
+
+
+def _parse_profile(response_text: str) -> Dict[str, str]:
+    """
+    標準プロファイルの応答を解析
+
+    Raises:
+        ValueError: 項目が1つも含まれていない場合
+    """
+    data = parse_json_with_retry(response_text)
+    profile = {item: str(data.get(item, "")).strip() for item in PROFILE_ITEMS if data.get(item)}
+    if not profile:
+        raise ValueError("標準プロファイルの項目が含まれていません")
+    return profile
+
+
+def format_profile(profile: Dict[str, str], max_chars: int = None) -> str:
+    """標準プロファイルをプロンプトに埋め込む短いテキストに整形"""
+    max_chars = max_chars or Config.KNOWLEDGE_PROFILE_MAX_CHARS
+    lines = [f"- {item}: {profile[item]}" for item in PROFILE_ITEMS if profile.get(item)]
+    return "\n".join(lines)[:max_chars]
+
+
+# ==================== キャッシュ ====================
+class CategoryKnowledge:
+    """職種ナレッジの保存・参照（1接続をロックで共有する）"""
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path or Config.RESULT_DB)
+        self._conn = connect(self.path)
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(category_knowledge)")}
+        if "search_results" not in columns:
+            # 整形済みテキスト（search_context）を保存していた旧スキーマ。検索結果は次回の検索で保存し直す
+            self._conn.execute("ALTER TABLE category_knowledge ADD COLUMN search_results TEXT")
+        self._lock = threading.Lock()
+        # 要約を実行中の職種（同じ職種の要約を重複して起動しない）
+        self._refreshing = set()
+
+    def _row(self, job_category: str) -> Optional[tuple]:
+        return self._conn.execute(
+            "SELECT job_category, search_results, search_fetched_at, profile, profile_built_at, hit_count "
+            "FROM category_knowledge WHERE category_key = ?",
+            (normalize_category(job_category),)
+        ).fetchone()
+
+    def _upsert(self, job_category: str, **columns: Any) -> None:
+        now = _now().isoformat(timespec="seconds")
+        names = list(columns)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO category_knowledge (category_key, job_category, updated_at, {', '.join(names)}) "
+                f"VALUES (?, ?, ?, {', '.join('?' for _ in names)}) "
+                f"ON CONFLICT(category_key) DO UPDATE SET job_category = excluded.job_category, "
+                f"updated_at = excluded.updated_at, {', '.join(f'{n} = excluded.{n}' for n in names)}",
+                [normalize_category(job_category), job_category.strip(), now] + [columns[n] for n in names]
+            )
+
+    def _touch(self, job_category: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE category_knowledge SET hit_count = hit_count + 1 WHERE category_key = ?",
+                (normalize_category(job_category),)
+            )
+
+    def get_search_results(self, job_category: str) -> Optional[List[List[Dict[str, str]]]]:
+        """有効期限内の検索結果（検索ごとの結果のリスト。無い・期限切れの場合は None）"""
+        with self._lock:
+            row = self._row(job_category)
+        if row is None or not row[1]:
+            KNOWLEDGE_CACHE_LOOKUPS.inc(kind="search", result="miss")
+            return None
+        if not _is_fresh(row[2], Config.KNOWLEDGE_SEARCH_TTL_HOURS):
+            KNOWLEDGE_CACHE_LOOKUPS.inc(kind="search", result="expired")
+            return None
+        KNOWLEDGE_CACHE_LOOKUPS.inc(kind="search", result="hit")
+        self._touch(job_category)
+        return json.loads(row[1])
+
+    def put_search_results(self, job_category: str, sections: List[List[Dict[str, str]]]) -> None:
+        self._upsert(
+            job_category,
+            search_results=json.dumps(sections, ensure_ascii=False),
+            search_fetched_at=_now().isoformat(timespec="seconds")
+        )
+
+    def get_profile(self, job_category: str) -> Optional[Dict[str, str]]:
+        """有効期限内の標準プロファイル（無い・期限切れの場合は None）"""
+        with self._lock:
+            row = self._row(job_category)
+        if row is None or not row[3]:
+            KNOWLEDGE_CACHE_LOOKUPS.inc(kind="profile", result="miss")
+            return None
+        if not _is_fresh(row[4], Config.KNOWLEDGE_PROFILE_TTL_HOURS):
+            KNOWLEDGE_CACHE_LOOKUPS.inc(kind="profile", result="expired")
+            return None
+        KNOWLEDGE_CACHE_LOOKUPS.inc(kind="profile", result="hit")
+        return json.loads(row[3])
+
+    def put_profile(self, job_category: str, profile: Dict[str, str]) -> None:
+        self._upsert(
+            job_category,
+            profile=json.dumps(profile, ensure_ascii=False),
+            profile_built_at=_now().isoformat(timespec="seconds")
+        )
+
+    def needs_profile(self, job_category: str) -> bool:
+        """標準プロファイルが無い・期限切れか（参照回数のメトリクスは数えない）"""
+        with self._lock:
+            row = self._row(job_category)
+        return row is None or not row[3] or not _is_fresh(row[4], Config.KNOWLEDGE_PROFILE_TTL_HOURS)
+
+    def refresh_profile(self, job_category: str, web_context: str) -> Optional[Dict[str, str]]:
+        """
+        検索コンテキストから標準プロファイルを要約して保存（失敗時はログのみで None）
+        """
+        key = normalize_category(job_category)
+        with self._lock:
+            if key in self._refreshing:
+                return None
+            self._refreshing.add(key)
+        try:
+            profile = distill_profile(job_category, web_context)
+            if not profile:
+                logger.warning(f"職種ナレッジの要約が空でした（職種: {job_category}）")
+                return None
+            self.put_profile(job_category, profile)
+            logger.info(f"職種ナレッジの標準プロファイルを更新しました（職種: {job_category}）")
+            return profile
+        except Exception as e:
+            logger.warning(f"職種ナレッジの要約に失敗しました（職種: {job_category}）: {str(e)}")
+            return None
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def refresh_profile_async(self, job_category: str, web_context: str) -> None:
+        """標準プロファイルの要約をバックグラウンドで実行（run ID 等のコンテキストを引き継ぐ）"""
+        ctx = contextvars.copy_context()
+        threading.Thread(
+            target=ctx.run,
+            args=(self.refresh_profile, job_category, web_context),
+            name="category-knowledge-refresh",
+            daemon=True
+        ).start()
+
+    def list_categories(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_category, search_fetched_at, profile_built_at, hit_count, updated_at "
+                "FROM category_knowledge ORDER BY hit_count DESC, updated_at DESC"
+            ).fetchall()
+        return [
+            {"job_category": r[0], "search_fetched_at": r[1], "profile_built_at": r[2],
+             "hit_count": r[3], "updated_at": r[4]}
+            for r in rows
+        ]
+
+    def show(self, job_category: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._row(job_category)
+        if row is None:
+            return None
+        return {
+            "job_category": row[0],
+            "search_results": json.loads(row[1]) if row[1] else None,
+            "search_fetched_at": row[2],
+            "profile": json.loads(row[3]) if row[3] else None,
+            "profile_built_at": row[4],
+            "hit_count": row[5],
+        }
+
+    def purge(self, days: int) -> int:
+        """最終更新から days 日以上経った職種を削除"""
+        cutoff = (_now() - timedelta(days=days)).isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM category_knowledge WHERE updated_at < ?", (cutoff,)).rowcount
+
+
+_knowledge: Optional[CategoryKnowledge] = None
+_knowledge_lock = threading.Lock()
+
+
+def get_category_knowledge() -> Optional[CategoryKnowledge]:
+    """プロセス共通のキャッシュ（KNOWLEDGE_CACHE_ENABLED=0 の場合は None）"""
+    global _knowledge
+    if not Config.KNOWLEDGE_CACHE_ENABLED:
+        return None
+    with _knowledge_lock:
+        if _knowledge is None:
+            _knowledge = CategoryKnowledge()
+        return _knowledge
+
+
+def get_profile_context(job_category: str) -> Optional[str]:
+    """
+    レイヤー②のプロンプトに渡す職種の標準プロファイル（無い・無効・参照失敗の場合は None）
+    """
+    try:
+        knowledge = get_category_knowledge()
+        profile = knowledge.get_profile(job_category) if knowledge else None
+    except Exception as e:
+        logger.warning(f"職種ナレッジの参照に失敗しました: {str(e)}")
+        return None
+    return format_profile(profile) if profile else None
+
+
+# ==================== CLI ====================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="職種ナレッジキャッシュの一覧・参照・更新・削除")
+    parser.add_argument("--db", default=str(Config.RESULT_DB), help="結果DBのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="保存済みの職種")
+    p_show = sub.add_parser("show", help="1職種の詳細")
+    p_show.add_argument("job_category")
+    p_refresh = sub.add_parser("refresh", help="検索・要約をやり直す")
+    p_refresh.add_argument("job_category")
+    p_purge = sub.add_parser("purge", help="古い職種を削除")
+    p_purge.add_argument("--days", type=int, default=90)
+    args = parser.parse_args()
+
+    knowledge = CategoryKnowledge(Path(args.db))
+    if args.command == "list":
+        for r in knowledge.list_categories():
+            print(f"{r['job_category']:<16} hits={r['hit_count']}  search={r['search_fetched_at']}  "
+                  f"profile={r['profile_built_at']}  updated={r['updated_at']}")
+    elif args.command == "show":
+        entry = knowledge.show(args.job_category)
+        if entry is None:
+            print("該当する職種が見つかりません")
+            sys.exit(1)
+        print(json.dumps(entry, ensure_ascii=False, indent=2))
+    elif args.command == "refresh":
+        # serpapi_utils はこのモジュールを参照するため、CLI の実行時に読み込む
+        from serpapi_utils import format_search_results, search_job_category
+        sections, result_count = search_job_category(args.job_category)
+        if not result_count:
+            print("検索結果が得られませんでした")
+            sys.exit(1)
+        knowledge.put_search_results(args.job_category, sections)
+        profile = knowledge.refresh_profile(args.job_category, format_search_results(*sections))
+        if profile is None:
+            sys.exit(1)
+        print(format_profile(profile))
+    else:
+        print(f"{knowledge.purge(args.days)}件を削除しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+生成のチェックポイント（ステージごとの検証済み出力）
+パイプラインのステージグラフ（stage_graph）の各ステージの出力を、入力のフィンガープリント付きで保存する。
+レイヤー③で失敗した場合でもレイヤー①②の出力を残し、再実行時はその続きから再開する（レイヤー①②の LLM 呼び出し・Web検索を省く）。
+入力が変わったステージから下流は再計算される。レイヤー②の出力があれば、レイヤー③だけを再生成することもできる（pipeline.regenerate_layer3）。
+
+キーは生成結果ストアと同じ result_key（求人ハッシュ + 職種名 + 生成バージョン）なので、プロンプトや設定を変えると古いチェックポイントは使われない。
+保存先は生成結果ストアと同じ SQLite（Config.RESULT_DB）で、直近 CHECKPOINT_MEMORY_RUNS 件はプロセス内にも保持する。
+CHECKPOINT_TTL_HOURS を過ぎたチェックポイントは使わない。
+
+使い方（CLI）:
+    python checkpoints.py list --limit 20       # チェックポイントのある生成
+    python checkpoints.py purge --hours 72      # 72時間より古いチェックポイントを削除
+"""
+import argparse
+import copy
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from result_store import _now, _pack, _unpack, connect
+from utils import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_checkpoints (
+    run_key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    job_category TEXT,
+    run_id TEXT,
+    created_at TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (run_key, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_stage_checkpoints_created ON stage_checkpoints(created_at);
+"""
+
+
+class CheckpointStore:
+    """チェックポイントの保存・参照（1接続をロックで共有する）"""
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path or Config.RESULT_DB)
+        self._conn = connect(self.path)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # run_key → {stage: (作成日時, 出力)}
+        self._memory: "OrderedDict[str, Dict[str, tuple]]" = OrderedDict()
+
+    def _cutoff(self) -> str:
+        return (datetime.now() - timedelta(hours=Config.CHECKPOINT_TTL_HOURS)).isoformat(timespec="seconds")
+
+    def save(self, run_key: str, stage: str, value: Any, job_category: str = None, run_id: str = None) -> None:
+        """ステージの出力を保存（同じステージの古いチェックポイントは置き換える）"""
+        now = _now()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO stage_checkpoints (run_key, stage, job_category, run_id, created_at, value) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (run_key, stage, job_category, run_id, now, _pack(value))
+                )
+            self._memory.setdefault(run_key, {})[stage] = (now, value)
+            self._memory.move_to_end(run_key)
+            while len(self._memory) > Config.CHECKPOINT_MEMORY_RUNS:
+                self._memory.popitem(last=False)
+
+    def load(self, run_key: str) -> Dict[str, Any]:
+        """
+        期限内のチェックポイント
+
+        Returns:
+            ステージ名 → 出力 の辞書（無い場合は空の辞書）
+        """
+        cutoff = self._cutoff()
+        with self._lock:
+            cached = self._memory.get(run_key)
+            if cached is not None:
+                self._memory.move_to_end(run_key)
+                # 呼び出し側で書き換えても保持している出力が変わらないように複製して返す
+                return {stage: copy.deepcopy(value) for stage, (created_at, value) in cached.items() if created_at >= cutoff}
+            rows = self._conn.execute(
+                "SELECT stage, created_at, value FROM stage_checkpoints WHERE run_key = ? AND created_at >= ?",
+                (run_key, cutoff)
+            ).fetchall()
+        return {stage: _unpack(value) for stage, _, value in rows}
+
+    def clear(self, run_key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM stage_checkpoints WHERE run_key = ?", (run_key,))
+            self._memory.pop(run_key, None)
+
+    def list_runs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_key, MAX(job_category), GROUP_CONCAT(stage), MAX(created_at), MAX(run_id) "
+                "FROM (SELECT * FROM stage_checkpoints ORDER BY created_at) GROUP BY run_key "
+                "ORDER BY MAX(created_at) DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [
+            {"run_key": r[0], "job_category": r[1], "stages": (r[2] or "").split(","), "updated_at": r[3], "run_id": r[4]}
+            for r in rows
+        ]
+
+    def purge(self, hours: float = None) -> int:
+        """期限切れのチェックポイントを削除"""
+        hours = Config.CHECKPOINT_TTL_HOURS if hours is None else hours
+        cutoff = (datetime.now() - timedelta(hours=hours)).isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._memory.clear()
+            return self._conn.execute("DELETE FROM stage_checkpoints WHERE created_at < ?", (cutoff,)).rowcount
+
+
+_store: Optional[CheckpointStore] = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> Optional[CheckpointStore]:
+    """プロセス共通のストア（無効な場合は None）"""
+    global _store
+    if not Config.CHECKPOINT_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = CheckpointStore()
+        return _store
+
+
+def save_checkpoint(run_key: str, stage: str, value: Any, job_category: str = None, run_id: str = None) -> None:
+    """チェックポイントを保存（無効・保存失敗の場合は何もしない。生成自体は続ける）"""
+    store = get_checkpoint_store()
+    if store is None:
+        return
+    try:
+        store.save(run_key, stage, value, job_category=job_category, run_id=run_id)
+    except Exception as e:
+        logger.warning(f"チェックポイントの保存に失敗しました（{stage}）: {str(e)}")
+
+
+def load_checkpoints(run_key: str) -> Dict[str, Any]:
+    """チェックポイントを取得（無効・参照失敗の場合は空の辞書）"""
+    store = get_checkpoint_store()
+    if store is None:
+        return {}
+    try:
+        return store.load(run_key)
+    except Exception as e:
+        logger.warning(f"チェックポイントの参照に失敗しました: {str(e)}")
+        return {}
+
+
+class RunCheckpoints:
+    """
+    1件の生成（run_key）のチェックポイントをステージグラフのキャッシュとして使う（stage_graph.StageCache と同じメソッド）
+    値は {"fingerprint": 入力のフィンガープリント, "outputs": 出力名 → 値} の形で保存する
+    """
+
+    def __init__(self, run_key: str, job_category: str = None, run_id: str = None):
+        self.run_key = run_key
+        self.job_category = job_category
+        self.run_id = run_id
+        self._loaded: Optional[Dict[str, Any]] = None
+
+    def get(self, stage: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        if self._loaded is None:
+            self._loaded = load_checkpoints(self.run_key)
+        entry = self._loaded.get(stage)
+        if not isinstance(entry, dict) or "fingerprint" not in entry:
+            return None
+        return entry["fingerprint"], entry["outputs"]
+
+    def put(self, stage: str, fingerprint: str, outputs: Dict[str, Any]) -> None:
+        save_checkpoint(
+            self.run_key, stage, {"fingerprint": fingerprint, "outputs": outputs},
+            job_category=self.job_category, run_id=self.run_id
+        )
+
+
+# ==================== CLI ====================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="生成のチェックポイントの一覧・削除")
+    parser.add_argument("--db", default=str(Config.RESULT_DB), help="結果DBのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_list = sub.add_parser("list", help="チェックポイントのある生成")
+    p_list.add_argument("--limit", type=int, default=20)
+    p_purge = sub.add_parser("purge", help="古いチェックポイントを削除")
+    p_purge.add_argument("--hours", type=float, default=Config.CHECKPOINT_TTL_HOURS)
+    args = parser.parse_args()
+
+    store = CheckpointStore(Path(args.db))
+    if args.command == "list":
+        for r in store.list_runs(args.limit):
+            print(f"{r['run_key'][:12]}  {r['job_category'] or '-':<16} stages={','.join(r['stages'])}  "
+                  f"updated={r['updated_at']}  run_id={r['run_id']}")
+    else:
+        print(f"{store.purge(args.hours)}件を削除しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,8 @@ from dotenv import load_dotenv
 try:
     import streamlit as st
     _USE_STREAMLIT_SECRETS = hasattr(st, 'secrets') and len(st.secrets) > 0
-except (ImportError, RuntimeError):
+except (ImportError, RuntimeError, OSError):
+    # secrets.toml が無い環境（バッチCLI等）では StreamlitSecretNotFoundError(OSError) が送出される
     _USE_STREAMLIT_SECRETS = False
 
 # config.envファイルを読み込み（`config.env` を優先し、なければ example を使用）
@@ -28,6 +29,14 @@ class Config:
     
     # ==================== LLM設定 ====================
     OPENAI_MODEL = "gpt-5-mini"
+    # 抽出・正規化など軽いステップ用の小さいモデル（model_routing）
+    OPENAI_MODEL_SMALL = os.getenv("OPENAI_MODEL_SMALL", "gpt-5-nano")
+    # 既定は無効（すべて OPENAI_MODEL）。有効にすると MODEL_ROUTES のステップを小さいモデルで実行する
+    MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "0") not in ("0", "false", "False")
+    # ステップタグ（telemetry.step）→ small | large。完全一致 → 末尾の要素の順で引き、無ければ large
+    MODEL_ROUTES = os.getenv("MODEL_ROUTES", "layer1=small,tech=small,knowledge_profile=small")
+    # small で Step 2-1 を実行した場合、自信度がこの値未満なら large でやり直す
+    MODEL_ESCALATE_CONFIDENCE = float(os.getenv("MODEL_ESCALATE_CONFIDENCE", "0.5"))
     
     # Streamlit Cloud対応: st.secretsから読み込み、なければ環境変数
     if _USE_STREAMLIT_SECRETS:
@@ -39,6 +48,9 @@ class Config:
     else:
         OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
     
+    # OpenAI互換エンドポイントのURL（空ならOpenAI本番。ローカルのスタンドインを指す場合に設定）
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+    
     # ==================== SerpAPI設定 ====================
     if _USE_STREAMLIT_SECRETS:
         try:
@@ -49,6 +61,53 @@ class Config:
     else:
         SERPAPI_KEY = os.getenv("SERPAPI_KEY", "")
     
+    # SerpAPIのエンドポイント（ローカルのスタンドインを指す場合に変更）
+    SERPAPI_ENDPOINT = os.getenv("SERPAPI_ENDPOINT", "https://serpapi.com/search")
+    # SerpAPI の HTTPクライアント: requests（既定）| httpx（h2 があれば HTTP/2）
+    SERPAPI_HTTP_CLIENT = os.getenv("SERPAPI_HTTP_CLIENT", "requests")
+    SERPAPI_READ_TIMEOUT_SEC = float(os.getenv("SERPAPI_READ_TIMEOUT_SEC", "15"))
+    
+    # ==================== HTTPクライアント（http_client） ====================
+    HTTP_CONNECT_TIMEOUT_SEC = float(os.getenv("HTTP_CONNECT_TIMEOUT_SEC", "3"))
+    HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))              # 接続エラー・429 / 5xx のリトライ回数
+    HTTP_BACKOFF_SEC = float(os.getenv("HTTP_BACKOFF_SEC", "0.5"))  # リトライ間隔 = この値 × 2^n
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))         # 1ホストあたりに保持する接続数
+    HTTP_GZIP = os.getenv("HTTP_GZIP", "1") not in ("0", "false", "False")
+    
+    # ==================== トランスポート設定（オフライン実行・ベンチマーク用） ====================
+    # LLM: openai（本番/OPENAI_BASE_URL）| record（本番呼び出しをカセットに記録）| replay（カセットから再生）| mock（合成応答）
+    LLM_TRANSPORT = os.getenv("LLM_TRANSPORT", "openai")
+    # 検索: serpapi（本番/SERPAPI_ENDPOINT）| record | replay | mock | local（corpus/ のローカル索引）
+    SEARCH_TRANSPORT = os.getenv("SEARCH_TRANSPORT", "serpapi")
+    CASSETTE_NAME = os.getenv("CASSETTE_NAME", "default")
+    # カセットに記録が無い場合: error（例外）| mock（合成応答で代替）
+    CASSETTE_MISS_POLICY = os.getenv("CASSETTE_MISS_POLICY", "error")
+    # replay時の待機時間 = 記録時レイテンシ × この倍率（0なら待機しない）
+    SIM_LATENCY_SCALE = float(os.getenv("SIM_LATENCY_SCALE", "0"))
+    # mock時の待機時間 = 基本秒数 + 出力1kトークンあたり秒数（対数正規ノイズ付き）
+    MOCK_LATENCY_BASE = float(os.getenv("MOCK_LATENCY_BASE", "0"))
+    MOCK_LATENCY_PER_1K_TOKENS = float(os.getenv("MOCK_LATENCY_PER_1K_TOKENS", "0"))
+    MOCK_LATENCY_JITTER = float(os.getenv("MOCK_LATENCY_JITTER", "0.25"))
+    # mock時のトークン数概算（1トークンあたりの文字数）
+    MOCK_CHARS_PER_TOKEN = float(os.getenv("MOCK_CHARS_PER_TOKEN", "2.0"))
+    # mock時のAPIティア制限（0なら無制限）。超過時はレート制限エラー（429相当）を返す
+    MOCK_RPM_LIMIT = int(os.getenv("MOCK_RPM_LIMIT", "0"))
+    MOCK_TPM_LIMIT = int(os.getenv("MOCK_TPM_LIMIT", "0"))
+    MOCK_MAX_CONCURRENCY = int(os.getenv("MOCK_MAX_CONCURRENCY", "0"))
+    # mock時にサーバーエラー（500相当）を返す確率
+    MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+    
+    # ==================== ヘッジ（遅い応答への重複リクエスト） ====================
+    # 応答が モデル × ステップ の直近レイテンシの HEDGE_PERCENTILE 分位点を超えても返らない場合に、同じリクエストをもう1本送る
+    HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") not in ("0", "false", "False")
+    HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+    HEDGE_MIN_DELAY_SEC = float(os.getenv("HEDGE_MIN_DELAY_SEC", "1.0"))  # 分位点がこれより短くてもこの秒数は待つ
+    HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))         # 実績がこの件数に満たない間はヘッジしない
+    HEDGE_WINDOW = 200                                                   # 分位点の計算に使う直近の件数
+    # 直近 HEDGE_BUDGET_WINDOW 件のリクエストに占めるヘッジの割合の上限（コストの上限）
+    HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.05"))
+    HEDGE_BUDGET_WINDOW = 200
+    
     # ==================== 処理パラメータ ====================
     # Web検索発動の閾値（この値未満の自信度でWeb検索を実行）
     CONFIDENCE_THRESHOLD = 0.65
@@ -56,8 +115,23 @@ class Config:
     # SerpAPIで取得する検索結果数
     MAX_SEARCH_RESULTS = 5
     
+    # 過去の検索での自信度の上昇幅に基づいて検索を省く・追加する（search_policy。LLM_TRANSPORT=openai / record のときのみ）
+    SEARCH_POLICY_ENABLED = os.getenv("SEARCH_POLICY_ENABLED", "1") not in ("0", "false", "False")
+    SEARCH_POLICY_MIN_UPLIFT = float(os.getenv("SEARCH_POLICY_MIN_UPLIFT", "0.03"))       # これ未満の上昇幅しか無い検索は省く
+    SEARCH_POLICY_PRIORITY_UPLIFT = float(os.getenv("SEARCH_POLICY_PRIORITY_UPLIFT", "0.1"))  # これ以上上がる職種は閾値付近でも検索する
+    SEARCH_POLICY_PRIORITY_MARGIN = 0.1   # 閾値 + この値未満の自信度を「閾値付近」とみなす
+    SEARCH_POLICY_EXPLORE_RATE = float(os.getenv("SEARCH_POLICY_EXPLORE_RATE", "0.1"))    # 省く判断でも実績の更新のため検索する割合
+    SEARCH_POLICY_WINDOW = 20             # 判断に使う直近の実績の件数
+    SEARCH_POLICY_MIN_SAMPLES = 3         # 職種の実績がこの件数未満なら全職種の実績を使う
+    
     # 検索結果から抽出する最大文字数
     WEB_CONTEXT_MAX_CHARS = 3000
+    # プロンプトに含める検索結果の推定トークン数の上限（関連度の高い順に選ぶ。context_packing）
+    WEB_CONTEXT_TOKEN_BUDGET = int(os.getenv("WEB_CONTEXT_TOKEN_BUDGET", "1500"))
+    # スニペットの語の Jaccard 係数がこの値以上の検索結果は重複として除く
+    CONTEXT_DEDUP_THRESHOLD = 0.6
+    # トークン数の概算に使う1トークンあたりの文字数（日本語混じりのテキスト）
+    CONTEXT_CHARS_PER_TOKEN = 2.0
     # プロンプトに含める各フィールドの最大文字数（超過分は切り詰める）
     PROMPT_FIELD_MAX_CHARS = 3000
     
@@ -72,6 +146,7 @@ class Config:
     MAX_TOKENS_LAYER2 = 12000  # Layer②: プロンプトが長いため出力を抑制（8192制限対策）
     MAX_TOKENS_LAYER3 = 12000  # Layer③: 表データ生成
     MAX_TOKENS_MODIFICATION = 3500
+    MAX_TOKENS_KNOWLEDGE_PROFILE = 2000  # 職種ナレッジ: 標準プロファイルの要約
 
     # ==================== QAメモリ設定 ====================
     QA_HISTORY_MAX_ITEMS = 10       # セッションに保持するQAターン数
@@ -86,26 +161,162 @@ class Config:
     MAX_RETRIES = 3
     RETRY_DELAY = 2  # 秒
     
+    # ==================== サーキットブレーカー・流量制限（resilience） ====================
+    # 依存先（openai:<モデル> / serpapi）ごとに直近 CIRCUIT_WINDOW_SEC 秒の失敗率が CIRCUIT_FAILURE_RATE 以上
+    # （CIRCUIT_MIN_CALLS 件以上）になったら CIRCUIT_OPEN_SEC 秒は呼び出さずに即失敗させ、その後 CIRCUIT_HALF_OPEN_PROBES 件の試行で回復を確認する
+    CIRCUIT_ENABLED = os.getenv("CIRCUIT_ENABLED", "1") not in ("0", "false", "False")
+    CIRCUIT_WINDOW_SEC = float(os.getenv("CIRCUIT_WINDOW_SEC", "60"))
+    CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+    CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+    CIRCUIT_OPEN_SEC = float(os.getenv("CIRCUIT_OPEN_SEC", "30"))
+    CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1"))
+    # 同時に実行する生成の上限。超えた分は最大 ADMISSION_MAX_QUEUED 件まで ADMISSION_QUEUE_TIMEOUT_SEC 秒待たせ、それ以上は受け付けない
+    ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "4"))
+    ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "8"))
+    ADMISSION_QUEUE_TIMEOUT_SEC = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SEC", "30"))
+    
+    # ==================== バッチ処理設定 ====================
+    BATCH_COMPLETION_WINDOW = "24h"   # Batch APIの完了期限
+    BATCH_POLL_INTERVAL = 30          # バッチ状態のポーリング間隔（秒）
+    BATCH_MAX_WAIT = 60 * 60 * 26     # ポーリングを諦めるまでの最大待機時間（秒）
+    
+    # ==================== テレメトリ設定 ====================
+    # LLM呼び出し記録の出力先: jsonl（token_usage.log）| sqlite（telemetry.db）| both
+    TELEMETRY_SINK = os.getenv("TELEMETRY_SINK", "both")
+    TELEMETRY_FLUSH_INTERVAL = 2.0    # SQLiteへの書き込み間隔（秒）
+    TELEMETRY_BATCH_SIZE = 200        # 1回の書き込みでまとめる最大件数
+    # 料金（USD / 100万トークン）: コスト集計用。バッチ処理は BATCH_PRICE_RATIO 倍で計算
+    PRICE_INPUT_PER_1M = float(os.getenv("PRICE_INPUT_PER_1M", "0.25"))
+    PRICE_CACHED_INPUT_PER_1M = float(os.getenv("PRICE_CACHED_INPUT_PER_1M", "0.025"))
+    PRICE_OUTPUT_PER_1M = float(os.getenv("PRICE_OUTPUT_PER_1M", "2.0"))
+    # OPENAI_MODEL_SMALL の料金
+    PRICE_SMALL_INPUT_PER_1M = float(os.getenv("PRICE_SMALL_INPUT_PER_1M", "0.05"))
+    PRICE_SMALL_CACHED_INPUT_PER_1M = float(os.getenv("PRICE_SMALL_CACHED_INPUT_PER_1M", "0.005"))
+    PRICE_SMALL_OUTPUT_PER_1M = float(os.getenv("PRICE_SMALL_OUTPUT_PER_1M", "0.40"))
+    BATCH_PRICE_RATIO = 0.5
+    # トレースの出力先（カンマ区切り: file,console,otlp。既定は無効）
+    # file は logs/traces.jsonl に追記し続ける（ローテーションしない）ため、調査時だけ有効にする
+    TRACE_EXPORTERS = os.getenv("TRACE_EXPORTERS", "")
+    OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+    # メトリクス（Prometheus 形式）の公開先。METRICS_PORT を設定した場合のみ公開する（未設定・0 で無効）
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+    # プロファイリング: off | sample（スタック採取）| cprofile | both。PROFILE_SAMPLE_RATE の割合の実行だけを対象にする
+    PROFILE_MODE = os.getenv("PROFILE_MODE", "off")
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "1.0"))
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+    PROFILE_KEEP = 200                # 保持するプロファイル（実行）の件数。超えた分は古い順に削除
+    
+    # ==================== 生成結果ストア ====================
+    # 生成結果（最終出力・中間成果物・修正履歴）を data/results.db に保存し、同じ求人の再生成を省く
+    RESULT_STORE_ENABLED = os.getenv("RESULT_STORE_ENABLED", "1") not in ("0", "false", "False")
+    # 類似求人の検出（MinHash + LSH）: 文字 n-gram の Jaccard 係数がこの値以上なら過去の成果物を再利用候補にする
+    NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "1") not in ("0", "false", "False")
+    NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.8"))
+    NEAR_DUP_SHINGLE_SIZE = 5         # シングルの文字数（変えた場合は near_duplicates.py rebuild で索引を作り直す）
+    # 生成の各レイヤーの出力をチェックポイントとして保存し、途中で失敗した生成を続きから再開する（checkpoints）
+    CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "1") not in ("0", "false", "False")
+    CHECKPOINT_TTL_HOURS = float(os.getenv("CHECKPOINT_TTL_HOURS", "72"))
+    CHECKPOINT_MEMORY_RUNS = 32       # プロセス内に保持する生成の件数（超えた分は SQLite からのみ読む）
+
+    # ステージグラフ（stage_graph）で並行して実行するステージのスレッド数（プロセス共通）
+    PIPELINE_STAGE_WORKERS = int(os.getenv("PIPELINE_STAGE_WORKERS", "4"))
+
+    # UI の生成をバックグラウンドジョブとして実行する（jobs、streamlit>=1.37 が必要）。既定はスクリプト実行の中で生成を待つ
+    JOBS_ENABLED = os.getenv("JOBS_ENABLED", "0") not in ("0", "false", "False")
+    # ジョブを実行するスレッド数（実行中の生成の上限は ADMISSION_MAX_IN_FLIGHT）と、受け付ける待ちのジョブの上限
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+    JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "16"))
+    JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+    JOB_POLL_INTERVAL_SEC = 1.0       # UI がジョブの進捗を確認する間隔（秒）
+    
+    # ==================== 検索キャッシュ ====================
+    # SerpAPI の応答を data/results.db に保存する（SEARCH_TRANSPORT=serpapi / record のときのみ）
+    SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "1") not in ("0", "false", "False")
+    SEARCH_CACHE_TTL_HOURS = float(os.getenv("SEARCH_CACHE_TTL_HOURS", "72"))
+    # 期限切れ後この時間までは保存済みの結果を返しつつバックグラウンドで再検索する
+    SEARCH_CACHE_STALE_HOURS = float(os.getenv("SEARCH_CACHE_STALE_HOURS", "168"))
+    # 失敗・0件の結果を保存しておく秒数（この間は再検索しない）
+    SEARCH_CACHE_NEGATIVE_TTL_SEC = float(os.getenv("SEARCH_CACHE_NEGATIVE_TTL_SEC", "300"))
+    
+    # SerpAPI が使えない場合に corpus/ と過去の検索結果のローカル索引（BM25）で代替する
+    LOCAL_SEARCH_FALLBACK = os.getenv("LOCAL_SEARCH_FALLBACK", "1") not in ("0", "false", "False")
+    
+    # 上位の検索結果のページを取得して本文から求人に関連する段落を抜き出す（SEARCH_TRANSPORT=serpapi / record のときのみ）
+    PAGE_FETCH_ENABLED = os.getenv("PAGE_FETCH_ENABLED", "0") in ("1", "true", "True")
+    PAGE_FETCH_TOP_K = int(os.getenv("PAGE_FETCH_TOP_K", "2"))              # 検索ごとに取得する上位の件数
+    PAGE_FETCH_WORKERS = int(os.getenv("PAGE_FETCH_WORKERS", "4"))          # 同時に取得するページ数
+    PAGE_FETCH_PER_HOST = int(os.getenv("PAGE_FETCH_PER_HOST", "2"))        # 同じホストへの同時接続数
+    PAGE_FETCH_READ_TIMEOUT_SEC = float(os.getenv("PAGE_FETCH_READ_TIMEOUT_SEC", "8"))
+    PAGE_FETCH_MAX_BYTES = 2_000_000      # これより大きいページは先頭だけを読む
+    PAGE_CACHE_TTL_HOURS = float(os.getenv("PAGE_CACHE_TTL_HOURS", "24"))   # 期限内は再取得しない（期限後は ETag で再検証）
+    PAGE_PASSAGE_MAX_CHARS = 800          # 1ページから抜き出す段落の合計の最大文字数
+    
+    # ==================== 職種ナレッジキャッシュ ====================
+    # 職種ごとの Web検索結果と業界標準プロファイルを保存し、同じ職種の検索・推察を省く
+    KNOWLEDGE_CACHE_ENABLED = os.getenv("KNOWLEDGE_CACHE_ENABLED", "1") not in ("0", "false", "False")
+    KNOWLEDGE_SEARCH_TTL_HOURS = float(os.getenv("KNOWLEDGE_SEARCH_TTL_HOURS", "168"))    # 検索結果の有効期限（1週間）
+    KNOWLEDGE_PROFILE_TTL_HOURS = float(os.getenv("KNOWLEDGE_PROFILE_TTL_HOURS", "720"))  # 標準プロファイルの有効期限（30日）
+    KNOWLEDGE_PROFILE_MAX_CHARS = 1200   # レイヤー②のプロンプトに含める標準プロファイルの最大文字数
+    
     # ==================== ログ設定 ====================
     LOG_LEVEL = "INFO"
     LOG_FILE = "recruiter_system.log"
-    LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+    LOG_FORMAT = '%(asctime)s [%(levelname)s] [%(run_id)s] %(message)s'
+    # ログ・トークン記録をバックグラウンドスレッドで書き込む（リクエスト処理がディスクI/Oを待たない）
+    LOG_ASYNC = os.getenv("LOG_ASYNC", "1") not in ("0", "false", "False")
+    # 非同期書き込みキューの上限（満杯時は WARNING 未満のログ・トークン記録を破棄）
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
     
     # ==================== ファイルパス ====================
     BASE_DIR = Path(__file__).parent
     LOG_DIR = BASE_DIR / "logs"
+    BATCH_DIR = LOG_DIR / "batches"
+    CASSETTE_DIR = BASE_DIR / "cassettes"
+    TELEMETRY_DB = LOG_DIR / "telemetry.db"
+    TRACE_FILE = LOG_DIR / "traces.jsonl"
+    DATA_DIR = BASE_DIR / "data"
+    RESULT_DB = DATA_DIR / "results.db"
+    PROFILE_DIR = LOG_DIR / "profiles"
+    LOCAL_CORPUS_DIR = BASE_DIR / "corpus"
+    PAGE_CACHE_DIR = DATA_DIR / "pages"
     
     @classmethod
     def validate(cls):
         """設定の妥当性をチェック"""
         errors = []
         
-        if not cls.OPENAI_API_KEY:
+        if not cls.OPENAI_API_KEY and cls.LLM_TRANSPORT in ("openai", "record"):
             errors.append("OPENAI_API_KEYが設定されていません")
         
+        if cls.LLM_TRANSPORT not in ("openai", "record", "replay", "mock"):
+            errors.append(f"LLM_TRANSPORTが不正です（現在: {cls.LLM_TRANSPORT}）")
+        
+        if cls.SEARCH_TRANSPORT not in ("serpapi", "record", "replay", "mock", "local"):
+            errors.append(f"SEARCH_TRANSPORTが不正です（現在: {cls.SEARCH_TRANSPORT}）")
+        
+        if cls.SERPAPI_HTTP_CLIENT not in ("requests", "httpx"):
+            errors.append(f"SERPAPI_HTTP_CLIENTが不正です（現在: {cls.SERPAPI_HTTP_CLIENT}）")
+        
+        if cls.TELEMETRY_SINK not in ("jsonl", "sqlite", "both"):
+            errors.append(f"TELEMETRY_SINKが不正です（現在: {cls.TELEMETRY_SINK}）")
+        
+        if cls.PROFILE_MODE not in ("off", "sample", "cprofile", "both"):
+            errors.append(f"PROFILE_MODEが不正です（現在: {cls.PROFILE_MODE}）")
+        
+        if not 0.0 < cls.CIRCUIT_FAILURE_RATE <= 1.0:
+            errors.append(f"CIRCUIT_FAILURE_RATEは0.0-1.0の範囲である必要があります（現在: {cls.CIRCUIT_FAILURE_RATE}）")
+        
+        if not 0.0 < cls.HEDGE_PERCENTILE < 1.0:
+            errors.append(f"HEDGE_PERCENTILEは0.0-1.0の範囲である必要があります（現在: {cls.HEDGE_PERCENTILE}）")
+        
         if not 0.0 <= cls.CONFIDENCE_THRESHOLD <= 1.0:
             errors.append(f"CONFIDENCE_THRESHOLDは0.0-1.0の範囲である必要があります（現在: {cls.CONFIDENCE_THRESHOLD}）")
         
+        for entry in filter(None, (e.strip() for e in cls.MODEL_ROUTES.split(","))):
+            if entry.partition("=")[2].strip() not in ("small", "large"):
+                errors.append(f"MODEL_ROUTESの指定が不正です（small / large を指定してください: {entry}）")
+        
         if cls.MAX_SEARCH_RESULTS < 1:
             errors.append(f"MAX_SEARCH_RESULTSは1以上である必要があります（現在: {cls.MAX_SEARCH_RESULTS}）")
         
@@ -119,7 +330,10 @@ class Config:
         """設定の概要を返す"""
         return {
             "モデル": cls.OPENAI_MODEL,
+            "小さいモデル": cls.OPENAI_MODEL_SMALL if cls.MODEL_ROUTING_ENABLED else "無効",
             "自信度閾値": cls.CONFIDENCE_THRESHOLD,
             "Web検索結果数": cls.MAX_SEARCH_RESULTS,
             "SerpAPI設定": "有効" if cls.SERPAPI_KEY else "無効",
+            "LLMトランスポート": cls.LLM_TRANSPORT,
+            "検索トランスポート": cls.SEARCH_TRANSPORT,
         }
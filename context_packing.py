@@ -0,0 +1,141 @@
+"""
+Web検索結果のコンテキスト圧縮（レイヤー② Step 2-3 のプロンプト用）
+2つの検索（業務フロー・使用技術）の結果を、重複を除き、求人との関連度順に、トークン予算の範囲で選んで整形する。
+
+1. 重複除去: 同じリンク、またはスニペットの語（local_search.tokenize）の Jaccard 係数が CONTEXT_DEDUP_THRESHOLD 以上の結果は
+   先に出てきた方だけを残す（複数のまとめサイトが同じ文面を転載している場合など）
+2. 関連度: レイヤー①の構造化データ（使用技術・業務プロセス・対象製品）の語とスニペットの語の重なり。
+   ツール名などの英数字の語は重みを大きくする。構造化データが無い場合は検索順位のまま
+3. 詰め込み: 関連度の高い順に WEB_CONTEXT_TOKEN_BUDGET（推定トークン数）に収まるものを採用し、検索ごとにまとめて出力する
+"""
+import math
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import Config
+from local_search import tokenize
+from utils import logger
+
+# 関連度の計算に使う構造化データの項目
+RELEVANCE_FIELDS = ["使用技術", "業務プロセス", "対象製品"]
+# 英数字の語（ツール名・技術名）の重み（かな・漢字の bigram は 1）
+ASCII_TERM_WEIGHT = 2.0
+
+SECTION_TITLES = ["【検索1: 業務フロー】", "【検索2: 使用技術】"]
+
+
+def estimate_tokens(text: str) -> int:
+    """日本語混じりテキストのトークン数を概算"""
+    return max(1, math.ceil(len(text or "") / Config.CONTEXT_CHARS_PER_TOKEN))
+
+
+def posting_terms(structured_data: Optional[Dict[str, Any]]) -> Set[str]:
+    """構造化データの関連度計算用の語"""
+    if not structured_data:
+        return set()
+    return set(tokenize(" ".join(str(structured_data.get(field, "")) for field in RELEVANCE_FIELDS)))
+
+
+def relevance(tokens: Set[str], terms: Set[str]) -> float:
+    """語の集合と求人の語の重なり（英数字の語を重視し、語数で正規化）"""
+    if not tokens or not terms:
+        return 0.0
+    overlap = sum(ASCII_TERM_WEIGHT if token.isascii() else 1.0 for token in tokens & terms)
+    # 長いスニペットほど一致しやすいため、語数の平方根で割る
+    return overlap / math.sqrt(len(tokens))
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def pack_search_results(
+    sections: List[List[Dict[str, str]]],
+    structured_data: Optional[Dict[str, Any]] = None,
+    budget_tokens: int = None,
+    max_chars: int = None
+) -> Tuple[List[List[Dict[str, str]]], Dict[str, int]]:
+    """
+    検索結果を重複除去・関連度順に選び、トークン予算に収める
+
+    Args:
+        sections: 検索ごとの結果のリスト（各要素は {title, link, snippet} の辞書。passages があればスニペットに続ける）
+        structured_data: レイヤー①の出力（関連度の計算に使う）
+        budget_tokens: 採用する結果の推定トークン数の上限
+        max_chars: 各スニペットの最大文字数
+
+    Returns:
+        (検索ごとの採用した結果（関連度順）, 集計 {candidates, duplicates, selected, tokens}) のタプル
+    """
+    budget_tokens = budget_tokens or Config.WEB_CONTEXT_TOKEN_BUDGET
+    max_chars = max_chars or Config.WEB_CONTEXT_MAX_CHARS
+    terms = posting_terms(structured_data)
+
+    candidates = []
+    kept_tokens: List[Set[str]] = []
+    seen_links = set()
+    duplicates = 0
+    total = 0
+    for section_index, results in enumerate(sections):
+        for position, item in enumerate(results):
+            total += 1
+            title = item.get("title", "")[:100]
+            snippet = item.get("snippet", "")
+            # page_fetch がページ本文から抜き出した段落はスニペットの後に続ける
+            if item.get("passages"):
+                snippet = f"{snippet}\n{item['passages']}"
+            snippet = snippet[:max_chars]
+            tokens = set(tokenize(f"{title} {snippet}"))
+            link = item.get("link", "")
+            if (link and link in seen_links) or any(
+                _jaccard(tokens, other) >= Config.CONTEXT_DEDUP_THRESHOLD for other in kept_tokens
+            ):
+                duplicates += 1
+                continue
+            seen_links.add(link)
+            kept_tokens.append(tokens)
+            candidates.append({
+                "section": section_index,
+                "position": position,
+                "score": relevance(tokens, terms),
+                "tokens": estimate_tokens(f"{title}\n{snippet}"),
+                "item": {"title": title, "link": link, "snippet": snippet},
+            })
+
+    # 関連度が同じ場合は検索順位、さらに同じなら検索の順（業務フロー → 使用技術を交互に）
+    candidates.sort(key=lambda c: (-c["score"], c["position"], c["section"]))
+    packed: List[List[Dict[str, str]]] = [[] for _ in sections]
+    used = 0
+    for candidate in candidates:
+        if used + candidate["tokens"] > budget_tokens:
+            continue
+        packed[candidate["section"]].append(candidate["item"])
+        used += candidate["tokens"]
+
+    stats = {
+        "candidates": total,
+        "duplicates": duplicates,
+        "selected": sum(len(items) for items in packed),
+        "tokens": used,
+    }
+    logger.info(
+        f"検索結果の圧縮: 候補{stats['candidates']}件（重複{stats['duplicates']}件を除外）→ "
+        f"採用{stats['selected']}件、推定{stats['tokens']}トークン（予算{budget_tokens}）"
+    )
+    return packed, stats
+
+
+def render_sections(packed: List[List[Dict[str, str]]]) -> str:
+    """採用した結果を検索ごとの見出し付きテキストに整形"""
+    context = ""
+    for section_index, items in enumerate(packed):
+        if section_index:
+            context += "\n"
+        context += f"{SECTION_TITLES[section_index]}\n"
+        if not items:
+            context += "（検索結果なし）\n\n"
+            continue
+        for i, item in enumerate(items, 1):
+            context += f"{i}. {item['title']}\n{item['snippet']}\n\n"
+    return context
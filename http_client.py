@@ -0,0 +1,180 @@
+"""
+外部HTTP呼び出しの共通クライアント（SerpAPI・検索結果ページの取得）
+呼び出しのたびに新しい接続を張らないよう、プロセス共通の接続プールを使い回す。
+
+- タイムアウト: 接続と読み取りを分ける（接続できないホストは HTTP_CONNECT_TIMEOUT_SEC ですぐに諦める）
+- リトライ: 接続エラーと 429 / 5xx を指数バックオフ（HTTP_BACKOFF_SEC × 2^n、Retry-After があればそれに従う）で HTTP_RETRIES 回まで。
+  読み取りタイムアウトはリトライしない（待ち時間が倍になるため）
+- 圧縮: HTTP_GZIP=1 で gzip / deflate の応答を受け付ける
+
+requests（既定）の他に httpx のクライアントも選べる（SERPAPI_HTTP_CLIENT=httpx。h2 があれば HTTP/2 を使う）。
+asyncio から呼び出す場合は new_async_http_client() / async_get() を使う（httpx が必要）。
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import Config
+from utils import logger
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    httpx = None
+    HTTPX_AVAILABLE = False
+
+try:
+    import h2  # noqa: F401 - httpx の HTTP/2 サポートの有無を確認するだけ
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def request_timeout(read_timeout: float) -> Tuple[float, float]:
+    """(接続, 読み取り) のタイムアウト（秒）"""
+    return (Config.HTTP_CONNECT_TIMEOUT_SEC, read_timeout)
+
+
+def _accept_encoding() -> str:
+    return "gzip, deflate" if Config.HTTP_GZIP else "identity"
+
+
+# ==================== requests ====================
+def build_session(pool_maxsize: int = None, retries: int = None) -> requests.Session:
+    """
+    接続プールとリトライを設定した Session を作成
+
+    Args:
+        pool_maxsize: 1ホストあたりに保持する接続数（省略時は Config.HTTP_POOL_SIZE）
+        retries: リトライ回数（省略時は Config.HTTP_RETRIES。0 でリトライしない）
+    """
+    retries = Config.HTTP_RETRIES if retries is None else retries
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        backoff_factor=Config.HTTP_BACKOFF_SEC,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        # リトライし尽くした場合も例外にせず最後の応答を返す（呼び出し元がステータスを見て扱う）
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_maxsize=pool_maxsize or Config.HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = _accept_encoding()
+    return session
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """プロセス共通の Session（SerpAPI 用。接続プールを共有する）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = build_session()
+        return _session
+
+
+# ==================== httpx ====================
+def _retry_delay(attempt: int, response: Any = None) -> float:
+    """attempt 回目（0始まり）のリトライまでの待ち時間。Retry-After（秒）があればそれに従う"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return Config.HTTP_BACKOFF_SEC * (2 ** attempt)
+
+
+def _httpx_timeout(timeout: Tuple[float, float]) -> Any:
+    connect, read = timeout
+    return httpx.Timeout(read, connect=connect)
+
+
+_httpx_client = None
+_httpx_lock = threading.Lock()
+
+
+def get_httpx_client() -> Any:
+    """
+    プロセス共通の httpx.Client（h2 があれば HTTP/2）
+
+    Raises:
+        RuntimeError: httpx がインストールされていない場合
+    """
+    global _httpx_client
+    if not HTTPX_AVAILABLE:
+        raise RuntimeError("httpx がインストールされていません（pip install httpx）")
+    with _httpx_lock:
+        if _httpx_client is None:
+            _httpx_client = httpx.Client(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_connections=Config.HTTP_POOL_SIZE, max_keepalive_connections=Config.HTTP_POOL_SIZE),
+                headers={"Accept-Encoding": _accept_encoding()},
+            )
+        return _httpx_client
+
+
+def httpx_get(url: str, params: Dict[str, Any], timeout: Tuple[float, float]) -> Any:
+    """httpx.Client で GET（接続エラーと 429 / 5xx をバックオフ付きでリトライ）"""
+    client = get_httpx_client()
+    for attempt in range(Config.HTTP_RETRIES + 1):
+        last = attempt == Config.HTTP_RETRIES
+        try:
+            response = client.get(url, params=params, timeout=_httpx_timeout(timeout))
+        except httpx.ConnectError:
+            if last:
+                raise
+            time.sleep(_retry_delay(attempt))
+            continue
+        if response.status_code not in RETRY_STATUSES or last:
+            return response
+        logger.warning(f"HTTP {response.status_code} のためリトライします（{attempt + 1}/{Config.HTTP_RETRIES}）: {url}")
+        time.sleep(_retry_delay(attempt, response))
+
+
+def new_async_http_client() -> Any:
+    """
+    httpx.AsyncClient を作成（イベントループに紐づくため、呼び出し元が async with で閉じる）
+
+    Raises:
+        RuntimeError: httpx がインストールされていない場合
+    """
+    if not HTTPX_AVAILABLE:
+        raise RuntimeError("httpx がインストールされていません（pip install httpx）")
+    return httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(max_connections=Config.HTTP_POOL_SIZE, max_keepalive_connections=Config.HTTP_POOL_SIZE),
+        headers={"Accept-Encoding": _accept_encoding()},
+    )
+
+
+async def async_get(client: Any, url: str, params: Dict[str, Any], timeout: Tuple[float, float]) -> Any:
+    """httpx.AsyncClient で GET（リトライの扱いは httpx_get と同じ）"""
+    for attempt in range(Config.HTTP_RETRIES + 1):
+        last = attempt == Config.HTTP_RETRIES
+        try:
+            response = await client.get(url, params=params, timeout=_httpx_timeout(timeout))
+        except httpx.ConnectError:
+            if last:
+                raise
+            await asyncio.sleep(_retry_delay(attempt))
+            continue
+        if response.status_code not in RETRY_STATUSES or last:
+            return response
+        logger.warning(f"HTTP {response.status_code} のためリトライします（{attempt + 1}/{Config.HTTP_RETRIES}）: {url}")
+        await asyncio.sleep(_retry_delay(attempt, response))
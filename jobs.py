@@ -0,0 +1,379 @@
+"""
+生成のバックグラウンドジョブ
+Streamlit のスクリプト実行の中で生成（最大1分程度）を待つと、再実行・再読み込みのたびに生成が中断されて
+それまでのトークンが無駄になる。UI は生成をジョブとして登録するだけにし、実行はプロセス共通のスレッドプールで行う。
+
+- ジョブの状態（queued → running → succeeded / failed）・進捗率・完了したステージ・最終出力は
+  生成結果ストアと同じ SQLite（Config.RESULT_DB）の generation_jobs テーブルに記録する。
+  UI はジョブIDでポーリングし、再実行・再読み込み後も同じジョブに接続し直す（URL の ?job=<ジョブID>）
+- 同じ求人・職種名・種別のジョブが実行中（queued / running）の場合は新しく登録せず、そのジョブを返す（重複した生成をまとめる）
+- 待ちのジョブが JOB_MAX_QUEUED 件を超える場合は OverloadedError で受け付けない
+- プロセスが終了して実行中のまま残ったジョブは、次にジョブ管理を起動したときに失敗として記録する
+  （完了したステージはチェックポイントに残るため、「続きから再開」で再実行できる）
+
+ジョブIDは生成の run_id としても使う（token_usage.log・トレースと対応付けられる）。
+
+使い方（CLI）:
+    python jobs.py list --limit 20        # 最近のジョブ
+    python jobs.py purge --hours 24       # 24時間より前に終了したジョブを削除
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import Config
+from metrics import JOBS, JOBS_ACTIVE
+from pipeline import DELTA_GRAPH, PIPELINE_GRAPH, regenerate_layer3, run_pipeline, run_pipeline_delta
+from result_store import _now, _pack, _unpack, connect, result_key
+from resilience import CircuitOpenError, OverloadedError
+from telemetry import new_run_id
+from utils import logger
+
+# ジョブの種別
+PIPELINE = "pipeline"    # 全レイヤーの生成（resume の場合はチェックポイントの続きから）
+LAYER3 = "layer3"        # レイヤー③だけ再生成
+DELTA = "delta"          # 類似求人の成果物を元に差分再生成
+MODES = (PIPELINE, LAYER3, DELTA)
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    job_id TEXT PRIMARY KEY,
+    job_key TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    job_category TEXT NOT NULL,
+    seed_key TEXT,
+    resume INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    progress INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    stages TEXT,
+    error TEXT,
+    error_kind TEXT,
+    owner TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    updated_at TEXT NOT NULL,
+    finished_at TEXT,
+    job_text BLOB,
+    output BLOB
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_generation_jobs_active ON generation_jobs(job_key) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_created ON generation_jobs(created_at);
+"""
+
+_COLUMNS = (
+    "job_id, mode, job_category, seed_key, resume, status, progress, message, stages, error, error_kind, "
+    "created_at, started_at, updated_at, finished_at, job_text"
+)
+
+
+def job_key(job_text: str, job_category: str, mode: str = PIPELINE, seed_key: str = None) -> str:
+    """重複した生成をまとめるためのキー（種別 + 生成結果ストアのキー + 差分再生成の元）"""
+    key = f"{mode}:{result_key(job_text, job_category)}"
+    return f"{key}:{seed_key}" if mode == DELTA and seed_key else key
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    """ジョブを実行しているプロセスが生きているか（別ホストのプロセスは生きているとみなす）"""
+    if not owner or ":" not in owner:
+        return False
+    host, pid = owner.rsplit(":", 1)
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ProcessLookupError, ValueError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobManager:
+    """生成ジョブの登録・実行・参照（1接続をロックで共有する）"""
+
+    def __init__(self, path: Path = None, workers: int = None):
+        self.path = Path(path or Config.RESULT_DB)
+        self._conn = connect(self.path)
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(generation_jobs)")}
+        if "resume" not in columns:
+            self._conn.execute("ALTER TABLE generation_jobs ADD COLUMN resume INTEGER NOT NULL DEFAULT 0")
+        self._lock = threading.Lock()
+        self._workers = workers or Config.JOB_WORKERS
+        self._executor: Optional[ThreadPoolExecutor] = None  # 最初の登録時に作る（CLI では作らない）
+        self._owner = _owner()
+        self._queued = 0
+        self._running = 0
+        JOBS_ACTIVE.set_function(lambda: self._queued, status=QUEUED)
+        JOBS_ACTIVE.set_function(lambda: self._running, status=RUNNING)
+
+    # ==================== 登録 ====================
+    def submit(
+        self,
+        job_text: str,
+        job_category: str,
+        mode: str = PIPELINE,
+        seed_key: str = None,
+        resume: bool = False
+    ) -> Dict[str, Any]:
+        """
+        生成ジョブを登録（同じ求人・種別のジョブが実行中の場合はそのジョブを返す）
+
+        Args:
+            job_text: 求人テキスト
+            job_category: 職種名
+            mode: ジョブの種別（pipeline / layer3 / delta）
+            seed_key: 類似求人の保存キー（delta の場合のみ）
+            resume: True の場合、前回の生成のチェックポイントの続きから再開する（pipeline の場合のみ。
+                同じ求人の生成が実行中の場合は resume の指定に関わらずそのジョブにまとめる）
+
+        Returns:
+            {"job_id": ジョブID, "coalesced": 実行中のジョブにまとめた場合 True}
+
+        Raises:
+            ValueError: 種別が不正な場合
+            OverloadedError: 待ちのジョブが多い場合
+        """
+        if mode not in MODES:
+            raise ValueError(f"不明なジョブの種別です: {mode}")
+        if mode == DELTA and not seed_key:
+            raise ValueError("差分再生成には類似求人の保存キーが必要です")
+        key = job_key(job_text, job_category, mode, seed_key)
+        job_id = new_run_id()
+        now = _now()
+        with self._lock:
+            existing = self._active_job_id(key)
+            if existing:
+                JOBS.inc(mode=mode, result="coalesced")
+                logger.info(f"実行中のジョブにまとめました（job_id={existing}, 種別={mode}）")
+                return {"job_id": existing, "coalesced": True}
+            if self._queued >= Config.JOB_MAX_QUEUED:
+                JOBS.inc(mode=mode, result="rejected")
+                raise OverloadedError(
+                    f"待ちの生成が多いため受け付けられませんでした（待ち {self._queued}件）。しばらくしてから再度お試しください"
+                )
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO generation_jobs (job_id, job_key, mode, job_category, seed_key, resume, status, "
+                        "message, owner, created_at, updated_at, job_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, key, mode, job_category, seed_key, int(resume), QUEUED, "⏳ 実行待ち...", self._owner,
+                         now, now, _pack(job_text))
+                    )
+            except sqlite3.IntegrityError:
+                # 別のプロセスが同時に同じジョブを登録した
+                existing = self._active_job_id(key)
+                if existing:
+                    JOBS.inc(mode=mode, result="coalesced")
+                    return {"job_id": existing, "coalesced": True}
+                raise
+            self._queued += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="generation-job")
+        JOBS.inc(mode=mode, result="submitted")
+        logger.info(f"生成ジョブを登録しました（job_id={job_id}, 種別={mode}, 職種={job_category}）")
+        self._executor.submit(self._run, job_id, mode, job_text, job_category, seed_key, resume)
+        return {"job_id": job_id, "coalesced": False}
+
+    def _active_job_id(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT job_id, owner FROM generation_jobs WHERE job_key = ? AND status IN ('queued', 'running')",
+            (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] != self._owner and not _owner_alive(row[1]):
+            self._mark_interrupted(row[0])
+            return None
+        return row[0]
+
+    # ==================== 実行 ====================
+    def _run(
+        self, job_id: str, mode: str, job_text: str, job_category: str, seed_key: Optional[str], resume: bool
+    ) -> None:
+        """ジョブを実行（ワーカースレッド。例外はジョブの失敗として記録する）"""
+        stages: List[Dict[str, Any]] = []
+        graph = DELTA_GRAPH if mode == DELTA else PIPELINE_GRAPH
+
+        def on_progress(percent: int, message: str) -> None:
+            self._update(job_id, progress=percent, message=message)
+
+        def on_stage(stage: str, layer: str, started: float, ended: float) -> None:
+            stages.append({
+                "stage": stage, "label": graph.stages[stage].label, "layer": layer,
+                "seconds": round(ended - started, 2)
+            })
+            self._update(job_id, stages=json.dumps(stages, ensure_ascii=False))
+
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        self._update(job_id, status=RUNNING, started_at=_now(), message="⏳ 生成を開始しました...")
+        try:
+            if mode == DELTA:
+                output = run_pipeline_delta(
+                    job_text, job_category, seed_key, progress_callback=on_progress, run_id=job_id,
+                    save_result=Config.RESULT_STORE_ENABLED, on_stage=on_stage
+                )
+            elif mode == LAYER3:
+                output = regenerate_layer3(
+                    job_text, job_category, progress_callback=on_progress, run_id=job_id,
+                    save_result=Config.RESULT_STORE_ENABLED, on_stage=on_stage
+                )
+            else:
+                output = run_pipeline(
+                    job_text, job_category, progress_callback=on_progress, run_id=job_id,
+                    save_result=Config.RESULT_STORE_ENABLED, resume=resume, on_stage=on_stage
+                )
+        except Exception as e:
+            overloaded = isinstance(e, (OverloadedError, CircuitOpenError))
+            if not overloaded:
+                logger.error(f"生成ジョブが失敗しました（job_id={job_id}）: {str(e)}")
+            self._update(
+                job_id, status=FAILED, finished_at=_now(), error=str(e),
+                error_kind="overloaded" if overloaded else "error"
+            )
+            JOBS.inc(mode=mode, result="failed")
+        else:
+            self._update(job_id, status=SUCCEEDED, finished_at=_now(), progress=100, output=_pack(output))
+            JOBS.inc(mode=mode, result="succeeded")
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        """ジョブの行を更新（記録に失敗しても生成は続ける）"""
+        fields["updated_at"] = _now()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    f"UPDATE generation_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id)
+                )
+        except Exception as e:
+            logger.warning(f"ジョブの状態の記録に失敗しました（job_id={job_id}）: {str(e)}")
+
+    def _mark_interrupted(self, job_id: str) -> None:
+        now = _now()
+        with self._conn:
+            self._conn.execute(
+                "UPDATE generation_jobs SET status = ?, error = ?, error_kind = ?, finished_at = ?, updated_at = ? "
+                "WHERE job_id = ? AND status IN ('queued', 'running')",
+                (FAILED, "プロセスの終了により生成が中断されました。「続きから再開」で完了したステージから再実行できます",
+                 "interrupted", now, now, job_id)
+            )
+
+    def reap_orphans(self) -> None:
+        """実行していたプロセスが終了して queued / running のまま残ったジョブを失敗にする"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, owner FROM generation_jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+            orphans = [job_id for job_id, owner in rows if owner != self._owner and not _owner_alive(owner)]
+            for job_id in orphans:
+                self._mark_interrupted(job_id)
+        if orphans:
+            logger.warning(f"中断されたまま残っていた生成ジョブを失敗として記録しました（{len(orphans)}件）")
+
+    # ==================== 参照 ====================
+    def get(self, job_id: str, with_output: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        ジョブの状態
+
+        Args:
+            job_id: ジョブID
+            with_output: True の場合、最終出力（output）も返す（ポーリングでは省く）
+
+        Returns:
+            ジョブの状態の辞書（status / progress / message / stages / error など）。無い場合は None
+        """
+        columns = _COLUMNS + (", output" if with_output else "")
+        with self._lock:
+            row = self._conn.execute(f"SELECT {columns} FROM generation_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip([c.strip() for c in columns.split(",")], row))
+        job["resume"] = bool(job["resume"])
+        job["stages"] = json.loads(job["stages"]) if job["stages"] else []
+        job["job_text"] = _unpack(job["job_text"])
+        if with_output:
+            job["output"] = _unpack(job["output"])
+        return job
+
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, mode, job_category, status, progress, created_at, finished_at, error "
+                "FROM generation_jobs ORDER BY created_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        keys = ("job_id", "mode", "job_category", "status", "progress", "created_at", "finished_at", "error")
+        return [dict(zip(keys, r)) for r in rows]
+
+    def purge(self, hours: float = None) -> int:
+        """終了してから hours 時間以上経ったジョブを削除"""
+        hours = Config.JOB_RETENTION_HOURS if hours is None else hours
+        cutoff = (datetime.now() - timedelta(hours=hours)).isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM generation_jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?", (cutoff,)
+            ).rowcount
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """プロセス共通のジョブ管理（Streamlit のセッション間で共有される）"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+            _manager.reap_orphans()
+            _manager.purge()
+        return _manager
+
+
+# ==================== CLI ====================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="生成ジョブの一覧・削除")
+    parser.add_argument("--db", default=str(Config.RESULT_DB), help="結果DBのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_list = sub.add_parser("list", help="最近のジョブ")
+    p_list.add_argument("--limit", type=int, default=20)
+    p_purge = sub.add_parser("purge", help="終了したジョブを削除")
+    p_purge.add_argument("--hours", type=float, default=Config.JOB_RETENTION_HOURS)
+    args = parser.parse_args()
+
+    manager = JobManager(Path(args.db))
+    if args.command == "list":
+        for j in manager.list_jobs(args.limit):
+            error = f"  error={j['error'][:60]}" if j["error"] else ""
+            print(f"{j['job_id']}  {j['mode']:<8} {j['job_category']:<16} {j['status']:<9} {j['progress']:>3}%  "
+                  f"created={j['created_at']}  finished={j['finished_at'] or '-'}{error}")
+    else:
+        print(f"{manager.purge(args.hours)}件を削除しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,16 @@
 レイヤー①: 求人構造化
 求人テキストから8項目を抽出し、構造化データを生成
 """
+import logging
 from typing import Dict, Any
 from config import Config
 from utils import (
-    call_openai_with_retry,
+    call_openai_routed,
     parse_json_with_retry,
     validate_structured_data,
     logger
 )
+from profiling import profiled
 
 
 def _build_layer1_prompt(job_text: str) -> str:
@@ -63,6 +65,102 @@ def _build_layer1_prompt(job_text: str) -> str:
     return prompt
 
 
+def _normalize_business_process(structured_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    業務プロセスを「ステップ\n↓\nステップ」形式に正規化
+    モデルが配列・辞書・別の区切り文字で返した場合も期待形式へ変換する（失敗時は警告のみで継続）
+    
+    Args:
+        structured_data: パース済みの構造化データ
+        
+    Returns:
+        業務プロセスを正規化した構造化データ（受け取ったオブジェクトを変更して返す）
+    """
+    try:
+        # デバッグ用: パース後のキー一覧と業務プロセスの存在確認
+        logger.debug(f"Parsed structured_data keys: {list(structured_data.keys())}")
+        bp = structured_data.get("業務プロセス")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Raw 業務プロセス (type={type(bp)}). repr head: {repr(bp)[:300]}")
+
+        # 配列で返ってきた場合は結合
+        if isinstance(bp, list):
+            structured_data["業務プロセス"] = "\n↓\n".join([str(x).strip() for x in bp if x is not None])
+            logger.info("業務プロセス: list -> joined string with '\\n↓\\n'")
+
+        # 辞書で返ってきた場合は値を順に結合
+        elif isinstance(bp, dict):
+            vals = [str(v).strip() for v in bp.values() if v is not None]
+            structured_data["業務プロセス"] = "\n↓\n".join(vals)
+            logger.info("業務プロセス: dict -> joined values into string")
+
+        # 文字列だが↓が無い場合は類似の区切り文字を置換してみる
+        elif isinstance(bp, str):
+            s = bp.strip()
+            if "↓" not in s:
+                # 改行があり、別の矢印文字やハイフンで区切られているケースを正規化
+                s = s.replace("->", "↓").replace("→", "↓").replace("=>", "↓")
+                # ハイフンや箇条書きを改行区切りに変換
+                s = s.replace("- ", "\n").replace("・", "\n")
+                # 連続改行を単一化
+                s = "\n".join([ln.strip() for ln in s.splitlines() if ln.strip()])
+                # 最後に各行を↓でつなげる
+                lines = [ln for ln in s.splitlines() if ln]
+                if len(lines) > 1:
+                    structured_data["業務プロセス"] = "\n↓\n".join(lines)
+                    logger.info("業務プロセス: string normalized into lines joined by '\\n↓\\n'")
+
+        # 最終整形: すべての '↓' の前後が改行で囲まれるようにする
+        try:
+            bp2 = structured_data.get("業務プロセス")
+            if isinstance(bp2, str):
+                s = bp2
+                # '←' といった別文字は触らない。まず '↓' の前後に確実に改行を入れる
+                s = s.replace('\r', '')
+                s = s.replace('\n\s*↓\s*\n', '\n↓\n')
+                # 保守的な置換: '文字↓' -> '文字\n↓' ; '↓文字' -> '↓\n文字'
+                s = s.replace('↓', '\n↓\n')
+                # 連続した改行を単一化
+                s = '\n'.join([ln for ln in s.splitlines() if ln.strip()])
+                # 複数連結による重複 '↓' の扱いを調整（↓が連続している場合は1つに）
+                s = s.replace('\n↓\n\n↓\n', '\n↓\n')
+                structured_data["業務プロセス"] = s
+                logger.info("業務プロセス: 最終正規化を適用しました")
+        except Exception:
+            logger.warning("業務プロセス: 最終正規化で例外発生しましたが継続します")
+
+    except Exception as e:
+        logger.warning(f"業務プロセス正規化中に例外発生: {str(e)}")
+
+    return structured_data
+
+
+def _postprocess_layer1_response(response_text: str) -> Dict[str, Any]:
+    """
+    レイヤー①のLLM応答を解析・正規化・バリデーション（同期呼び出しとバッチ処理で共通）
+    
+    Args:
+        response_text: LLMの応答テキスト
+        
+    Returns:
+        構造化データ（8項目を含む辞書）
+        
+    Raises:
+        ValueError: バリデーション失敗時
+    """
+    # JSON解析
+    structured_data = parse_json_with_retry(response_text)
+
+    # 業務プロセスの正規化: モデルが配列や別区切りで返す場合に期待形式へ変換
+    structured_data = _normalize_business_process(structured_data)
+
+    # バリデーション
+    validate_structured_data(structured_data)
+    
+    return structured_data
+
+
+@profiled("layer1")
 def layer1_extract_structure(job_text: str) -> Dict[str, Any]:
     """
     レイヤー①: 求人テキストから構造化データを抽出
@@ -84,75 +182,14 @@ def layer1_extract_structure(job_text: str) -> Dict[str, Any]:
         # プロンプト構築
         prompt = _build_layer1_prompt(job_text)
         
-        # LLM呼び出し
-        response_text = call_openai_with_retry(
+        # LLM呼び出し → 解析・正規化・バリデーション（小さいモデルの応答が不正なら大きいモデルでやり直す）
+        structured_data = call_openai_routed(
             prompt=prompt,
             temperature=1,  # 修正: モデルがサポートするデフォルト値に変更
-            max_completion_tokens=Config.MAX_TOKENS_LAYER1
+            max_completion_tokens=Config.MAX_TOKENS_LAYER1,
+            postprocess=_postprocess_layer1_response
         )
         
-        # JSON解析
-        structured_data = parse_json_with_retry(response_text)
-
-        # 業務プロセスの正規化: モデルが配列や別区切りで返す場合に期待形式へ変換
-        try:
-            # デバッグ用: パース後のキー一覧と業務プロセスの存在確認
-            logger.info(f"Parsed structured_data keys: {list(structured_data.keys())}")
-            bp = structured_data.get("業務プロセス")
-            logger.info(f"Raw 業務プロセス (type={type(bp)}). repr head: {repr(bp)[:300]}")
-
-            # 配列で返ってきた場合は結合
-            if isinstance(bp, list):
-                structured_data["業務プロセス"] = "\n↓\n".join([str(x).strip() for x in bp if x is not None])
-                logger.info("業務プロセス: list -> joined string with '\\n↓\\n'")
-
-            # 辞書で返ってきた場合は値を順に結合
-            elif isinstance(bp, dict):
-                vals = [str(v).strip() for v in bp.values() if v is not None]
-                structured_data["業務プロセス"] = "\n↓\n".join(vals)
-                logger.info("業務プロセス: dict -> joined values into string")
-
-            # 文字列だが↓が無い場合は類似の区切り文字を置換してみる
-            elif isinstance(bp, str):
-                s = bp.strip()
-                if "↓" not in s:
-                    # 改行があり、別の矢印文字やハイフンで区切られているケースを正規化
-                    s = s.replace("->", "↓").replace("→", "↓").replace("=>", "↓")
-                    # ハイフンや箇条書きを改行区切りに変換
-                    s = s.replace("- ", "\n").replace("・", "\n")
-                    # 連続改行を単一化
-                    s = "\n".join([ln.strip() for ln in s.splitlines() if ln.strip()])
-                    # 最後に各行を↓でつなげる
-                    lines = [ln for ln in s.splitlines() if ln]
-                    if len(lines) > 1:
-                        structured_data["業務プロセス"] = "\n↓\n".join(lines)
-                        logger.info("業務プロセス: string normalized into lines joined by '\\n↓\\n'")
-
-            # 最終整形: すべての '↓' の前後が改行で囲まれるようにする
-            try:
-                bp2 = structured_data.get("業務プロセス")
-                if isinstance(bp2, str):
-                    s = bp2
-                    # '←' といった別文字は触らない。まず '↓' の前後に確実に改行を入れる
-                    s = s.replace('\r', '')
-                    s = s.replace('\n\s*↓\s*\n', '\n↓\n')
-                    # 保守的な置換: '文字↓' -> '文字\n↓' ; '↓文字' -> '↓\n文字'
-                    s = s.replace('↓', '\n↓\n')
-                    # 連続した改行を単一化
-                    s = '\n'.join([ln for ln in s.splitlines() if ln.strip()])
-                    # 複数連結による重複 '↓' の扱いを調整（↓が連続している場合は1つに）
-                    s = s.replace('\n↓\n\n↓\n', '\n↓\n')
-                    structured_data["業務プロセス"] = s
-                    logger.info("業務プロセス: 最終正規化を適用しました")
-            except Exception:
-                logger.warning("業務プロセス: 最終正規化で例外発生しましたが継続します")
-
-        except Exception as e:
-            logger.warning(f"業務プロセス正規化中に例外発生: {str(e)}")
-
-        # バリデーション
-        validate_structured_data(structured_data)
-        
         logger.info("レイヤー①: 求人構造化 完了")
         logger.info(f"抽出項目: {', '.join(structured_data.keys())}")
         logger.info("=" * 60)
@@ -3,18 +3,23 @@
 条件付きWeb検索を含む、業界標準との比較分析
 """
 import json
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 # ========== 修正箇所（ここから） ==========
 # 1. まず config をインポート
 from config import Config
 
 # 2. 次に utils をインポート
 from utils import (
-    call_openai_with_retry,
+    call_openai_routed,
     parse_json_with_retry,
     validate_comparison_data,
     logger
 )
+from telemetry import step
+from tracing import start_span
+from profiling import profiled
+from category_knowledge import get_profile_context
+from search_policy import LOW_CONFIDENCE_TRIGGER, decide_web_search, record_search_outcome
 
 # 3. 最後に serpapi_utils をインポート（条件付き）
 try:
@@ -26,22 +31,41 @@ except ImportError as e:
     SERPAPI_AVAILABLE = False
     
     # ダミー関数を定義
-    def execute_dual_search(job_category: str) -> str:
-        return "Web検索は無効化されています。"
+    def execute_dual_search(job_category: str, structured_data: Optional[Dict[str, Any]] = None) -> Tuple[str, bool]:
+        return "Web検索は無効化されています。", False
 # ========== 修正箇所（ここまで） ==========
 
+# 各ステップの最大トークン数（同期呼び出しとバッチ処理で共通）
+STEP1_MAX_TOKENS = Config.MAX_TOKENS_LAYER2 + 3000
+STEP3_MAX_TOKENS = Config.MAX_TOKENS_LAYER2 + 1500
 
-def _build_step1_prompt(structured_data: Dict[str, Any], job_category: str) -> str:
+# Web検索判断で重視する項目
+PRIORITY_ITEMS = ["対象製品", "使用技術", "業務プロセス"]
+
+
+def _build_step1_prompt(
+    structured_data: Dict[str, Any],
+    job_category: str,
+    profile_context: Optional[str] = None
+) -> str:
     """
     Step 2-1（LLM単体での実態推察）のプロンプトを構築
     
     Args:
         structured_data: レイヤー①の出力
         job_category: 職種名
+        profile_context: 職種ナレッジの標準プロファイル（category_knowledge.get_profile_context）
         
     Returns:
         構築されたプロンプト
     """
+    profile_section = ""
+    if profile_context:
+        profile_section = f"""
+【この職種の業界標準（過去のWeb検索から集約した参考情報）】
+{profile_context}
+※ 業界標準は推察の出発点として使い、この求人票固有の記述を優先してください
+"""
     prompt = f"""
 あなたは採用コンサルタントです。
 
@@ -50,7 +74,7 @@ def _build_step1_prompt(structured_data: Dict[str, Any], job_category: str) -> s
 
 【職種】
 {job_category}
-
+{profile_section}
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 【あなたのタスク】
 この求人票の「真の姿（実態）」を具体的・リッチに推察してください。
@@ -311,6 +335,20 @@ Web検索で得た情報を参考に、より正確な内容B（実態推察）
     return prompt
 
 
+def _parse_comparison(response_text: str) -> Dict[str, Any]:
+    """
+    Step 2-1 / 2-3 の応答を解析・バリデーション
+
+    Raises:
+        Exception: JSON解析・バリデーションに失敗した場合
+    """
+    logger.info(f"応答文字数: {len(response_text)}")
+    logger.debug(f"応答内容（全体）: {response_text}")  # 応答内容の全体を記録（量が多いためDEBUG）
+    comparison = parse_json_with_retry(response_text)
+    validate_comparison_data(comparison)
+    return comparison
+
+
 def _step1_llm_only_comparison(
     structured_data: Dict[str, Any],
     job_category: str
@@ -327,12 +365,15 @@ def _step1_llm_only_comparison(
     """
     logger.info("Step 2-1: LLM単体での実態推察生成 開始")
     
-    # プロンプト構築
-    prompt = _build_step1_prompt(structured_data, job_category)
+    # プロンプト構築（職種ナレッジがあれば業界標準を参考情報として渡す）
+    profile_context = get_profile_context(job_category)
+    if profile_context:
+        logger.info(f"職種ナレッジの標準プロファイルを使用します（{len(profile_context)}文字）")
+    prompt = _build_step1_prompt(structured_data, job_category, profile_context)
     
     # ========== 追加箇所（ここから） ==========
     logger.info(f"プロンプト長: {len(prompt)} 文字")
-    logger.info(f"プロンプトの先頭500文字: {prompt[:500]}")
+    logger.debug(f"プロンプトの先頭500文字: {prompt[:500]}")
     # ========== 追加箇所（ここまで） ==========
 
     # ========== プロンプト全体をログに記録（追加） ==========
@@ -341,23 +382,16 @@ def _step1_llm_only_comparison(
 
 
     # LLM呼び出し
-    response_text = call_openai_with_retry(
-        prompt=prompt,
-        temperature=1,  # 修正: モデルがサポートするデフォルト値に変更
-        max_completion_tokens=Config.MAX_TOKENS_LAYER2 + 3000
-    )
-
-    # ========== 追加箇所（ここから） ==========
-    logger.info(f"応答文字数: {len(response_text)}")
-    logger.info(f"応答内容（全体）: {response_text}")  # 応答内容の全体を記録
-    # ========== 追加箇所（ここまで） ==========
-
-
-    # JSON解析
-    comparison_v1 = parse_json_with_retry(response_text)
-    
-    # バリデーション
-    validate_comparison_data(comparison_v1)
+    # 小さいモデルに振り分けた場合（MODEL_ROUTES）は、不正な応答・自信度の低い応答を大きいモデルでやり直す
+    with step("step1"), start_span("layer2.step1", prompt_chars=len(prompt), knowledge=bool(profile_context)) as span:
+        comparison_v1 = call_openai_routed(
+            prompt=prompt,
+            temperature=1,  # 修正: モデルがサポートするデフォルト値に変更
+            max_completion_tokens=STEP1_MAX_TOKENS,
+            postprocess=_parse_comparison,
+            escalate_if=lambda c: c["confidence_score"] < Config.MODEL_ESCALATE_CONFIDENCE
+        )
+        span.set_attribute("confidence", comparison_v1.get("confidence_score"))
     
     logger.info(f"Step 2-1完了: 自信度={comparison_v1['confidence_score']:.2f}")
     
@@ -384,29 +418,176 @@ def _step3_web_integration(
     prompt = _build_step3_prompt(comparison_v1, web_context)
     
     # LLM呼び出し
-    response_text = call_openai_with_retry(
-        prompt=prompt,
-        temperature=1, 
-        max_completion_tokens=Config.MAX_TOKENS_LAYER2 + 1500
-    )
-    
-    # JSON解析
-    comparison_v2 = parse_json_with_retry(response_text)
-    
-    # バリデーション
-    validate_comparison_data(comparison_v2)
+    with step("step3"), start_span("layer2.step3", prompt_chars=len(prompt)) as span:
+        comparison_v2 = call_openai_routed(
+            prompt=prompt,
+            temperature=1, 
+            max_completion_tokens=STEP3_MAX_TOKENS,
+            postprocess=_parse_comparison
+        )
+        span.set_attribute("confidence", comparison_v2.get("confidence_score"))
     
     logger.info(f"Step 2-3完了: 更新後自信度={comparison_v2['confidence_score']:.2f}")
     
     return comparison_v2
 
 
+def _search_triggers(comparison_v1: Dict[str, Any]) -> List[str]:
+    """固定ルールでの検索理由（不確実性のある重要項目名と、自信度が閾値未満なら LOW_CONFIDENCE_TRIGGER）"""
+    uncertain_aspects = comparison_v1.get("uncertain_aspects", [])
+    triggers = [p for p in PRIORITY_ITEMS if any(p in item for item in uncertain_aspects)]
+    if comparison_v1["confidence_score"] < Config.CONFIDENCE_THRESHOLD:
+        triggers.append(LOW_CONFIDENCE_TRIGGER)
+    return triggers
+
+
+def _decide_web_search(
+    comparison_v1: Dict[str, Any],
+    job_category: str = None,
+    structured_data: Optional[Dict[str, Any]] = None
+) -> Tuple[bool, str, List[str]]:
+    """
+    Step 2-2: Web検索を実行するかを判断（ハイブリッド方式）
+    職種名を渡した場合は、固定ルールの判断を過去の自信度の上昇幅で見直す（search_policy）
+    
+    Args:
+        comparison_v1: Step 2-1の出力
+        job_category: 職種名
+        structured_data: レイヤー①の出力（実績の更新のために検索する求人の選択に使う）
+        
+    Returns:
+        (検索実行フラグ, 判断理由, 検索理由) のタプル。検索理由は search_policy に記録する理由（検索しない場合は空）
+    """
+    confidence_score = comparison_v1["confidence_score"]
+    threshold = Config.CONFIDENCE_THRESHOLD
+    uncertain_aspects = comparison_v1.get("uncertain_aspects", [])
+    
+    # 条件1: 特定項目の不確実性チェック
+    uncertain_priority_items = [item for item in uncertain_aspects
+                                 if any(p in item for p in PRIORITY_ITEMS)]
+    
+    if uncertain_priority_items:
+        decision = (True, f"重要項目に不確実性あり: {', '.join(uncertain_priority_items)}")
+    # 条件2: 自信度が閾値未満
+    elif confidence_score < threshold:
+        decision = (True, f"自信度 {confidence_score:.2f} < 閾値 {threshold:.2f}")
+    else:
+        decision = (False, "")
+    
+    triggers = _search_triggers(comparison_v1)
+    if job_category:
+        sample_key = json.dumps(structured_data, ensure_ascii=False, sort_keys=True, default=str)
+        should_search, reason = decide_web_search(job_category, triggers, confidence_score, decision, sample_key)
+        if should_search and not decision[0]:
+            # 固定ルールでは検索しない求人を、この職種の低自信度での上昇幅を根拠に検索する
+            triggers = [LOW_CONFIDENCE_TRIGGER]
+        decision = (should_search, reason)
+    return decision[0], decision[1], triggers if decision[0] else []
+
+
+def _run_web_search(
+    comparison_v1: Dict[str, Any],
+    job_category: str,
+    structured_data: Dict[str, Any]
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Step 2-2: Web検索の判断と実行
+
+    Args:
+        comparison_v1: Step 2-1の出力
+        job_category: 職種名
+        structured_data: レイヤー①の出力
+
+    Returns:
+        (Web検索結果, 検索の記録) のタプル（検索しない場合は (None, None)）。
+        検索の記録は {"triggers": 検索理由, "web_results": Web検索の結果があったか}
+    """
+    confidence_score = comparison_v1["confidence_score"]
+    threshold = Config.CONFIDENCE_THRESHOLD
+
+    # Web検索の判断（ハイブリッド方式）
+    with start_span("layer2.search_decision", confidence=confidence_score) as span:
+        should_search_web, search_reason, triggers = _decide_web_search(comparison_v1, job_category, structured_data)
+        span.set_attributes(should_search=should_search_web, reason=search_reason)
+
+    if should_search_web:
+        logger.info(f"🔍 Web検索を実行: {search_reason}")
+        web_context, has_web_results = execute_dual_search(job_category, structured_data)
+        return web_context, {"triggers": triggers, "web_results": has_web_results}
+
+    if search_reason:
+        logger.info(f"⏭️ Web検索をスキップ: {search_reason}")
+    else:
+        logger.info(
+            f"✅ 自信度 {confidence_score:.2f} >= 閾値 {threshold:.2f} "
+            f"かつ重要項目に不確実性なし → Web検索をスキップ"
+        )
+    return None, None
+
+
+def _record_search(job_category: str, search_record: Optional[Dict[str, Any]], confidence_before: float, confidence_after: float) -> None:
+    """Web検索の結果があった検索だけ、自信度の変化を search_policy に記録する"""
+    if not search_record or not search_record.get("web_results"):
+        logger.info("Web検索の結果が無かったため、検索の実績には記録しません")
+        return
+    record_search_outcome(job_category, search_record["triggers"], confidence_before, confidence_after)
+
+
+def _integrate_web_search(
+    comparison_v1: Dict[str, Any],
+    web_context: Optional[str],
+    structured_data: Dict[str, Any],
+    job_category: str,
+    search_record: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Step 2-3: Web情報の統合（検索しなかった場合は Step 2-1 の出力をそのまま使う）
+
+    Args:
+        comparison_v1: Step 2-1の出力
+        web_context: Web検索結果（検索しなかった場合は None）
+        structured_data: レイヤー①の出力
+        job_category: 職種名
+        search_record: _run_web_search の検索の記録（Web検索の結果があった場合だけ自信度の変化を記録する）
+
+    Returns:
+        レイヤー②の最終出力（content_a, web_search_performed を含む）
+    """
+    if web_context is not None:
+        comparison_final = _step3_web_integration(comparison_v1, web_context)
+        comparison_final["web_search_performed"] = True
+        _record_search(
+            job_category, search_record, comparison_v1["confidence_score"], comparison_final["confidence_score"]
+        )
+
+        logger.info(
+            f"Web検索後の自信度: {comparison_v1['confidence_score']:.2f} → "
+            f"{comparison_final['confidence_score']:.2f} "
+            f"(変化: {comparison_final['confidence_score'] - comparison_v1['confidence_score']:+.2f})"
+        )
+    else:
+        comparison_final = dict(comparison_v1)
+        comparison_final["web_search_performed"] = False
+
+    # content_aを追加
+    comparison_final["content_a"] = structured_data
+
+    logger.info("レイヤー②: 実態推察・ギャップ分析 完了")
+    logger.info(f"最終自信度: {comparison_final['confidence_score']:.2f}")
+    logger.info(f"Web検索実行: {comparison_final['web_search_performed']}")
+    logger.info("=" * 60)
+
+    return comparison_final
+
+
+@profiled("layer2")
 def layer2_build_comparison_smart(
     structured_data: Dict[str, Any],
     job_category: str
 ) -> Dict[str, Any]:
     """
     レイヤー②: 業界標準比較（条件付きWeb検索）
+    Step 2-1 → 2-2 → 2-3 を順に実行する（パイプラインではステージグラフの step2_1 / search / step2_3 として実行）
     
     Args:
         structured_data: レイヤー①の出力
@@ -426,62 +607,11 @@ def layer2_build_comparison_smart(
         # Step 2-1: LLM単体での実態推察
         comparison_v1 = _step1_llm_only_comparison(structured_data, job_category)
         
-        confidence_score = comparison_v1["confidence_score"]
-        threshold = Config.CONFIDENCE_THRESHOLD
-        uncertain_aspects = comparison_v1.get("uncertain_aspects", [])
-        
-        # Step 2-2: Web検索の判断（ハイブリッド方式）
-        should_search_web = False
-        search_reason = ""
-        
-        # 条件1: 特定項目の不確実性チェック
-        priority_items = ["対象製品", "使用技術", "業務プロセス"]
-        uncertain_priority_items = [item for item in uncertain_aspects
-                                     if any(p in item for p in priority_items)]
-        
-        if uncertain_priority_items:
-            should_search_web = True
-            search_reason = f"重要項目に不確実性あり: {', '.join(uncertain_priority_items)}"
-        
-        # 条件2: 自信度が閾値未満
-        elif confidence_score < threshold:
-            should_search_web = True
-            search_reason = f"自信度 {confidence_score:.2f} < 閾値 {threshold:.2f}"
-        
-        # Web検索実行
-        if should_search_web:
-            logger.info(f"🔍 Web検索を実行: {search_reason}")
-            
-            # Web検索実行
-            web_context = execute_dual_search(job_category)
-            
-            # Step 2-3: Web情報統合
-            comparison_final = _step3_web_integration(comparison_v1, web_context)
-            comparison_final["web_search_performed"] = True
-            
-            logger.info(
-                f"Web検索後の自信度: {comparison_v1['confidence_score']:.2f} → "
-                f"{comparison_final['confidence_score']:.2f} "
-                f"(変化: {comparison_final['confidence_score'] - comparison_v1['confidence_score']:+.2f})"
-            )
-            
-        else:
-            logger.info(
-                f"✅ 自信度 {confidence_score:.2f} >= 閾値 {threshold:.2f} "
-                f"かつ重要項目に不確実性なし → Web検索をスキップ"
-            )
-            comparison_final = comparison_v1
-            comparison_final["web_search_performed"] = False
-        
-        # content_aを追加
-        comparison_final["content_a"] = structured_data
-        
-        logger.info("レイヤー②: 実態推察・ギャップ分析 完了")
-        logger.info(f"最終自信度: {comparison_final['confidence_score']:.2f}")
-        logger.info(f"Web検索実行: {comparison_final['web_search_performed']}")
-        logger.info("=" * 60)
+        # Step 2-2: Web検索の判断・実行
+        web_context, search_record = _run_web_search(comparison_v1, job_category, structured_data)
         
-        return comparison_final
+        # Step 2-3: Web情報統合
+        return _integrate_web_search(comparison_v1, web_context, structured_data, job_category, search_record)
         
     except Exception as e:
         logger.error(f"レイヤー②でエラー発生: {str(e)}")
@@ -3,15 +3,22 @@
 新人リクルーター向けに表形式データと解説を生成
 """
 import json
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from config import Config
 from utils import (
+    call_openai_routed,
     call_openai_with_retry,
     parse_json_with_retry,
     validate_final_output,
     logger,
     normalize_table_data_structure
 )
+from telemetry import step
+from tracing import set_attributes, traced
+from profiling import profiled
+
+# 使用技術専門化の最大トークン数（同期呼び出しとバッチ処理で共通）
+TECH_SPECIALIZATION_MAX_TOKENS = 800
 
 
 def _build_layer3_prompt(comparison_final: Dict[str, Any]) -> str:
@@ -145,12 +152,57 @@ JSONオブジェクトをそのまま出力してください。
 
 
 
-def layer3_optimize_for_learning(comparison_final: Dict[str, Any]) -> Dict[str, Any]:
+def _postprocess_layer3_response(
+    response_text: str,
+    comparison_final: Dict[str, Any],
+    specialize_tech: bool = True,
+    finalize: bool = True
+) -> Dict[str, Any]:
+    """
+    レイヤー③のLLM応答を解析・正規化・バリデーション（同期呼び出しとバッチ処理で共通）
+    
+    Args:
+        response_text: LLMの応答テキスト
+        comparison_final: レイヤー②の出力
+        specialize_tech: 使用技術の専門化（追加LLM呼び出し）を同期で行うか
+        finalize: False の場合は内容Aの補足・使用技術の専門化を行わない（ステージグラフで別ステージとして実行する場合）
+        
+    Returns:
+        最終出力データ
+        
+    Raises:
+        ValueError: バリデーション失敗時
+    """
+    # JSON解析
+    final_output = parse_json_with_retry(response_text)
+    
+    # CRITICAL: 正規化を最優先で実行（table→table_data変換含む）
+    final_output = normalize_table_data_structure(final_output)
+    
+    # 出力が要件を満たしているかのサーバ側チェック（Aの具体性補完など）
+    if finalize:
+        try:
+            final_output = _ensure_content_a_specificity(
+                final_output, comparison_final, specialize_tech=specialize_tech
+            )
+        except Exception:
+            logger.warning("内容Aの自動補完に失敗しましたが、処理は継続します")
+    
+    # バリデーション
+    validate_final_output(final_output)
+    
+    return final_output
+
+
+@profiled("layer3")
+def layer3_optimize_for_learning(comparison_final: Dict[str, Any], finalize: bool = True) -> Dict[str, Any]:
     """
     レイヤー③: 教育最適化
     
     Args:
         comparison_final: レイヤー②の出力
+        finalize: False の場合は内容Aの補足・使用技術の専門化を行わない（パイプラインではステージグラフの
+            a_comments / tech ステージとして並行して実行する）
         
     Returns:
         最終出力データ（table_data, explanations, how_to_read等を含む）
@@ -172,20 +224,8 @@ def layer3_optimize_for_learning(comparison_final: Dict[str, Any]) -> Dict[str,
             max_completion_tokens=Config.MAX_TOKENS_LAYER3
         )
         
-        # JSON解析
-        final_output = parse_json_with_retry(response_text)
-        
-        # CRITICAL: 正規化を最優先で実行（table→table_data変換含む）
-        final_output = normalize_table_data_structure(final_output)
-        
-        # 出力が要件を満たしているかのサーバ側チェック（Aの具体性補完など）
-        try:
-            final_output = _ensure_content_a_specificity(final_output, comparison_final)
-        except Exception:
-            logger.warning("内容Aの自動補完に失敗しましたが、処理は継続します")
-        
-        # バリデーション
-        validate_final_output(final_output)
+        # 解析・正規化・バリデーション
+        final_output = _postprocess_layer3_response(response_text, comparison_final, finalize=finalize)
         
         logger.info("レイヤー③: 教育最適化 完了")
         logger.info(f"表データ: {len(final_output['table_data'])}行 x {len(final_output['table_data'][0])}列")
@@ -199,11 +239,35 @@ def layer3_optimize_for_learning(comparison_final: Dict[str, Any]) -> Dict[str,
         raise Exception(f"教育最適化に失敗しました: {str(e)}")
 
 
-def _ensure_content_a_specificity(final_output: Dict[str, Any], comparison_final: Dict[str, Any]) -> Dict[str, Any]:
+def _ensure_content_a_specificity(
+    final_output: Dict[str, Any],
+    comparison_final: Dict[str, Any],
+    specialize_tech: bool = True
+) -> Dict[str, Any]:
     """
     final_output の `table_data` を確認し、`内容A（求人票の記述）` に具体性が欠けている場合は
     LLM に短い具体例（1行）を生成させて追記します。
     """
+    try:
+        final_output = _finalize_a_comments(final_output, comparison_final)
+
+        # 続けて使用技術の専門化を行う（バッチ処理では別ステージで実行するためスキップ）
+        if specialize_tech:
+            try:
+                final_output = _specialize_usage_tech(final_output)
+            except Exception:
+                logger.warning("使用技術の専門化に失敗しましたが、処理は継続します")
+
+        return final_output
+    except Exception:
+        logger.exception("_specialize_usage_tech でエラー")
+        return final_output
+
+
+def _finalize_a_comments(final_output: Dict[str, Any], comparison_final: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    内容Aの補足（a_comments）を整え、求人票名・役割の内容Aを求人票の記述に戻す（LLM呼び出しなし）
+    """
     try:
         table = final_output.get('table_data')
         if not table or len(table) < 2:
@@ -230,7 +294,8 @@ def _ensure_content_a_specificity(final_output: Dict[str, Any], comparison_final
                     comments[k] = str(v).strip()
         else:
             for row in table[1:]:
-                comments[row[0]] = ""
+                if row[0]:
+                    comments[row[0]] = ""
 
         # 生成結果を final_output の独立フィールド `a_comments` に格納（内容Aは上書きしない）
         final_output['a_comments'] = comments
@@ -262,45 +327,42 @@ def _ensure_content_a_specificity(final_output: Dict[str, Any], comparison_final
         except Exception:
             logger.exception("layer3: 求人票名/役割保護処理でエラー")
 
-        # 続けて使用技術の専門化を行う
-        try:
-            final_output = _specialize_usage_tech(final_output)
-        except Exception:
-            logger.warning("使用技術の専門化に失敗しましたが、処理は継続します")
-
         return final_output
     except Exception:
-        logger.exception("_specialize_usage_tech でエラー")
+        logger.exception("_finalize_a_comments でエラー")
         return final_output
 
 
-def _specialize_usage_tech(final_output: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    使用技術（B列）を専門性の高い候補に拡張し、用途を1短文で添えて可読な箇条書きに変換する。
+def _find_usage_tech_row(final_output: Dict[str, Any]):
+    """table_data から使用技術の行を探す（見つからなければNone）"""
+    table = final_output.get('table_data')
+    if not table or len(table) < 2:
+        return None
+    for row in table[1:]:
+        if row[0] == '使用技術':
+            return row
+    return None
+
+
+def _build_tech_specialization_prompt(final_output: Dict[str, Any]) -> Optional[str]:
     """
-    try:
-        table = final_output.get('table_data')
-        if not table or len(table) < 2:
-            return final_output
+    使用技術の専門化プロンプトを構築
 
-        # find usage tech row
-        b_index = 2
-        target_row = None
-        for row in table[1:]:
-            if row[0] == '使用技術':
-                target_row = row
-                break
-        if not target_row:
-            return final_output
+    Returns:
+        プロンプト（対象行が無い・既に整形済みで専門化不要な場合はNone）
+    """
+    target_row = _find_usage_tech_row(final_output)
+    if not target_row:
+        return None
 
-        current_b = (target_row[b_index] or "").strip()
+    current_b = (target_row[2] or "").strip()
 
-        # If usage tech already looks specialized/structured (contains bullets or '：'), skip extra LLM call.
-        if current_b and ("\n-" in current_b or (current_b.count('\n') > 0 and '：' in current_b) or ('：' in current_b and len(current_b) > 40)):
-            logger.info("使用技術は既に整形済みと判断、専門化処理をスキップします")
-            return final_output
+    # If usage tech already looks specialized/structured (contains bullets or '：'), skip extra LLM call.
+    if current_b and ("\n-" in current_b or (current_b.count('\n') > 0 and '：' in current_b) or ('：' in current_b and len(current_b) > 40)):
+        logger.info("使用技術は既に整形済みと判断、専門化処理をスキップします")
+        return None
 
-        prompt = f"""
+    return f"""
 以下は求人の「使用技術」についての元の推察です。これを、一般的・曖昧な表現を除外し、実務で役立つ専門性の高い技術を上位{Config.TECH_DEFAULT_COUNT}件まで列挙してください。
 各技術には短く（1文）利用目的を添えてください。出力はJSONで、キーを連番（1,2,...）にして、値に{{"tech": 技術名, "purpose": 利用目的}}の形で返してください。
 
@@ -308,39 +370,75 @@ def _specialize_usage_tech(final_output: Dict[str, Any]) -> Dict[str, Any]:
 {json.dumps(current_b, ensure_ascii=False)}
 """
 
-        resp = call_openai_with_retry(prompt=prompt, temperature=1, max_completion_tokens=800)
-        try:
-            tech_json = parse_json_with_retry(resp)
-        except Exception:
-            logger.warning("使用技術専門化: LLM応答のJSON解析に失敗しました")
-            return final_output
 
-        # tech_json expected like {"1": {"tech":"Python","purpose":"..."}, ...}
-        lines = []
-        try:
-            keys = sorted(tech_json.keys(), key=lambda x: int(x) if str(x).isdigit() else x)
-        except Exception:
-            keys = list(tech_json.keys()) if isinstance(tech_json, dict) else []
+def _apply_tech_specialization(final_output: Dict[str, Any], resp: str) -> Dict[str, Any]:
+    """
+    使用技術の専門化LLM応答を解析し、B列を箇条書きに置き換える
+    """
+    target_row = _find_usage_tech_row(final_output)
+    if not target_row:
+        return final_output
 
-        for k in keys:
-            entry = tech_json.get(k)
-            if isinstance(entry, dict):
-                t = entry.get('tech')
-                p = entry.get('purpose', '')
+    try:
+        tech_json = parse_json_with_retry(resp)
+    except Exception:
+        logger.warning("使用技術専門化: LLM応答のJSON解析に失敗しました")
+        return final_output
+
+    # tech_json expected like {"1": {"tech":"Python","purpose":"..."}, ...}
+    lines = []
+    try:
+        keys = sorted(tech_json.keys(), key=lambda x: int(x) if str(x).isdigit() else x)
+    except Exception:
+        keys = list(tech_json.keys()) if isinstance(tech_json, dict) else []
+
+    for k in keys:
+        entry = tech_json.get(k)
+        if isinstance(entry, dict):
+            t = entry.get('tech')
+            p = entry.get('purpose', '')
+        else:
+            t = entry
+            p = ''
+        if t:
+            if p:
+                lines.append(f"- {t}：{p}")
             else:
-                t = entry
-                p = ''
-            if t:
-                if p:
-                    lines.append(f"- {t}：{p}")
-                else:
-                    lines.append(f"- {t}")
+                lines.append(f"- {t}")
 
-        if lines:
-            target_row[b_index] = "\n".join(lines)
-            final_output['table_data'] = table
+    if lines:
+        target_row[2] = "\n".join(lines)
 
-        return final_output
+    return final_output
+
+
+def _check_tech_response(resp: str) -> str:
+    """使用技術専門化の応答がJSONとして読めることを確認（読めない場合は大きいモデルでやり直すため例外を送出）"""
+    if not isinstance(parse_json_with_retry(resp), dict):
+        raise ValueError("使用技術専門化の応答がJSONオブジェクトではありません")
+    return resp
+
+
+@traced("layer3.tech")
+def _specialize_usage_tech(final_output: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    使用技術（B列）を専門性の高い候補に拡張し、用途を1短文で添えて可読な箇条書きに変換する。
+    """
+    try:
+        prompt = _build_tech_specialization_prompt(final_output)
+        if prompt is None:
+            set_attributes(skipped=True)
+            return final_output
+        set_attributes(prompt_chars=len(prompt))
+
+        with step("tech"):
+            resp = call_openai_routed(
+                prompt=prompt,
+                temperature=1,
+                max_completion_tokens=TECH_SPECIALIZATION_MAX_TOKENS,
+                postprocess=_check_tech_response
+            )
+        return _apply_tech_specialization(final_output, resp)
     except Exception:
         logger.exception("_specialize_usage_tech でエラー")
         return final_output
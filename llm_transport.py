@@ -0,0 +1,668 @@
+"""
+LLM / Web検索のトランスポート層
+OpenAIラッパー（utils.call_openai_*）と serpapi_search の実際の通信先を差し替え可能にする。
+
+- openai / serpapi: 本番API（OPENAI_BASE_URL / SERPAPI_ENDPOINT でローカルのスタンドインも指定可能）
+- record: 本番APIを呼び出し、リクエストと応答をカセット（JSONL）に記録
+- replay: カセットから応答を再生（ネットワーク不要。記録時レイテンシを倍率付きで再現）
+- mock: 合成応答を返す（mock_openai_server と同じ応答生成ロジック。レイテンシとトークン数を設定可能）
+- local（検索のみ）: corpus/ と過去の検索結果のローカル索引（local_search）で検索する
+"""
+import contextvars
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import Config
+from metrics import LLM_HEDGES
+from telemetry import current_step
+from utils import _extract_usage, append_token_usage, get_openai_client, logger
+from mock_openai_server import build_chat_completion, synthesize_search_results
+from local_search import local_search
+from http_client import get_http_session, httpx_get
+
+
+# ==================== 共通ヘルパー ====================
+def to_namespace(obj: Any) -> Any:
+    """dict/list を属性アクセス可能なオブジェクトに再帰変換（openai SDK の応答と同じ形で扱うため）"""
+    if isinstance(obj, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return [to_namespace(x) for x in obj]
+    return obj
+
+
+def _request_key(kind: str, request: Dict[str, Any]) -> str:
+    """リクエスト内容からカセットのキーを生成"""
+    raw = json.dumps({"kind": kind, "request": request}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _chat_request_for_key(body: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: body.get(k) for k in ("model", "messages", "temperature", "max_completion_tokens")}
+
+
+def _search_request_for_key(params: Dict[str, Any]) -> Dict[str, Any]:
+    # APIキーはカセットに含めない
+    return {k: v for k, v in params.items() if k != "api_key"}
+
+
+class TransportResponse:
+    """requests.Response 互換の最小応答（serpapi_search が status_code と json() のみ参照するため）"""
+
+    def __init__(self, status_code: int, payload: Dict[str, Any]):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self) -> Dict[str, Any]:
+        return self._payload
+
+
+# ==================== カセット ====================
+class Cassette:
+    """
+    リクエストと応答の記録（1行1エントリのJSONL）
+    同じキーに複数の記録がある場合は記録順に順番に返す
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as fh:
+                for line in fh:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry["key"], []).append(entry)
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            i = self._cursor.get(key, 0)
+            self._cursor[key] = i + 1
+            return entries[i % len(entries)]
+
+    def record(self, kind: str, key: str, request: Dict[str, Any], response: Dict[str, Any], latency: float) -> None:
+        entry = {
+            "key": key,
+            "kind": kind,
+            "request": request,
+            "response": response,
+            "latency": round(latency, 4),
+            "recorded_at": datetime.now().isoformat(),
+        }
+        with self._lock:
+            self._entries.setdefault(key, []).append(entry)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._entries.values())
+
+
+def cassette_path(name: str = None) -> Path:
+    return Config.CASSETTE_DIR / f"{name or Config.CASSETTE_NAME}.jsonl"
+
+
+# ==================== レイテンシモデル ====================
+class LatencyModel:
+    """
+    合成応答のレイテンシ = (base + 出力1kトークンあたり秒数 × 出力トークン数/1000) × 対数正規ノイズ
+    """
+
+    def __init__(self, base: float = None, per_1k_tokens: float = None, jitter: float = None, seed: int = None):
+        self.base = Config.MOCK_LATENCY_BASE if base is None else base
+        self.per_1k_tokens = Config.MOCK_LATENCY_PER_1K_TOKENS if per_1k_tokens is None else per_1k_tokens
+        self.jitter = Config.MOCK_LATENCY_JITTER if jitter is None else jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self, completion_tokens: int = 0) -> float:
+        mean = self.base + self.per_1k_tokens * completion_tokens / 1000
+        if mean <= 0:
+            return 0.0
+        with self._lock:
+            noise = self._rng.lognormvariate(0.0, self.jitter) if self.jitter > 0 else 1.0
+        return mean * noise
+
+
+# ==================== LLMトランスポート ====================
+class LLMTransport:
+    """chat.completions を実行するトランスポートの基底クラス"""
+
+    name = "base"
+
+    def chat_completion(self, body: Dict[str, Any]) -> Any:
+        """
+        Args:
+            body: utils.build_chat_request_body で構築したリクエストボディ
+
+        Returns:
+            openai SDK の ChatCompletion と同じ属性（choices / usage）を持つ応答
+        """
+        raise NotImplementedError
+
+
+class OpenAITransport(LLMTransport):
+    """本番API（または OPENAI_BASE_URL のスタンドイン）を呼び出す"""
+
+    name = "openai"
+
+    def __init__(self, client=None):
+        self.client = client or get_openai_client()
+
+    def chat_completion(self, body: Dict[str, Any]) -> Any:
+        return self.client.chat.completions.create(**body)
+
+
+class MockTransport(LLMTransport):
+    """
+    合成応答を返す（ネットワーク不要）
+    markdown_ratio を指定すると、その確率で応答を ```json フェンスで囲み、JSON解析のリトライ経路を再現する
+    """
+
+    name = "mock"
+
+    def __init__(self, latency: LatencyModel = None, chars_per_token: float = None, markdown_ratio: float = 0.0, seed: int = None):
+        self.latency = latency or LatencyModel()
+        self.chars_per_token = Config.MOCK_CHARS_PER_TOKEN if chars_per_token is None else chars_per_token
+        self.markdown_ratio = markdown_ratio
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def chat_completion(self, body: Dict[str, Any]) -> Any:
+        payload = build_chat_completion(body, chars_per_token=self.chars_per_token)
+        if self.markdown_ratio > 0:
+            with self._lock:
+                fenced = self._rng.random() < self.markdown_ratio
+            if fenced:
+                message = payload["choices"][0]["message"]
+                message["content"] = f"```json\n{message['content']}\n```"
+        delay = self.latency.sample(payload["usage"]["completion_tokens"])
+        if delay > 0:
+            time.sleep(delay)
+        return to_namespace(payload)
+
+
+class RateLimitedTransport(LLMTransport):
+    """
+    APIティアの制限（RPM / TPM / 同時実行数）と一時的なサーバーエラーを模擬するラッパー
+    制限超過時は openai SDK の RateLimitError と同じ "rate_limit_exceeded" を含む例外を送出し、
+    call_openai_with_retry のレート制限リトライ経路を通す。
+    TPM は本番と同じく「プロンプトの推定トークン数 + max_completion_tokens」で消費する。
+    """
+
+    WINDOW_SECONDS = 60.0
+
+    def __init__(
+        self,
+        inner: LLMTransport,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_concurrency: int = 0,
+        error_rate: float = 0.0,
+        seed: int = None
+    ):
+        self.inner = inner
+        self.name = inner.name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.error_rate = error_rate
+        self.chars_per_token = getattr(inner, "chars_per_token", Config.MOCK_CHARS_PER_TOKEN)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window: List[tuple] = []  # (受付時刻, 消費トークン数)
+        self._in_flight = 0
+        self.stats = {"calls": 0, "succeeded": 0, "rate_limited_rpm": 0, "rate_limited_tpm": 0,
+                      "rate_limited_concurrency": 0, "server_errors": 0, "max_in_flight": 0}
+
+    def _estimate_tokens(self, body: Dict[str, Any]) -> int:
+        chars = sum(len(m.get("content") or "") for m in body.get("messages", []))
+        return int(chars / self.chars_per_token) + int(body.get("max_completion_tokens") or 0)
+
+    def _admit(self, tokens: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.stats["calls"] += 1
+            self._window = [(t, n) for t, n in self._window if now - t < self.WINDOW_SECONDS]
+            if self.max_concurrency and self._in_flight >= self.max_concurrency:
+                self.stats["rate_limited_concurrency"] += 1
+                raise Exception("Error code: 429 - rate_limit_exceeded: 同時実行数の上限に達しました（模擬）")
+            if self.rpm and len(self._window) >= self.rpm:
+                self.stats["rate_limited_rpm"] += 1
+                raise Exception("Error code: 429 - rate_limit_exceeded: RPM上限に達しました（模擬）")
+            if self.tpm and sum(n for _, n in self._window) + tokens > self.tpm:
+                self.stats["rate_limited_tpm"] += 1
+                raise Exception("Error code: 429 - rate_limit_exceeded: TPM上限に達しました（模擬）")
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.stats["server_errors"] += 1
+                raise Exception("Error code: 500 - server_error: 一時的なサーバーエラー（模擬）")
+            self._window.append((now, tokens))
+            self._in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+
+    def chat_completion(self, body: Dict[str, Any]) -> Any:
+        self._admit(self._estimate_tokens(body))
+        try:
+            response = self.inner.chat_completion(body)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        with self._lock:
+            self.stats["succeeded"] += 1
+        return response
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+
+class HedgedTransport(LLMTransport):
+    """
+    遅い応答に対して同じリクエストをもう1本送り、先に返った有効な応答を使うラッパー（テールレイテンシ対策）
+
+    - 待ち時間: モデル × ステップタグごとの直近 HEDGE_WINDOW 件のレイテンシの HEDGE_PERCENTILE 分位点
+      （HEDGE_MIN_DELAY_SEC 以上。実績が HEDGE_MIN_SAMPLES 件に満たない間はヘッジしない）
+    - 上限: 直近 HEDGE_BUDGET_WINDOW 件のリクエストに占めるヘッジの割合が HEDGE_MAX_RATE を超える場合は送らずに待つ
+    - 負けた側: 同期呼び出しは途中で止められないため、応答は捨てて待たない。消費したトークンは hedge_abandoned として記録する
+    - スレッド: ヘッジの対象になる呼び出しはリクエストごとの専用スレッドで実行する。共有のスレッドプールを使うと
+      LLM の同時呼び出し数がプールの大きさで頭打ちになり、プールでの待ちもヘッジの待ち時間に数えてしまうため
+
+    openai SDK の同期呼び出しはストリーミングしないため、最初のトークンではなく応答全体の到着時間で判断する。
+    """
+
+    def __init__(self, inner: LLMTransport, percentile: float = None, max_rate: float = None, min_samples: int = None):
+        self.inner = inner
+        self.name = inner.name
+        self.percentile = Config.HEDGE_PERCENTILE if percentile is None else percentile
+        self.max_rate = Config.HEDGE_MAX_RATE if max_rate is None else max_rate
+        self.min_samples = Config.HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+        self._lock = threading.Lock()
+        self._latencies: Dict[Tuple[str, str], Deque[float]] = {}
+        self._recent: Deque[bool] = deque(maxlen=Config.HEDGE_BUDGET_WINDOW)  # 直近のリクエストでヘッジしたかどうか
+        self.stats = {"requests": 0, "fired": 0, "won": 0, "lost": 0, "denied": 0}
+
+    # ==================== 待ち時間・上限 ====================
+    def observe(self, key: Tuple[str, str], latency: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=Config.HEDGE_WINDOW)).append(latency)
+
+    def hedge_delay(self, key: Tuple[str, str]) -> Optional[float]:
+        """ヘッジを送るまでの待ち時間（秒）。実績が足りない場合は None"""
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(self.percentile * len(samples)))
+        return max(samples[index], Config.HEDGE_MIN_DELAY_SEC)
+
+    def _admit_request(self) -> None:
+        with self._lock:
+            self._recent.append(False)
+            self.stats["requests"] += 1
+
+    def _count(self, outcome: str) -> None:
+        LLM_HEDGES.inc(outcome=outcome)
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+    def _admit_hedge(self) -> bool:
+        """ヘッジの割合が上限以内ならヘッジ分を計上して True"""
+        with self._lock:
+            if sum(self._recent) + 1 > self.max_rate * len(self._recent):
+                return False
+            self._recent[-1] = True
+            return True
+
+    # ==================== 呼び出し ====================
+    def _timed(self, key: Tuple[str, str], body: Dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        response = self.inner.chat_completion(body)
+        self.observe(key, time.perf_counter() - started)
+        return response
+
+    def _submit(self, key: Tuple[str, str], body: Dict[str, Any]) -> Tuple[Future, threading.Event]:
+        """
+        専用スレッドで呼び出す
+
+        Returns:
+            (応答の Future, 呼び出しを開始したときにセットされる Event)
+        """
+        future: Future = Future()
+        started = threading.Event()
+
+        def target() -> None:
+            if not future.set_running_or_notify_cancel():
+                return
+            started.set()
+            try:
+                future.set_result(self._timed(key, body))
+            except BaseException as e:
+                future.set_exception(e)
+
+        # run ID・ステップタグを引き継ぐ（record 時のカセットやトークン記録のため）
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(target,), name="llm-hedge", daemon=True).start()
+        return future, started
+
+    @staticmethod
+    def _valid(response: Any) -> bool:
+        try:
+            return bool(response.choices[0].message.content)
+        except (AttributeError, IndexError, TypeError):
+            return False
+
+    def _abandon(self, future: Future, body: Dict[str, Any]) -> None:
+        """負けた側の応答を捨てる（完了後に消費トークンだけ記録する）"""
+        if future.cancel():
+            return
+        context = contextvars.copy_context()
+        future.add_done_callback(lambda f: context.run(self._record_abandoned, f, body))
+
+    @staticmethod
+    def _record_abandoned(future: Future, body: Dict[str, Any]) -> None:
+        if future.exception() is not None:
+            return
+        usage = _extract_usage(future.result())
+        if usage:
+            append_token_usage({'model': body.get("model"), **usage, 'hedge_abandoned': True})
+
+    def chat_completion(self, body: Dict[str, Any]) -> Any:
+        key = (body.get("model") or "-", current_step() or "-")
+        self._admit_request()
+        delay = self.hedge_delay(key)
+        if delay is None:
+            return self._timed(key, body)
+
+        primary, started = self._submit(key, body)
+        # 待ち時間はリクエストを実際に送り始めてから数える
+        started.wait()
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if not self._admit_hedge():
+            self._count("denied")
+            return primary.result()
+
+        logger.info(f"LLM応答が{delay:.1f}秒を超えたため、同じリクエストをもう1本送ります（{key[1]}）")
+        self._count("fired")
+        hedge, _ = self._submit(key, body)
+        pending = {primary, hedge}
+        fallback = None
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if not self._valid(response):
+                    fallback = fallback or response
+                    continue
+                self._count("won" if future is hedge else "lost")
+                for loser in pending:
+                    self._abandon(loser, body)
+                return response
+        # どちらも有効な応答を返さなかった場合は、空の応答（finish_reason の判定を呼び出し元に任せる）か最初の例外
+        if fallback is not None:
+            return fallback
+        raise error
+
+
+class RecordingTransport(LLMTransport):
+    """内側のトランスポートを呼び出し、応答をカセットに記録する"""
+
+    name = "record"
+
+    def __init__(self, inner: LLMTransport, cassette: Cassette):
+        self.inner = inner
+        self.cassette = cassette
+
+    def chat_completion(self, body: Dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        response = self.inner.chat_completion(body)
+        latency = time.perf_counter() - started
+        payload = response.model_dump() if hasattr(response, "model_dump") else _namespace_to_dict(response)
+        request = _chat_request_for_key(body)
+        self.cassette.record("chat", _request_key("chat", request), request, payload, latency)
+        return response
+
+
+class ReplayTransport(LLMTransport):
+    """カセットに記録された応答を再生する"""
+
+    name = "replay"
+
+    def __init__(self, cassette: Cassette, latency_scale: float = None, miss_policy: str = None, fallback: LLMTransport = None):
+        self.cassette = cassette
+        self.latency_scale = Config.SIM_LATENCY_SCALE if latency_scale is None else latency_scale
+        self.miss_policy = miss_policy or Config.CASSETTE_MISS_POLICY
+        self.fallback = fallback or MockTransport()
+
+    def chat_completion(self, body: Dict[str, Any]) -> Any:
+        entry = self.cassette.lookup(_request_key("chat", _chat_request_for_key(body)))
+        if entry is None:
+            if self.miss_policy == "mock":
+                logger.debug("カセットに記録が無いため合成応答を返します")
+                return self.fallback.chat_completion(body)
+            raise Exception(f"カセットに記録がありません（{self.cassette.path.name}）。LLM_TRANSPORT=record で記録してください")
+        if self.latency_scale > 0:
+            time.sleep(entry.get("latency", 0) * self.latency_scale)
+        return to_namespace(entry["response"])
+
+
+def _namespace_to_dict(obj: Any) -> Any:
+    if isinstance(obj, SimpleNamespace):
+        return {k: _namespace_to_dict(v) for k, v in vars(obj).items()}
+    if isinstance(obj, list):
+        return [_namespace_to_dict(x) for x in obj]
+    return obj
+
+
+# ==================== 検索トランスポート ====================
+class SearchTransport:
+    """SerpAPI互換の検索を実行するトランスポートの基底クラス"""
+
+    name = "base"
+
+    def get(self, params: Dict[str, Any], timeout: float) -> Any:
+        """
+        Args:
+            params: SerpAPI のクエリパラメータ
+            timeout: (接続, 読み取り) のタイムアウト（秒）
+
+        Returns:
+            status_code と json() を持つ応答（requests.Response 互換）
+        """
+        raise NotImplementedError
+
+
+class SerpAPITransport(SearchTransport):
+    """本番SerpAPI（または SERPAPI_ENDPOINT のスタンドイン）を呼び出す（共通の接続プール・リトライを使う）"""
+
+    name = "serpapi"
+
+    def get(self, params: Dict[str, Any], timeout: Any) -> Any:
+        if Config.SERPAPI_HTTP_CLIENT == "httpx":
+            return httpx_get(Config.SERPAPI_ENDPOINT, params, timeout)
+        return get_http_session().get(Config.SERPAPI_ENDPOINT, params=params, timeout=timeout)
+
+
+class MockSearchTransport(SearchTransport):
+    """合成検索結果を返す（ネットワーク不要）"""
+
+    name = "mock"
+
+    def __init__(self, latency: LatencyModel = None):
+        self.latency = latency or LatencyModel()
+
+    def get(self, params: Dict[str, Any], timeout: float) -> Any:
+        delay = self.latency.sample()
+        if delay > 0:
+            time.sleep(delay)
+        return TransportResponse(200, synthesize_search_results(params))
+
+
+class LocalSearchTransport(SearchTransport):
+    """ローカル検索索引（BM25）で検索する（ネットワーク不要・待機なし）"""
+
+    name = "local"
+
+    def get(self, params: Dict[str, Any], timeout: float) -> Any:
+        try:
+            num = int(params.get("num") or Config.MAX_SEARCH_RESULTS)
+        except (TypeError, ValueError):
+            num = Config.MAX_SEARCH_RESULTS
+        results = local_search(str(params.get("q", "")), num, mode="transport")
+        organic = [{"position": i, **item} for i, item in enumerate(results, 1)]
+        return TransportResponse(200, {"search_metadata": {"status": "Success"}, "organic_results": organic})
+
+
+class RecordingSearchTransport(SearchTransport):
+    """内側のトランスポートを呼び出し、成功した応答をカセットに記録する"""
+
+    name = "record"
+
+    def __init__(self, inner: SearchTransport, cassette: Cassette):
+        self.inner = inner
+        self.cassette = cassette
+
+    def get(self, params: Dict[str, Any], timeout: float) -> Any:
+        started = time.perf_counter()
+        response = self.inner.get(params, timeout)
+        latency = time.perf_counter() - started
+        if response.status_code == 200:
+            request = _search_request_for_key(params)
+            self.cassette.record("search", _request_key("search", request), request, response.json(), latency)
+        return response
+
+
+class ReplaySearchTransport(SearchTransport):
+    """カセットに記録された検索結果を再生する"""
+
+    name = "replay"
+
+    def __init__(self, cassette: Cassette, latency_scale: float = None, miss_policy: str = None, fallback: SearchTransport = None):
+        self.cassette = cassette
+        self.latency_scale = Config.SIM_LATENCY_SCALE if latency_scale is None else latency_scale
+        self.miss_policy = miss_policy or Config.CASSETTE_MISS_POLICY
+        self.fallback = fallback or MockSearchTransport()
+
+    def get(self, params: Dict[str, Any], timeout: float) -> Any:
+        entry = self.cassette.lookup(_request_key("search", _search_request_for_key(params)))
+        if entry is None:
+            if self.miss_policy == "mock":
+                return self.fallback.get(params, timeout)
+            raise Exception(f"カセットに検索結果の記録がありません（{self.cassette.path.name}）")
+        if self.latency_scale > 0:
+            time.sleep(entry.get("latency", 0) * self.latency_scale)
+        return TransportResponse(200, entry["response"])
+
+
+# ==================== トランスポートの選択 ====================
+_llm_transport: Optional[LLMTransport] = None
+_search_transport: Optional[SearchTransport] = None
+_transport_lock = threading.Lock()
+
+
+def _hedged(transport: LLMTransport) -> LLMTransport:
+    return HedgedTransport(transport) if Config.HEDGE_ENABLED else transport
+
+
+def build_llm_transport(mode: str = None, cassette: Cassette = None) -> LLMTransport:
+    """
+    モード名から LLM トランスポートを構築
+    HEDGE_ENABLED の場合は openai / mock / record の通信部分を HedgedTransport で包む（record は勝った応答だけを記録する）
+    """
+    mode = mode or Config.LLM_TRANSPORT
+    if mode == "openai":
+        return _hedged(OpenAITransport())
+    if mode == "mock":
+        if Config.MOCK_RPM_LIMIT or Config.MOCK_TPM_LIMIT or Config.MOCK_MAX_CONCURRENCY or Config.MOCK_ERROR_RATE:
+            return _hedged(RateLimitedTransport(
+                MockTransport(),
+                rpm=Config.MOCK_RPM_LIMIT,
+                tpm=Config.MOCK_TPM_LIMIT,
+                max_concurrency=Config.MOCK_MAX_CONCURRENCY,
+                error_rate=Config.MOCK_ERROR_RATE
+            ))
+        return _hedged(MockTransport())
+    if mode == "record":
+        return RecordingTransport(_hedged(OpenAITransport()), cassette or Cassette(cassette_path()))
+    if mode == "replay":
+        return ReplayTransport(cassette or Cassette(cassette_path()))
+    raise ValueError(f"未知のLLMトランスポートです: {mode}")
+
+
+def build_search_transport(mode: str = None, cassette: Cassette = None) -> SearchTransport:
+    """モード名から検索トランスポートを構築"""
+    mode = mode or Config.SEARCH_TRANSPORT
+    if mode == "serpapi":
+        return SerpAPITransport()
+    if mode == "mock":
+        return MockSearchTransport()
+    if mode == "local":
+        return LocalSearchTransport()
+    if mode == "record":
+        return RecordingSearchTransport(SerpAPITransport(), cassette or Cassette(cassette_path()))
+    if mode == "replay":
+        return ReplaySearchTransport(cassette or Cassette(cassette_path()))
+    raise ValueError(f"未知の検索トランスポートです: {mode}")
+
+
+def get_llm_transport() -> LLMTransport:
+    """現在の LLM トランスポート（未設定なら Config.LLM_TRANSPORT から構築）"""
+    global _llm_transport
+    with _transport_lock:
+        if _llm_transport is None:
+            _llm_transport = build_llm_transport()
+            logger.info(f"LLMトランスポート: {_llm_transport.name}")
+        return _llm_transport
+
+
+def get_search_transport() -> SearchTransport:
+    """現在の検索トランスポート（未設定なら Config.SEARCH_TRANSPORT から構築）"""
+    global _search_transport
+    with _transport_lock:
+        if _search_transport is None:
+            _search_transport = build_search_transport()
+            logger.info(f"検索トランスポート: {_search_transport.name}")
+        return _search_transport
+
+
+def set_llm_transport(transport: Optional[LLMTransport]) -> None:
+    """LLM トランスポートを差し替える（None で Config に従って再構築）"""
+    global _llm_transport
+    with _transport_lock:
+        _llm_transport = transport
+
+
+def set_search_transport(transport: Optional[SearchTransport]) -> None:
+    """検索トランスポートを差し替える（None で Config に従って再構築）"""
+    global _search_transport
+    with _transport_lock:
+        _search_transport = transport
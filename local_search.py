@@ -0,0 +1,226 @@
+"""
+ローカル検索索引（BM25）
+SerpAPI が使えない場合（APIキー未設定・障害・ネガティブキャッシュ中）に serpapi_search_with_fallback が代わりに使う検索。
+serpapi_search と同じ List[{title, link, snippet}] を返すため、レイヤー②の検索付きの経路をネットワーク無しで維持できる。
+SEARCH_TRANSPORT=local では検索トランスポートとしても使える（オフラインでの動作確認用）。
+
+索引の対象:
+- corpus/*.jsonl: 職種ごとの業務フロー・使用技術をまとめた文書（1行1件の {title, link, snippet, job_category}）
+- 検索キャッシュ（search_cache）に保存済みの過去の検索結果
+
+日本語は形態素解析を使わず、かな・漢字の連続を文字 bigram に、英数字を単語に分割して BM25 で順位付けする。
+索引はプロセス内で最初の検索時に作成する（文書は数百〜数千件程度を想定）。
+
+使い方（CLI）:
+    python local_search.py stats
+    python local_search.py query "経理 業務フロー 標準的な流れ"
+"""
+import argparse
+import json
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from config import Config
+from metrics import LOCAL_SEARCH_QUERIES
+from search_cache import SearchCache
+from utils import logger
+
+# BM25 のパラメータ
+K1 = 1.5
+B = 0.75
+# 最上位のスコアに対してこの割合未満の文書は返さない（「業務フロー」等の共通語だけで一致した他職種の文書を除く）
+MIN_RELATIVE_SCORE = 0.5
+# コーパスの job_category の語を本文の何回分として数えるか（職種名の一致を重視する）
+CATEGORY_BOOST = 3
+# 文書の割合がこの値以上に出現する語は共通語とみなす。共通語だけで一致した文書は返さない
+COMMON_TERM_RATIO = 0.2
+
+# 英数字の連続、かな・カナ・漢字の連続
+_TOKEN_PATTERN = re.compile(r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u9fff]+")
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff]")
+
+
+def tokenize(text: str) -> List[str]:
+    """英数字は単語、かな・漢字の連続は文字 bigram（1文字の場合はその文字）に分割"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        if not _CJK_PATTERN.match(run):
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class LocalSearchIndex:
+    """BM25 の転置索引"""
+
+    def __init__(self):
+        self._docs: List[Dict[str, str]] = []
+        self._links = set()
+        self._postings: Dict[str, List[tuple]] = defaultdict(list)
+        self._lengths: List[int] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, title: str, link: str, snippet: str, job_category: str = "") -> bool:
+        """文書を追加（同じリンクの文書は追加しない）。追加した場合は True"""
+        if not snippet:
+            return False
+        with self._lock:
+            if link in self._links:
+                return False
+            doc_id = len(self._docs)
+            self._docs.append({"title": title, "link": link, "snippet": snippet})
+            self._links.add(link)
+            # タイトルは職種名を含むことが多いため本文と合わせて索引する
+            counts = Counter(tokenize(f"{title} {snippet}"))
+            for token in tokenize(job_category):
+                counts[token] += CATEGORY_BOOST
+            for token, tf in counts.items():
+                self._postings[token].append((doc_id, tf))
+            self._lengths.append(sum(counts.values()))
+        return True
+
+    def add_many(self, items: Iterable[Dict[str, str]]) -> int:
+        return sum(
+            self.add(item.get("title", ""), item.get("link", ""), item.get("snippet", ""), item.get("job_category", ""))
+            for item in items
+        )
+
+    def search(self, query: str, num_results: int = None) -> List[Dict[str, str]]:
+        """
+        BM25 で検索
+
+        Args:
+            query: 検索クエリ
+            num_results: 取得する結果数（Noneの場合はConfig.MAX_SEARCH_RESULTSを使用）
+
+        Returns:
+            スコアの高い順の検索結果（各要素は {title, link, snippet} の辞書）
+        """
+        num_results = num_results or Config.MAX_SEARCH_RESULTS
+        with self._lock:
+            n = len(self._docs)
+            if n == 0:
+                return []
+            avgdl = sum(self._lengths) / n
+            scores: Dict[int, float] = defaultdict(float)
+            specific = set()
+            for token in set(tokenize(query)):
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                is_specific = len(postings) < n * COMMON_TERM_RATIO
+                for doc_id, tf in postings:
+                    norm = K1 * (1 - B + B * self._lengths[doc_id] / avgdl)
+                    scores[doc_id] += idf * tf * (K1 + 1) / (tf + norm)
+                    if is_specific:
+                        specific.add(doc_id)
+            ranked = sorted(
+                ((doc_id, score) for doc_id, score in scores.items() if doc_id in specific),
+                key=lambda kv: kv[1], reverse=True
+            )[:num_results]
+            if not ranked:
+                return []
+            cutoff = ranked[0][1] * MIN_RELATIVE_SCORE
+            return [dict(self._docs[doc_id]) for doc_id, score in ranked if score >= cutoff]
+
+
+# ==================== 索引の作成 ====================
+def load_corpus(corpus_dir: Path = None) -> List[Dict[str, str]]:
+    """corpus/*.jsonl の文書を読み込む（壊れた行は読み飛ばす）"""
+    corpus_dir = Path(corpus_dir or Config.LOCAL_CORPUS_DIR)
+    items = []
+    for path in sorted(corpus_dir.glob("*.jsonl")):
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"ローカル検索: {path.name} の {line_no} 行目を読み飛ばしました")
+    return items
+
+
+def build_index(corpus_dir: Path = None, include_cache: bool = True) -> LocalSearchIndex:
+    """コーパスと検索キャッシュの過去の結果から索引を作成"""
+    index = LocalSearchIndex()
+    corpus_count = index.add_many(load_corpus(corpus_dir))
+    cache_count = 0
+    if include_cache and Config.RESULT_DB.exists():
+        try:
+            for results in SearchCache().all_results():
+                cache_count += index.add_many(results)
+        except Exception as e:
+            logger.warning(f"ローカル検索: 検索キャッシュの読み込みに失敗しました: {str(e)}")
+    logger.info(f"ローカル検索の索引を作成しました（コーパス {corpus_count}件、過去の検索結果 {cache_count}件）")
+    return index
+
+
+_index: Optional[LocalSearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_local_index() -> LocalSearchIndex:
+    """プロセス共通の索引（最初の呼び出しで作成）"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = build_index()
+        return _index
+
+
+def local_search(query: str, num_results: int = None, mode: str = "fallback") -> List[Dict[str, str]]:
+    """
+    ローカル索引で検索（serpapi_search と同じ形式。失敗時は空リスト）
+
+    Args:
+        query: 検索クエリ
+        num_results: 取得する結果数
+        mode: メトリクスのラベル（fallback: SerpAPI の代替 | transport: SEARCH_TRANSPORT=local）
+    """
+    LOCAL_SEARCH_QUERIES.inc(mode=mode)
+    try:
+        return get_local_index().search(query, num_results)
+    except Exception as e:
+        logger.warning(f"ローカル検索に失敗しました: {str(e)}")
+        return []
+
+
+def remember(results: List[Dict[str, str]]) -> None:
+    """取得した検索結果を索引に追加（索引が未作成の場合は次回の作成時に検索キャッシュから読み込まれる）"""
+    if _index is not None:
+        _index.add_many(results)
+
+
+# ==================== CLI ====================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ローカル検索索引（BM25）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="索引の件数")
+    p_query = sub.add_parser("query", help="検索")
+    p_query.add_argument("query")
+    p_query.add_argument("--num", type=int, default=None)
+    args = parser.parse_args()
+
+    index = build_index()
+    if args.command == "stats":
+        print(f"documents={len(index)}")
+        return
+    for i, item in enumerate(index.search(args.query, args.num), 1):
+        print(f"{i}. {item['title']}  <{item['link']}>\n   {item['snippet'][:120]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+非同期ログ出力
+ログレコードと JSONL の追記を呼び出し元スレッドから切り離し、バックグラウンドスレッドで書き込む。
+
+- BoundedQueueHandler: logging.handlers.QueueHandler の上限付き版。
+  キューが満杯のとき、WARNING 未満のレコードは破棄し、WARNING 以上は最も古いレコードを押し出して積む。
+- AsyncLineWriter: ファイルへの1行追記（token_usage.log など）をまとめて書き込む。
+  ファイルは開いたまま保持し、一定間隔または一定件数ごとに flush する。
+
+どちらも呼び出し元はキューに積むだけで、ディスクI/Oを待たない。破棄件数は dropped で確認できる。
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, TextIO, Tuple
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """上限付きキューに積む QueueHandler（満杯時は重要度の低いレコードから破棄）"""
+
+    def __init__(self, maxsize: int, keep_level: int = logging.WARNING):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.keep_level = keep_level
+        self.dropped = 0
+        self._drop_lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if record.levelno >= self.keep_level:
+            # 重要なレコードは最も古いレコードを押し出して積む
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self._count_drop()
+                return
+        self._count_drop()
+
+    def _count_drop(self) -> None:
+        with self._drop_lock:
+            self.dropped += 1
+
+
+def start_async_logging(
+    logger: logging.Logger,
+    handlers: List[logging.Handler],
+    maxsize: int,
+    filters: Optional[List[logging.Filter]] = None
+) -> Tuple[BoundedQueueHandler, logging.handlers.QueueListener]:
+    """
+    logger に BoundedQueueHandler を付け、実際の出力先 handlers をバックグラウンドの QueueListener で動かす
+
+    Args:
+        logger: 対象のロガー
+        handlers: ファイル/コンソールなど実際の出力先
+        maxsize: キューの上限件数
+        filters: 呼び出し元スレッドで適用するフィルター（contextvars を参照するものはここに渡す）
+
+    Returns:
+        (キューハンドラー, リスナー)
+    """
+    queue_handler = BoundedQueueHandler(maxsize)
+    for f in filters or []:
+        queue_handler.addFilter(f)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(queue_handler)
+    atexit.register(listener.stop)
+    return queue_handler, listener
+
+
+class AsyncLineWriter:
+    """
+    ファイルへの1行追記をバックグラウンドスレッドでまとめて行う
+    キューが満杯の場合は破棄する（呼び出し元を待たせない）
+    """
+
+    def __init__(self, maxsize: int = 10000, flush_interval: float = 1.0, batch_size: int = 500):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Tuple[Path, str]]]" = queue.Queue(maxsize=maxsize)
+        self._files: Dict[Path, TextIO] = {}
+        self._idle = threading.Condition()
+        self._pending = 0
+        self._thread = threading.Thread(target=self._run, name="line-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def pending(self) -> int:
+        """書き込み待ちの行数"""
+        return self._pending
+
+    def write(self, path: Path, line: str) -> bool:
+        """
+        1行を書き込みキューに積む
+
+        Returns:
+            積めた場合 True（キューが満杯で破棄した場合 False）
+        """
+        with self._idle:
+            self._pending += 1
+        try:
+            self._queue.put_nowait((Path(path), line))
+            return True
+        except queue.Full:
+            with self._idle:
+                self._pending -= 1
+                self.dropped += 1
+            return False
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """積まれた行がすべて書き込まれるまで待つ"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def close(self) -> None:
+        if not self._thread.is_alive():
+            return
+        self.flush()
+        self._queue.put(None)
+        self._thread.join(timeout=10.0)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            items: List[Tuple[Path, str]] = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                if item is None:
+                    stop = True
+                else:
+                    items.append(item)
+                while len(items) < self.batch_size:
+                    item = self._queue.get_nowait()
+                    if item is None:
+                        stop = True
+                        break
+                    items.append(item)
+            except queue.Empty:
+                pass
+            if items:
+                self._write(items)
+        for fh in self._files.values():
+            fh.close()
+        self._files.clear()
+
+    def _write(self, items: List[Tuple[Path, str]]) -> None:
+        touched = set()
+        try:
+            for path, line in items:
+                fh = self._files.get(path)
+                if fh is None:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    fh = self._files[path] = open(path, "a", encoding="utf-8")
+                fh.write(line if line.endswith("\n") else line + "\n")
+                touched.add(path)
+            for path in touched:
+                self._files[path].flush()
+        except Exception:
+            # 書き込み失敗はアプリケーションの処理に影響させない（次回に再オープン）
+            for fh in self._files.values():
+                try:
+                    fh.close()
+                except Exception:
+                    pass
+            self._files.clear()
+        finally:
+            with self._idle:
+                self._pending -= len(items)
+                self._idle.notify_all()
@@ -0,0 +1,401 @@
+"""
+メトリクス（Prometheus テキスト形式）
+実行数・LLM呼び出し・リトライ・レート制限・検索・JSON解析のフォールバックをカウンター、
+レイヤー別の所要時間・トークン数をヒストグラム、実行中の処理数・書き込みキューの滞留件数をゲージとして集計し、
+ローカルのHTTPエンドポイント（METRICS_PORT を設定した場合のみ。例: http://127.0.0.1:9464/metrics）で公開する。
+
+値はプロセス内のメモリに保持する（再起動でリセット。長期の推移は telemetry_store を使う）。
+Streamlit の起動時に start_metrics_server() でエンドポイントを立ち上げる（プロセスにつき1回）。
+
+    curl -s http://127.0.0.1:9464/metrics
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import Config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# ==================== メトリクス型 ====================
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} のラベルが一致しません: {sorted(labels)} != {sorted(self.labelnames)}")
+        return tuple("" if labels[name] is None else str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """単調増加のカウンター"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if amount < 0:
+            raise ValueError("カウンターは減算できません")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    """増減する値（set_function で出力時に値を取得することもできる）"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+        self._functions: Dict[LabelKey, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, func: Callable[[], float], **labels: Any) -> None:
+        """出力のたびに func() を呼んで値とする（キューの滞留件数など）"""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = func
+
+    @contextmanager
+    def track_inprogress(self, **labels: Any) -> Iterator[None]:
+        """ブロック実行中だけ値を1増やす"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def value(self, **labels: Any) -> float:
+        key = self._key(labels)
+        with self._lock:
+            func = self._functions.get(key)
+            if func is None:
+                return self._values.get(key, 0.0)
+        return float(func())
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, func in functions.items():
+            try:
+                values[key] = float(func())
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """バケット別の累積件数・合計・件数"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # ラベルごとに [各バケットの件数..., 合計, 件数]
+        self._values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """ブロックの所要時間（秒）を記録する（例外で抜けた場合も記録）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            cumulative = 0.0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(state[-1])}")
+        return lines
+
+
+# ==================== レジストリ ====================
+class Registry:
+    """メトリクスの登録先（名前の重複は許可しない）"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"メトリクス名が重複しています: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus テキスト形式で出力"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ==================== メトリクス定義 ====================
+RUNS = REGISTRY.counter("recruiter_runs_total", "実行数（pipeline / modification / qa）", ["kind", "status"])
+RUNS_IN_FLIGHT = REGISTRY.gauge("recruiter_runs_in_flight", "実行中の処理数", ["kind"])
+RUN_DURATION = REGISTRY.histogram("recruiter_run_duration_seconds", "1実行の所要時間（秒）", ["kind"])
+LAYER_DURATION = REGISTRY.histogram("recruiter_layer_duration_seconds", "レイヤーごとの所要時間（秒）", ["layer"])
+STAGE_DURATION = REGISTRY.histogram("recruiter_stage_duration_seconds", "ステージグラフのステージごとの所要時間（秒）", ["stage"])
+STAGE_RESULTS = REGISTRY.counter(
+    "recruiter_stage_results_total", "ステージの実行結果（run / cached / seeded / failed）", ["stage", "result"]
+)
+
+LLM_CALLS = REGISTRY.counter("recruiter_llm_calls_total", "LLM呼び出し数（リトライを含めて1回）", ["model", "step", "status"])
+LLM_RETRIES = REGISTRY.counter("recruiter_llm_retries_total", "LLM呼び出しのリトライ回数", ["model"])
+LLM_RATE_LIMITED = REGISTRY.counter("recruiter_llm_rate_limited_total", "レート制限エラーの発生回数", ["model"])
+LLM_IN_FLIGHT = REGISTRY.gauge("recruiter_llm_in_flight", "応答待ちのLLM呼び出し数")
+LLM_HEDGES = REGISTRY.counter(
+    "recruiter_llm_hedges_total", "遅い応答への重複リクエスト（fired / won / lost / denied）", ["outcome"]
+)
+LLM_LATENCY = REGISTRY.histogram("recruiter_llm_latency_seconds", "LLM呼び出しの所要時間（リトライ待ちを含む、秒）", ["model"])
+LLM_PROMPT_TOKENS = REGISTRY.histogram("recruiter_llm_prompt_tokens", "1呼び出しあたりの入力トークン数", ["step"], TOKEN_BUCKETS)
+LLM_COMPLETION_TOKENS = REGISTRY.histogram("recruiter_llm_completion_tokens", "1呼び出しあたりの出力トークン数", ["step"], TOKEN_BUCKETS)
+LLM_COST = REGISTRY.counter("recruiter_llm_cost_usd_total", "LLM呼び出しの概算料金（USD）", ["model"])
+MODEL_ESCALATIONS = REGISTRY.counter(
+    "recruiter_model_escalations_total", "小さいモデルの応答を大きいモデルでやり直した回数（invalid / low_confidence）", ["step", "reason"]
+)
+
+SEARCH_REQUESTS = REGISTRY.counter("recruiter_search_requests_total", "Web検索の実行数", ["status"])
+SEARCH_LATENCY = REGISTRY.histogram("recruiter_search_latency_seconds", "Web検索の所要時間（秒）")
+LOCAL_SEARCH_QUERIES = REGISTRY.counter(
+    "recruiter_local_search_queries_total", "ローカル検索索引の検索（fallback / transport）", ["mode"]
+)
+SEARCH_CACHE_LOOKUPS = REGISTRY.counter(
+    "recruiter_search_cache_lookups_total", "検索キャッシュの参照（hit / stale / negative / miss）", ["result"]
+)
+SEARCH_DECISIONS = REGISTRY.counter(
+    "recruiter_search_decisions_total", "Web検索の実行判断（search / skip × rule / history / explore / priority）", ["decision", "basis"]
+)
+PAGE_FETCHES = REGISTRY.counter(
+    "recruiter_page_fetches_total", "検索結果ページの取得（cache / fetched / not_modified / error）", ["result"]
+)
+
+CIRCUIT_STATE = REGISTRY.gauge("recruiter_circuit_state", "サーキットブレーカーの状態（0: closed / 1: half_open / 2: open）", ["dependency"])
+CIRCUIT_REJECTED = REGISTRY.counter("recruiter_circuit_rejected_total", "ブレーカーが開いていて即失敗させた呼び出し数", ["dependency"])
+ADMISSION = REGISTRY.counter("recruiter_admission_total", "生成の受付（admitted / queued / rejected）", ["result"])
+ADMISSION_IN_FLIGHT = REGISTRY.gauge("recruiter_admission_in_flight", "実行中の生成数")
+ADMISSION_QUEUED = REGISTRY.gauge("recruiter_admission_queued", "受付待ちの生成数")
+JOBS = REGISTRY.counter(
+    "recruiter_jobs_total", "生成ジョブ（submitted / coalesced / rejected / succeeded / failed）", ["mode", "result"]
+)
+JOBS_ACTIVE = REGISTRY.gauge("recruiter_jobs_active", "このプロセスの生成ジョブ数（queued / running）", ["status"])
+
+RESULT_STORE_LOOKUPS = REGISTRY.counter("recruiter_result_store_lookups_total", "生成結果ストアの参照（hit / miss）", ["result"])
+NEAR_DUPLICATE_QUERIES = REGISTRY.counter("recruiter_near_duplicate_queries_total", "類似求人の検索（match / none）", ["result"])
+KNOWLEDGE_CACHE_LOOKUPS = REGISTRY.counter(
+    "recruiter_knowledge_cache_lookups_total", "職種ナレッジキャッシュの参照（search / profile × hit / miss / expired）", ["kind", "result"]
+)
+
+JSON_PARSE = REGISTRY.counter("recruiter_json_parse_total", "JSON解析の結果（direct 以外はフォールバック）", ["strategy"])
+
+QUEUE_DEPTH = REGISTRY.gauge("recruiter_queue_depth", "書き込み待ちの件数", ["queue"])
+QUEUE_DROPPED = REGISTRY.gauge("recruiter_queue_dropped", "キュー満杯で破棄した件数（プロセス起動から）", ["queue"])
+
+
+def observe_llm_call(record: Dict[str, Any], cost_usd: float = 0.0) -> None:
+    """
+    LLM呼び出しの記録（utils.append_token_usage と同じレコード）をメトリクスに反映
+
+    Args:
+        record: トークン記録（model / step / prompt_tokens / retries / error など）
+        cost_usd: 概算料金
+    """
+    model = record.get("model") or "-"
+    step = record.get("step") or "-"
+    LLM_CALLS.inc(model=model, step=step, status="error" if record.get("error") else "ok")
+    if record.get("retries"):
+        LLM_RETRIES.inc(record["retries"], model=model)
+    if record.get("rate_limited"):
+        LLM_RATE_LIMITED.inc(record["rate_limited"], model=model)
+    latency_ms = record.get("total_latency_ms") or record.get("latency_ms")
+    if latency_ms is not None:
+        LLM_LATENCY.observe(latency_ms / 1000, model=model)
+    if record.get("prompt_tokens") is not None:
+        LLM_PROMPT_TOKENS.observe(record["prompt_tokens"], step=step)
+    if record.get("completion_tokens") is not None:
+        LLM_COMPLETION_TOKENS.observe(record["completion_tokens"], step=step)
+    if cost_usd:
+        LLM_COST.inc(cost_usd, model=model)
+
+
+def instrumented(counter: Counter, histogram: Histogram) -> Callable:
+    """呼び出しごとに counter（status=ok/error）と histogram（所要時間）を記録するデコレータ"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time():
+                try:
+                    result = func(*args, **kwargs)
+                except Exception:
+                    counter.inc(status="error")
+                    raise
+            counter.inc(status="ok")
+            return result
+        return wrapper
+    return decorator
+
+
+# ==================== HTTPエンドポイント ====================
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # スクレイプのたびにアクセスログを出さない
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+_server_attempted = False
+
+
+def start_metrics_server(port: int = None, host: str = None) -> Optional[int]:
+    """
+    /metrics を返すHTTPサーバーをバックグラウンドで起動
+    起動はプロセスにつき1回だけ試みる（Streamlit の再実行のたびに呼ばれても、起動済み・起動に失敗した場合は何もしない）
+
+    Args:
+        port: 待ち受けポート（省略時は Config.METRICS_PORT。0・未設定の場合は起動しない）
+        host: 待ち受けアドレス（省略時は Config.METRICS_HOST）
+
+    Returns:
+        待ち受けているポート番号（起動しなかった・できなかった場合は None）
+    """
+    global _server, _server_attempted
+    port = Config.METRICS_PORT if port is None else port
+    host = host or Config.METRICS_HOST
+    with _server_lock:
+        if _server is not None:
+            return _server.server_address[1]
+        if not port or _server_attempted:
+            return None
+        _server_attempted = True
+        try:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            # 同じポートを別プロセス（複数ワーカーなど）が使っている場合は公開せずに続行
+            from utils import logger
+            logger.warning(f"メトリクスエンドポイントを起動できませんでした（{host}:{port}）: {str(e)}")
+            return None
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        _server = server
+    from utils import logger
+    logger.info(f"メトリクスエンドポイントを起動しました: http://{host}:{server.server_address[1]}/metrics")
+    return server.server_address[1]
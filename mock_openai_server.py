@@ -0,0 +1,513 @@
+"""
+OpenAI互換のローカル・スタンドインサーバー
+chat.completions / files / batches、SerpAPI互換の /search、OTLP/HTTP の /v1/traces の最小実装。
+/search の結果のリンクは /pages/ のフィクスチャページ（ETag 付きのHTML）を指す（page_fetch の確認用）。
+ネットワーク無しでパイプライン・バッチ処理を検証するために使用
+
+起動例:
+    python mock_openai_server.py --port 8765 --batch-delay 3 --latency 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python batch_runner.py run --input postings.jsonl
+    SERPAPI_ENDPOINT=http://127.0.0.1:8765/search SEARCH_TRANSPORT=serpapi ...
+    TRACE_EXPORTERS=otlp OTLP_ENDPOINT=http://127.0.0.1:8765/v1/traces ...
+"""
+import argparse
+import hashlib
+import html
+import json
+import math
+import re
+import threading
+import time
+import uuid
+import zlib
+from urllib.parse import parse_qs, urlencode, urlparse
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+ITEMS = [
+    "求人票名", "採用背景", "役割", "業務プロセス",
+    "対象製品", "ステークホルダー", "使用技術", "バリューチェーン"
+]
+
+
+# ==================== 応答の合成 ====================
+def estimate_tokens(text: str, chars_per_token: float = 2.0) -> int:
+    """日本語混じりテキストのトークン数を概算（デフォルトは 1トークン ≒ 2文字）"""
+    return max(1, math.ceil(len(text or "") / chars_per_token))
+
+
+def _extract_json_block(prompt: str, start_marker: str, end_marker: str) -> Optional[Dict[str, Any]]:
+    """プロンプト中のマーカー間に埋め込まれたJSONを取り出す（失敗時はNone）"""
+    try:
+        start = prompt.index(start_marker) + len(start_marker)
+        end = prompt.index(end_marker, start)
+        return json.loads(prompt[start:end].strip())
+    except (ValueError, json.JSONDecodeError):
+        return None
+
+
+def _extract_between(prompt: str, start_marker: str, end_marker: str) -> str:
+    """プロンプト中のマーカー間のテキストを取り出す（見つからなければ空文字）"""
+    try:
+        start = prompt.index(start_marker) + len(start_marker)
+        end = prompt.index(end_marker, start)
+        return prompt[start:end].strip()
+    except ValueError:
+        return ""
+
+
+def _layer1_reply(prompt: str) -> Dict[str, Any]:
+    job_text = _extract_between(prompt, "【求人票】", "【抽出項目】")
+    lines = [ln.strip("【】 　-・") for ln in job_text.splitlines() if ln.strip()]
+    title = lines[0][:40] if lines else "求人"
+    steps = [ln[:40] for ln in lines[1:6]] or ["要件確認", "実施", "報告"]
+    if len(steps) < 2:
+        steps.append("報告")
+    return {
+        "求人票名": title,
+        "採用背景": "記載なし",
+        "役割": f"{title}の担当者",
+        "業務プロセス": "\n↓\n".join(steps),
+        "対象製品": "自社サービス",
+        "ステークホルダー": "上長（R）、関連部署（C）",
+        "使用技術": "Excel、社内システム（※推察）",
+        "バリューチェーン": "記載なし",
+    }
+
+
+def _layer2_reply(prompt: str, with_web: bool) -> Dict[str, Any]:
+    seed = sum(ord(ch) for ch in prompt[:2000]) % 40
+    confidence = 0.75 + seed / 200 if with_web else 0.45 + seed / 100
+    uncertain = [] if with_web or confidence >= 0.7 else ["使用技術の具体的なツール名"]
+    return {
+        "content_b": {item: f"{item}の実態推察（{'Web情報反映' if with_web else 'LLM推察'}）" for item in ITEMS},
+        "gap_analysis": {
+            item: "【差異】内容Aは簡潔、内容Bは具体的\n\n【不足情報】規模・頻度\n\n"
+                  "【採用部門へのヒアリング項目】\n1. チーム人数は？\n2. 予算規模は？\n3. 使用ツールは？"
+            for item in ITEMS
+        },
+        "confidence_score": round(min(confidence, 0.95), 2),
+        "uncertain_aspects": uncertain,
+        "reasoning": "スタンドインサーバーによる合成応答",
+    }
+
+
+def _layer3_reply(prompt: str) -> Dict[str, Any]:
+    data = _extract_json_block(prompt, "【データ】", "\n\n【タスク】") or {}
+    content_a = data.get("content_a", {}) if isinstance(data, dict) else {}
+    content_b = data.get("content_b", {}) if isinstance(data, dict) else {}
+    gap = data.get("gap_analysis", {}) if isinstance(data, dict) else {}
+    table = [["項目名", "内容A（求人票の記述）", "内容B（実態推察）", "ギャップ"]]
+    for item in ITEMS:
+        table.append([
+            item,
+            str(content_a.get(item, "記載なし")),
+            str(content_b.get(item, "")),
+            str(gap.get(item, "")),
+        ])
+    return {
+        "table_data": table,
+        "explanations": {item: f"{item}の読み方の解説です。" for item in ITEMS},
+        "how_to_read": "内容Aは求人票の文字面、内容Bは実態の推察、ギャップは確認すべき点です。",
+        "confidence_score": data.get("confidence_score", 0.0) if isinstance(data, dict) else 0.0,
+        "web_search_performed": bool(data.get("web_search_performed", False)) if isinstance(data, dict) else False,
+        "a_comments": {item: "" for item in ITEMS},
+    }
+
+
+def _modification_reply(prompt: str) -> Dict[str, Any]:
+    current = (
+        _extract_json_block(prompt, "【現在の出力】", "\n\n【修正依頼】")
+        or _extract_json_block(prompt, "【現在の出力】", "\n\n【要求】")
+        or {}
+    )
+    return {
+        "modified_output": current,
+        "changes_made": [{"item": "業務プロセス", "reason": "修正依頼を反映（スタンドイン）"}],
+    }
+
+
+def _category_profile_reply(prompt: str) -> Dict[str, Any]:
+    job_category = _extract_between(prompt, "【職種】", "【Web検索で得た情報】") or "この職種"
+    return {
+        "標準的な業務フロー": f"{job_category}の要件確認 → 計画 → 実施 → 振り返り",
+        "標準的な使用技術": "Excel、社内システム、業務に応じたSaaS",
+        "典型的なステークホルダー": "上長、関連部署、取引先",
+        "業界動向": "人材需要は堅調（スタンドインサーバーによる合成応答）",
+    }
+
+
+def synthesize_chat_reply(prompt: str) -> str:
+    """
+    プロンプトの種類（レイヤー・ステップ）を判別し、パイプラインが受理できる合成応答を返す
+
+    Args:
+        prompt: userメッセージ
+
+    Returns:
+        応答テキスト（QA以外はJSON文字列）
+    """
+    if "以下の求人票から、8項目" in prompt:
+        payload = _layer1_reply(prompt)
+    elif "【Web検索で得た追加情報】" in prompt:
+        payload = _layer2_reply(prompt, with_web=True)
+    elif "「真の姿（実態）」" in prompt:
+        payload = _layer2_reply(prompt, with_web=False)
+    elif "職種の業界標準プロファイル" in prompt:
+        payload = _category_profile_reply(prompt)
+    elif "新人リクルーター向けに最適化" in prompt:
+        payload = _layer3_reply(prompt)
+    elif "「使用技術」についての元の推察" in prompt:
+        payload = {
+            "1": {"tech": "Salesforce", "purpose": "商談・顧客情報の管理"},
+            "2": {"tech": "Tableau", "purpose": "売上データの可視化"},
+            "3": {"tech": "SQL", "purpose": "データ抽出"},
+        }
+    elif "【現在の出力】" in prompt:
+        payload = _modification_reply(prompt)
+    else:
+        return "スタンドインサーバーの回答です。（根拠: 役割）"
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def build_chat_completion(body: Dict[str, Any], chars_per_token: float = 2.0) -> Dict[str, Any]:
+    """chat.completions のリクエストボディから応答オブジェクト（dict）を生成"""
+    messages = body.get("messages", [])
+    prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    content = synthesize_chat_reply(prompt)
+    prompt_tokens = sum(estimate_tokens(m.get("content", ""), chars_per_token) for m in messages)
+    completion_tokens = estimate_tokens(content, chars_per_token)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock-model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def synthesize_search_results(params: Dict[str, Any], link_base: str = None) -> Dict[str, Any]:
+    """
+    SerpAPI の検索パラメータから organic_results 形式の合成応答を生成
+
+    Args:
+        params: SerpAPI のクエリパラメータ
+        link_base: 結果のリンク先（例: http://127.0.0.1:8765/pages）。省略時は example.com
+    """
+    query = str(params.get("q", ""))
+    try:
+        num = int(params.get("num") or 5)
+    except (TypeError, ValueError):
+        num = 5
+    results = []
+    for i in range(1, num + 1):
+        path = f"{zlib.crc32(query.encode('utf-8')) % 100000}/{i}"
+        results.append({
+            "position": i,
+            "title": f"{query} の解説 {i}",
+            "link": f"{link_base}/{path}?{urlencode({'q': query})}" if link_base else f"https://example.com/{path}",
+            "snippet": f"{query}について、一般的な業務の流れと使われるツールを紹介します。（合成結果 {i}）",
+        })
+    return {"search_metadata": {"status": "Success"}, "organic_results": results}
+
+
+def synthesize_page(query: str, index: int) -> str:
+    """検索結果のリンク先のフィクスチャページ（ナビゲーション・サイドバー・フッター付きの記事）"""
+    job = html.escape((query.split() or ["職種"])[0])
+    return f"""<!DOCTYPE html>
+<html lang="ja"><head><meta charset="utf-8"><title>{job}の仕事内容 {index}</title>
+<script>window.dataLayer = window.dataLayer || [];</script></head>
+<body class="has-sidebar">
+<header><nav><a href="/">トップ</a> <a href="/jobs">職種一覧</a> <a href="/tools">ツール比較</a> <a href="/login">ログイン</a></nav></header>
+<div class="breadcrumb"><a href="/">トップ</a> &gt; <a href="/jobs">職種一覧</a> &gt; {job}</div>
+<main><article>
+<h1>{job}の仕事内容と1日の流れ</h1>
+<p>{job}の業務は、依頼内容と目的の確認から始まり、計画の作成、関係部署との調整、実行、結果の振り返りという流れで進みます。（フィクスチャ {index}）</p>
+<p>日々の業務では Excel や Google スプレッドシートで数値を管理し、Slack や Teams で関係者と連絡を取ります。Salesforce などの業務システムに記録を残す職場も多くあります。</p>
+<p>{job}は社内の他部署や社外の取引先など、多くのステークホルダーと関わります。期限と品質を守るため、進捗の共有と早めの相談が重視されます。</p>
+<p><a href="/jobs/related1">{job}に向いている人の特徴とは？未経験からの転職方法を解説</a></p>
+</article></main>
+<aside class="sidebar"><h2>人気記事</h2><ul><li><a href="/r1">転職活動の始め方と進め方のポイントまとめ</a></li><li><a href="/r2">面接でよく聞かれる質問と回答例を徹底解説</a></li></ul></aside>
+<footer><p>Copyright 2026 Example Media. All rights reserved. 利用規約 プライバシーポリシー 運営会社</p></footer>
+</body></html>"""
+
+
+# ==================== サーバー状態 ====================
+class MockState:
+    """アップロードされたファイル・バッチ・受信したトレースの状態を保持"""
+
+    def __init__(self, batch_delay: float = 0.0, latency: float = 0.0):
+        self.batch_delay = batch_delay
+        self.latency = latency
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.spans: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def add_traces(self, payload: Dict[str, Any]) -> int:
+        """OTLP/JSON の ExportTraceServiceRequest からスパンを取り出して保持"""
+        spans = []
+        for resource_spans in payload.get("resourceSpans", []):
+            for scope_spans in resource_spans.get("scopeSpans", []):
+                spans.extend(scope_spans.get("spans", []))
+        with self.lock:
+            self.spans.extend(spans)
+        return len(spans)
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        meta = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self.lock:
+            self.files[file_id] = {"meta": meta, "content": content}
+        return meta
+
+    def create_batch(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body.get("endpoint", "/v1/chat/completions"),
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "in_progress_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": body.get("metadata"),
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        return batch
+
+    def retrieve_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.batch_delay:
+            self._complete_batch(batch)
+        return batch
+
+    def _complete_batch(self, batch: Dict[str, Any]) -> None:
+        """入力ファイルの各行を処理し、出力ファイル・エラーファイルを作成"""
+        source = self.files.get(batch["input_file_id"])
+        outputs, errors = [], []
+        for line in (source["content"].decode("utf-8").splitlines() if source else []):
+            if not line.strip():
+                continue
+            req = json.loads(line)
+            try:
+                response_body = build_chat_completion(req.get("body", {}))
+                outputs.append({
+                    "id": f"batch_req_{uuid.uuid4().hex[:16]}",
+                    "custom_id": req.get("custom_id"),
+                    "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": response_body},
+                    "error": None,
+                })
+            except Exception as e:
+                errors.append({
+                    "id": f"batch_req_{uuid.uuid4().hex[:16]}",
+                    "custom_id": req.get("custom_id"),
+                    "response": None,
+                    "error": {"code": "server_error", "message": str(e)},
+                })
+        out_meta = self.add_file(
+            "".join(json.dumps(o, ensure_ascii=False) + "\n" for o in outputs).encode("utf-8"),
+            f"{batch['id']}_output.jsonl", "batch_output"
+        )
+        batch["output_file_id"] = out_meta["id"]
+        if errors:
+            err_meta = self.add_file(
+                "".join(json.dumps(o, ensure_ascii=False) + "\n" for o in errors).encode("utf-8"),
+                f"{batch['id']}_errors.jsonl", "batch_output"
+            )
+            batch["error_file_id"] = err_meta["id"]
+        batch["request_counts"] = {
+            "total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)
+        }
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+
+# ==================== HTTPハンドラー ====================
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """OpenAI REST API のサブセットを処理するハンドラー"""
+
+    state: MockState = None  # サーバー起動時にクラス属性として注入
+
+    def log_message(self, format, *args):  # noqa: A002 - BaseHTTPRequestHandler のシグネチャに合わせる
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _parse_multipart(self, body: bytes) -> Tuple[Dict[str, str], Optional[Tuple[str, bytes]]]:
+        """multipart/form-data を (フィールド, (ファイル名, 内容)) に分解"""
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+        message = BytesParser(policy=HTTP).parsebytes(header + body)
+        fields, upload = {}, None
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            filename = part.get_filename()
+            payload = part.get_payload(decode=True) or b""
+            if filename:
+                upload = (filename, payload)
+            elif name:
+                fields[name] = payload.decode("utf-8")
+        return fields, upload
+
+    def do_POST(self):  # noqa: N802 - http.server の命名規約
+        path = self.path.split("?")[0].rstrip("/")
+        body = self._read_body()
+
+        if path.endswith("/chat/completions"):
+            if self.state.latency:
+                time.sleep(self.state.latency)
+            self._send_json(200, build_chat_completion(json.loads(body or b"{}")))
+        elif path.endswith("/files"):
+            fields, upload = self._parse_multipart(body)
+            if upload is None:
+                self._send_json(400, {"error": {"message": "file is required"}})
+                return
+            self._send_json(200, self.state.add_file(upload[1], upload[0], fields.get("purpose", "batch")))
+        elif path.endswith("/v1/traces"):
+            # OTLP/HTTP（JSON）のトレース受信（tracing.OTLPSpanExporter のスタンドイン）
+            self.state.add_traces(json.loads(body or b"{}"))
+            self._send_json(200, {"partialSuccess": {}})
+        elif path.endswith("/batches"):
+            payload = json.loads(body or b"{}")
+            if payload.get("input_file_id") not in self.state.files:
+                self._send_json(404, {"error": {"message": "input file not found"}})
+                return
+            self._send_json(200, self.state.create_batch(payload))
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path: {path}"}})
+
+    def do_GET(self):  # noqa: N802 - http.server の命名規約
+        path = self.path.split("?")[0].rstrip("/")
+
+        if path.endswith("/search"):
+            params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            self._send_json(200, synthesize_search_results(params, f"http://{self.headers.get('Host')}/pages"))
+            return
+
+        m = re.search(r"/pages/\d+/(\d+)$", path)
+        if m:
+            query = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+            data = synthesize_page(query, int(m.group(1))).encode("utf-8")
+            etag = f'"{hashlib.sha256(data).hexdigest()[:16]}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if path.endswith("/v1/traces"):
+            with self.state.lock:
+                spans = list(self.state.spans)
+            self._send_json(200, {"spans": spans})
+            return
+
+        m = re.search(r"/files/([^/]+)/content$", path)
+        if m:
+            entry = self.state.files.get(m.group(1))
+            if entry is None:
+                self._send_json(404, {"error": {"message": "file not found"}})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(entry["content"])))
+            self.end_headers()
+            self.wfile.write(entry["content"])
+            return
+
+        m = re.search(r"/batches/([^/]+)$", path)
+        if m:
+            batch = self.state.retrieve_batch(m.group(1))
+            if batch is None:
+                self._send_json(404, {"error": {"message": "batch not found"}})
+            else:
+                self._send_json(200, batch)
+            return
+
+        self._send_json(404, {"error": {"message": f"unknown path: {path}"}})
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, batch_delay: float = 0.0, latency: float = 0.0):
+    """
+    スタンドインサーバーをデーモンスレッドで起動
+
+    Args:
+        host: 待ち受けホスト
+        port: 待ち受けポート（0なら空きポートを自動選択）
+        batch_delay: バッチ作成から完了までの秒数
+        latency: chat.completions 1回あたりの応答遅延（秒）
+
+    Returns:
+        (server, base_url) のタプル。base_url は OPENAI_BASE_URL にそのまま設定でき、
+        SerpAPI互換エンドポイントは base_url の /v1 を /search に置き換えたURL
+    """
+    handler = type("BoundMockOpenAIHandler", (MockOpenAIHandler,), {"state": MockState(batch_delay, latency)})
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI互換のローカル・スタンドインサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="バッチ完了までの秒数")
+    parser.add_argument("--latency", type=float, default=0.0, help="chat.completions の応答遅延（秒）")
+    args = parser.parse_args()
+
+    handler = type("BoundMockOpenAIHandler", (MockOpenAIHandler,), {"state": MockState(args.batch_delay, args.latency)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Mock OpenAI server: http://{args.host}:{args.port}/v1")
+    print(f"Mock SerpAPI endpoint: http://{args.host}:{args.port}/search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+LLM呼び出しのモデル振り分け（2段構成）
+求人票からの構造化抽出（レイヤー①）や使用技術の箇条書き化など、推論の難しくないステップは小さいモデル
+（OPENAI_MODEL_SMALL）で実行し、レイヤー②の推論など品質に効くステップは OPENAI_MODEL のまま実行する。
+
+- 振り分け: 呼び出し時のステップタグ（telemetry.step。例: layer3.tech）を MODEL_ROUTES で small / large に対応づける。
+  完全一致 → 末尾の要素（tech）の順に引き、どちらにも無ければ large
+- 昇格: 小さいモデルの応答が検証に失敗した場合・自信度が低い場合は、大きいモデルで同じ呼び出しをやり直す
+  （utils.call_openai_routed。やり直しの回数は MODEL_ESCALATIONS に残る）
+- 計上: トークン記録に model / route / escalated を残し、料金はモデルごとの単価で計算する（telemetry_store）
+
+既定（MODEL_ROUTING_ENABLED=0）ではすべてのステップを OPENAI_MODEL で実行する。MODEL_ROUTING_ENABLED=1 で振り分けを有効にする。
+振り分けの設定は生成バージョン（result_store.generation_version）に含まれ、変えると保存済みの結果・チェックポイントは使われない。
+"""
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from telemetry import current_step
+
+ROUTE_SMALL = "small"
+ROUTE_LARGE = "large"
+
+_parsed: Tuple[str, Dict[str, str]] = ("", {})
+
+
+def routes() -> Dict[str, str]:
+    """MODEL_ROUTES（layer1=small,tech=small のようなカンマ区切り）をステップタグ → 振り分け先の辞書に変換"""
+    global _parsed
+    raw = Config.MODEL_ROUTES
+    if _parsed[0] != raw:
+        table = {}
+        for entry in raw.split(","):
+            key, _, route = entry.partition("=")
+            if key.strip() and route.strip() in (ROUTE_SMALL, ROUTE_LARGE):
+                table[key.strip()] = route.strip()
+        _parsed = (raw, table)
+    return _parsed[1]
+
+
+def route_for(step: Optional[str]) -> str:
+    """
+    ステップタグの振り分け先
+
+    Args:
+        step: ステップタグ（layer2.step1 など。None の場合は large）
+
+    Returns:
+        small | large
+    """
+    if not Config.MODEL_ROUTING_ENABLED or not step:
+        return ROUTE_LARGE
+    table = routes()
+    if step in table:
+        return table[step]
+    return table.get(step.rsplit(".", 1)[-1], ROUTE_LARGE)
+
+
+def model_for(route: str) -> str:
+    return Config.OPENAI_MODEL_SMALL if route == ROUTE_SMALL else Config.OPENAI_MODEL
+
+
+def models_in_use() -> List[str]:
+    """
+    生成で呼び出す可能性のあるモデル（OPENAI_MODEL と、振り分けが有効で small のステップがある場合は OPENAI_MODEL_SMALL）
+    """
+    models = [Config.OPENAI_MODEL]
+    if Config.MODEL_ROUTING_ENABLED and ROUTE_SMALL in routes().values() and Config.OPENAI_MODEL_SMALL not in models:
+        models.append(Config.OPENAI_MODEL_SMALL)
+    return models
+
+
+def resolve_model(step: Optional[str] = None) -> Tuple[str, str]:
+    """
+    呼び出しに使うモデル
+
+    Args:
+        step: ステップタグ（省略時は実行中のステップタグ）
+
+    Returns:
+        (振り分け先, モデル名) のタプル
+    """
+    route = route_for(step if step is not None else current_step())
+    return route, model_for(route)
+
+
+def route_of_model(model: Optional[str]) -> str:
+    """
+    記録済みのモデル名から振り分け先を逆引き（バッチ処理の記録など route を持たない記録用）
+    API の応答のモデル名には日付が付く（gpt-5-nano-2025-08-07 など）ため、前方一致でも判定する
+    """
+    small, large = Config.OPENAI_MODEL_SMALL, Config.OPENAI_MODEL
+    if not model or small == large or model == large:
+        return ROUTE_LARGE
+    return ROUTE_SMALL if model == small or model.startswith(f"{small}-") else ROUTE_LARGE
+
+
+def prices_for(model: Optional[str]) -> Tuple[float, float, float]:
+    """
+    モデルの単価（USD / 100万トークン）
+
+    Returns:
+        (入力, キャッシュヒットした入力, 出力) のタプル
+    """
+    if route_of_model(model) == ROUTE_SMALL:
+        return (Config.PRICE_SMALL_INPUT_PER_1M, Config.PRICE_SMALL_CACHED_INPUT_PER_1M, Config.PRICE_SMALL_OUTPUT_PER_1M)
+    return (Config.PRICE_INPUT_PER_1M, Config.PRICE_CACHED_INPUT_PER_1M, Config.PRICE_OUTPUT_PER_1M)
@@ -11,6 +11,7 @@ from utils import (
     parse_json_with_retry,
     logger
 )
+from telemetry import traced_run
 import re
 
 
@@ -97,6 +98,7 @@ def _build_template_modification_prompt(
     return prompt
 
 
+@traced_run("modification")
 def handle_modification_request(
     current_output: Dict[str, Any],
     user_request: str,
@@ -0,0 +1,261 @@
+"""
+類似求人の検出（MinHash + LSH）
+日付・給与レンジの変更や箇条書きの並べ替えだけの再掲載は、完全一致のキー（result_store）では見つからない。
+正規化した求人テキストの文字 n-gram（シングル）から MinHash 署名を作り、LSH のバケットで候補を絞り込んで、
+過去に生成した求人のうち類似度（Jaccard）が閾値以上のものを返す。
+
+索引は生成結果ストアと同じ SQLite（Config.RESULT_DB）に保存する:
+- posting_signatures: 保存キー → 署名（MinHash の最小値の配列）
+- lsh_buckets: (バンド番号, バンドのハッシュ) → 保存キー
+
+見つかった求人の成果物は pipeline.run_pipeline_delta でレイヤー②を再利用した差分再生成に使える。
+
+使い方（CLI）:
+    python near_duplicates.py rebuild          # 生成結果ストアの全件から索引を作り直す
+    python near_duplicates.py query --file posting.txt --category 経理
+"""
+import argparse
+import hashlib
+import sys
+import threading
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+from config import Config
+from metrics import NEAR_DUPLICATE_QUERIES
+from result_store import ResultStore, connect, generation_version, get_result_store, normalize_posting, result_key
+from utils import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posting_signatures (
+    result_key TEXT PRIMARY KEY,
+    job_category TEXT NOT NULL,
+    version TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    result_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_lsh_buckets ON lsh_buckets(band, bucket);
+CREATE INDEX IF NOT EXISTS idx_lsh_buckets_key ON lsh_buckets(result_key);
+"""
+
+# 署名の長さ = バンド数 × 1バンドの行数。類似度 s の組が候補に残る確率は 1 - (1 - s^ROWS)^BANDS
+# （16 × 8 では s=0.7 で約 60%、s=0.8 で約 94%、s=0.9 でほぼ 100%）
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+# ==================== MinHash ====================
+def shingles(job_text: str, size: int = None) -> Set[int]:
+    """
+    正規化した求人テキストの文字 n-gram（空白は除去）を 32bit ハッシュの集合にする
+    """
+    size = size or Config.NEAR_DUP_SHINGLE_SIZE
+    text = "".join(normalize_posting(job_text).split())
+    if len(text) <= size:
+        return {zlib.crc32(text.encode("utf-8"))} if text else set()
+    return {zlib.crc32(text[i:i + size].encode("utf-8")) for i in range(len(text) - size + 1)}
+
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """(a·x + b) mod p のハッシュ族で MinHash 署名を計算する（係数は固定シードで生成し、索引間で共通）"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: Set[int]) -> np.ndarray:
+        if not shingle_set:
+            return np.full(len(self.a), _MERSENNE_PRIME, dtype=np.uint32)
+        x = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set)) % _MERSENNE_PRIME
+        # a, x < 2^31 のため積は uint64 に収まる
+        hashed = (np.outer(x, self.a) + self.b) % _MERSENNE_PRIME
+        return hashed.min(axis=0).astype(np.uint32)
+
+
+def band_hashes(signature: np.ndarray) -> List[int]:
+    """署名をバンドに分け、各バンドを 63bit の整数にハッシュする（SQLite の INTEGER に収める）"""
+    hashes = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        digest = hashlib.blake2b(chunk, digest_size=8).digest()
+        hashes.append(int.from_bytes(digest, "big") >> 1)
+    return hashes
+
+
+def estimate_similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    return float(np.mean(sig_a == sig_b))
+
+
+# ==================== 索引 ====================
+class NearDuplicateIndex:
+    """LSH 索引（生成結果ストアと同じDBに保存）"""
+
+    def __init__(self, path: Path = None, store: ResultStore = None):
+        self.path = Path(path or Config.RESULT_DB)
+        self._conn = connect(self.path)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._hasher = MinHasher()
+        self._store = store
+
+    @property
+    def store(self) -> ResultStore:
+        return self._store or get_result_store()
+
+    def add(self, key: str, job_text: str, job_category: str, version: str = None) -> None:
+        """保存済みの結果を索引に登録（同じキーは置き換え）"""
+        signature = self._hasher.signature(shingles(job_text))
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM lsh_buckets WHERE result_key = ?", (key,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO posting_signatures (result_key, job_category, version, created_at, signature) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, job_category.strip(), version or generation_version(),
+                 datetime.now().isoformat(timespec="seconds"), signature.tobytes())
+            )
+            self._conn.executemany(
+                "INSERT INTO lsh_buckets (band, bucket, result_key) VALUES (?, ?, ?)",
+                [(band, bucket, key) for band, bucket in enumerate(band_hashes(signature))]
+            )
+
+    def query(
+        self,
+        job_text: str,
+        job_category: str,
+        threshold: float = None,
+        limit: int = 3
+    ) -> List[Dict[str, Any]]:
+        """
+        類似度が閾値以上の生成済み求人を探す（同じ職種名・同じ生成バージョンのみ。完全一致は除く）
+
+        Args:
+            job_text: 新しい求人テキスト
+            job_category: 職種名
+            threshold: 類似度の閾値（省略時は Config.NEAR_DUP_THRESHOLD）
+            limit: 返す件数の上限
+
+        Returns:
+            類似度の高い順の [{result_key, similarity, created_at}]
+        """
+        threshold = Config.NEAR_DUP_THRESHOLD if threshold is None else threshold
+        query_shingles = shingles(job_text)
+        signature = self._hasher.signature(query_shingles)
+        exact_key = result_key(job_text, job_category)
+        buckets = band_hashes(signature)
+
+        with self._lock:
+            placeholders = " OR ".join("(band = ? AND bucket = ?)" for _ in buckets)
+            params = [v for band, bucket in enumerate(buckets) for v in (band, bucket)]
+            rows = self._conn.execute(
+                f"SELECT DISTINCT s.result_key, s.signature, s.created_at FROM lsh_buckets b "
+                f"JOIN posting_signatures s ON s.result_key = b.result_key "
+                f"WHERE ({placeholders}) AND s.job_category = ? AND s.version = ?",
+                params + [job_category.strip(), generation_version()]
+            ).fetchall()
+
+        matches = []
+        for key, blob, created_at in rows:
+            if key == exact_key:
+                continue
+            # 署名の推定値で粗く絞り、保存済みテキストとの Jaccard 係数で確定する
+            if estimate_similarity(signature, np.frombuffer(blob, dtype=np.uint32)) < threshold - 0.1:
+                continue
+            artifacts = self.store.load_artifacts(key)
+            if not artifacts or not artifacts.get("job_text"):
+                continue
+            similarity = jaccard(query_shingles, shingles(artifacts["job_text"]))
+            if similarity >= threshold:
+                matches.append({"result_key": key, "similarity": round(similarity, 3), "created_at": created_at})
+
+        matches.sort(key=lambda m: m["similarity"], reverse=True)
+        NEAR_DUPLICATE_QUERIES.inc(result="match" if matches else "none")
+        return matches[:limit]
+
+    def rebuild(self) -> int:
+        """生成結果ストアの全件から索引を作り直す"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM lsh_buckets")
+            self._conn.execute("DELETE FROM posting_signatures")
+            rows = self._conn.execute("SELECT result_key, job_category, version FROM results").fetchall()
+        count = 0
+        for key, job_category, version in rows:
+            artifacts = self.store.load_artifacts(key)
+            if artifacts and artifacts.get("job_text"):
+                self.add(key, artifacts["job_text"], job_category, version)
+                count += 1
+        return count
+
+
+_index: Optional[NearDuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index() -> NearDuplicateIndex:
+    """プロセス共通の索引"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex()
+        return _index
+
+
+def find_similar(job_text: str, job_category: str) -> Optional[Dict[str, Any]]:
+    """
+    最も類似した生成済み求人を返す（無効・該当なし・検索失敗の場合は None）
+    """
+    if not Config.RESULT_STORE_ENABLED or not Config.NEAR_DUP_ENABLED:
+        return None
+    try:
+        matches = get_near_duplicate_index().query(job_text, job_category, limit=1)
+    except Exception as e:
+        logger.warning(f"類似求人の検索に失敗しました: {str(e)}")
+        return None
+    return matches[0] if matches else None
+
+
+# ==================== CLI ====================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="類似求人の索引（MinHash + LSH）")
+    parser.add_argument("--db", default=str(Config.RESULT_DB), help="結果DBのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="生成結果ストアの全件から索引を作り直す")
+    p_query = sub.add_parser("query", help="類似求人を検索")
+    p_query.add_argument("--file", required=True, help="求人テキストのファイル")
+    p_query.add_argument("--category", required=True, help="職種名")
+    p_query.add_argument("--threshold", type=float, default=None)
+    args = parser.parse_args()
+
+    index = NearDuplicateIndex(Path(args.db), store=ResultStore(Path(args.db)))
+    if args.command == "rebuild":
+        print(f"{index.rebuild()}件を索引に登録しました")
+        return
+    job_text = Path(args.file).read_text(encoding="utf-8")
+    matches = index.query(job_text, args.category, threshold=args.threshold, limit=10)
+    if not matches:
+        print("類似する求人は見つかりませんでした")
+        sys.exit(1)
+    for m in matches:
+        print(f"{m['result_key'][:12]}  similarity={m['similarity']:.3f}  created={m['created_at']}")
+
+
+if __name__ == "__main__":
+    main()
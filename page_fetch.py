@@ -0,0 +1,389 @@
+"""
+検索結果ページの取得と本文抽出（レイヤー② Step 2-3 のプロンプト用）
+Step 2-3 は検索結果のスニペット（100〜200文字）しか見ないため、自信度が上がらずに Web検索の1往復が無駄になることがある。
+検索ごとに上位 PAGE_FETCH_TOP_K 件のページを並列に取得して本文を抽出し、求人との関連度が高い段落を
+検索結果の passages に加える（context_packing がスニペットと合わせてトークン予算の範囲で選ぶ）。
+
+- 取得: 接続を再利用する requests.Session（http_client。リトライはしない）。全体の同時取得数は PAGE_FETCH_WORKERS、同じホストへは PAGE_FETCH_PER_HOST まで
+- 本文抽出: html.parser で script/style/nav/header/footer/aside やメニュー・サイドバー（class/id）を除き、
+  リンク文字の割合が高いブロック（関連記事・パンくず）を捨てる。main/article があればその中だけを使う
+- キャッシュ: data/pages/ に URL ごとの抽出済みテキストと ETag / Last-Modified を保存する。
+  PAGE_CACHE_TTL_HOURS の間は再取得せず、期限後は条件付きリクエストで再検証する（304 なら保存済みのテキストを使う）
+
+本番の検索（SEARCH_TRANSPORT=serpapi / record）にだけ適用する。mock_openai_server の /search は /pages/ のフィクスチャページへの
+リンクを返すため、SERPAPI_ENDPOINT をスタンドインサーバーに向けるとネットワーク無しで確認できる。
+
+使い方（CLI）:
+    python page_fetch.py extract https://example.com/article   # 抽出した本文を表示
+    python page_fetch.py clear                                  # ページキャッシュを削除
+"""
+import argparse
+import contextvars
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+from urllib.parse import urlparse
+
+import requests
+
+from config import Config
+from context_packing import posting_terms, relevance
+from http_client import build_session, request_timeout
+from local_search import tokenize
+from metrics import PAGE_FETCHES
+from tracing import start_span
+from utils import logger
+
+USER_AGENT = "Mozilla/5.0 (compatible; recruiter-system page fetcher)"
+
+# 本文として扱わない要素
+SKIP_TAGS = {
+    "script", "style", "noscript", "template", "svg", "iframe", "form", "button", "select",
+    "nav", "header", "footer", "aside",
+}
+# class / id にこれらを含む要素はメニュー・広告などとして除く
+_BOILERPLATE_PATTERN = re.compile(r"nav|menu|footer|header|sidebar|breadcrumb|comment|share|social|banner|\bads?\b|related|ranking")
+# テキストのまとまり（ブロック）の区切りになる要素
+BLOCK_TAGS = {
+    "p", "div", "li", "td", "th", "tr", "table", "ul", "ol", "dl", "dt", "dd", "br",
+    "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "main", "blockquote", "pre",
+}
+# この文字数未満のブロックは見出し・ボタン等とみなして捨てる
+MIN_BLOCK_CHARS = 25
+# リンク文字の割合がこの値以上のブロックはリンク集とみなして捨てる
+MAX_LINK_DENSITY = 0.5
+
+_META_CHARSET_PATTERN = re.compile(rb"<meta[^>]+charset=[\"']?([a-zA-Z0-9_\-]+)", re.IGNORECASE)
+
+
+# ==================== 本文抽出 ====================
+class _BlockParser(HTMLParser):
+    """HTMLをテキストのブロックに分解する（除外要素の中は読み飛ばす）"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        # (テキスト, リンク内の文字数, main/article の中か)
+        self.blocks: List[tuple] = []
+        self._parts: List[str] = []
+        self._link_chars = 0
+        self._in_link = 0
+        self._content_depth = 0
+        # 読み飛ばし中の要素名とその入れ子の深さ
+        self._skip_tag: Optional[str] = None
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag: str, attrs: List[tuple]) -> None:
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+            return
+        # body / main / article は class に sidebar 等を含んでも本文を含むため除かない
+        marker = "" if tag in ("html", "body", "main", "article") else " ".join(
+            value or "" for name, value in attrs if name in ("class", "id")
+        ).lower()
+        if tag in SKIP_TAGS or (marker and _BOILERPLATE_PATTERN.search(marker)):
+            self._flush()
+            self._skip_tag, self._skip_depth = tag, 1
+            return
+        if tag in BLOCK_TAGS:
+            self._flush()
+        if tag in ("main", "article"):
+            self._content_depth += 1
+        elif tag == "a":
+            self._in_link += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if self._skip_depth == 0:
+                    self._skip_tag = None
+            return
+        if tag in BLOCK_TAGS:
+            self._flush()
+        if tag in ("main", "article"):
+            self._content_depth = max(0, self._content_depth - 1)
+        elif tag == "a":
+            self._in_link = max(0, self._in_link - 1)
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_tag:
+            return
+        text = " ".join(data.split())
+        if not text:
+            return
+        self._parts.append(text)
+        if self._in_link:
+            self._link_chars += len(text)
+
+    def _flush(self) -> None:
+        if self._parts:
+            self.blocks.append((" ".join(self._parts), self._link_chars, self._content_depth > 0))
+        self._parts = []
+        self._link_chars = 0
+
+    def close(self) -> None:
+        super().close()
+        self._flush()
+
+
+def extract_main_text(html: str) -> str:
+    """
+    HTMLから本文を抽出（ナビゲーション・フッター・リンク集などの定型部分を除く）
+
+    Returns:
+        段落を空行で区切ったテキスト（本文が無い場合は空文字列）
+    """
+    parser = _BlockParser()
+    parser.feed(html)
+    parser.close()
+    blocks = [
+        (text, in_content) for text, link_chars, in_content in parser.blocks
+        if len(text) >= MIN_BLOCK_CHARS and link_chars / len(text) < MAX_LINK_DENSITY
+    ]
+    if any(in_content for _, in_content in blocks):
+        blocks = [b for b in blocks if b[1]]
+    return "\n\n".join(text for text, _ in blocks)
+
+
+def condense_passages(text: str, terms: Set[str], max_chars: int = None) -> str:
+    """
+    本文から求人との関連度が高い段落を max_chars 以内で選ぶ（本文中の順序で返す）
+
+    Args:
+        text: extract_main_text の出力
+        terms: 求人の語（context_packing.posting_terms。空の場合は先頭から選ぶ）
+        max_chars: 選ぶ段落の合計の最大文字数
+    """
+    max_chars = max_chars or Config.PAGE_PASSAGE_MAX_CHARS
+    paragraphs = [p for p in text.split("\n\n") if p.strip()]
+    if not paragraphs:
+        return ""
+    scores = [relevance(set(tokenize(p)), terms) for p in paragraphs]
+    # 関連度が同じなら先に出てくる段落を優先する
+    order = sorted(range(len(paragraphs)), key=lambda i: (-scores[i], i))
+    if terms and scores[order[0]] > 0:
+        order = [i for i in order if scores[i] > 0]
+
+    chosen, used = [], 0
+    for i in order:
+        paragraph = paragraphs[i][:max_chars]
+        if used + len(paragraph) > max_chars:
+            continue
+        chosen.append(i)
+        used += len(paragraph)
+    return "\n".join(paragraphs[i][:max_chars] for i in sorted(chosen))
+
+
+def _decode(body: bytes, response: requests.Response) -> str:
+    """Content-Type か meta タグの charset で復号（どちらも無ければ UTF-8）"""
+    encoding = None
+    if "charset=" in response.headers.get("Content-Type", "").lower():
+        encoding = response.encoding
+    if not encoding:
+        m = _META_CHARSET_PATTERN.search(body[:4096])
+        encoding = m.group(1).decode("ascii") if m else "utf-8"
+    try:
+        return body.decode(encoding, errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+# ==================== ページキャッシュ ====================
+class PageCache:
+    """URLごとの抽出済みテキストをJSONファイルで保存する（data/pages/<URLのハッシュ>.json）"""
+
+    def __init__(self, directory: Path = None):
+        self.directory = Path(directory or Config.PAGE_CACHE_DIR)
+
+    def _path(self, url: str) -> Path:
+        return self.directory / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """保存済みのエントリ {url, etag, last_modified, fetched_at, text}（無い・壊れている場合は None）"""
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, url: str, text: str, etag: str = None, last_modified: str = None) -> None:
+        entry = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": datetime.now().isoformat(timespec="seconds"),
+            "text": text,
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(url)
+        # 同じURLを並列に取得した場合でも壊れたファイルを読まないよう、一時ファイルから置き換える
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def clear(self) -> int:
+        count = 0
+        for path in self.directory.glob("*.json"):
+            path.unlink()
+            count += 1
+        return count
+
+
+# ==================== 取得 ====================
+class PageFetcher:
+    """検索結果ページを並列に取得して本文を抽出する（ホストごとの同時接続数を制限）"""
+
+    def __init__(self, cache: PageCache = None, session: requests.Session = None):
+        self.cache = cache or PageCache()
+        self.session = session or self._build_session()
+        self._host_limits: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _build_session() -> requests.Session:
+        # 取得できないページは他の結果で補えるため、リトライせずに諦める
+        session = build_session(pool_maxsize=Config.PAGE_FETCH_PER_HOST, retries=0)
+        session.headers.update({"User-Agent": USER_AGENT, "Accept": "text/html,application/xhtml+xml"})
+        return session
+
+    def _host_limit(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(Config.PAGE_FETCH_PER_HOST)
+            return self._host_limits[host]
+
+    def fetch(self, url: str) -> Optional[str]:
+        """
+        ページを取得して本文を返す（キャッシュの期限内は取得しない）
+
+        Returns:
+            抽出した本文（取得に失敗し、保存済みのテキストも無い場合は None）
+        """
+        entry = self.cache.get(url)
+        if entry and datetime.now() < datetime.fromisoformat(entry["fetched_at"]) + timedelta(hours=Config.PAGE_CACHE_TTL_HOURS):
+            PAGE_FETCHES.inc(result="cache")
+            return entry["text"]
+
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        timeout = request_timeout(Config.PAGE_FETCH_READ_TIMEOUT_SEC)
+        try:
+            with self._host_limit(url):
+                with self.session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+                    if response.status_code == 304 and entry:
+                        self.cache.put(url, entry["text"], entry.get("etag"), entry.get("last_modified"))
+                        PAGE_FETCHES.inc(result="not_modified")
+                        return entry["text"]
+                    response.raise_for_status()
+                    content_type = response.headers.get("Content-Type", "")
+                    if "html" not in content_type:
+                        raise ValueError(f"HTMLではありません（{content_type}）")
+                    body = b""
+                    for chunk in response.iter_content(chunk_size=65536):
+                        body += chunk
+                        if len(body) >= Config.PAGE_FETCH_MAX_BYTES:
+                            break
+                    text = extract_main_text(_decode(body, response))
+                    etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        except Exception as e:
+            PAGE_FETCHES.inc(result="error")
+            logger.warning(f"ページの取得に失敗しました: {url}: {str(e)}")
+            return entry["text"] if entry else None
+
+        try:
+            self.cache.put(url, text, etag, last_modified)
+        except OSError as e:
+            logger.warning(f"ページキャッシュの保存に失敗しました: {str(e)}")
+        PAGE_FETCHES.inc(result="fetched")
+        return text
+
+    def fetch_many(self, urls: Iterable[str]) -> Dict[str, Optional[str]]:
+        """複数のページを並列に取得（URL → 本文。失敗したURLは None）"""
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(Config.PAGE_FETCH_WORKERS, len(urls))) as pool:
+            # run ID 等のコンテキストを引き継いでログ・トレースを元の実行に紐づける
+            futures = {url: pool.submit(contextvars.copy_context().run, self.fetch, url) for url in urls}
+            return {url: future.result() for url, future in futures.items()}
+
+
+_fetcher: Optional[PageFetcher] = None
+_fetcher_lock = threading.Lock()
+
+
+def get_page_fetcher() -> PageFetcher:
+    """プロセス共通の取得クライアント（接続プールを共有する）"""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = PageFetcher()
+        return _fetcher
+
+
+def enrich_results(
+    sections: List[List[Dict[str, str]]],
+    structured_data: Optional[Dict[str, Any]] = None
+) -> List[List[Dict[str, str]]]:
+    """
+    検索ごとの上位のページを取得し、求人に関連する段落を passages として加える
+
+    Args:
+        sections: 検索ごとの結果のリスト
+        structured_data: レイヤー①の出力（段落の選択に使う）
+
+    Returns:
+        passages を加えた検索結果（無効な場合・取得できなかった結果はそのまま）
+    """
+    if not Config.PAGE_FETCH_ENABLED or Config.SEARCH_TRANSPORT not in ("serpapi", "record"):
+        return sections
+    urls = [
+        item["link"] for results in sections for item in results[:Config.PAGE_FETCH_TOP_K]
+        if item.get("link", "").startswith(("http://", "https://"))
+    ]
+    if not urls:
+        return sections
+
+    with start_span("layer2.page_fetch", urls=len(set(urls))) as span:
+        texts = get_page_fetcher().fetch_many(urls)
+        terms = posting_terms(structured_data)
+        passages = {url: condense_passages(text, terms) for url, text in texts.items() if text}
+        span.set_attributes(pages=len(passages))
+    logger.info(f"検索結果ページの取得: {len(passages)}/{len(texts)}件から段落を抽出しました")
+    return [
+        [{**item, "passages": passages[item["link"]]} if passages.get(item.get("link")) else item for item in results]
+        for results in sections
+    ]
+
+
+# ==================== CLI ====================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="検索結果ページの取得と本文抽出")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_extract = sub.add_parser("extract", help="ページを取得して抽出した本文を表示")
+    p_extract.add_argument("url")
+    sub.add_parser("clear", help="ページキャッシュを削除")
+    args = parser.parse_args()
+
+    if args.command == "clear":
+        print(f"{PageCache().clear()}件を削除しました")
+        return
+    text = PageFetcher().fetch(args.url)
+    print(text if text is not None else "取得に失敗しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+パイプライン実行
+求人構造化 → 業界標準比較 → 教育最適化をステージグラフ（stage_graph）として実行する（Streamlit UI・バッチ処理・ベンチマーク・負荷試験で共通）
+
+ステージ（入力 → 出力）:
+    layer1:     job_text → structured_data
+    step2_1:    structured_data, job_category → comparison_v1
+    search:     comparison_v1, job_category, structured_data → web_context, search_record（検索しない場合は None）
+    step2_3:    comparison_v1, web_context, search_record, structured_data, job_category → comparison
+    layer3:     comparison → layer3_draft
+    a_comments: layer3_draft, comparison → layer3_annotated    （tech と並行して実行）
+    tech:       layer3_draft → usage_tech                       （a_comments と並行して実行）
+    assemble:   layer3_annotated, usage_tech → final_output
+
+差分再生成（DELTA_GRAPH）は step2_1 / search / step2_3 の代わりに次のステージを使い、他は同じステージを共有する:
+    reuse_layer2: structured_data, seed_comparison → comparison（類似求人の比較結果の content_a を差し替える）
+
+各ステージの出力はチェックポイント（checkpoints）として保存し、途中で失敗した生成は続きから再開できる
+"""
+import copy
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from config import Config
+from utils import logger
+from telemetry import run_context
+from tracing import start_span
+from profiling import profiled
+from result_store import get_result_store, result_key
+from checkpoints import RunCheckpoints
+from near_duplicates import get_near_duplicate_index
+from resilience import get_admission_controller
+from stage_graph import CACHED, Stage, StageCallback, StageGraph, StageNotRunnableError
+from layer1 import layer1_extract_structure
+from layer2 import _integrate_web_search, _run_web_search, _step1_llm_only_comparison
+from layer3 import _find_usage_tech_row, _finalize_a_comments, _specialize_usage_tech, layer3_optimize_for_learning
+
+# 進捗通知: (進捗率0-100, 表示メッセージ)
+ProgressCallback = Callable[[int, str], None]
+
+
+def _notify(progress_callback: Optional[ProgressCallback], percent: int, message: str) -> None:
+    if progress_callback is not None:
+        progress_callback(percent, message)
+
+
+# ==================== ステージ ====================
+def _stage_layer1(job_text: str) -> Dict[str, Any]:
+    return {"structured_data": layer1_extract_structure(job_text)}
+
+
+@profiled("layer2")
+def _stage_step2_1(structured_data: Dict[str, Any], job_category: str) -> Dict[str, Any]:
+    logger.info("=" * 60)
+    logger.info(f"レイヤー②: 実態推察・ギャップ分析 開始（職種: {job_category}）")
+    try:
+        return {"comparison_v1": _step1_llm_only_comparison(structured_data, job_category)}
+    except Exception as e:
+        logger.error(f"レイヤー②でエラー発生: {str(e)}")
+        raise Exception(f"実態推察・ギャップ分析に失敗しました: {str(e)}")
+
+
+@profiled("layer2")
+def _stage_search(comparison_v1: Dict[str, Any], job_category: str, structured_data: Dict[str, Any]) -> Dict[str, Any]:
+    web_context, search_record = _run_web_search(comparison_v1, job_category, structured_data)
+    return {"web_context": web_context, "search_record": search_record}
+
+
+@profiled("layer2")
+def _stage_step2_3(
+    comparison_v1: Dict[str, Any],
+    web_context: Optional[str],
+    search_record: Optional[Dict[str, Any]],
+    structured_data: Dict[str, Any],
+    job_category: str
+) -> Dict[str, Any]:
+    try:
+        comparison = _integrate_web_search(comparison_v1, web_context, structured_data, job_category, search_record)
+        return {"comparison": comparison}
+    except Exception as e:
+        logger.error(f"レイヤー②でエラー発生: {str(e)}")
+        raise Exception(f"実態推察・ギャップ分析に失敗しました: {str(e)}")
+
+
+def _stage_layer3(comparison: Dict[str, Any]) -> Dict[str, Any]:
+    return {"layer3_draft": layer3_optimize_for_learning(comparison, finalize=False)}
+
+
+def _stage_a_comments(layer3_draft: Dict[str, Any], comparison: Dict[str, Any]) -> Dict[str, Any]:
+    return {"layer3_annotated": _finalize_a_comments(layer3_draft, comparison)}
+
+
+def _stage_tech(layer3_draft: Dict[str, Any]) -> Dict[str, Any]:
+    row = _find_usage_tech_row(_specialize_usage_tech(layer3_draft))
+    return {"usage_tech": row[2] if row else None}
+
+
+def _stage_assemble(layer3_annotated: Dict[str, Any], usage_tech: Optional[str]) -> Dict[str, Any]:
+    row = _find_usage_tech_row(layer3_annotated)
+    if row is not None and usage_tech is not None:
+        row[2] = usage_tech
+    return {"final_output": layer3_annotated}
+
+
+PIPELINE_GRAPH = StageGraph([
+    Stage("layer1", _stage_layer1, ["job_text"], ["structured_data"], layer="layer1",
+          label="レイヤー①", progress=10, message="⏳ レイヤー①: 求人情報を構造化しています..."),
+    Stage("step2_1", _stage_step2_1, ["structured_data", "job_category"], ["comparison_v1"], layer="layer2",
+          label="レイヤー②", progress=30, message="⏳ レイヤー②: 業界標準と比較しています..."),
+    Stage("search", _stage_search, ["comparison_v1", "job_category", "structured_data"], ["web_context", "search_record"],
+          layer="layer2", label="レイヤー②（Web検索）", progress=45, message="⏳ レイヤー②: Web検索の要否を判断しています..."),
+    Stage("step2_3", _stage_step2_3, ["comparison_v1", "web_context", "search_record", "structured_data", "job_category"],
+          ["comparison"], layer="layer2", label="レイヤー②（Web情報の統合）", progress=50),
+    Stage("layer3", _stage_layer3, ["comparison"], ["layer3_draft"], layer="layer3",
+          label="レイヤー③", progress=60, message="⏳ レイヤー③: 教育資料を生成しています..."),
+    Stage("a_comments", _stage_a_comments, ["layer3_draft", "comparison"], ["layer3_annotated"], layer="layer3",
+          label="レイヤー③（内容Aの補足）"),
+    Stage("tech", _stage_tech, ["layer3_draft"], ["usage_tech"], layer="layer3",
+          label="レイヤー③（使用技術）", progress=85, message="⏳ レイヤー③: 使用技術を整理しています..."),
+    Stage("assemble", _stage_assemble, ["layer3_annotated", "usage_tech"], ["final_output"], layer="layer3"),
+])
+
+
+def _stage_reuse_layer2(structured_data: Dict[str, Any], seed_comparison: Dict[str, Any]) -> Dict[str, Any]:
+    # 類似求人の比較結果のうち、求人側の内容だけ差し替える
+    seed_comparison["content_a"] = structured_data
+    return {"comparison": seed_comparison}
+
+
+# 差分再生成（run_pipeline_delta）: レイヤー②を類似求人の比較結果の差し替えに置き換えたグラフ
+DELTA_GRAPH = StageGraph([
+    PIPELINE_GRAPH.stages["layer1"],
+    Stage("reuse_layer2", _stage_reuse_layer2, ["structured_data", "seed_comparison"], ["comparison"], layer="layer2",
+          label="レイヤー②（類似求人の再利用）", progress=40, message="♻️ レイヤー②: 類似求人の比較結果を再利用しています..."),
+    *(PIPELINE_GRAPH.stages[name] for name in ("layer3", "a_comments", "tech", "assemble")),
+])
+
+
+def _stage_cache(key: str, job_category: str, run_id: str) -> Optional[RunCheckpoints]:
+    return RunCheckpoints(key, job_category=job_category, run_id=run_id) if Config.CHECKPOINT_ENABLED else None
+
+
+# ==================== 実行 ====================
+def run_pipeline(
+    job_text: str,
+    job_category: str,
+    progress_callback: Optional[ProgressCallback] = None,
+    run_id: Optional[str] = None,
+    save_result: bool = False,
+    resume: bool = False,
+    on_stage: Optional[StageCallback] = None
+) -> Dict[str, Any]:
+    """
+    求人票から最終出力を生成
+
+    Args:
+        job_text: 求人テキスト
+        job_category: 職種名
+        progress_callback: 進捗通知のコールバック（UIのプログレスバー更新などに使用）
+        run_id: 実行ID（省略時は自動採番。token_usage.log とログ行に記録される）
+        save_result: True の場合、最終出力と中間成果物を生成結果ストア（result_store）に保存する
+        resume: True の場合、前回の生成のチェックポイントのうち入力が同じステージは実行せずにその出力を使う
+        on_stage: ステージを実行するたびに呼ぶコールバック（ステージ名, レイヤー, 開始時刻, 終了時刻）
+
+    Returns:
+        最終出力データ
+
+    Raises:
+        OverloadedError: 処理中の生成が多い・OpenAI API が障害中で受け付けなかった場合（resilience）
+        Exception: いずれかのステージで失敗した場合（それまでのステージの出力はチェックポイントに残る）
+    """
+    key = result_key(job_text, job_category)
+
+    with run_context("pipeline", run_id=run_id, job_category=job_category) as current_run_id, \
+            get_admission_controller().admit(), \
+            start_span("generate", job_category=job_category, job_text_chars=len(job_text)) as span:
+        logger.info(f"パイプライン実行開始（run_id={current_run_id}）")
+        start_time = datetime.now()
+
+        # 再開時は入力のフィンガープリントが一致するステージをすべて再利用する（失敗したステージから実行される）
+        result = PIPELINE_GRAPH.run(
+            {"job_text": job_text, "job_category": job_category},
+            cache=_stage_cache(key, job_category, current_run_id),
+            reuse_cache=resume,
+            progress_callback=progress_callback,
+            on_stage=on_stage
+        )
+        final_output = result.values["final_output"]
+
+        # 完了
+        _notify(progress_callback, 100, "✅ 生成完了!")
+        reused = result.stages_with(CACHED)
+        if reused:
+            span.set_attribute("resumed_stages", ",".join(reused))
+            logger.info(f"前回のチェックポイントから再開しました（再利用: {', '.join(reused)}）")
+
+        # 処理時間計算
+        elapsed_time = (datetime.now() - start_time).total_seconds()
+        logger.info(f"総処理時間: {elapsed_time:.2f}秒")
+
+        if save_result:
+            _save_result(
+                job_text, job_category, final_output,
+                result.values["structured_data"], result.values["comparison"], current_run_id
+            )
+
+    return final_output
+
+
+def regenerate_layer3(
+    job_text: str,
+    job_category: str,
+    progress_callback: Optional[ProgressCallback] = None,
+    run_id: Optional[str] = None,
+    save_result: bool = False,
+    on_stage: Optional[StageCallback] = None
+) -> Dict[str, Any]:
+    """
+    レイヤー③だけを再生成（レイヤー①②はチェックポイントか生成結果ストアの出力を使う）
+
+    Args:
+        job_text: 求人テキスト
+        job_category: 職種名
+        progress_callback: 進捗通知のコールバック
+        run_id: 実行ID
+        save_result: True の場合、再生成した結果を生成結果ストアに保存する（修正履歴は消去される）
+        on_stage: ステージを実行するたびに呼ぶコールバック（ステージ名, レイヤー, 開始時刻, 終了時刻）
+
+    Returns:
+        最終出力データ
+
+    Raises:
+        OverloadedError: 処理中の生成が多い・OpenAI API が障害中で受け付けなかった場合（resilience）
+        Exception: レイヤー②の出力が見つからない場合、またはレイヤー③で失敗した場合
+    """
+    key = result_key(job_text, job_category)
+
+    with run_context("layer3_regen", run_id=run_id, job_category=job_category) as current_run_id, \
+            get_admission_controller().admit(), \
+            start_span("generate", job_category=job_category, job_text_chars=len(job_text), layer3_only=True):
+        logger.info(f"レイヤー③の再生成開始（run_id={current_run_id}, key={key[:12]}）")
+        start_time = datetime.now()
+
+        # チェックポイントが無い場合は生成結果ストアの中間成果物を使う
+        cache = _stage_cache(key, job_category, current_run_id)
+        seed = {}
+        if cache is None or cache.get("step2_3") is None:
+            saved = get_result_store().load_artifacts(key) or {}
+            # 類似求人の結果をそのまま使った結果は、レイヤー①②がこの求人のものではないため使わない
+            if saved.get("layer2") and not saved.get("source_key"):
+                seed = {
+                    "structured_data": saved.get("layer1") or saved["layer2"].get("content_a"),
+                    "comparison": saved["layer2"],
+                }
+
+        try:
+            result = PIPELINE_GRAPH.run(
+                {"job_text": job_text, "job_category": job_category},
+                seed=seed,
+                cache=cache,
+                force=["layer3"],
+                runnable=PIPELINE_GRAPH.downstream(["layer3"]),
+                progress_callback=progress_callback,
+                on_stage=on_stage
+            )
+        except StageNotRunnableError:
+            raise Exception("レイヤー③の再生成に必要なレイヤー②の結果が見つかりません。最初から生成してください")
+        final_output = result.values["final_output"]
+
+        _notify(progress_callback, 100, "✅ 生成完了!")
+
+        elapsed_time = (datetime.now() - start_time).total_seconds()
+        logger.info(f"総処理時間（レイヤー③の再生成）: {elapsed_time:.2f}秒")
+
+        if save_result:
+            _save_result(
+                job_text, job_category, final_output,
+                result.values["structured_data"], result.values["comparison"], current_run_id
+            )
+
+    return final_output
+
+
+def run_pipeline_delta(
+    job_text: str,
+    job_category: str,
+    seed_key: str,
+    progress_callback: Optional[ProgressCallback] = None,
+    run_id: Optional[str] = None,
+    save_result: bool = False,
+    on_stage: Optional[StageCallback] = None
+) -> Dict[str, Any]:
+    """
+    類似求人（near_duplicates で検出）の成果物を元に差分再生成
+    レイヤー①だけを新しい求人テキストで実行し、レイヤー②（業界標準との比較・Web検索）は類似求人の結果を再利用する。
+    レイヤー①の結果が類似求人と同じ場合はレイヤー③も省略し、類似求人の最終出力を使う。
+    DELTA_GRAPH を comparison まで実行し、レイヤー③が必要な場合は layer1 / reuse_layer2 の出力を事前投入して続きを実行する
+    （レイヤー①の結果を見てから省略を判断するため2回に分けている）。
+
+    Args:
+        job_text: 求人テキスト
+        job_category: 職種名
+        seed_key: 類似求人の保存キー（result_store）
+        progress_callback: 進捗通知のコールバック
+        run_id: 実行ID
+        save_result: True の場合、結果を新しい求人のキーで生成結果ストアに保存する
+        on_stage: ステージを実行するたびに呼ぶコールバック（ステージ名, レイヤー, 開始時刻, 終了時刻）
+
+    Returns:
+        最終出力データ
+
+    Raises:
+        OverloadedError: 処理中の生成が多い・OpenAI API が障害中で受け付けなかった場合（resilience）
+        Exception: 類似求人の成果物が見つからない場合、またはレイヤー①③で失敗した場合
+    """
+    key = result_key(job_text, job_category)
+    seed = get_result_store().load_artifacts(seed_key)
+    # 類似求人の結果をそのまま使った結果（source_key あり）は layer1 を持たないが、layer2 は元の求人のものを使える
+    if not seed or not seed.get("layer2"):
+        raise Exception("差分再生成の元になる類似求人の成果物が見つかりません")
+
+    with run_context("delta", run_id=run_id, job_category=job_category) as current_run_id, \
+            get_admission_controller().admit(), \
+            start_span("generate", job_category=job_category, job_text_chars=len(job_text), seed=seed_key[:12]) as span:
+        logger.info(f"差分再生成開始（run_id={current_run_id}, 類似求人={seed_key[:12]}）")
+        start_time = datetime.now()
+
+        # レイヤー①と、類似求人の比較結果の差し替えまでを実行
+        cache = _stage_cache(key, job_category, current_run_id)
+        inputs = {"job_text": job_text, "seed_comparison": seed["layer2"]}
+        upstream = DELTA_GRAPH.run(
+            inputs, cache=cache, reuse_cache=False, targets=["comparison"],
+            progress_callback=progress_callback, on_stage=on_stage
+        )
+        structured_data = upstream.values["structured_data"]
+        comparison_data = upstream.values["comparison"]
+
+        layer1_unchanged = seed.get("layer1") is not None and structured_data == seed["layer1"]
+        span.set_attribute("layer1_unchanged", layer1_unchanged)
+        if layer1_unchanged and seed.get("final_output"):
+            # 構造化の結果が同じなら、レイヤー③の出力もそのまま使える
+            logger.info("レイヤー①の結果が類似求人と同じため、レイヤー③を省略します")
+            final_output = copy.deepcopy(seed["final_output"])
+        else:
+            result = DELTA_GRAPH.run(
+                inputs, seed={"structured_data": structured_data, "comparison": comparison_data},
+                cache=cache, reuse_cache=False, progress_callback=progress_callback, on_stage=on_stage
+            )
+            final_output = result.values["final_output"]
+
+        _notify(progress_callback, 100, "✅ 生成完了!")
+
+        elapsed_time = (datetime.now() - start_time).total_seconds()
+        logger.info(f"総処理時間（差分再生成）: {elapsed_time:.2f}秒")
+
+        if save_result:
+            _save_result(job_text, job_category, final_output, structured_data, comparison_data, current_run_id)
+
+    return final_output
+
+
+def _save_result(
+    job_text: str,
+    job_category: str,
+    final_output: Dict[str, Any],
+    structured_data: Dict[str, Any],
+    comparison_data: Dict[str, Any],
+    run_id: str
+) -> None:
+    """生成結果ストアに保存し、類似求人の索引に登録（失敗しても生成結果は返すためログのみ）"""
+    try:
+        key = get_result_store().save(
+            job_text, job_category, final_output,
+            layer1=structured_data, layer2=comparison_data, run_id=run_id
+        )
+    except Exception as e:
+        logger.warning(f"生成結果の保存に失敗しました: {str(e)}")
+        return
+    try:
+        get_near_duplicate_index().add(key, job_text, job_category)
+    except Exception as e:
+        logger.warning(f"類似求人の索引への登録に失敗しました: {str(e)}")
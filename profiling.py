@@ -0,0 +1,333 @@
+"""
+プロファイリング
+各レイヤーと CPU 処理のヘルパー（JSON解析・表データ正規化・HTMLテーブル生成）を @profiled で包み、
+実行（run ID）単位でプロファイルを Config.PROFILE_DIR に出力する。
+
+モード（Config.PROFILE_MODE）:
+- off: 何もしない（デコレータは設定値を1回参照するだけ）
+- sample: 実行中のスレッドのスタックを PROFILE_INTERVAL_MS ごとに採取し、
+  flamegraph.pl / speedscope で読める collapsed stacks（stacks.collapsed）を出力する。
+  LLM・検索の待ち時間も含む実時間のプロファイル。オーバーヘッドが小さいため本番でも常時有効にできる
+- cprofile: ステージ（最も外側の @profiled）ごとに cProfile を取り、<ステージ名>.pstats を出力する。
+  cProfile はプロセス内で同時に1つしか動かせないため、他の実行がプロファイル中のステージは計測しない（開発用）
+- both: sample + cprofile
+
+PROFILE_SAMPLE_RATE（0〜1）の割合の実行だけをプロファイルする。
+
+使い方（CLI）:
+    python profiling.py list                     # 直近のプロファイル一覧
+    python profiling.py top --stage layer1       # 直近の pstats を合算して累積時間の上位を表示
+    python profiling.py collapse --last 20 > all.collapsed   # collapsed stacks を合算
+"""
+import argparse
+import contextvars
+import cProfile
+import functools
+import json
+import pstats
+import random
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+from config import Config
+
+MODES = ("off", "sample", "cprofile", "both")
+
+# 抽選済みでプロファイル対象外の実行を表す（入れ子の呼び出しで再抽選しない）
+_NOT_SAMPLED = object()
+
+_session: contextvars.ContextVar[Union["ProfileSession", object, None]] = contextvars.ContextVar("profile_session", default=None)
+
+# cProfile はプロセス内で同時に1つしか有効にできない
+_cprofile_lock = threading.Lock()
+
+
+# ==================== セッション ====================
+class ProfileSession:
+    """1実行ぶんのプロファイル（ステージごとの所要時間・pstats・スタックの採取結果）"""
+
+    def __init__(self, label: str, run_id: Optional[str], mode: str):
+        self.label = label
+        self.run_id = run_id
+        self.mode = mode
+        self.started_at = datetime.now()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        # スレッドごとの実行中ステージ（入れ子・再帰の検出用）
+        self._active: Dict[int, List[str]] = {}
+
+    @property
+    def sampling(self) -> bool:
+        return self.mode in ("sample", "both")
+
+    @property
+    def cprofiling(self) -> bool:
+        return self.mode in ("cprofile", "both")
+
+    def run_stage(self, stage: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+        thread_id = threading.get_ident()
+        with self._lock:
+            active = self._active.setdefault(thread_id, [])
+            outermost = not active
+            recursive = stage in active
+            active.append(stage)
+
+        profile = None
+        if outermost and self.cprofiling and _cprofile_lock.acquire(blocking=False):
+            profile = self.profiles.setdefault(stage, cProfile.Profile())
+        if outermost and self.sampling:
+            _sampler.register(thread_id, self, sys._getframe())
+
+        started = time.perf_counter()
+        try:
+            if profile is not None:
+                profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if profile is not None:
+                    profile.disable()
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if profile is not None:
+                _cprofile_lock.release()
+            if outermost and self.sampling:
+                _sampler.unregister(thread_id)
+            with self._lock:
+                active.pop()
+                if not active:
+                    del self._active[thread_id]
+                if not recursive:
+                    totals = self.stages.setdefault(stage, {"calls": 0, "total_ms": 0.0})
+                    totals["calls"] += 1
+                    totals["total_ms"] += elapsed_ms
+
+    def add_sample(self, stack: str) -> None:
+        with self._lock:
+            self.stacks[stack] += 1
+            self.samples += 1
+
+    def dump(self) -> Optional[Path]:
+        """Config.PROFILE_DIR/<run_id>_<label>/ に出力（ステージが1つも実行されなかった場合は出力しない）"""
+        if not self.stages:
+            return None
+        base = Path(Config.PROFILE_DIR)
+        out_dir = base / f"{self.run_id or datetime.now().strftime('%Y%m%d%H%M%S')}_{self.label}"
+        if out_dir.exists():
+            out_dir = out_dir.with_name(f"{out_dir.name}_{uuid.uuid4().hex[:6]}")
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        for stage, profile in self.profiles.items():
+            profile.dump_stats(str(out_dir / f"{stage}.pstats"))
+        if self.stacks:
+            lines = [f"{stack} {count}" for stack, count in sorted(self.stacks.items())]
+            (out_dir / "stacks.collapsed").write_text("\n".join(lines) + "\n", encoding="utf-8")
+        summary = {
+            "label": self.label,
+            "run_id": self.run_id,
+            "mode": self.mode,
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "interval_ms": Config.PROFILE_INTERVAL_MS if self.sampling else None,
+            "samples": self.samples,
+            "stages": {k: {"calls": v["calls"], "total_ms": round(v["total_ms"], 2)} for k, v in self.stages.items()},
+        }
+        (out_dir / "summary.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+        _prune(base, Config.PROFILE_KEEP)
+        return out_dir
+
+
+# ==================== スタック採取 ====================
+class _StackSampler:
+    """登録されたスレッドのスタックを一定間隔で採取するバックグラウンドスレッド"""
+
+    def __init__(self):
+        self._targets: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, thread_id: int, session: ProfileSession, root: FrameType) -> None:
+        with self._lock:
+            self._targets[thread_id] = (session, root)
+            self._wakeup.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def unregister(self, thread_id: int) -> None:
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                idle = not self._targets
+            if idle:
+                # 対象がない間は待機する（常時有効でもアイドル時に CPU を使わない）
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(Config.PROFILE_INTERVAL_MS / 1000)
+            with self._lock:
+                targets = dict(self._targets)
+            frames = sys._current_frames()
+            for thread_id, (session, root) in targets.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    session.add_sample(_collapse(frame, root, session.label))
+
+
+_sampler = _StackSampler()
+
+
+def _collapse(frame: Optional[FrameType], root: FrameType, label: str) -> str:
+    """frame から root（最も外側のステージ）までを「label;外側;…;内側」の形式にする"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename != __file__:
+            # collapsed 形式の区切り（; と空白）を含まない名前にする
+            name = f"{Path(code.co_filename).stem}:{code.co_name}"
+            names.append(name.replace(";", ":").replace(" ", "_"))
+        if frame is root:
+            break
+        frame = frame.f_back
+    names.append(label)
+    return ";".join(reversed(names))
+
+
+def _prune(base: Path, keep: int) -> None:
+    """古いプロファイルを削除して keep 件に保つ"""
+    if keep <= 0:
+        return
+    dirs = sorted((p for p in base.iterdir() if p.is_dir()), key=lambda p: p.stat().st_mtime)
+    for old in dirs[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+# ==================== 公開API ====================
+def _should_profile() -> bool:
+    return Config.PROFILE_MODE != "off" and random.random() < Config.PROFILE_SAMPLE_RATE
+
+
+@contextmanager
+def profile_run(label: str, run_id: Optional[str] = None) -> Iterator[Optional[ProfileSession]]:
+    """
+    1実行をプロファイルの単位にする（抽選に外れた場合・無効の場合は何もしない）
+
+    Args:
+        label: 実行種別（pipeline / modification / qa など、出力先ディレクトリ名に使う）
+        run_id: 実行ID
+
+    Yields:
+        プロファイル中のセッション（対象外の場合は None）
+    """
+    if Config.PROFILE_MODE == "off" or _session.get() is not None:
+        yield None
+        return
+    session = ProfileSession(label, run_id, Config.PROFILE_MODE) if _should_profile() else None
+    token = _session.set(session or _NOT_SAMPLED)
+    try:
+        yield session
+    finally:
+        _session.reset(token)
+        if session is not None:
+            try:
+                session.dump()
+            except Exception as e:
+                from utils import logger
+                logger.warning(f"プロファイルの出力に失敗しました: {str(e)}")
+
+
+def profiled(stage: str) -> Callable:
+    """
+    関数をプロファイルのステージとして計測するデコレータ
+    実行（profile_run）の外で呼ばれた場合は、その呼び出し自体を1実行として抽選する
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if Config.PROFILE_MODE == "off":
+                return func(*args, **kwargs)
+            session = _session.get()
+            if session is _NOT_SAMPLED:
+                return func(*args, **kwargs)
+            if session is None:
+                from telemetry import current_run_id
+                with profile_run(stage, current_run_id()) as session:
+                    if session is None:
+                        return func(*args, **kwargs)
+                    return session.run_stage(stage, func, args, kwargs)
+            return session.run_stage(stage, func, args, kwargs)
+        return wrapper
+    return decorator
+
+
+# ==================== CLI ====================
+def _recent_dirs(last: int) -> List[Path]:
+    base = Path(Config.PROFILE_DIR)
+    if not base.exists():
+        return []
+    dirs = sorted((p for p in base.iterdir() if p.is_dir()), key=lambda p: p.stat().st_mtime)
+    return dirs[-last:]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="プロファイルの一覧・集計")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_list = sub.add_parser("list", help="直近のプロファイル一覧")
+    p_list.add_argument("--last", type=int, default=20)
+    p_top = sub.add_parser("top", help="pstats を合算して累積時間の上位を表示")
+    p_top.add_argument("--last", type=int, default=20)
+    p_top.add_argument("--stage", default=None, help="ステージ名（layer1 / parse_json など）")
+    p_top.add_argument("--limit", type=int, default=30)
+    p_top.add_argument("--sort", default="cumulative")
+    p_col = sub.add_parser("collapse", help="collapsed stacks を合算して標準出力へ")
+    p_col.add_argument("--last", type=int, default=20)
+    args = parser.parse_args()
+
+    dirs = _recent_dirs(args.last)
+    if args.command == "list":
+        for d in dirs:
+            summary_path = d / "summary.json"
+            if not summary_path.exists():
+                continue
+            summary = json.loads(summary_path.read_text(encoding="utf-8"))
+            stages = "  ".join(f"{k}={v['total_ms']:.0f}ms" for k, v in summary["stages"].items())
+            print(f"{d.name}  mode={summary['mode']}  samples={summary['samples']}  {stages}")
+    elif args.command == "top":
+        pattern = f"{args.stage}.pstats" if args.stage else "*.pstats"
+        files = [str(f) for d in dirs for f in sorted(d.glob(pattern))]
+        if not files:
+            print("pstats が見つかりません（PROFILE_MODE=cprofile または both で記録してください）")
+            sys.exit(1)
+        stats = pstats.Stats(*files)
+        stats.sort_stats(args.sort).print_stats(args.limit)
+    elif args.command == "collapse":
+        merged: Counter = Counter()
+        for d in dirs:
+            path = d / "stacks.collapsed"
+            if not path.exists():
+                continue
+            for line in path.read_text(encoding="utf-8").splitlines():
+                stack, _, count = line.rpartition(" ")
+                if stack:
+                    merged[stack] += int(count)
+        for stack, count in sorted(merged.items()):
+            print(f"{stack} {count}")
+
+
+if __name__ == "__main__":
+    main()
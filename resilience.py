@@ -0,0 +1,296 @@
+"""
+外部依存（OpenAI・SerpAPI）の障害時にプロセスの応答性を保つための仕組み
+
+- サーキットブレーカー: 依存先（openai:<モデル> / serpapi）ごとに直近 CIRCUIT_WINDOW_SEC 秒の呼び出しの失敗率を数え、
+  CIRCUIT_FAILURE_RATE 以上になったら CIRCUIT_OPEN_SEC 秒は呼び出さずに CircuitOpenError で即失敗させる（open）。
+  その後は CIRCUIT_HALF_OPEN_PROBES 件だけ試行を通し（half_open）、成功すれば元に戻し、失敗すれば再び open にする。
+  失敗として数えるのは依存先側の問題（接続エラー・タイムアウト・429・5xx）だけで、リクエスト内容の誤りは数えない
+- 流量制限: 同時に実行する生成を ADMISSION_MAX_IN_FLIGHT 件までに抑え、超えた分は ADMISSION_MAX_QUEUED 件まで待たせる。
+  それ以上の生成・待ち時間切れ・生成で使うモデル（model_routing.models_in_use）のいずれかのブレーカーが開いている間の生成は
+  OverloadedError で受け付けない
+
+状態はプロセス内のメモリに持つ（Streamlit のセッション間で共有される）。
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Tuple
+
+from config import Config
+from metrics import (
+    ADMISSION,
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUED,
+    CIRCUIT_REJECTED,
+    CIRCUIT_STATE,
+)
+from model_routing import models_in_use
+from utils import logger
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# 依存先側の問題とみなすエラー（openai SDK の例外クラス名・応答メッセージ・requests の例外クラス名）
+_FAILURE_TYPES = (
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    "ConnectionError", "ConnectTimeout", "ReadTimeout", "Timeout", "ConnectError", "TimeoutException",
+)
+_FAILURE_MARKERS = (
+    "rate_limit", "Error code: 429", "Error code: 500", "Error code: 502", "Error code: 503", "Error code: 504",
+    "server_error", "timed out", "Connection error",
+)
+
+
+class CircuitOpenError(Exception):
+    """ブレーカーが開いているため呼び出さなかった"""
+
+    def __init__(self, dependency: str, retry_after: float):
+        self.dependency = dependency
+        self.retry_after = retry_after
+        super().__init__(f"{dependency} は障害のため一時的に呼び出しを停止しています（約{retry_after:.0f}秒後に再開）")
+
+
+class OverloadedError(Exception):
+    """処理中の生成が多いため受け付けなかった"""
+
+
+def is_dependency_failure(error: BaseException) -> bool:
+    """依存先側の問題（ブレーカーで数える失敗）かどうか"""
+    if any(cls.__name__ in _FAILURE_TYPES for cls in type(error).__mro__):
+        return True
+    message = str(error)
+    return any(marker in message for marker in _FAILURE_MARKERS)
+
+
+# ==================== サーキットブレーカー ====================
+class CircuitBreaker:
+    """依存先1つ分のブレーカー（closed → open → half_open → closed）"""
+
+    def __init__(
+        self,
+        name: str,
+        window_sec: float = None,
+        min_calls: int = None,
+        failure_rate: float = None,
+        open_sec: float = None,
+        half_open_probes: int = None
+    ):
+        self.name = name
+        self.window_sec = Config.CIRCUIT_WINDOW_SEC if window_sec is None else window_sec
+        self.min_calls = Config.CIRCUIT_MIN_CALLS if min_calls is None else min_calls
+        self.failure_rate = Config.CIRCUIT_FAILURE_RATE if failure_rate is None else failure_rate
+        self.open_sec = Config.CIRCUIT_OPEN_SEC if open_sec is None else open_sec
+        self.half_open_probes = Config.CIRCUIT_HALF_OPEN_PROBES if half_open_probes is None else half_open_probes
+        self._lock = threading.Lock()
+        self._outcomes: Deque[Tuple[float, bool]] = deque()  # (時刻, 成功したか)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        CIRCUIT_STATE.set(0, dependency=name)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_sec:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        logger.warning(f"サーキットブレーカー {self.name}: {self._state} → {state}")
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self._probes = 0
+        if state == CLOSED:
+            self._outcomes.clear()
+        CIRCUIT_STATE.set(_STATE_VALUES[state], dependency=self.name)
+
+    def available(self) -> bool:
+        """呼び出しを通せる状態か（試行枠を消費しない）"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return state == CLOSED or (state == HALF_OPEN and self._probes < self.half_open_probes)
+
+    def before_call(self) -> None:
+        """
+        呼び出し前の確認（half_open の場合は試行枠を1つ使う）
+
+        Raises:
+            CircuitOpenError: ブレーカーが開いている（または試行枠が埋まっている）場合
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return
+            retry_after = max(0.0, self.open_sec - (now - self._opened_at)) if state == OPEN else 1.0
+        CIRCUIT_REJECTED.inc(dependency=self.name)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._current_state(time.monotonic()) == HALF_OPEN:
+                self._transition(CLOSED)
+                return
+            self._record(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self._current_state(time.monotonic()) == HALF_OPEN:
+                self._transition(OPEN)
+                return
+            self._record(False)
+            calls = len(self._outcomes)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                logger.warning(
+                    f"サーキットブレーカー {self.name}: 直近{self.window_sec:.0f}秒の失敗率 {failures}/{calls} のため"
+                    f"{self.open_sec:.0f}秒間呼び出しを停止します"
+                )
+                self._transition(OPEN)
+
+    def _record(self, ok: bool) -> None:
+        now = time.monotonic()
+        self._outcomes.append((now, ok))
+        while self._outcomes and now - self._outcomes[0][0] > self.window_sec:
+            self._outcomes.popleft()
+
+    def record(self, error: Optional[BaseException]) -> None:
+        """呼び出し結果を記録（依存先側の問題でないエラーは成功として数える）"""
+        if error is not None and is_dependency_failure(error):
+            self.record_failure()
+        else:
+            self.record_success()
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """before_call → 呼び出し → 結果の記録 をまとめて行う"""
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            self.record(e)
+            raise
+        self.record_success()
+
+
+class _DisabledBreaker(CircuitBreaker):
+    """CIRCUIT_ENABLED=0 の場合のブレーカー（常に呼び出しを通す）"""
+
+    def available(self) -> bool:
+        return True
+
+    def before_call(self) -> None:
+        return None
+
+    def record_success(self) -> None:
+        return None
+
+    def record_failure(self) -> None:
+        return None
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """依存先ごとのプロセス共通のブレーカー（openai:<モデル> / serpapi）"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name) if Config.CIRCUIT_ENABLED else _DisabledBreaker(name)
+        return _breakers[name]
+
+
+def openai_breaker(model: str) -> CircuitBreaker:
+    return get_breaker(f"openai:{model}")
+
+
+# ==================== 流量制限 ====================
+class AdmissionController:
+    """同時に実行する生成の数を制限する（超えた分は件数・時間の上限付きで待たせる）"""
+
+    def __init__(self, max_in_flight: int = None, max_queued: int = None, queue_timeout: float = None):
+        self.max_in_flight = Config.ADMISSION_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        self.max_queued = Config.ADMISSION_MAX_QUEUED if max_queued is None else max_queued
+        self.queue_timeout = Config.ADMISSION_QUEUE_TIMEOUT_SEC if queue_timeout is None else queue_timeout
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        ADMISSION_IN_FLIGHT.set_function(lambda: self.in_flight)
+        ADMISSION_QUEUED.set_function(lambda: self.queued)
+
+    def acquire(self) -> None:
+        """
+        実行枠を1つ確保（空くまで待つ）
+
+        Raises:
+            OverloadedError: 待ち行列が満杯の場合・待ち時間が上限を超えた場合・生成で使うモデルのブレーカーが開いている場合
+        """
+        for model in models_in_use():
+            if not openai_breaker(model).available():
+                ADMISSION.inc(result="rejected")
+                raise OverloadedError(
+                    f"OpenAI API（{model}）の障害のため、現在は新しい生成を受け付けていません。しばらくしてから再度お試しください"
+                )
+        with self._cond:
+            if self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                ADMISSION.inc(result="admitted")
+                return
+            if self.queued >= self.max_queued:
+                ADMISSION.inc(result="rejected")
+                raise OverloadedError(
+                    f"処理中の生成が多いため受け付けられませんでした（実行中 {self.in_flight}件・待ち {self.queued}件）。"
+                    "しばらくしてから再度お試しください"
+                )
+            ADMISSION.inc(result="queued")
+            self.queued += 1
+            logger.info(f"生成の実行枠が空くのを待ちます（実行中 {self.in_flight}件・待ち {self.queued}件）")
+            try:
+                if not self._cond.wait_for(lambda: self.in_flight < self.max_in_flight, timeout=self.queue_timeout):
+                    ADMISSION.inc(result="rejected")
+                    raise OverloadedError(
+                        f"{self.queue_timeout:.0f}秒待っても実行枠が空かなかったため中止しました。しばらくしてから再度お試しください"
+                    )
+                self.in_flight += 1
+            finally:
+                self.queued -= 1
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+_admission: Optional[AdmissionController] = None
+_admission_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """プロセス共通の流量制限"""
+    global _admission
+    with _admission_lock:
+        if _admission is None:
+            _admission = AdmissionController()
+        return _admission
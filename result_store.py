@@ -0,0 +1,387 @@
+"""
+生成結果ストア（SQLite）
+求人票（正規化したテキストのハッシュ）+ 職種名 + 生成バージョン（設定値・プロンプトのハッシュ）をキーに、
+最終出力・中間成果物（レイヤー①の構造化データ、レイヤー②の比較データ）・修正履歴を保存する。
+JSON は zlib で圧縮して BLOB 列に格納する。
+
+UI は生成前に lookup() で保存済みの結果を探し、見つかった場合は LLM を呼ばずに表示する。
+プロンプト（layer1.py / layer2.py / layer3.py）・プロンプトに入る内容を作るモジュール（職種ナレッジ・検索結果の圧縮・ページ本文の抽出など）や
+生成に関わる設定値を変更するとバージョンが変わり、古い結果・チェックポイントは使われない。それ以外の変更で出力が変わる場合は GENERATION_REVISION を上げる。
+
+使い方（CLI）:
+    python result_store.py list --limit 20          # 保存済みの結果
+    python result_store.py show <result_key>        # 1件の詳細（修正履歴を含む）
+    python result_store.py purge --days 90          # 最終参照から90日以上経った結果を削除
+"""
+import argparse
+import functools
+import hashlib
+import json
+import re
+import sqlite3
+import sys
+import threading
+import unicodedata
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import Config
+from metrics import RESULT_STORE_LOOKUPS
+from utils import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    result_key TEXT PRIMARY KEY,
+    posting_hash TEXT NOT NULL,
+    job_category TEXT NOT NULL,
+    version TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    last_accessed_at TEXT,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    run_id TEXT,
+    revision INTEGER NOT NULL DEFAULT 0,
+    job_text BLOB,
+    layer1 BLOB,
+    layer2 BLOB,
+    final_output BLOB NOT NULL,
+    current_output BLOB NOT NULL,
+    source_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_posting ON results(posting_hash, job_category);
+CREATE INDEX IF NOT EXISTS idx_results_accessed ON results(last_accessed_at);
+
+CREATE TABLE IF NOT EXISTS modifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    result_key TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    run_id TEXT,
+    request TEXT,
+    changes BLOB,
+    output BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_modifications_key ON modifications(result_key, revision);
+"""
+
+# 生成バージョンに含める設定値（出力に影響するもの）
+VERSION_CONFIG_KEYS = (
+    "OPENAI_MODEL", "OPENAI_MODEL_SMALL", "MODEL_ROUTING_ENABLED", "MODEL_ROUTES", "MODEL_ESCALATE_CONFIDENCE",
+    "TEMP_LAYER1", "TEMP_LAYER2", "TEMP_LAYER3",
+    "MAX_TOKENS_LAYER1", "MAX_TOKENS_LAYER2", "MAX_TOKENS_LAYER3",
+    "CONFIDENCE_THRESHOLD", "MAX_SEARCH_RESULTS", "WEB_CONTEXT_MAX_CHARS", "PROMPT_FIELD_MAX_CHARS",
+    "TECH_BLACKLIST", "TECH_DEFAULT_COUNT", "TECH_FOCUS_DEFAULT",
+    # 検索結果の圧縮・ページ本文の抽出（プロンプトに入る Web 情報）
+    "WEB_CONTEXT_TOKEN_BUDGET", "CONTEXT_CHARS_PER_TOKEN", "CONTEXT_DEDUP_THRESHOLD",
+    "PAGE_FETCH_ENABLED", "PAGE_FETCH_TOP_K", "PAGE_FETCH_MAX_BYTES", "PAGE_PASSAGE_MAX_CHARS",
+    # 職種ナレッジ（Step 2-1 のプロンプトに入る業界標準プロファイル）・検索の実行判断
+    "KNOWLEDGE_CACHE_ENABLED", "KNOWLEDGE_PROFILE_MAX_CHARS", "MAX_TOKENS_KNOWLEDGE_PROFILE",
+    "SEARCH_POLICY_ENABLED", "LOCAL_SEARCH_FALLBACK",
+)
+# 生成バージョンに含めるモジュール（プロンプトの定義と、プロンプトに入る内容を作るもの）
+PROMPT_MODULES = (
+    "layer1.py", "layer2.py", "layer3.py",
+    "category_knowledge.py", "context_packing.py", "page_fetch.py", "serpapi_utils.py", "local_search.py",
+)
+# 上記以外の変更（utils の表の正規化など）で出力が変わる場合に上げる
+GENERATION_REVISION = 1
+
+
+# ==================== キー ====================
+def normalize_posting(job_text: str) -> str:
+    """
+    求人テキストを正規化（全角/半角・改行コード・行末空白・連続する空行の違いを吸収）
+    """
+    text = unicodedata.normalize("NFKC", job_text).replace("\r\n", "\n").replace("\r", "\n")
+    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def posting_hash(job_text: str) -> str:
+    return hashlib.sha256(normalize_posting(job_text).encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=1)
+def generation_version() -> str:
+    """
+    生成バージョン（出力に影響する設定値・プロンプトに関わるモジュールの内容・GENERATION_REVISION のハッシュ）
+
+    Returns:
+        16桁の16進文字列
+    """
+    digest = hashlib.sha256()
+    config_values = {key: getattr(Config, key, None) for key in VERSION_CONFIG_KEYS}
+    config_values["GENERATION_REVISION"] = GENERATION_REVISION
+    digest.update(json.dumps(config_values, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    for name in PROMPT_MODULES:
+        path = Config.BASE_DIR / name
+        digest.update(name.encode("utf-8"))
+        if path.exists():
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def result_key(job_text: str, job_category: str, version: str = None) -> str:
+    """
+    保存キー（求人ハッシュ + 職種名 + 生成バージョン）
+
+    Args:
+        job_text: 求人テキスト
+        job_category: 職種名
+        version: 生成バージョン（省略時は現在の generation_version()）
+    """
+    version = version or generation_version()
+    material = f"{posting_hash(job_text)}|{job_category.strip()}|{version}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _pack(value: Any) -> Optional[bytes]:
+    if value is None:
+        return None
+    return zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), 6)
+
+
+def _unpack(blob: Optional[bytes]) -> Any:
+    if blob is None:
+        return None
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+# ==================== ストア ====================
+def connect(path: Path = None) -> sqlite3.Connection:
+    """WALモードで接続し、スキーマを作成"""
+    path = Path(path or Config.RESULT_DB)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(results)")}
+    if "source_key" not in columns:
+        conn.execute("ALTER TABLE results ADD COLUMN source_key TEXT")
+    return conn
+
+
+class ResultStore:
+    """生成結果の保存・参照（1接続をロックで共有する）"""
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path or Config.RESULT_DB)
+        self._conn = connect(self.path)
+        self._lock = threading.Lock()
+
+    def lookup(self, job_text: str, job_category: str) -> Optional[Dict[str, Any]]:
+        """
+        保存済みの結果を探す（見つかった場合は参照回数・最終参照時刻を更新）
+
+        Returns:
+            result_key / output（修正反映後の最新出力）/ revision / modifications（修正履歴）/ created_at / run_id。
+            見つからない場合は None
+        """
+        key = result_key(job_text, job_category)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT current_output, revision, created_at, run_id FROM results WHERE result_key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                RESULT_STORE_LOOKUPS.inc(result="miss")
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE results SET hit_count = hit_count + 1, last_accessed_at = ? WHERE result_key = ?",
+                    (_now(), key)
+                )
+            history = self._history(key)
+        RESULT_STORE_LOOKUPS.inc(result="hit")
+        return {
+            "result_key": key,
+            "output": _unpack(row[0]),
+            "revision": row[1],
+            "created_at": row[2],
+            "run_id": row[3],
+            "modifications": history,
+        }
+
+    def save(
+        self,
+        job_text: str,
+        job_category: str,
+        final_output: Dict[str, Any],
+        layer1: Optional[Dict[str, Any]] = None,
+        layer2: Optional[Dict[str, Any]] = None,
+        run_id: Optional[str] = None,
+        source_key: Optional[str] = None
+    ) -> str:
+        """
+        生成結果を保存（同じキーの結果があれば置き換え、修正履歴も消去する）
+
+        Args:
+            source_key: 類似求人の結果をそのまま使った場合の、元の結果の保存キー
+                （layer2 は元の求人のもの。layer1 はこの求人のものではないため保存しない）
+
+        Returns:
+            保存キー
+        """
+        key = result_key(job_text, job_category)
+        now = _now()
+        packed_output = _pack(final_output)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM modifications WHERE result_key = ?", (key,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (result_key, posting_hash, job_category, version, created_at, updated_at, "
+                "last_accessed_at, hit_count, run_id, revision, job_text, layer1, layer2, final_output, current_output, source_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, 0, ?, ?, ?, ?, ?, ?)",
+                (key, posting_hash(job_text), job_category.strip(), generation_version(), now, now, now, run_id,
+                 _pack(job_text), _pack(layer1), _pack(layer2), packed_output, packed_output, source_key)
+            )
+        logger.info(f"生成結果を保存しました（key={key[:12]}）")
+        return key
+
+    def add_modification(
+        self,
+        key: str,
+        request: str,
+        changes: List[Dict[str, Any]],
+        modified_output: Dict[str, Any],
+        run_id: Optional[str] = None
+    ) -> Optional[int]:
+        """
+        修正結果を履歴に追加し、最新出力を更新
+
+        Returns:
+            修正後のリビジョン番号（保存済みの結果が無い場合は None）
+        """
+        now = _now()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT revision FROM results WHERE result_key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            revision = row[0] + 1
+            packed_output = _pack(modified_output)
+            self._conn.execute(
+                "INSERT INTO modifications (result_key, revision, created_at, run_id, request, changes, output) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, revision, now, run_id, request, _pack(changes), packed_output)
+            )
+            self._conn.execute(
+                "UPDATE results SET current_output = ?, revision = ?, updated_at = ? WHERE result_key = ?",
+                (packed_output, revision, now, key)
+            )
+        return revision
+
+    def load_artifacts(self, key: str) -> Optional[Dict[str, Any]]:
+        """中間成果物（job_text / layer1 / layer2 / final_output / current_output / source_key）を取得"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_text, layer1, layer2, final_output, current_output, source_key FROM results WHERE result_key = ?",
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_text": _unpack(row[0]),
+            "layer1": _unpack(row[1]),
+            "layer2": _unpack(row[2]),
+            "final_output": _unpack(row[3]),
+            "current_output": _unpack(row[4]),
+            "source_key": row[5],
+        }
+
+    def history(self, key: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._history(key)
+
+    def _history(self, key: str) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            "SELECT revision, created_at, request, changes FROM modifications WHERE result_key = ? ORDER BY revision",
+            (key,)
+        ).fetchall()
+        return [
+            {"revision": r[0], "timestamp": r[1], "request": r[2], "changes": _unpack(r[3]) or []}
+            for r in rows
+        ]
+
+    def list_results(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT result_key, job_category, version, created_at, last_accessed_at, hit_count, revision, "
+                "LENGTH(final_output) + IFNULL(LENGTH(layer1), 0) + IFNULL(LENGTH(layer2), 0) AS bytes "
+                "FROM results ORDER BY updated_at DESC LIMIT ?",
+                (limit,)
+            )
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def find_keys(self, prefix: str) -> List[str]:
+        """保存キーを先頭一致で検索（CLI で短縮キーを使うため）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result_key FROM results WHERE result_key LIKE ? LIMIT 2", (prefix + "%",)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def purge(self, days: int) -> int:
+        """最終参照から days 日以上経った結果を削除"""
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            keys = [r[0] for r in self._conn.execute(
+                "SELECT result_key FROM results WHERE IFNULL(last_accessed_at, created_at) < ?", (cutoff,)
+            ).fetchall()]
+            for key in keys:
+                self._conn.execute("DELETE FROM modifications WHERE result_key = ?", (key,))
+                self._conn.execute("DELETE FROM results WHERE result_key = ?", (key,))
+        return len(keys)
+
+
+_store: Optional[ResultStore] = None
+_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """プロセス共通のストア"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore()
+        return _store
+
+
+# ==================== CLI ====================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="生成結果ストアの一覧・参照・削除")
+    parser.add_argument("--db", default=str(Config.RESULT_DB), help="結果DBのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_list = sub.add_parser("list", help="保存済みの結果")
+    p_list.add_argument("--limit", type=int, default=20)
+    p_show = sub.add_parser("show", help="1件の詳細")
+    p_show.add_argument("result_key")
+    p_purge = sub.add_parser("purge", help="古い結果を削除")
+    p_purge.add_argument("--days", type=int, default=90)
+    args = parser.parse_args()
+
+    store = ResultStore(Path(args.db))
+    if args.command == "list":
+        for r in store.list_results(args.limit):
+            print(f"{r['result_key'][:12]}  {r['job_category']:<16} version={r['version']}  created={r['created_at']}  "
+                  f"accessed={r['last_accessed_at']}  hits={r['hit_count']}  rev={r['revision']}  bytes={r['bytes']}")
+    elif args.command == "show":
+        matches = store.find_keys(args.result_key)
+        if len(matches) != 1:
+            print("該当する結果が見つからないか、複数に一致しました")
+            sys.exit(1)
+        artifacts = store.load_artifacts(matches[0])
+        print(json.dumps({**artifacts, "modifications": store.history(matches[0])}, ensure_ascii=False, indent=2))
+    else:
+        print(f"{store.purge(args.days)}件を削除しました")
+
+
+if __name__ == "__main__":
+    main()
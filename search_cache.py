@@ -0,0 +1,304 @@
+"""
+SerpAPI 応答のディスクキャッシュ（SQLite）
+検索クエリは職種名からのテンプレート（「{職種} 業務フロー 標準的な流れ」など）のため、同じ職種では同じ検索が繰り返される。
+正規化したクエリ + 件数 + hl/gl/engine をキーに検索結果を保存し、有料の検索呼び出しとタイムアウト待ちを省く。
+
+- 有効期限内（SEARCH_CACHE_TTL_HOURS）: 保存済みの結果を返す（hit）
+- 期限切れ後 SEARCH_CACHE_STALE_HOURS 以内: 保存済みの結果をすぐ返し、バックグラウンドで再検索して更新する（stale）
+- 失敗・0件の結果: SEARCH_CACHE_NEGATIVE_TTL_SEC の間だけ保存し、その間は再検索しない（negative）。
+  保存する失敗は検索先が返した失敗（SearchFailure）だけで、ブレーカーによる即失敗やプロセス内のエラーは保存しない
+
+本番の検索（SEARCH_TRANSPORT=serpapi / record）にだけ適用する。mock / replay はもともとローカルで完結するため、
+ベンチマークの再現性を保つようにキャッシュを通さない。保存先は生成結果ストアと同じ SQLite（Config.RESULT_DB）。
+
+使い方（CLI）:
+    python search_cache.py stats              # 件数・参照回数
+    python search_cache.py purge              # 再利用できなくなったエントリを削除
+    python search_cache.py clear              # 全件削除
+"""
+import argparse
+import contextvars
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from metrics import SEARCH_CACHE_LOOKUPS
+from result_store import connect
+from tracing import set_attributes
+from utils import logger
+
+
+class SearchFailure(Exception):
+    """検索先の失敗（HTTPエラー・エラー応答・接続エラーなど）。ネガティブキャッシュに保存する"""
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_cache (
+    cache_key TEXT PRIMARY KEY,
+    query TEXT NOT NULL,
+    status TEXT NOT NULL,
+    results TEXT,
+    error TEXT,
+    fetched_at TEXT NOT NULL,
+    expires_at TEXT NOT NULL,
+    hit_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_search_cache_expires ON search_cache(expires_at);
+"""
+
+# キーに含める検索パラメータ（api_key は含めない）
+KEY_PARAMS = ("num", "hl", "gl", "engine")
+
+# 接続エラーのメッセージにはリクエストURL（api_key を含む）が入るため、保存前に伏せる
+_API_KEY_PATTERN = re.compile(r"api_key=[^&\s'\"]+")
+
+
+def normalize_query(query: str) -> str:
+    """検索クエリを正規化（全角/半角・連続する空白・大文字小文字の違いを吸収）"""
+    text = unicodedata.normalize("NFKC", query or "")
+    return " ".join(text.split()).lower()
+
+
+def cache_key(params: Dict[str, Any]) -> str:
+    """正規化したクエリ + 件数 + hl/gl/engine のハッシュ"""
+    material = {"q": normalize_query(str(params.get("q", "")))}
+    material.update({name: str(params.get(name, "")) for name in KEY_PARAMS})
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _now() -> datetime:
+    return datetime.now()
+
+
+class SearchCache:
+    """検索結果のキャッシュ（1接続をロックで共有する）"""
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path or Config.RESULT_DB)
+        self._conn = connect(self.path)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # 再検索を実行中のキー（同じクエリの再検索を重複して起動しない）
+        self._revalidating = set()
+
+    def get(self, key: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        キャッシュを参照
+
+        Returns:
+            (hit | stale | negative | miss, エントリ) のタプル。
+            エントリは {query, status, results, error, fetched_at}（miss の場合は None）
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT query, status, results, error, fetched_at, expires_at FROM search_cache WHERE cache_key = ?",
+                (key,)
+            ).fetchone()
+        if row is None:
+            return "miss", None
+        entry = {
+            "query": row[0],
+            "status": row[1],
+            "results": json.loads(row[2]) if row[2] else [],
+            "error": row[3],
+            "fetched_at": row[4],
+        }
+        now = _now()
+        expires_at = datetime.fromisoformat(row[5])
+        if now < expires_at:
+            # 0件の結果は失敗と同じ短い期限で保存しているため negative として数える
+            state = "hit" if entry["status"] == "ok" and entry["results"] else "negative"
+        elif entry["status"] == "ok" and entry["results"] and now < expires_at + timedelta(hours=Config.SEARCH_CACHE_STALE_HOURS):
+            state = "stale"
+        else:
+            return "miss", None
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE search_cache SET hit_count = hit_count + 1 WHERE cache_key = ?", (key,))
+        return state, entry
+
+    def put(self, key: str, query: str, results: List[Dict[str, str]]) -> None:
+        """成功した検索結果を保存（0件は失敗と同じ短い期限にする）"""
+        if results:
+            ttl = timedelta(hours=Config.SEARCH_CACHE_TTL_HOURS)
+        else:
+            ttl = timedelta(seconds=Config.SEARCH_CACHE_NEGATIVE_TTL_SEC)
+        self._write(key, query, "ok", json.dumps(results, ensure_ascii=False), None, ttl)
+
+    def put_error(self, key: str, query: str, error: str) -> None:
+        """失敗した検索を短い期限で保存（ネガティブキャッシュ）"""
+        error = _API_KEY_PATTERN.sub("api_key=***", error)
+        self._write(key, query, "error", None, error, timedelta(seconds=Config.SEARCH_CACHE_NEGATIVE_TTL_SEC))
+
+    def _write(self, key: str, query: str, status: str, results: Optional[str], error: Optional[str], ttl: timedelta) -> None:
+        now = _now()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO search_cache (cache_key, query, status, results, error, fetched_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(cache_key) DO UPDATE SET query = excluded.query, status = excluded.status, "
+                "results = excluded.results, error = excluded.error, fetched_at = excluded.fetched_at, "
+                "expires_at = excluded.expires_at",
+                (key, query, status, results, error,
+                 now.isoformat(timespec="seconds"), (now + ttl).isoformat(timespec="seconds"))
+            )
+
+    def revalidate_async(self, key: str, query: str, fetch: Callable[[], List[Dict[str, str]]]) -> None:
+        """
+        期限切れのエントリをバックグラウンドで再検索して更新（失敗時は保存済みの結果を残す）
+
+        Args:
+            key: キャッシュキー
+            query: 検索クエリ
+            fetch: 検索を実行して結果を返す関数
+        """
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def _run() -> None:
+            try:
+                self.put(key, query, fetch())
+                logger.info(f"検索キャッシュを更新しました: query='{query}'")
+            except Exception as e:
+                logger.warning(f"検索キャッシュの更新に失敗しました（保存済みの結果を使い続けます）: {str(e)}")
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        # run ID 等のコンテキストを引き継いでログ・トレースを元の実行に紐づける
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(_run,), name="search-cache-revalidate", daemon=True).start()
+
+    def all_results(self) -> List[List[Dict[str, str]]]:
+        """保存済みの成功した検索結果（期限切れを含む。local_search の索引に使う）"""
+        with self._lock:
+            rows = self._conn.execute("SELECT results FROM search_cache WHERE status = 'ok' AND results IS NOT NULL").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        now = _now().isoformat(timespec="seconds")
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*), SUM(status = 'ok'), SUM(status = 'error'), SUM(expires_at > ?), "
+                "COALESCE(SUM(hit_count), 0) FROM search_cache",
+                (now,)
+            ).fetchone()
+        return {"entries": row[0], "ok": row[1] or 0, "error": row[2] or 0, "fresh": row[3] or 0, "hits": row[4]}
+
+    def purge(self) -> int:
+        """再利用できなくなったエントリ（失敗は期限切れ、成功は stale の期間も過ぎたもの）を削除"""
+        now = _now()
+        stale_cutoff = (now - timedelta(hours=Config.SEARCH_CACHE_STALE_HOURS)).isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM search_cache WHERE (status != 'ok' AND expires_at < ?) OR expires_at < ?",
+                (now.isoformat(timespec="seconds"), stale_cutoff)
+            ).rowcount
+
+    def clear(self) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM search_cache").rowcount
+
+
+_cache: Optional[SearchCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_search_cache() -> Optional[SearchCache]:
+    """
+    プロセス共通のキャッシュ（無効な場合・mock / replay の場合は None）
+    """
+    global _cache
+    if not Config.SEARCH_CACHE_ENABLED or Config.SEARCH_TRANSPORT not in ("serpapi", "record"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SearchCache()
+        return _cache
+
+
+def cached_search(params: Dict[str, Any], fetch: Callable[[], List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    """
+    キャッシュを通して検索を実行
+
+    Args:
+        params: SerpAPI のクエリパラメータ
+        fetch: 検索を実行して結果を返す関数（失敗時は例外。検索先の失敗は SearchFailure）
+
+    Returns:
+        検索結果のリスト
+
+    Raises:
+        Exception: 検索に失敗した場合（ネガティブキャッシュの期限内は保存済みの失敗を再送出）。
+            SearchFailure 以外の例外（ブレーカーの即失敗など）はネガティブキャッシュに保存しない
+    """
+    cache = get_search_cache()
+    if cache is None:
+        return fetch()
+
+    query = str(params.get("q", ""))
+    key = cache_key(params)
+    try:
+        state, entry = cache.get(key)
+    except Exception as e:
+        logger.warning(f"検索キャッシュの参照に失敗しました: {str(e)}")
+        return fetch()
+    SEARCH_CACHE_LOOKUPS.inc(result=state)
+    set_attributes(search_cache=state)
+
+    if state == "hit":
+        logger.info(f"検索キャッシュを使用します: query='{query}'（取得日時: {entry['fetched_at']}）")
+        return entry["results"]
+    if state == "stale":
+        logger.info(f"期限切れの検索キャッシュを使用し、バックグラウンドで更新します: query='{query}'")
+        cache.revalidate_async(key, query, fetch)
+        return entry["results"]
+    if state == "negative":
+        if entry["status"] == "ok":
+            return entry["results"]
+        raise Exception(f"直近の検索が失敗したため再検索を見合わせます（{entry['fetched_at']}）: {entry['error']}")
+
+    try:
+        results = fetch()
+    except SearchFailure as e:
+        try:
+            cache.put_error(key, query, str(e))
+        except Exception as write_error:
+            logger.warning(f"検索キャッシュの保存に失敗しました: {str(write_error)}")
+        raise
+    try:
+        cache.put(key, query, results)
+    except Exception as e:
+        logger.warning(f"検索キャッシュの保存に失敗しました: {str(e)}")
+    return results
+
+
+# ==================== CLI ====================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SerpAPI 応答キャッシュの集計・削除")
+    parser.add_argument("--db", default=str(Config.RESULT_DB), help="結果DBのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="件数・参照回数")
+    sub.add_parser("purge", help="再利用できなくなったエントリを削除")
+    sub.add_parser("clear", help="全件削除")
+    args = parser.parse_args()
+
+    cache = SearchCache(Path(args.db))
+    if args.command == "stats":
+        s = cache.stats()
+        print(f"entries={s['entries']}  ok={s['ok']}  error={s['error']}  fresh={s['fresh']}  hits={s['hits']}")
+    elif args.command == "purge":
+        print(f"{cache.purge()}件を削除しました")
+    else:
+        print(f"{cache.clear()}件を削除しました")
+
+
+if __name__ == "__main__":
+    main()
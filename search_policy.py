@@ -0,0 +1,250 @@
+"""
+Web検索の実行判断（過去の自信度の上昇幅に基づく）
+レイヤー②の固定ルール（重要項目の不確実性・自信度が閾値未満）は、検索しても自信度がほとんど上がらない職種でも
+毎回 Step 2-3 の LLM 呼び出しと2回の検索を行っている。検索ごとに Step 2-1 → Step 2-3 の自信度の変化を
+職種 × 検索理由（重要項目名・低自信度）単位で記録し、次の方針で判断する:
+
+- 固定ルールで検索する場合: すべての理由で直近の平均上昇幅が SEARCH_POLICY_MIN_UPLIFT 未満なら検索を省く
+  （実績の無い理由が1つでもあれば検索する。SEARCH_POLICY_EXPLORE_RATE の割合で実績の更新のために検索する。
+  探索する求人は職種名と求人の内容のハッシュで決めるため、同じ求人では毎回同じ判断になる）
+- 固定ルールで検索しない場合: 自信度が閾値 + SEARCH_POLICY_PRIORITY_MARGIN 未満で、その職種の低自信度での
+  平均上昇幅が SEARCH_POLICY_PRIORITY_UPLIFT 以上なら検索する（検索理由は低自信度として記録する）
+
+記録するのは Web検索の結果があった検索だけ（SerpAPI の障害・ローカル検索での代替では自信度が上がらないため、
+障害の間に「検索しても効果が無い」と学習しないようにする）。
+
+実績は職種ごとに直近 SEARCH_POLICY_WINDOW 件を使い、SEARCH_POLICY_MIN_SAMPLES 件に満たない場合は全職種の実績を使う。
+本番の LLM（LLM_TRANSPORT=openai / record）にだけ適用する（合成応答の自信度の変化は実績にならないため）。
+保存先は生成結果ストアと同じ SQLite（Config.RESULT_DB）。
+
+使い方（CLI）:
+    python search_policy.py stats                 # 職種 × 検索理由ごとの件数・平均上昇幅
+    python search_policy.py purge --days 180      # 180日より古い実績を削除
+"""
+import argparse
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from category_knowledge import normalize_category
+from config import Config
+from metrics import SEARCH_DECISIONS
+from result_store import connect
+from utils import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_outcomes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category_key TEXT NOT NULL,
+    job_category TEXT NOT NULL,
+    confidence_before REAL NOT NULL,
+    confidence_after REAL NOT NULL,
+    uplift REAL NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_outcome_triggers (
+    outcome_id INTEGER NOT NULL,
+    trigger TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_search_outcomes_category ON search_outcomes(category_key);
+CREATE INDEX IF NOT EXISTS idx_search_outcome_triggers ON search_outcome_triggers(trigger, outcome_id);
+"""
+
+# 自信度が閾値未満であることを表す検索理由
+LOW_CONFIDENCE_TRIGGER = "低自信度"
+
+
+def explore_draw(job_category: str, sample_key: str) -> float:
+    """探索するかの判定に使う 0 以上 1 未満の値（職種名と求人のキーのハッシュ。同じ求人では毎回同じ値）"""
+    digest = hashlib.sha256(f"{normalize_category(job_category)}\n{sample_key}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+class SearchPolicy:
+    """検索ごとの自信度の変化の記録と、それに基づく実行判断"""
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path or Config.RESULT_DB)
+        self._conn = connect(self.path)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    # ==================== 記録 ====================
+    def record(self, job_category: str, triggers: List[str], confidence_before: float, confidence_after: float) -> None:
+        """
+        1回の検索の結果を記録
+
+        Args:
+            job_category: 職種名
+            triggers: 検索の理由（重要項目名・LOW_CONFIDENCE_TRIGGER）
+            confidence_before: Step 2-1 の自信度
+            confidence_after: Step 2-3 の自信度
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO search_outcomes (category_key, job_category, confidence_before, confidence_after, uplift, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (normalize_category(job_category), job_category.strip(), confidence_before, confidence_after,
+                 confidence_after - confidence_before, datetime.now().isoformat(timespec="seconds"))
+            )
+            self._conn.executemany(
+                "INSERT INTO search_outcome_triggers (outcome_id, trigger) VALUES (?, ?)",
+                [(cursor.lastrowid, trigger) for trigger in triggers]
+            )
+
+    def uplift(self, job_category: str, trigger: str) -> Optional[Dict[str, Any]]:
+        """
+        検索理由ごとの直近の平均上昇幅
+
+        Returns:
+            {n, mean, scope（category | global）}。実績が SEARCH_POLICY_MIN_SAMPLES 件に満たない場合は None
+        """
+        for scope, where, params in (
+            ("category", "AND o.category_key = ?", [normalize_category(job_category)]),
+            ("global", "", []),
+        ):
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT o.uplift FROM search_outcomes o JOIN search_outcome_triggers t ON t.outcome_id = o.id "
+                    f"WHERE t.trigger = ? {where} ORDER BY o.id DESC LIMIT ?",
+                    [trigger] + params + [Config.SEARCH_POLICY_WINDOW]
+                ).fetchall()
+            if len(rows) >= Config.SEARCH_POLICY_MIN_SAMPLES:
+                return {"n": len(rows), "mean": sum(r[0] for r in rows) / len(rows), "scope": scope}
+        return None
+
+    # ==================== 判断 ====================
+    def decide(
+        self,
+        job_category: str,
+        triggers: List[str],
+        confidence_score: float,
+        rule_decision: Tuple[bool, str],
+        sample_key: str
+    ) -> Tuple[bool, str]:
+        """
+        固定ルールの判断を過去の実績で見直す
+
+        Args:
+            job_category: 職種名
+            triggers: 固定ルールの検索理由
+            confidence_score: Step 2-1 の自信度
+            rule_decision: 固定ルールの (検索実行フラグ, 判断理由)
+            sample_key: 求人のキー（探索する求人の選択に使う）
+
+        Returns:
+            (検索実行フラグ, 判断理由) のタプル
+        """
+        should_search, reason = rule_decision
+        if should_search:
+            stats = {trigger: self.uplift(job_category, trigger) for trigger in triggers}
+            if any(s is None or s["mean"] >= Config.SEARCH_POLICY_MIN_UPLIFT for s in stats.values()):
+                SEARCH_DECISIONS.inc(decision="search", basis="rule")
+                return True, reason
+            details = ", ".join(f"{t}: 平均{s['mean']:+.2f}（{s['n']}件）" for t, s in stats.items())
+            if explore_draw(job_category, sample_key) < Config.SEARCH_POLICY_EXPLORE_RATE:
+                SEARCH_DECISIONS.inc(decision="search", basis="explore")
+                return True, f"{reason}（実績の更新のため検索: {details}）"
+            SEARCH_DECISIONS.inc(decision="skip", basis="history")
+            return False, f"過去の検索で自信度がほとんど上がっていないため省略（{details}）"
+
+        if confidence_score < Config.CONFIDENCE_THRESHOLD + Config.SEARCH_POLICY_PRIORITY_MARGIN:
+            s = self.uplift(job_category, LOW_CONFIDENCE_TRIGGER)
+            if s and s["scope"] == "category" and s["mean"] >= Config.SEARCH_POLICY_PRIORITY_UPLIFT:
+                SEARCH_DECISIONS.inc(decision="search", basis="priority")
+                return True, f"この職種では検索で自信度が平均{s['mean']:+.2f}上がっている（{s['n']}件）"
+        SEARCH_DECISIONS.inc(decision="skip", basis="rule")
+        return False, reason
+
+    # ==================== 集計・削除 ====================
+    def stats(self) -> List[Dict[str, Any]]:
+        """職種 × 検索理由ごとの件数・平均上昇幅（全期間）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT o.job_category, t.trigger, COUNT(*), AVG(o.uplift), MAX(o.created_at) "
+                "FROM search_outcomes o JOIN search_outcome_triggers t ON t.outcome_id = o.id "
+                "GROUP BY o.category_key, t.trigger ORDER BY o.category_key, t.trigger"
+            ).fetchall()
+        return [
+            {"job_category": r[0], "trigger": r[1], "n": r[2], "mean_uplift": r[3], "last": r[4]}
+            for r in rows
+        ]
+
+    def purge(self, days: int) -> int:
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM search_outcome_triggers WHERE outcome_id IN (SELECT id FROM search_outcomes WHERE created_at < ?)",
+                (cutoff,)
+            )
+            return self._conn.execute("DELETE FROM search_outcomes WHERE created_at < ?", (cutoff,)).rowcount
+
+
+_policy: Optional[SearchPolicy] = None
+_policy_lock = threading.Lock()
+
+
+def get_search_policy() -> Optional[SearchPolicy]:
+    """
+    プロセス共通の判断（無効な場合・本番の LLM でない場合は None）
+    """
+    global _policy
+    if not Config.SEARCH_POLICY_ENABLED or Config.LLM_TRANSPORT not in ("openai", "record"):
+        return None
+    with _policy_lock:
+        if _policy is None:
+            _policy = SearchPolicy()
+        return _policy
+
+
+def decide_web_search(
+    job_category: str,
+    triggers: List[str],
+    confidence_score: float,
+    rule_decision: Tuple[bool, str],
+    sample_key: str
+) -> Tuple[bool, str]:
+    """実績に基づく判断（無効・参照失敗の場合は固定ルールの判断をそのまま返す）"""
+    policy = get_search_policy()
+    if policy is None:
+        return rule_decision
+    try:
+        return policy.decide(job_category, triggers, confidence_score, rule_decision, sample_key)
+    except Exception as e:
+        logger.warning(f"検索実績の参照に失敗しました（固定ルールで判断します）: {str(e)}")
+        return rule_decision
+
+
+def record_search_outcome(job_category: str, triggers: List[str], confidence_before: float, confidence_after: float) -> None:
+    """検索の結果を記録（無効・保存失敗の場合は何もしない）"""
+    policy = get_search_policy()
+    if policy is None:
+        return
+    try:
+        policy.record(job_category, triggers, confidence_before, confidence_after)
+    except Exception as e:
+        logger.warning(f"検索実績の保存に失敗しました: {str(e)}")
+
+
+# ==================== CLI ====================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Web検索の実績（自信度の上昇幅）の集計・削除")
+    parser.add_argument("--db", default=str(Config.RESULT_DB), help="結果DBのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="職種 × 検索理由ごとの件数・平均上昇幅")
+    p_purge = sub.add_parser("purge", help="古い実績を削除")
+    p_purge.add_argument("--days", type=int, default=180)
+    args = parser.parse_args()
+
+    policy = SearchPolicy(Path(args.db))
+    if args.command == "stats":
+        for r in policy.stats():
+            print(f"{r['job_category']:<16} {r['trigger']:<8} n={r['n']:<4} uplift={r['mean_uplift']:+.3f}  last={r['last']}")
+    else:
+        print(f"{policy.purge(args.days)}件を削除しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,28 @@
 SerpAPI連携機能
 Google検索を実行し、結果を取得・整形する
 """
+import contextvars
 import requests
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 from config import Config
 from utils import logger
+from llm_transport import get_search_transport
+from tracing import set_attributes, traced
+from metrics import SEARCH_LATENCY, SEARCH_REQUESTS, instrumented
+from category_knowledge import get_category_knowledge
+from search_cache import SearchFailure, cached_search
+from local_search import local_search, remember
+from context_packing import pack_search_results, render_sections
+from page_fetch import enrich_results
+from http_client import request_timeout
+from resilience import CircuitOpenError, get_breaker, is_dependency_failure
 
 
+@traced("search")
 def serpapi_search(query: str, num_results: int = None) -> List[Dict[str, str]]:
     """
-    SerpAPIを使ってGoogle検索を実行
+    SerpAPIを使ってGoogle検索を実行（search_cache で応答をキャッシュする）
     
     Args:
         query: 検索クエリ
@@ -25,10 +38,12 @@ def serpapi_search(query: str, num_results: int = None) -> List[Dict[str, str]]:
     if num_results is None:
         num_results = Config.MAX_SEARCH_RESULTS
     
-    if not Config.SERPAPI_KEY:
+    # replay / mock ではAPIキー不要
+    if not Config.SERPAPI_KEY and Config.SEARCH_TRANSPORT in ("serpapi", "record"):
         raise Exception("SERPAPI_KEYが設定されていません")
     
     logger.info(f"SerpAPI検索開始: query='{query}', num={num_results}")
+    set_attributes(query=query, num_results=num_results)
     
     params = {
         "q": query,
@@ -39,15 +54,44 @@ def serpapi_search(query: str, num_results: int = None) -> List[Dict[str, str]]:
         "engine": "google"
     }
     
+    results = cached_search(params, lambda: _fetch_results(params))
+    set_attributes(result_count=len(results))
+    if Config.SEARCH_TRANSPORT != "local":
+        remember(results)
+    return results
+
+
+@instrumented(SEARCH_REQUESTS, SEARCH_LATENCY)
+def _fetch_results(params: Dict[str, str]) -> List[Dict[str, str]]:
+    """
+    検索トランスポートを呼び出して検索結果を取得（キャッシュを通さない）
+    
+    Args:
+        params: SerpAPI のクエリパラメータ
+        
+    Returns:
+        検索結果のリスト（各要素は {title, link, snippet} の辞書）
+        
+    Raises:
+        CircuitOpenError: SerpAPI のブレーカーが開いている場合（呼び出さずに即失敗。ネガティブキャッシュには保存しない）
+        SearchFailure: SerpAPI が失敗を返した場合・接続できなかった場合
+        Exception: それ以外の予期しないエラー
+    """
+    breaker = get_breaker("serpapi")
     try:
-        response = requests.get(
-            "https://serpapi.com/search",
-            params=params,
-            timeout=30
-        )
+        breaker.before_call()
+        try:
+            response = get_search_transport().get(params, timeout=request_timeout(Config.SERPAPI_READ_TIMEOUT_SEC))
+        except Exception as e:
+            breaker.record(e)
+            raise
+        if response.status_code == 429 or response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
         
         if response.status_code != 200:
-            raise Exception(
+            raise SearchFailure(
                 f"SerpAPI HTTPエラー: {response.status_code}"
             )
         
@@ -55,7 +99,7 @@ def serpapi_search(query: str, num_results: int = None) -> List[Dict[str, str]]:
         
         # エラーレスポンスのチェック
         if "error" in data:
-            raise Exception(f"SerpAPIエラー: {data['error']}")
+            raise SearchFailure(f"SerpAPIエラー: {data['error']}")
         
         # 検索結果の抽出
         results = []
@@ -69,35 +113,52 @@ def serpapi_search(query: str, num_results: int = None) -> List[Dict[str, str]]:
         logger.info(f"SerpAPI検索成功: {len(results)}件の結果を取得")
         return results
         
+    except CircuitOpenError as e:
+        logger.warning(f"SerpAPI呼び出しを見合わせました: {str(e)}")
+        raise
+    
+    except SearchFailure as e:
+        logger.error(str(e))
+        raise
+    
     except requests.exceptions.RequestException as e:
         logger.error(f"SerpAPI接続エラー: {str(e)}")
-        raise Exception(f"SerpAPI接続エラー: {str(e)}")
+        raise SearchFailure(f"SerpAPI接続エラー: {str(e)}")
     
-    except KeyError as e:
+    except (KeyError, ValueError) as e:
         logger.error(f"SerpAPIレスポンス解析エラー: {str(e)}")
-        raise Exception(f"SerpAPIレスポンス解析エラー: {str(e)}")
+        raise SearchFailure(f"SerpAPIレスポンス解析エラー: {str(e)}")
     
     except Exception as e:
+        if is_dependency_failure(e):
+            # httpx の接続エラー・タイムアウトなど
+            logger.error(f"SerpAPI接続エラー: {str(e)}")
+            raise SearchFailure(f"SerpAPI接続エラー: {str(e)}")
         logger.error(f"SerpAPI予期しないエラー: {str(e)}")
         raise Exception(f"SerpAPI予期しないエラー: {str(e)}")
 
 
 def serpapi_search_with_fallback(query: str, num_results: int = None) -> List[Dict[str, str]]:
     """
-    SerpAPI検索（失敗時は空リストを返す）
+    SerpAPI検索（失敗時はローカル検索索引で代替し、それも無ければ空リストを返す）
     
     Args:
         query: 検索クエリ
         num_results: 取得する結果数
         
     Returns:
-        検索結果のリスト（失敗時は空リスト）
+        検索結果のリスト（失敗時はローカル検索の結果。各要素に source="local" が付く）
     """
     try:
         return serpapi_search(query, num_results)
     
     except Exception as e:
         logger.warning(f"SerpAPI検索失敗: {str(e)}")
+        if Config.LOCAL_SEARCH_FALLBACK:
+            results = local_search(query, num_results)
+            if results:
+                logger.info(f"ローカル検索索引の結果で代替します: {len(results)}件")
+                return [{**item, "source": "local"} for item in results]
         logger.info("LLMの知識のみで継続します")
         return []
 
@@ -105,72 +166,123 @@ def serpapi_search_with_fallback(query: str, num_results: int = None) -> List[Di
 def format_search_results(
     results1: List[Dict[str, str]], 
     results2: List[Dict[str, str]], 
-    max_chars: int = None
+    max_chars: int = None,
+    structured_data: Optional[Dict[str, Any]] = None
 ) -> str:
     """
     検索結果をLLMに渡す形式に整形
+    重複を除き、求人との関連度の高い順に WEB_CONTEXT_TOKEN_BUDGET の範囲で選ぶ（context_packing）
     
     Args:
         results1: 検索クエリ1の結果
         results2: 検索クエリ2の結果
         max_chars: 各検索結果から抽出する最大文字数
+        structured_data: レイヤー①の出力（関連度の計算に使う。Noneの場合は検索順位のまま）
         
     Returns:
         整形済みテキスト
     """
-    if max_chars is None:
-        max_chars = Config.WEB_CONTEXT_MAX_CHARS
-    
     logger.info(f"検索結果を整形中: results1={len(results1)}件, results2={len(results2)}件")
     
-    context = "【検索1: 業務フロー】\n"
-    
-    if not results1:
-        context += "（検索結果なし）\n\n"
-    else:
-        for i, item in enumerate(results1, 1):
-            snippet = item["snippet"][:max_chars]
-            title = item["title"][:100]  # タイトルも制限
-            context += f"{i}. {title}\n{snippet}\n\n"
-    
-    context += "\n【検索2: 使用技術】\n"
-    
-    if not results2:
-        context += "（検索結果なし）\n\n"
-    else:
-        for i, item in enumerate(results2, 1):
-            snippet = item["snippet"][:max_chars]
-            title = item["title"][:100]
-            context += f"{i}. {title}\n{snippet}\n\n"
+    packed, stats = pack_search_results([results1, results2], structured_data, max_chars=max_chars)
+    context = render_sections(packed)
+    set_attributes(
+        context_candidates=stats["candidates"],
+        context_duplicates=stats["duplicates"],
+        context_selected=stats["selected"],
+        context_tokens=stats["tokens"]
+    )
     
     logger.info(f"検索結果整形完了: 総文字数={len(context)}")
     
     return context
 
 
-def execute_dual_search(job_category: str) -> str:
+@traced("layer2.dual_search")
+def execute_dual_search(job_category: str, structured_data: Optional[Dict[str, Any]] = None) -> Tuple[str, bool]:
     """
     2つの検索クエリを実行し、整形済みコンテキストを返す
+    職種ナレッジキャッシュに有効期限内の結果があれば検索せずにそれを使う（整形は求人ごとに行う）
     
     Args:
         job_category: 職種名
+        structured_data: レイヤー①の出力（検索結果の関連度順の選択に使う）
         
     Returns:
-        整形済みの検索結果テキスト
+        (整形済みの検索結果テキスト, Web検索の結果があったか) のタプル。
+        SerpAPI の失敗・ブレーカーによる即失敗で結果が無い場合やローカル検索だけで代替した場合は False
+    """
+    knowledge = get_category_knowledge()
+    sections = None
+    if knowledge:
+        try:
+            sections = knowledge.get_search_results(job_category)
+        except Exception as e:
+            logger.warning(f"職種ナレッジの参照に失敗しました: {str(e)}")
+        if sections:
+            logger.info(f"デュアル検索: 職種ナレッジの検索結果を使用します（job_category='{job_category}'）")
+            set_attributes(cache_hit=True)
+    
+    # 職種ナレッジの検索結果は Web検索の結果があった場合だけ保存している
+    has_web_results = bool(sections)
+    if not sections:
+        sections, result_count = search_job_category(job_category)
+        has_web_results = result_count > 0
+        # 検索に失敗した（Web検索の結果が無い）場合はキャッシュしない
+        if knowledge and result_count:
+            try:
+                knowledge.put_search_results(job_category, sections)
+            except Exception as e:
+                logger.warning(f"職種ナレッジの保存に失敗しました: {str(e)}")
+        else:
+            knowledge = None
+    
+    # 上位のページ本文から求人に関連する段落を加える（PAGE_FETCH_ENABLED のとき。職種ナレッジには保存しない）
+    web_context = format_search_results(*enrich_results(sections, structured_data), structured_data=structured_data)
+    set_attributes(context_chars=len(web_context))
+    if knowledge:
+        _refresh_profile_if_needed(knowledge, job_category, sections)
+    
+    return web_context, has_web_results
+
+
+def search_job_category(job_category: str) -> Tuple[List[List[Dict[str, str]]], int]:
+    """
+    職種の業務フロー・使用技術を検索（キャッシュは使わない）
+    
+    Args:
+        job_category: 職種名
+        
+    Returns:
+        ([業務フローの検索結果, 使用技術の検索結果], Web検索の結果の件数) のタプル。
+        件数にはローカル検索で代替した結果を含めない
     """
     logger.info(f"デュアル検索開始: job_category='{job_category}'")
     
     # 検索クエリ1: 業務フロー
     query1 = f"{job_category} 業務フロー 標準的な流れ"
-    results1 = serpapi_search_with_fallback(query1)
-    
     # 検索クエリ2: 使用技術
     query2 = f"{job_category} 使用技術 ツール 最新"
-    results2 = serpapi_search_with_fallback(query2)
     
-    # 結果を整形
-    web_context = format_search_results(results1, results2)
+    # 2つの検索は独立しているため並列に実行する（接続は http_client の接続プールを共有）
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        future2 = pool.submit(contextvars.copy_context().run, serpapi_search_with_fallback, query2)
+        results1 = serpapi_search_with_fallback(query1)
+        results2 = future2.result()
+    
+    set_attributes(result_count=len(results1) + len(results2))
     
     logger.info("デュアル検索完了")
     
-    return web_context
+    web_count = sum(1 for item in results1 + results2 if item.get("source") != "local")
+    return [results1, results2], web_count
+
+
+def _refresh_profile_if_needed(knowledge, job_category: str, sections: List[List[Dict[str, str]]]) -> None:
+    """標準プロファイルが無い・期限切れなら、検索結果からバックグラウンドで要約する"""
+    try:
+        if knowledge.needs_profile(job_category):
+            # プロファイルは職種共通のため、求人による選択をせずに整形する
+            knowledge.refresh_profile_async(job_category, format_search_results(*sections))
+    except Exception as e:
+        logger.warning(f"職種ナレッジの更新に失敗しました: {str(e)}")
@@ -0,0 +1,381 @@
+"""
+ステージグラフ（依存関係を宣言したパイプラインの実行エンジン）
+各ステージは入力と出力を成果物名で宣言し、入力がそろったステージから実行する。
+互いに依存しないステージ（使用技術の専門化と内容Aの補足など）は並行して実行する。
+
+- キャッシュ: ステージの出力を「ステージ名 + 入力の値」のフィンガープリント付きで保存し（cache）、
+  同じ入力で再実行する場合は保存済みの出力を使う。上流のステージの出力が変わった場合は
+  フィンガープリントが一致しなくなるため、そのステージから下流だけが再計算される
+- 強制再計算: force に指定したステージとその下流はキャッシュを使わずに実行する（レイヤー③だけの再生成など）
+- 事前投入: seed に成果物を渡すと、その成果物だけを出力するステージは実行しない（生成結果ストアの中間成果物の利用など）
+
+1本のステージ列は呼び出し元のスレッドで順に実行し、並行して実行できるステージがある場合だけ
+プロセス共通のスレッドプール（PIPELINE_STAGE_WORKERS）に渡す。進捗通知は呼び出し元のスレッドからだけ行う
+（Streamlit の描画は他のスレッドから呼べないため）。
+"""
+import contextvars
+import copy
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import Config
+from metrics import LAYER_DURATION, STAGE_DURATION, STAGE_RESULTS
+from telemetry import step
+from tracing import start_span
+
+# 進捗通知: (進捗率0-100, 表示メッセージ)
+ProgressCallback = Callable[[int, str], None]
+# ステージ完了の通知: (ステージ名, レイヤー, 開始時刻, 終了時刻)。時刻は time.perf_counter() の値
+StageCallback = Callable[[str, str, float, float], None]
+
+# ステージの実行結果
+RUN = "run"
+CACHED = "cached"
+SEEDED = "seeded"
+
+
+class StageNotRunnableError(Exception):
+    """実行を許可していないステージを実行する必要があった（必要な成果物がキャッシュ・事前投入に無い）"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        super().__init__(f"ステージ {stage} の出力が見つかりません")
+
+
+class Stage:
+    """
+    ステージ1つ分の宣言
+
+    Args:
+        name: ステージ名（キャッシュのキー・スパン名・メトリクスのラベルに使う）
+        func: 入力をキーワード引数で受け取り、出力名 → 値 の辞書を返す関数（入力は複製して渡すため書き換えてよい）
+        inputs: 入力の成果物名
+        outputs: 出力の成果物名
+        layer: 所属するレイヤー（ステップタグ・レイヤー別の所要時間に使う）
+        label: 進捗表示での名前
+        progress: 開始時に通知する進捗率（None の場合は通知しない）
+        message: 開始時に通知するメッセージ
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[..., Dict[str, Any]],
+        inputs: Iterable[str],
+        outputs: Iterable[str],
+        layer: str,
+        label: str = None,
+        progress: Optional[int] = None,
+        message: str = None
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.layer = layer
+        self.label = label or name
+        self.progress = progress
+        self.message = message
+
+    def __repr__(self) -> str:
+        return f"Stage({self.name}: {', '.join(self.inputs)} → {', '.join(self.outputs)})"
+
+
+class StageCache:
+    """ステージの出力の保存先（プロセス内のメモリ。checkpoints.RunCheckpoints も同じメソッドを持つ）"""
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, stage: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(フィンガープリント, 出力) のタプル（無い場合は None）"""
+        with self._lock:
+            return self._entries.get(stage)
+
+    def put(self, stage: str, fingerprint: str, outputs: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[stage] = (fingerprint, outputs)
+
+
+class GraphResult:
+    """
+    グラフ1回分の実行結果
+
+    Attributes:
+        values: 成果物名 → 値
+        statuses: ステージ名 → run / cached / seeded
+        timings: 実行したステージ名 → (開始時刻, 終了時刻)
+    """
+
+    def __init__(self):
+        self.values: Dict[str, Any] = {}
+        self.statuses: Dict[str, str] = {}
+        self.timings: Dict[str, Tuple[float, float]] = {}
+
+    def stages_with(self, status: str) -> List[str]:
+        return [name for name, s in self.statuses.items() if s == status]
+
+
+def fingerprint(stage: Stage, values: Dict[str, Any]) -> str:
+    """ステージ名と入力の値のハッシュ（入力が同じなら同じ値になる）"""
+    payload = json.dumps(
+        [stage.name, [values[name] for name in stage.inputs]],
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=Config.PIPELINE_STAGE_WORKERS, thread_name_prefix="stage")
+        return _executor
+
+
+class StageGraph:
+    """ステージの依存関係（宣言順ではなく入力・出力の対応から実行順を決める）"""
+
+    def __init__(self, stages: Iterable[Stage]):
+        self.stages: Dict[str, Stage] = {}
+        self.producers: Dict[str, str] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"ステージ名が重複しています: {stage.name}")
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"成果物 {output} を出力するステージが複数あります: {self.producers[output]}, {stage.name}")
+                self.producers[output] = stage.name
+            self.stages[stage.name] = stage
+        self.inputs = sorted({
+            name for stage in self.stages.values() for name in stage.inputs if name not in self.producers
+        })
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        remaining = {name: set(self.upstream_of(name)) for name in self.stages}
+        order: List[str] = []
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"ステージの依存関係が循環しています: {', '.join(sorted(remaining))}")
+            for name in ready:
+                order.append(name)
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        return order
+
+    def upstream_of(self, name: str) -> List[str]:
+        """直接依存しているステージ"""
+        return sorted({self.producers[i] for i in self.stages[name].inputs if i in self.producers})
+
+    def downstream(self, names: Iterable[str]) -> Set[str]:
+        """指定したステージと、その出力に（間接的に）依存するステージ"""
+        result = set(names)
+        for name in self.order:
+            if name not in result and any(dep in result for dep in self.upstream_of(name)):
+                result.add(name)
+        return result
+
+    # ==================== 実行 ====================
+    def run(
+        self,
+        inputs: Dict[str, Any],
+        seed: Optional[Dict[str, Any]] = None,
+        cache: Optional[StageCache] = None,
+        reuse_cache: bool = True,
+        force: Iterable[str] = (),
+        runnable: Optional[Iterable[str]] = None,
+        targets: Optional[Iterable[str]] = None,
+        progress_callback: Optional[ProgressCallback] = None,
+        on_stage: Optional[StageCallback] = None
+    ) -> GraphResult:
+        """
+        グラフを実行
+
+        Args:
+            inputs: グラフの入力（job_text / job_category など）
+            seed: 事前に分かっている成果物（その成果物だけを出力するステージは実行しない）
+            cache: ステージの出力の保存先（None の場合は保存・再利用しない）
+            reuse_cache: False の場合、キャッシュには保存するだけで再利用しない
+            force: キャッシュを使わずに実行するステージ（下流のステージも再計算する）
+            runnable: 実行してよいステージ（それ以外のステージを実行する必要がある場合は StageNotRunnableError）
+            targets: 作る成果物（None の場合は最終的な成果物。途中の成果物までで止める場合に指定する）
+            progress_callback: 進捗通知のコールバック
+            on_stage: ステージを実行するたびに呼ぶコールバック（ベンチマークの計測など）
+
+        Returns:
+            実行結果（values に全成果物）
+
+        Raises:
+            ValueError: グラフの入力が不足している場合
+            StageNotRunnableError: runnable 以外のステージを実行する必要があった場合
+            Exception: ステージの実行に失敗した場合（そのステージの例外をそのまま送出）
+        """
+        missing = [name for name in self.inputs if name not in inputs and name not in (seed or {})]
+        if missing:
+            raise ValueError(f"グラフの入力が不足しています: {', '.join(missing)}")
+
+        result = GraphResult()
+        result.values.update(inputs)
+        result.values.update(seed or {})
+        forced = self.downstream(force)
+        allowed = set(self.order) if runnable is None else set(runnable)
+        needed = self._needed(seed or {}, forced, targets)
+        for name in self.order:
+            if name not in needed:
+                result.statuses[name] = SEEDED
+                STAGE_RESULTS.inc(stage=name, result=SEEDED)
+        pending = [name for name in self.order if name in needed]
+        running: Dict[Future, Stage] = {}
+        layer_spans: Dict[str, List[float]] = {}
+
+        def finish(stage: Stage, outputs: Dict[str, Any], started: float, ended: float) -> None:
+            missing_outputs = [name for name in stage.outputs if name not in outputs]
+            if missing_outputs:
+                raise ValueError(f"ステージ {stage.name} の出力が不足しています: {', '.join(missing_outputs)}")
+            result.values.update({name: outputs[name] for name in stage.outputs})
+            result.statuses[stage.name] = RUN
+            result.timings[stage.name] = (started, ended)
+            span = layer_spans.setdefault(stage.layer, [started, ended])
+            span[0], span[1] = min(span[0], started), max(span[1], ended)
+            if on_stage is not None:
+                on_stage(stage.name, stage.layer, started, ended)
+
+        try:
+            while pending or running:
+                ready = [
+                    self.stages[name] for name in pending
+                    if all(i in result.values for i in self.stages[name].inputs)
+                ]
+                to_run: List[Tuple[Stage, str]] = []
+                resolved = False
+                for stage in ready:
+                    pending.remove(stage.name)
+                    status, fp = self._resolve(stage, result, cache, reuse_cache and stage.name not in forced)
+                    if status is not None:
+                        resolved = True
+                        STAGE_RESULTS.inc(stage=stage.name, result=status)
+                        if status == CACHED and stage.progress is not None:
+                            _notify(progress_callback, stage.progress, f"♻️ {stage.label}: 前回の結果を再利用しています...")
+                        continue
+                    if stage.name not in allowed:
+                        raise StageNotRunnableError(stage.name)
+                    to_run.append((stage, fp))
+
+                if not to_run:
+                    if resolved:
+                        # 再利用した出力で入力がそろったステージを探し直す
+                        continue
+                    if not running:
+                        if pending:
+                            raise ValueError(f"入力がそろわないステージがあります: {', '.join(pending)}")
+                        break
+
+                for stage, _ in to_run:
+                    if stage.progress is not None and stage.message:
+                        _notify(progress_callback, stage.progress, stage.message)
+
+                # 1つは呼び出し元のスレッドで実行し、残りはスレッドプールに渡す（入力はここで複製する）
+                for stage, fp in to_run[1:]:
+                    kwargs = {name: copy.deepcopy(result.values[name]) for name in stage.inputs}
+                    future = _get_executor().submit(
+                        contextvars.copy_context().run, self._execute, stage, fp, kwargs, cache
+                    )
+                    running[future] = stage
+                if to_run:
+                    stage, fp = to_run[0]
+                    kwargs = {name: copy.deepcopy(result.values[name]) for name in stage.inputs}
+                    finish(stage, *self._execute(stage, fp, kwargs, cache))
+                    if not running:
+                        continue
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    finish(stage, *future.result())
+        finally:
+            # 失敗時も実行中のステージの完了は待つ（呼び出し元が抜けた後に書き込みが起きないように）
+            if running:
+                wait(list(running))
+            for layer, (started, ended) in layer_spans.items():
+                LAYER_DURATION.observe(ended - started, layer=layer)
+
+        return result
+
+    def _needed(self, seed: Dict[str, Any], forced: Set[str], targets: Optional[Iterable[str]] = None) -> Set[str]:
+        """targets（省略時は最終的な成果物 = どのステージの入力にもならない出力）を作るのに実行が必要なステージ"""
+        if targets is not None:
+            wanted = set(targets)
+        else:
+            consumed = {name for stage in self.stages.values() for name in stage.inputs}
+            wanted = {name for stage in self.stages.values() for name in stage.outputs if name not in consumed}
+        needed: Set[str] = set()
+        for name in reversed(self.order):
+            stage = self.stages[name]
+            if any(o in wanted and (o not in seed or name in forced) for o in stage.outputs):
+                needed.add(name)
+                wanted.update(stage.inputs)
+        return needed
+
+    def _resolve(
+        self,
+        stage: Stage,
+        result: GraphResult,
+        cache: Optional[StageCache],
+        reuse: bool
+    ) -> Tuple[Optional[str], str]:
+        """
+        キャッシュの出力を使えるかを判定（使える場合は成果物を result に反映する）
+
+        Returns:
+            (cached / None（実行が必要）, フィンガープリント)
+        """
+        fp = fingerprint(stage, result.values)
+        if cache is not None and reuse:
+            hit = cache.get(stage.name)
+            if hit is not None and hit[0] == fp and all(name in hit[1] for name in stage.outputs):
+                result.values.update({name: hit[1][name] for name in stage.outputs})
+                result.statuses[stage.name] = CACHED
+                return CACHED, fp
+        return None, fp
+
+    @staticmethod
+    def _execute(
+        stage: Stage,
+        fp: str,
+        kwargs: Dict[str, Any],
+        cache: Optional[StageCache]
+    ) -> Tuple[Dict[str, Any], float, float]:
+        """ステージを1つ実行し、(出力, 開始時刻, 終了時刻) を返す"""
+        started = time.perf_counter()
+        try:
+            with step(stage.layer), start_span(stage.name, layer=stage.layer), STAGE_DURATION.time(stage=stage.name):
+                outputs = stage.func(**kwargs)
+        except Exception:
+            STAGE_RESULTS.inc(stage=stage.name, result="failed")
+            raise
+        ended = time.perf_counter()
+        STAGE_RESULTS.inc(stage=stage.name, result=RUN)
+        if cache is not None:
+            try:
+                cache.put(stage.name, fp, outputs)
+            except Exception as e:
+                from utils import logger
+                logger.warning(f"ステージ {stage.name} の出力の保存に失敗しました: {str(e)}")
+        return outputs, started, ended
+
+
+def _notify(progress_callback: Optional[ProgressCallback], percent: int, message: str) -> None:
+    if progress_callback is not None:
+        progress_callback(percent, message)
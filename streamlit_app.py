@@ -8,14 +8,19 @@ from datetime import datetime
 import traceback
 import re
 from html import escape
+from typing import Any, Dict, List
 
 # 自作モジュールのインポート
 from config import Config
 from utils import format_confidence_score, logger, answer_question
-from layer1 import layer1_extract_structure
-from layer2 import layer2_build_comparison_smart
-from layer3 import layer3_optimize_for_learning
+from pipeline import regenerate_layer3, run_pipeline, run_pipeline_delta
 from modification import handle_modification_request
+from metrics import start_metrics_server
+from profiling import profiled
+from result_store import get_result_store, result_key
+from near_duplicates import find_similar, get_near_duplicate_index
+from resilience import CircuitOpenError, OverloadedError
+from jobs import ACTIVE, DELTA, LAYER3, PIPELINE, SUCCEEDED, get_job_manager
 
 
 # ==================== ページ設定 ====================
@@ -40,10 +45,26 @@ def initialize_session_state():
     
     if 'generation_count' not in st.session_state:
         st.session_state.generation_count = 0
+    
+    # 生成結果ストアのキー（修正履歴の保存先）
+    if 'result_key' not in st.session_state:
+        st.session_state.result_key = None
+    # 類似求人が見つかった場合の選択待ち（{result_key, similarity, created_at, job_text, job_category}）
+    if 'near_duplicate' not in st.session_state:
+        st.session_state.near_duplicate = None
+    # 直近の生成の入力と成否（{job_text, job_category, failed}。続きからの再開・レイヤー③だけの再生成に使う）
+    if 'last_generation' not in st.session_state:
+        st.session_state.last_generation = None
+    # 進捗を表示している生成ジョブのID（再読み込み時は URL の ?job= から接続し直す）
+    if 'job' not in st.session_state:
+        st.session_state.job = st.query_params.get("job") if Config.JOBS_ENABLED else None
 
 
 initialize_session_state()
 
+# メトリクスエンドポイント（Prometheus のスクレイプ先。再実行時は起動済みのサーバーをそのまま使う）
+start_metrics_server()
+
 
 # ==================== ヘッダー ====================
 st.title("🎓 採用リクルータージョブ理解支援システム v4.0")
@@ -70,51 +91,53 @@ except ValueError as e:
 
 
 # ==================== メイン処理関数 ====================
-def generate_full_output(job_text: str, job_category: str):
+def generate_full_output(job_text: str, job_category: str, seed_key: str = None, resume: bool = False, layer3_only: bool = False):
     """
     求人票から最終出力を生成
     
     Args:
         job_text: 求人テキスト
         job_category: 職種名
+        seed_key: 類似求人の保存キー。指定時はレイヤー②を再利用して差分再生成する
+        resume: True の場合、前回の生成のチェックポイントがあるレイヤーは実行しない（続きから再開）
+        layer3_only: True の場合、レイヤー①②の前回の結果を使ってレイヤー③だけを再生成する
         
     Returns:
         最終出力データ
     """
-    start_time = datetime.now()
-    
     try:
         # プログレス表示
         progress_bar = st.progress(0)
         status_text = st.empty()
-        
-        # レイヤー① : 求人構造化
-        status_text.text("⏳ レイヤー①: 求人情報を構造化しています...")
-        progress_bar.progress(10)
-        
-        structured_data = layer1_extract_structure(job_text)
-        progress_bar.progress(30)
-        
-        # レイヤー②: 業界標準比較
-        status_text.text("⏳ レイヤー②: 業界標準と比較しています...")
-        
-        comparison_data = layer2_build_comparison_smart(structured_data, job_category)
-        progress_bar.progress(60)
-        
-        # レイヤー③: 教育最適化
-        status_text.text("⏳ レイヤー③: 教育資料を生成しています...")
-        
-        final_output = layer3_optimize_for_learning(comparison_data)
-        progress_bar.progress(90)
-        
-        # 完了
-        progress_bar.progress(100)
-        status_text.text("✅ 生成完了!")
-        
-        # 処理時間計算
-        elapsed_time = (datetime.now() - start_time).total_seconds()
-        logger.info(f"総処理時間: {elapsed_time:.2f}秒")
-        
+
+        def _on_progress(percent: int, message: str):
+            progress_bar.progress(percent)
+            status_text.text(message)
+
+        if seed_key:
+            final_output = run_pipeline_delta(
+                job_text,
+                job_category,
+                seed_key,
+                progress_callback=_on_progress,
+                save_result=Config.RESULT_STORE_ENABLED
+            )
+        elif layer3_only:
+            final_output = regenerate_layer3(
+                job_text,
+                job_category,
+                progress_callback=_on_progress,
+                save_result=Config.RESULT_STORE_ENABLED
+            )
+        else:
+            final_output = run_pipeline(
+                job_text,
+                job_category,
+                progress_callback=_on_progress,
+                save_result=Config.RESULT_STORE_ENABLED,
+                resume=resume
+            )
+
         # プログレス表示をクリア
         progress_bar.empty()
         status_text.empty()
@@ -127,6 +150,76 @@ def generate_full_output(job_text: str, job_category: str):
         raise e
 
 
+@profiled("ui.html_table")
+def build_html_table(table_data: List[List[Any]], a_comments: Dict[str, str]) -> str:
+    """
+    分析表のHTMLを生成（セルはエスケープし、内容A列には a_comments の要約を添える）
+    
+    Args:
+        table_data: 表データ（1行目がヘッダー）
+        a_comments: 項目名 → 内容Aへのコメント
+        
+    Returns:
+        <table> 要素のHTML文字列
+    """
+    headers = table_data[0]
+    try:
+        a_col_index = headers.index(next(h for h in headers if '内容A' in h))
+    except Exception:
+        a_col_index = 1
+
+    parts = ['<table class="custom-table">']
+
+    # ヘッダー
+    parts.append('<thead><tr>')
+    for col in headers:
+        parts.append(f'<th>{escape(str(col))}</th>')
+    parts.append('</tr></thead>')
+
+    # データ行
+    parts.append('<tbody>')
+    for row in table_data[1:]:
+        parts.append('<tr>')
+        item_name = row[0]
+        for ci, cell in enumerate(row):
+            cell_html = escape(str(cell)) if cell is not None else ''
+            if ci == a_col_index:
+                comment = a_comments.get(item_name, '')
+                if comment:
+                    short = (comment[:50] + '...') if len(comment) > 50 else comment
+                    comment_html = f"<div class='a-comment'>{escape(short)}</div>"
+                else:
+                    comment_html = ''
+                parts.append(f'<td>{cell_html}{comment_html}</td>')
+            else:
+                parts.append(f'<td>{cell_html}</td>')
+        parts.append('</tr>')
+    parts.append('</tbody>')
+
+    parts.append('</table>')
+    return ''.join(parts)
+
+
+def load_saved_result(job_text: str, job_category: str):
+    """
+    生成結果ストアから保存済みの結果を取得
+    
+    Args:
+        job_text: 求人テキスト
+        job_category: 職種名
+        
+    Returns:
+        保存済みの結果（result_store.ResultStore.lookup の戻り値）。無い場合・参照に失敗した場合は None
+    """
+    if not Config.RESULT_STORE_ENABLED:
+        return None
+    try:
+        return get_result_store().lookup(job_text, job_category)
+    except Exception as e:
+        logger.warning(f"生成結果ストアの参照に失敗しました: {str(e)}")
+        return None
+
+
 # ==================== 入力エリア ====================
 st.subheader("📋 求人情報を入力してください")
 
@@ -148,6 +241,13 @@ with col2:
         help="職種名を入力してください（例: 法人営業、バックエンドエンジニア）"
     )
 
+# 保存済みの結果の利用
+use_saved_result = Config.RESULT_STORE_ENABLED and st.checkbox(
+    "保存済みの結果があれば使う",
+    value=True,
+    help="同じ求人票・職種名で生成済みの場合、再生成せずに保存済みの結果（修正を含む）を表示します"
+)
+
 # 生成ボタン
 generate_button = st.button(
     "🔥 生成",
@@ -156,19 +256,210 @@ generate_button = st.button(
     use_container_width=True
 )
 
+def show_generated_output(job_text: str, job_category: str, seed_key: str = None, resume: bool = False, layer3_only: bool = False):
+    """
+    生成（または差分再生成・続きから再開・レイヤー③だけ再生成）して結果をセッションに反映
+    JOBS_ENABLED の場合はバックグラウンドジョブとして登録し、結果は完了後に apply_job_result で反映する
+    """
+    if Config.JOBS_ENABLED:
+        mode = DELTA if seed_key else LAYER3 if layer3_only else PIPELINE
+        job = get_job_manager().submit(job_text, job_category, mode=mode, seed_key=seed_key, resume=resume)
+        st.session_state.job = job['job_id']
+        st.query_params["job"] = job['job_id']
+        st.session_state.last_generation = {'job_text': job_text, 'job_category': job_category, 'failed': False}
+        if job['coalesced']:
+            st.info("♻️ 同じ求人の生成が実行中のため、その進捗を表示します")
+        return
+
+    st.session_state.last_generation = {'job_text': job_text, 'job_category': job_category, 'failed': True}
+    output = generate_full_output(job_text, job_category, seed_key=seed_key, resume=resume, layer3_only=layer3_only)
+    st.session_state.last_generation['failed'] = False
+    st.session_state.output = output
+    st.session_state.result_key = result_key(job_text, job_category) if Config.RESULT_STORE_ENABLED else None
+    st.session_state.generation_count += 1
+    st.session_state.modification_history = []  # 履歴リセット
+    st.success("✅ 生成が完了しました!")
+
+
 if generate_button:
+    st.session_state.near_duplicate = None
     with st.spinner("処理中..."):
         try:
-            output = generate_full_output(job_text, job_category)
-            st.session_state.output = output
-            st.session_state.generation_count += 1
-            st.session_state.modification_history = []  # 履歴リセット
-            st.success("✅ 生成が完了しました!")
+            saved = load_saved_result(job_text, job_category) if use_saved_result else None
+            similar = find_similar(job_text, job_category) if use_saved_result and not saved else None
+            if saved:
+                st.session_state.output = saved["output"]
+                st.session_state.result_key = saved["result_key"]
+                st.session_state.modification_history = [
+                    {'request': m['request'], 'changes': m['changes'], 'timestamp': m['timestamp']}
+                    for m in saved["modifications"]
+                ]
+                st.session_state.last_generation = {'job_text': job_text, 'job_category': job_category, 'failed': False}
+                st.session_state.job = None
+                st.query_params.pop("job", None)
+                st.success(f"✅ 保存済みの結果を表示しました（生成日時: {saved['created_at']}）")
+            elif similar:
+                # 生成はせず、類似求人の結果の使い方を選んでもらう
+                st.session_state.near_duplicate = {**similar, 'job_text': job_text, 'job_category': job_category}
+            else:
+                show_generated_output(job_text, job_category)
             
+        except (OverloadedError, CircuitOpenError) as e:
+            st.warning(f"⏳ {str(e)}")
         except Exception as e:
             st.error(f"❌ エラーが発生しました: {str(e)}")
             st.info("エラーの詳細はログファイルを確認してください")
 
+# 直近の生成の続きから再開（失敗した場合のみ）・レイヤー③だけ再生成（チェックポイントを使う）
+last = st.session_state.last_generation
+if Config.CHECKPOINT_ENABLED and last and not st.session_state.near_duplicate:
+    resume_button = False
+    if last['failed']:
+        col_resume, col_layer3 = st.columns(2)
+        with col_resume:
+            resume_button = st.button(
+                "🔁 続きから再開", use_container_width=True, disabled=bool(st.session_state.job),
+                help="前回の生成で完了したレイヤーの結果を使い、失敗したレイヤーから再実行します"
+            )
+    else:
+        col_layer3 = st.container()
+    with col_layer3:
+        layer3_button = st.button(
+            "🔄 レイヤー③だけ再生成", use_container_width=True, disabled=bool(st.session_state.job),
+            help="求人の構造化（レイヤー①）と業界標準との比較（レイヤー②・Web検索）の結果を使い、教育資料だけを作り直します"
+        )
+
+    if resume_button or layer3_button:
+        with st.spinner("処理中..."):
+            try:
+                show_generated_output(last['job_text'], last['job_category'], resume=resume_button, layer3_only=layer3_button)
+            except (OverloadedError, CircuitOpenError) as e:
+                st.warning(f"⏳ {str(e)}")
+            except Exception as e:
+                st.error(f"❌ エラーが発生しました: {str(e)}")
+                st.info("エラーの詳細はログファイルを確認してください")
+
+# 類似求人が見つかった場合の選択
+if st.session_state.near_duplicate:
+    near = st.session_state.near_duplicate
+    st.info(
+        f"♻️ 類似する求人の生成結果があります（類似度: {near['similarity']:.0%}、生成日時: {near['created_at']}）。"
+        "使い方を選んでください。"
+    )
+    col_reuse, col_delta, col_full = st.columns(3)
+    with col_reuse:
+        reuse_button = st.button("そのまま使う", use_container_width=True,
+                                 help="類似求人の結果（修正を含む）をそのまま表示します。API呼び出しはありません")
+    with col_delta:
+        delta_button = st.button("差分だけ再生成", use_container_width=True,
+                                 help="業界標準との比較（レイヤー②・Web検索）を再利用し、レイヤー①③だけを実行します")
+    with col_full:
+        full_button = st.button("新規に生成", use_container_width=True,
+                                help="類似求人の結果を使わずに全レイヤーを実行します")
+
+    if reuse_button or delta_button or full_button:
+        st.session_state.near_duplicate = None
+        with st.spinner("処理中..."):
+            try:
+                if reuse_button:
+                    artifacts = get_result_store().load_artifacts(near['result_key'])
+                    if not artifacts:
+                        raise Exception("類似求人の生成結果が見つかりません")
+                    # この求人のキーで新しく保存する（以降の修正が類似求人の結果・修正履歴を書き換えないように）。
+                    # レイヤー①は類似求人のものなので保存せず、元の結果のキーを残す（差分再生成では layer2 だけを使う）
+                    st.session_state.output = artifacts['current_output'] or artifacts['final_output']
+                    st.session_state.result_key = get_result_store().save(
+                        near['job_text'], near['job_category'], st.session_state.output,
+                        layer2=artifacts['layer2'], source_key=near['result_key']
+                    )
+                    try:
+                        get_near_duplicate_index().add(st.session_state.result_key, near['job_text'], near['job_category'])
+                    except Exception as e:
+                        logger.warning(f"類似求人の索引への登録に失敗しました: {str(e)}")
+                    st.session_state.modification_history = []
+                    st.session_state.job = None
+                    st.query_params.pop("job", None)
+                    st.success("✅ 類似求人の結果を表示しました")
+                else:
+                    show_generated_output(
+                        near['job_text'],
+                        near['job_category'],
+                        seed_key=near['result_key'] if delta_button else None
+                    )
+            except (OverloadedError, CircuitOpenError) as e:
+                st.warning(f"⏳ {str(e)}")
+            except Exception as e:
+                st.error(f"❌ エラーが発生しました: {str(e)}")
+                st.info("エラーの詳細はログファイルを確認してください")
+
+
+# ==================== 生成ジョブの進捗 ====================
+def apply_job_result(job_id: str):
+    """
+    終了した生成ジョブの結果をセッションに反映（失敗した場合はエラーを表示）
+
+    Args:
+        job_id: ジョブID
+    """
+    st.session_state.job = None
+    job = get_job_manager().get(job_id, with_output=True)
+    if job is None:
+        st.query_params.pop("job", None)
+        st.warning("生成ジョブが見つかりません（保存期間を過ぎた可能性があります）")
+        return
+
+    st.session_state.last_generation = {
+        'job_text': job['job_text'], 'job_category': job['job_category'], 'failed': job['status'] != SUCCEEDED
+    }
+    if job['status'] != SUCCEEDED:
+        if job['error_kind'] == 'overloaded':
+            st.warning(f"⏳ {job['error']}")
+        else:
+            st.error(f"❌ エラーが発生しました: {job['error']}")
+            st.info("エラーの詳細はログファイルを確認してください")
+        return
+
+    # 再読み込みで接続し直した場合に、完了後の修正も含めて表示する
+    saved = load_saved_result(job['job_text'], job['job_category'])
+    if saved:
+        st.session_state.output = saved["output"]
+        st.session_state.result_key = saved["result_key"]
+        st.session_state.modification_history = [
+            {'request': m['request'], 'changes': m['changes'], 'timestamp': m['timestamp']}
+            for m in saved["modifications"]
+        ]
+    else:
+        st.session_state.output = job['output']
+        st.session_state.result_key = None
+        st.session_state.modification_history = []
+    st.session_state.generation_count += 1
+    st.success("✅ 生成が完了しました!")
+
+
+def show_job_progress():
+    """実行中のジョブの進捗（この部分だけを定期的に再実行し、終了したらページ全体を再実行して結果を反映する）"""
+    job = get_job_manager().get(st.session_state.job) if st.session_state.job else None
+    if job is None or job['status'] not in ACTIVE:
+        st.rerun()
+    st.progress(job['progress'], text=job['message'] or "")
+    for stage in job['stages']:
+        st.caption(f"✅ {stage['label']}（{stage['seconds']:.1f}秒）")
+    st.caption("ページを再読み込み・移動しても生成は続きます（このページを開き直すと進捗を表示します）")
+
+
+if Config.JOBS_ENABLED:
+    # st.fragment は streamlit>=1.37 が必要（ジョブを使わない場合は従来のバージョンでも動く）
+    show_job_progress = st.fragment(run_every=Config.JOB_POLL_INTERVAL_SEC)(show_job_progress)
+
+if st.session_state.job:
+    current_job = get_job_manager().get(st.session_state.job)
+    if current_job is None or current_job['status'] not in ACTIVE:
+        apply_job_result(st.session_state.job)
+    else:
+        st.markdown("---")
+        st.subheader("⏳ 生成中")
+        show_job_progress()
+
 
 # ==================== 結果表示エリア ====================
 if st.session_state.output:
@@ -241,42 +532,7 @@ if st.session_state.output:
         """, unsafe_allow_html=True)
         
         # テーブルHTML生成
-        html_table = '<table class="custom-table">'
-
-        # ヘッダー
-        html_table += '<thead><tr>'
-        for col in table_data[0]:
-            html_table += f'<th>{escape(str(col))}</th>'
-        html_table += '</tr></thead>'
-
-        # データ行
-        a_comments = output.get('a_comments', {}) or {}
-        headers = table_data[0]
-        try:
-            a_col_index = headers.index(next(h for h in headers if '内容A' in h))
-        except Exception:
-            a_col_index = 1
-
-        html_table += '<tbody>'
-        for row in table_data[1:]:
-            html_table += '<tr>'
-            item_name = row[0]
-            for ci, cell in enumerate(row):
-                cell_html = escape(str(cell)) if cell is not None else ''
-                if ci == a_col_index:
-                    comment = a_comments.get(item_name, '')
-                    if comment:
-                        short = (comment[:50] + '...') if len(comment) > 50 else comment
-                        comment_html = f"<div class='a-comment'>{escape(short)}</div>"
-                    else:
-                        comment_html = ''
-                    html_table += f'<td>{cell_html}{comment_html}</td>'
-                else:
-                    html_table += f'<td>{cell_html}</td>'
-            html_table += '</tr>'
-        html_table += '</tbody>'
-
-        html_table += '</table>'
+        html_table = build_html_table(table_data, output.get('a_comments', {}) or {})
 
         # a_comments 用のスタイル
         st.markdown("""
@@ -393,6 +649,18 @@ if st.session_state.output:
                     'timestamp': modification_response.get('timestamp', '')
                 })
                 
+                # 生成結果ストアにも修正を記録（次回の参照時に修正後の出力を返す）
+                if st.session_state.result_key:
+                    try:
+                        get_result_store().add_modification(
+                            st.session_state.result_key,
+                            modification_request,
+                            modification_response.get('changes_made', []),
+                            modification_response["modified_output"]
+                        )
+                    except Exception as e:
+                        logger.warning(f"修正履歴の保存に失敗しました: {str(e)}")
+                
                 st.success("✅ 修正が完了しました!")
                 st.rerun()  # ページを再読み込み
                 
@@ -0,0 +1,147 @@
+"""
+実行コンテキスト（run ID / ステップタグ）の管理
+パイプライン実行・修正依頼・QAの各呼び出しに run ID を付与し、
+LLM呼び出しのトークン記録（token_usage.log）とアプリケーションログに伝播させる。
+
+contextvars を使うため、同時に複数セッションが処理されても run ID が混ざらない。
+スレッドを新たに起動して処理を続ける場合は contextvars.copy_context().run で引き継ぐこと。
+"""
+import contextvars
+import functools
+import logging
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from metrics import RUN_DURATION, RUNS, RUNS_IN_FLIGHT
+from profiling import profile_run
+
+_run_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("run_id", default=None)
+_run_kind: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("run_kind", default=None)
+_step: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("step", default=None)
+_attributes: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("run_attributes", default={})
+
+
+def new_run_id() -> str:
+    """run ID を生成（時刻プレフィックス付きで、ログ上で時系列に並ぶ）"""
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def current_run_id() -> Optional[str]:
+    return _run_id.get()
+
+
+def current_step() -> Optional[str]:
+    return _step.get()
+
+
+def current_context() -> Dict[str, Any]:
+    """
+    現在の実行コンテキスト（トークン記録に埋め込む項目）
+
+    Returns:
+        run_id / run_kind / step と run_context で指定した属性の辞書（未設定の項目は含めない）
+    """
+    context = {}
+    for key, var in (("run_id", _run_id), ("run_kind", _run_kind), ("step", _step)):
+        value = var.get()
+        if value is not None:
+            context[key] = value
+    context.update(_attributes.get())
+    return context
+
+
+@contextmanager
+def run_context(kind: str, run_id: Optional[str] = None, **attributes: Any) -> Iterator[str]:
+    """
+    run ID を割り当てて処理を実行する
+
+    Args:
+        kind: 実行種別（pipeline / modification / qa / batch など）
+        run_id: 指定した場合はその ID を使う（ジョブIDなどを引き継ぐ場合）
+        **attributes: トークン記録に付与する属性（job_category など）
+
+    実行数・実行中の件数・所要時間はメトリクス（metrics.RUNS など）にも記録する。
+    プロファイリングが有効な場合は、この実行を1つのプロファイルとして出力する（profiling.profile_run）
+
+    Yields:
+        割り当てた run ID
+    """
+    run_id = run_id or new_run_id()
+    tokens = [
+        (_run_id, _run_id.set(run_id)),
+        (_run_kind, _run_kind.set(kind)),
+        (_step, _step.set(None)),
+        (_attributes, _attributes.set({**_attributes.get(), **attributes})),
+    ]
+    status = "error"
+    try:
+        with RUNS_IN_FLIGHT.track_inprogress(kind=kind), RUN_DURATION.time(kind=kind), profile_run(kind, run_id):
+            yield run_id
+        status = "ok"
+    finally:
+        RUNS.inc(kind=kind, status=status)
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+@contextmanager
+def step(name: str) -> Iterator[str]:
+    """
+    ステップタグを設定する（入れ子の場合は「layer2.step1」のように連結）
+
+    Yields:
+        連結後のステップタグ
+    """
+    parent = _step.get()
+    full_name = f"{parent}.{name}" if parent else name
+    token = _step.set(full_name)
+    try:
+        yield full_name
+    finally:
+        _step.reset(token)
+
+
+def traced_run(kind: str) -> Callable:
+    """関数呼び出しごとに新しい run ID を割り当てるデコレータ"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with run_context(kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RunContextFilter(logging.Filter):
+    """ログレコードに run_id / step を付与する（フォーマット文字列の %(run_id)s 用）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.run_id = _run_id.get() or "-"
+        record.step = _step.get() or "-"
+        return True
+
+
+_factory_installed = False
+
+
+def install_log_record_factory() -> None:
+    """
+    すべてのログレコードに run_id / step を持たせる（logging.setLogRecordFactory。2回目以降は何もしない）
+    LOG_FORMAT は %(run_id)s を含むため、RunContextFilter を付けていないハンドラー・他ライブラリのロガーでも
+    フォーマットで失敗しないようにする（実行外のレコードは "-"）
+    """
+    global _factory_installed
+    if _factory_installed:
+        return
+    base_factory = logging.getLogRecordFactory()
+
+    def factory(*args: Any, **kwargs: Any) -> logging.LogRecord:
+        record = base_factory(*args, **kwargs)
+        record.run_id = _run_id.get() or "-"
+        record.step = _step.get() or "-"
+        return record
+
+    logging.setLogRecordFactory(factory)
+    _factory_installed = True
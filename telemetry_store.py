@@ -0,0 +1,450 @@
+"""
+テレメトリストア（SQLite）
+LLM呼び出しの記録（utils.append_token_usage と同じレコード）を SQLite（WALモード）に保存し、
+日別・レイヤー別・職種別のロールアップを SQL で引けるようにする。
+
+書き込みはバックグラウンドスレッドでまとめて行うため、呼び出し元はキューに積むだけで待たない。
+
+使い方（CLI）:
+    python telemetry_store.py import                  # 既存の token_usage.log を取り込む
+    python telemetry_store.py daily --days 30         # 日別のトークン・コスト・レイテンシ
+    python telemetry_store.py layers --days 7         # レイヤー/ステップ別
+    python telemetry_store.py categories --days 30    # 職種別
+    python telemetry_store.py models --days 7         # モデル × ステップ別（小さいモデルへの振り分け・昇格の件数）
+    python telemetry_store.py latency --by layer      # p50/p95/p99
+    python telemetry_store.py run <run_id>            # 1実行の明細
+"""
+import argparse
+import atexit
+import json
+import queue
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import Config
+from metrics import QUEUE_DEPTH, QUEUE_DROPPED
+from model_routing import prices_for
+from utils import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    day TEXT NOT NULL,
+    run_id TEXT,
+    run_kind TEXT,
+    step TEXT,
+    layer TEXT,
+    job_category TEXT,
+    model TEXT,
+    prompt_len INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    cached_tokens INTEGER,
+    finish_reason TEXT,
+    latency_ms REAL,
+    total_latency_ms REAL,
+    retries INTEGER,
+    rate_limited INTEGER,
+    error TEXT,
+    batch INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_ts ON llm_calls(ts);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_day ON llm_calls(day);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_run_id ON llm_calls(run_id);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_layer_day ON llm_calls(layer, day);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_category_day ON llm_calls(job_category, day);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_model_day ON llm_calls(model, day);
+
+CREATE VIEW IF NOT EXISTS v_daily AS
+SELECT day,
+       COUNT(*) AS calls,
+       SUM(error IS NOT NULL) AS failed_calls,
+       COUNT(DISTINCT run_id) AS runs,
+       IFNULL(SUM(prompt_tokens), 0) AS prompt_tokens,
+       IFNULL(SUM(completion_tokens), 0) AS completion_tokens,
+       IFNULL(SUM(cached_tokens), 0) AS cached_tokens,
+       ROUND(SUM(cost_usd), 4) AS cost_usd,
+       ROUND(AVG(latency_ms), 1) AS avg_latency_ms,
+       IFNULL(SUM(retries), 0) AS retries,
+       IFNULL(SUM(rate_limited), 0) AS rate_limited
+FROM llm_calls GROUP BY day;
+
+CREATE VIEW IF NOT EXISTS v_daily_layer AS
+SELECT day, layer, step,
+       COUNT(*) AS calls,
+       IFNULL(SUM(prompt_tokens), 0) AS prompt_tokens,
+       IFNULL(SUM(completion_tokens), 0) AS completion_tokens,
+       IFNULL(SUM(cached_tokens), 0) AS cached_tokens,
+       ROUND(SUM(cost_usd), 4) AS cost_usd,
+       ROUND(AVG(latency_ms), 1) AS avg_latency_ms,
+       IFNULL(SUM(retries), 0) AS retries,
+       SUM(finish_reason = 'length') AS truncated
+FROM llm_calls GROUP BY day, layer, step;
+
+CREATE VIEW IF NOT EXISTS v_daily_job_category AS
+SELECT day, job_category,
+       COUNT(DISTINCT run_id) AS runs,
+       COUNT(*) AS calls,
+       IFNULL(SUM(total_tokens), 0) AS total_tokens,
+       ROUND(SUM(cost_usd), 4) AS cost_usd,
+       ROUND(SUM(cost_usd) / MAX(COUNT(DISTINCT run_id), 1), 5) AS cost_per_run_usd,
+       ROUND(AVG(latency_ms), 1) AS avg_latency_ms
+FROM llm_calls WHERE run_kind = 'pipeline' OR run_kind = 'batch'
+GROUP BY day, job_category;
+
+CREATE VIEW IF NOT EXISTS v_daily_model AS
+SELECT day, model, step,
+       COUNT(*) AS calls,
+       SUM(error IS NOT NULL) AS failed_calls,
+       IFNULL(SUM(json_extract(extra, '$.escalated') = 1), 0) AS escalated,
+       IFNULL(SUM(prompt_tokens), 0) AS prompt_tokens,
+       IFNULL(SUM(completion_tokens), 0) AS completion_tokens,
+       ROUND(SUM(cost_usd), 4) AS cost_usd,
+       ROUND(AVG(latency_ms), 1) AS avg_latency_ms
+FROM llm_calls GROUP BY day, model, step;
+"""
+
+COLUMNS = [
+    "ts", "day", "run_id", "run_kind", "step", "layer", "job_category", "model",
+    "prompt_len", "prompt_tokens", "completion_tokens", "total_tokens", "cached_tokens",
+    "finish_reason", "latency_ms", "total_latency_ms", "retries", "rate_limited",
+    "error", "batch", "cost_usd", "extra",
+]
+_KNOWN_KEYS = set(COLUMNS) | {"timestamp", "stage", "flex"}
+
+
+def estimate_cost(record: Dict[str, Any]) -> float:
+    """レコードのトークン数から料金（USD）を概算（モデルごとの単価。キャッシュヒット分は割引単価）"""
+    prompt = record.get("prompt_tokens") or 0
+    cached = min(record.get("cached_tokens") or 0, prompt)
+    completion = record.get("completion_tokens") or 0
+    price_input, price_cached, price_output = prices_for(record.get("model"))
+    cost = (
+        (prompt - cached) * price_input
+        + cached * price_cached
+        + completion * price_output
+    ) / 1_000_000
+    if record.get("batch"):
+        cost *= Config.BATCH_PRICE_RATIO
+    return cost
+
+
+def to_row(record: Dict[str, Any]) -> tuple:
+    """token_usage レコードを llm_calls の1行に変換"""
+    ts = record.get("timestamp") or datetime.now().isoformat(timespec="milliseconds")
+    # 旧形式のバッチ記録（stage = layer2_step1 など）は同期実行と同じ表記に揃える
+    step = record.get("step") or (record["stage"].replace("_", ".") if record.get("stage") else None)
+    run_id = record.get("run_id")
+    if not run_id and record.get("batch_run_id") and record.get("posting_id"):
+        run_id = f"batch:{record['batch_run_id']}:{record['posting_id']}"
+    extra = {k: v for k, v in record.items() if k not in _KNOWN_KEYS}
+    values = {
+        **record,
+        "ts": ts,
+        "day": ts[:10],
+        "run_id": run_id,
+        "run_kind": record.get("run_kind") or ("batch" if record.get("batch") else None),
+        "step": step,
+        "layer": step.split(".", 1)[0] if step else None,
+        "batch": 1 if record.get("batch") else 0,
+        "cost_usd": estimate_cost(record),
+        "extra": json.dumps(extra, ensure_ascii=False) if extra else None,
+    }
+    return tuple(values.get(c) for c in COLUMNS)
+
+
+def connect(path: Path = None) -> sqlite3.Connection:
+    """WALモードで接続し、スキーマを作成"""
+    path = Path(path or Config.TELEMETRY_DB)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+# ==================== バックグラウンド書き込み ====================
+class TelemetryStore:
+    """
+    レコードをキューに積み、バックグラウンドスレッドがまとめて INSERT する
+    キューが上限に達した場合は記録を破棄して呼び出し元を待たせない（破棄件数は dropped に残す）
+    """
+
+    def __init__(self, path: Path = None, flush_interval: float = None, batch_size: int = None, max_queue: int = 10000):
+        self.path = Path(path or Config.TELEMETRY_DB)
+        self.flush_interval = Config.TELEMETRY_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.batch_size = batch_size or Config.TELEMETRY_BATCH_SIZE
+        self.dropped = 0
+        self._disabled = False
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_queue)
+        self._flushed = threading.Condition()
+        self._pending = 0
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        """書き込み待ちの件数"""
+        return self._pending
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        if self._disabled:
+            return
+        try:
+            row = to_row(record)
+        except Exception as e:
+            logger.debug(f"テレメトリ記録の変換に失敗しました: {str(e)}")
+            return
+        with self._flushed:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._flushed:
+                self._pending -= 1
+                self.dropped += 1
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """キューに積まれた記録が書き込まれるまで待つ"""
+        with self._flushed:
+            return self._flushed.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def close(self) -> None:
+        self.flush()
+        self._queue.put(None)
+        self._thread.join(timeout=10.0)
+
+    def _run(self) -> None:
+        try:
+            conn = connect(self.path)
+        except Exception as e:
+            logger.warning(f"テレメトリDBを開けませんでした。以降の記録は破棄します: {str(e)}")
+            self._disabled = True
+            with self._flushed:
+                self._pending = 0
+                self._flushed.notify_all()
+            return
+        stop = False
+        while not stop:
+            rows: List[tuple] = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                if item is None:
+                    stop = True
+                else:
+                    rows.append(item)
+                # まとめて書き込むため、溜まっている分を取り出す
+                while len(rows) < self.batch_size:
+                    item = self._queue.get_nowait()
+                    if item is None:
+                        stop = True
+                        break
+                    rows.append(item)
+            except queue.Empty:
+                pass
+            if rows:
+                self._write(conn, rows)
+        conn.close()
+
+    def _write(self, conn: sqlite3.Connection, rows: List[tuple]) -> None:
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO llm_calls ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    rows
+                )
+        except Exception as e:
+            logger.warning(f"テレメトリDBへの書き込みに失敗しました（{len(rows)}件）: {str(e)}")
+        finally:
+            with self._flushed:
+                self._pending -= len(rows)
+                self._flushed.notify_all()
+
+
+_store: Optional[TelemetryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> TelemetryStore:
+    """プロセス共通のストア（初回呼び出し時に書き込みスレッドを起動）"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TelemetryStore()
+            atexit.register(_store.close)
+            QUEUE_DEPTH.set_function(lambda: _store.pending, queue="telemetry_db")
+            QUEUE_DROPPED.set_function(lambda: _store.dropped, queue="telemetry_db")
+        return _store
+
+
+def record_llm_call(record: Dict[str, Any]) -> None:
+    """LLM呼び出しの記録をストアに積む（utils.append_token_usage から呼ばれる）"""
+    get_store().submit(record)
+
+
+# ==================== 取り込み・集計 ====================
+def import_jsonl(path: Path, conn: sqlite3.Connection, batch_size: int = 1000) -> int:
+    """
+    token_usage.log（JSONL）を1行ずつ読み込んで取り込む
+
+    Returns:
+        取り込んだ件数
+    """
+    count = 0
+    rows: List[tuple] = []
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(to_row(json.loads(line)))
+            except (json.JSONDecodeError, AttributeError):
+                continue
+            if len(rows) >= batch_size:
+                count += _insert(conn, rows)
+                rows = []
+    if rows:
+        count += _insert(conn, rows)
+    return count
+
+
+def _insert(conn: sqlite3.Connection, rows: List[tuple]) -> int:
+    with conn:
+        conn.executemany(
+            f"INSERT INTO llm_calls ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            rows
+        )
+    return len(rows)
+
+
+def _since(days: int) -> str:
+    return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def query_rollup(conn: sqlite3.Connection, view: str, days: int) -> List[Dict[str, Any]]:
+    """ロールアップビューから直近 days 日分を取得"""
+    order = {
+        "v_daily": "day",
+        "v_daily_layer": "day, layer, step",
+        "v_daily_job_category": "day, cost_usd DESC",
+        "v_daily_model": "day, model, step",
+    }[view]
+    cursor = conn.execute(f"SELECT * FROM {view} WHERE day >= ? ORDER BY {order}", (_since(days),))
+    names = [d[0] for d in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def query_latency_percentiles(conn: sqlite3.Connection, by: str, days: int) -> List[Dict[str, Any]]:
+    """
+    グループ別のレイテンシ分位点（SQLite に分位関数が無いため、グループごとに並べて取り出す）
+
+    Args:
+        by: day / layer / step / model / job_category
+        days: 集計対象の日数
+    """
+    if by not in ("day", "layer", "step", "model", "job_category"):
+        raise ValueError(f"未対応の集計キーです: {by}")
+    groups = conn.execute(
+        f"SELECT {by}, COUNT(*) FROM llm_calls WHERE day >= ? AND latency_ms IS NOT NULL GROUP BY {by} ORDER BY {by}",
+        (_since(days),)
+    ).fetchall()
+    results = []
+    for key, n in groups:
+        row = {by: key, "calls": n}
+        for label, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            offset = min(n - 1, max(0, int(round(q * n + 0.5)) - 1))
+            value = conn.execute(
+                f"SELECT latency_ms FROM llm_calls WHERE day >= ? AND latency_ms IS NOT NULL AND {by} IS ? "
+                f"ORDER BY latency_ms LIMIT 1 OFFSET ?",
+                (_since(days), key, offset)
+            ).fetchone()
+            row[f"{label}_ms"] = value[0] if value else None
+        results.append(row)
+    return results
+
+
+def query_run(conn: sqlite3.Connection, run_id: str) -> List[Dict[str, Any]]:
+    cursor = conn.execute(
+        "SELECT ts, step, model, prompt_tokens, completion_tokens, cached_tokens, latency_ms, retries, "
+        "finish_reason, error, ROUND(cost_usd, 5) AS cost_usd FROM llm_calls WHERE run_id = ? ORDER BY ts",
+        (run_id,)
+    )
+    names = [d[0] for d in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def _print_table(rows: Iterable[Dict[str, Any]]) -> None:
+    rows = list(rows)
+    if not rows:
+        print("（該当データなし）")
+        return
+    headers = list(rows[0].keys())
+    widths = [max(len(str(h)), *(len(str(r[h])) for r in rows)) for h in headers]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for r in rows:
+        print("  ".join(str(r[h]).ljust(w) for h, w in zip(headers, widths)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="テレメトリDB（トークン使用量・コスト・レイテンシ）の集計")
+    parser.add_argument("--db", default=str(Config.TELEMETRY_DB), help="テレメトリDBのパス")
+    parser.add_argument("--json", action="store_true", help="JSONで出力")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="token_usage.log を取り込む")
+    p_import.add_argument("--log", default=str(Config.LOG_DIR / "token_usage.log"))
+
+    for name, help_text in (
+        ("daily", "日別"), ("layers", "レイヤー/ステップ別"), ("categories", "職種別"), ("models", "モデル × ステップ別")
+    ):
+        p = sub.add_parser(name, help=f"{help_text}のトークン・コスト・レイテンシ")
+        p.add_argument("--days", type=int, default=30)
+
+    p_latency = sub.add_parser("latency", help="レイテンシ分位点")
+    p_latency.add_argument("--by", default="layer", choices=["day", "layer", "step", "model", "job_category"])
+    p_latency.add_argument("--days", type=int, default=7)
+
+    p_run = sub.add_parser("run", help="1実行の明細")
+    p_run.add_argument("run_id")
+
+    args = parser.parse_args()
+    conn = connect(Path(args.db))
+
+    if args.command == "import":
+        count = import_jsonl(Path(args.log), conn)
+        print(f"{count}件を取り込みました: {args.db}")
+        return
+
+    if args.command == "daily":
+        rows = query_rollup(conn, "v_daily", args.days)
+    elif args.command == "layers":
+        rows = query_rollup(conn, "v_daily_layer", args.days)
+    elif args.command == "categories":
+        rows = query_rollup(conn, "v_daily_job_category", args.days)
+    elif args.command == "models":
+        rows = query_rollup(conn, "v_daily_model", args.days)
+    elif args.command == "latency":
+        rows = query_latency_percentiles(conn, args.by, args.days)
+    else:
+        rows = query_run(conn, args.run_id)
+
+    if args.json:
+        json.dump(rows, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        _print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+テスト共通の設定
+LLM・Web検索はモック（LLM_TRANSPORT=mock / SEARCH_TRANSPORT=mock）で実行し、メトリクスの公開・トレースの出力は行わない。
+環境変数は config の読み込み前に設定する（config.env の値より優先される）。
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ["OPENAI_API_KEY"] = ""
+os.environ["LLM_TRANSPORT"] = "mock"
+os.environ["SEARCH_TRANSPORT"] = "mock"
+os.environ["METRICS_PORT"] = "0"
+os.environ["TRACE_EXPORTERS"] = ""
+os.environ["TELEMETRY_SINK"] = "jsonl"
+
+from config import Config  # noqa: E402
+
+
+@pytest.fixture
+def result_db(tmp_path, monkeypatch):
+    """テストごとの結果DB（プロセス共通のストアも作り直す）"""
+    import checkpoints
+    import near_duplicates
+    import result_store
+    import search_cache
+    import search_policy
+
+    path = tmp_path / "results.db"
+    monkeypatch.setattr(Config, "RESULT_DB", path)
+    for module, name in ((checkpoints, "_store"), (result_store, "_store"),
+                         (search_cache, "_cache"), (search_policy, "_policy"), (near_duplicates, "_index")):
+        monkeypatch.setattr(module, name, None)
+    return path
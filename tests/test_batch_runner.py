@@ -0,0 +1,128 @@
+"""バッチ処理（batch_runner）の再開"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import batch_runner
+import pipeline
+from batch_runner import BatchRun, run_local
+from config import Config
+from mock_openai_server import MockState
+
+POSTINGS = [
+    {"id": "p1", "job_text": "【経理】月次決算・請求書発行", "job_category": "経理"},
+    {"id": "p2", "job_text": "【法人営業】既存顧客へのルート営業", "job_category": "法人営業"},
+]
+
+
+class FakeBatchClient:
+    """mock_openai_server の状態を直接使う Batch API クライアント（files / batches のみ）"""
+
+    def __init__(self, state: MockState = None):
+        self.state = state or MockState()
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    def _create_file(self, file, purpose):
+        return SimpleNamespace(**self.state.add_file(file.read(), "input.jsonl", purpose))
+
+    def _file_content(self, file_id):
+        return SimpleNamespace(text=self.state.files[file_id]["content"].decode("utf-8"))
+
+    def _create_batch(self, **body):
+        return SimpleNamespace(**self.state.create_batch(body))
+
+    def _retrieve_batch(self, batch_id):
+        return SimpleNamespace(**self.state.retrieve_batch(batch_id))
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def batch_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "BATCH_DIR", tmp_path / "batches")
+    return Config.BATCH_DIR
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """layer2_step3 の検索判断（p1 だけ検索する）と Web検索の呼び出し回数"""
+    calls = {"decide": 0, "search": 0}
+
+    def decide(comparison_v1, job_category, structured_data):
+        calls["decide"] += 1
+        return (job_category == "経理", "テスト", ["使用技術"] if job_category == "経理" else [])
+
+    def search(job_category, structured_data):
+        calls["search"] += 1
+        return "【業務フロー】テスト用の検索結果", True
+
+    monkeypatch.setattr(batch_runner, "_decide_web_search", decide)
+    monkeypatch.setattr(batch_runner, "execute_dual_search", search)
+    return calls
+
+
+def test_resume_uses_submitted_batch_without_rebuilding(batch_dir, searches, monkeypatch):
+    client = FakeBatchClient()
+    run = BatchRun("resume", client=client, poll_interval=0)
+    run.add_postings(POSTINGS)
+    run.run_stage("layer1")
+    run.run_stage("layer2_step1")
+
+    # layer2_step3 の投入直後にプロセスが終了した
+    def interrupted(batch_id):
+        raise Interrupted()
+
+    monkeypatch.setattr(client.batches, "retrieve", interrupted)
+    with pytest.raises(Interrupted):
+        run.run_stage("layer2_step3")
+    assert searches == {"decide": 2, "search": 1}
+
+    resumed_client = FakeBatchClient(client.state)
+    resumed = BatchRun("resume", client=resumed_client, poll_interval=0)
+    resumed.run_stage("layer2_step3")
+
+    # 再開時は検索の判断も Web検索もやり直さない
+    assert searches == {"decide": 2, "search": 1}
+    assert len([s for s in resumed.manifest["submissions"] if s["stage"] == "layer2_step3"]) == 1
+    results = resumed._load_stage_results("layer2_step3")
+    assert results["p1"]["ok"] and "comparison_v2" in results["p1"]["value"]
+    assert results["p2"]["ok"] and "comparison_v2" not in results["p2"]["value"]
+    assert resumed.manifest["postings"]["p1"]["search_record"] == {"triggers": ["使用技術"], "web_results": True}
+
+
+def test_full_run_and_completed_stages_are_skipped(batch_dir, searches):
+    client = FakeBatchClient()
+    run = BatchRun("full", client=client, poll_interval=0)
+    run.add_postings(POSTINGS)
+    results_path = run.run()
+
+    lines = [json.loads(line) for line in results_path.read_text(encoding="utf-8").splitlines()]
+    assert sorted(line["id"] for line in lines) == ["p1", "p2"]
+    batches = len(client.state.batches)
+
+    BatchRun("full", client=client, poll_interval=0).run()
+    assert len(client.state.batches) == batches
+
+
+def test_run_local_defaults_posting_ids(batch_dir, monkeypatch):
+    calls = []
+
+    def fake_pipeline(job_text, job_category, run_id=None, save_result=False, resume=False):
+        calls.append(run_id)
+        return {"job_text": job_text}
+
+    monkeypatch.setattr(pipeline, "run_pipeline", fake_pipeline)
+    postings = [{k: v for k, v in p.items() if k != "id"} for p in POSTINGS]
+
+    results_path = run_local(postings, "local", workers=1)
+    lines = [json.loads(line) for line in results_path.read_text(encoding="utf-8").splitlines()]
+    assert sorted(line["id"] for line in lines) == ["posting-1", "posting-2"]
+    assert sorted(calls) == ["local:posting-1", "local:posting-2"]
+
+    # 同じ run-id では完了済みの求人を省く
+    run_local(postings, "local", workers=1)
+    assert len(calls) == 2
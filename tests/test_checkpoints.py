@@ -0,0 +1,103 @@
+"""チェックポイント（checkpoints.RunCheckpoints）を使ったステージグラフの再開とフィンガープリントによる無効化"""
+from stage_graph import CACHED, RUN, SEEDED, Stage, StageGraph
+from checkpoints import RunCheckpoints
+
+RUN_KEY = "test-run-key"
+
+
+def _graph(calls):
+    def parse(text):
+        calls.append("parse")
+        return {"words": text.split()}
+
+    def count(words):
+        calls.append("count")
+        return {"total": len(words)}
+
+    def report(total, label):
+        calls.append("report")
+        return {"report": f"{label}: {total}"}
+
+    return StageGraph([
+        Stage("parse", parse, ["text"], ["words"], layer="layer1"),
+        Stage("count", count, ["words"], ["total"], layer="layer2"),
+        Stage("report", report, ["total", "label"], ["report"], layer="layer3"),
+    ])
+
+
+def _run(graph, inputs, **kwargs):
+    # 再開のたびに新しい生成として読み込み直す
+    return graph.run(inputs, cache=RunCheckpoints(RUN_KEY), **kwargs)
+
+
+def test_resume_reuses_all_stages_with_same_inputs(result_db):
+    calls = []
+    graph = _graph(calls)
+    inputs = {"text": "a b c", "label": "件数"}
+
+    first = _run(graph, inputs)
+    assert first.values["report"] == "件数: 3"
+    assert calls == ["parse", "count", "report"]
+
+    calls.clear()
+    second = _run(graph, inputs)
+    assert second.values["report"] == "件数: 3"
+    assert calls == []
+    assert second.stages_with(CACHED) == ["parse", "count", "report"]
+
+
+def test_changed_input_invalidates_only_downstream(result_db):
+    calls = []
+    graph = _graph(calls)
+    _run(graph, {"text": "a b c", "label": "件数"})
+
+    # report だけが読む入力を変えると、report だけ再計算する
+    calls.clear()
+    result = _run(graph, {"text": "a b c", "label": "語数"})
+    assert calls == ["report"]
+    assert result.values["report"] == "語数: 3"
+    assert result.statuses["parse"] == CACHED and result.statuses["count"] == CACHED
+
+    # 最上流の入力を変えると、すべて再計算する
+    calls.clear()
+    result = _run(graph, {"text": "a b c d", "label": "語数"})
+    assert calls == ["parse", "count", "report"]
+    assert result.values["report"] == "語数: 4"
+
+
+def test_same_upstream_output_keeps_downstream_checkpoint(result_db):
+    calls = []
+    graph = _graph(calls)
+    _run(graph, {"text": "a b c", "label": "件数"})
+
+    # parse の出力が変わっても count の出力（total）が同じなら report のフィンガープリントは一致する
+    calls.clear()
+    result = _run(graph, {"text": "x y z", "label": "件数"})
+    assert calls == ["parse", "count"]
+    assert result.statuses["report"] == CACHED
+
+
+def test_reuse_cache_false_recomputes_and_saves(result_db):
+    calls = []
+    graph = _graph(calls)
+    inputs = {"text": "a b c", "label": "件数"}
+    _run(graph, inputs)
+
+    calls.clear()
+    result = _run(graph, inputs, reuse_cache=False)
+    assert calls == ["parse", "count", "report"]
+    assert result.stages_with(RUN) == ["parse", "count", "report"]
+
+
+def test_targets_and_seed(result_db):
+    calls = []
+    graph = _graph(calls)
+
+    upstream = graph.run({"text": "a b", "label": "件数"}, targets=["total"])
+    assert calls == ["parse", "count"]
+    assert "report" not in upstream.values
+
+    calls.clear()
+    result = graph.run({"text": "a b", "label": "件数"}, seed={"words": upstream.values["words"], "total": 2})
+    assert calls == ["report"]
+    assert result.statuses["parse"] == SEEDED and result.statuses["count"] == SEEDED
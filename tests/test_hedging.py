@@ -0,0 +1,75 @@
+"""ヘッジ付きトランスポート（llm_transport.HedgedTransport）の上限"""
+import threading
+import time
+from types import SimpleNamespace
+
+from llm_transport import HedgedTransport, LLMTransport
+
+
+def _response(content="ok"):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+class SlowTransport(LLMTransport):
+    """常に delay 秒かかるトランスポート（呼び出し回数を数える）"""
+
+    name = "fake"
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def chat_completion(self, body):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return _response()
+
+
+def _transport(inner, max_rate):
+    transport = HedgedTransport(inner, max_rate=max_rate, min_samples=0)
+    # 実績に関わらず、応答が 10ms 以内に返らなければヘッジの対象にする
+    transport.hedge_delay = lambda key: 0.01
+    return transport
+
+
+def test_hedge_rate_is_capped():
+    inner = SlowTransport(0.05)
+    transport = _transport(inner, max_rate=0.25)
+
+    for _ in range(20):
+        assert transport.chat_completion({"model": "m", "messages": []}).choices[0].message.content == "ok"
+
+    stats = transport.snapshot()
+    assert stats["requests"] == 20
+    # 直近のリクエストに占めるヘッジの割合は max_rate 以下
+    assert stats["fired"] == 5
+    assert stats["denied"] == 15
+    assert stats["won"] + stats["lost"] == stats["fired"]
+    assert inner.calls == 25
+
+
+def test_no_hedge_when_rate_is_zero():
+    inner = SlowTransport(0.03)
+    transport = _transport(inner, max_rate=0.0)
+
+    for _ in range(5):
+        transport.chat_completion({"model": "m", "messages": []})
+
+    stats = transport.snapshot()
+    assert stats["fired"] == 0
+    assert stats["denied"] == 5
+    assert inner.calls == 5
+
+
+def test_no_hedge_without_samples():
+    inner = SlowTransport(0.0)
+    transport = HedgedTransport(inner, max_rate=1.0, min_samples=3)
+    key = ("m", "-")
+
+    assert transport.hedge_delay(key) is None
+    for _ in range(3):
+        transport.chat_completion({"model": "m", "messages": []})
+    assert transport.hedge_delay(key) is not None
+    assert transport.snapshot()["fired"] == 0
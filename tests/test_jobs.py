@@ -0,0 +1,86 @@
+"""生成ジョブ（jobs.JobManager）の中断からの回復"""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from jobs import FAILED, PIPELINE, RUNNING, SUCCEEDED, JobManager, job_key
+from result_store import _now, _pack
+
+JOB_TEXT = "【経理スタッフ】月次決算・請求書発行・経費精算をご担当いただきます。"
+JOB_CATEGORY = "経理"
+
+
+def _dead_owner() -> str:
+    """終了済みのプロセスを所有者とする（同じホスト）"""
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return f"{socket.gethostname()}:{process.pid}"
+
+
+def _insert_job(manager: JobManager, job_id: str, owner: str, job_text: str = JOB_TEXT) -> None:
+    now = _now()
+    with manager._conn:
+        manager._conn.execute(
+            "INSERT INTO generation_jobs (job_id, job_key, mode, job_category, status, owner, created_at, updated_at, "
+            "job_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, job_key(job_text, JOB_CATEGORY), PIPELINE, JOB_CATEGORY, RUNNING, owner, now, now, _pack(job_text))
+        )
+
+
+def _wait_finished(manager: JobManager, job_id: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job["status"] in (SUCCEEDED, FAILED):
+            return job
+        time.sleep(0.1)
+    pytest.fail(f"ジョブが終了しませんでした: {job_id}")
+
+
+def test_reap_orphans_marks_dead_owner_interrupted(result_db):
+    manager = JobManager(result_db)
+    _insert_job(manager, "orphan", _dead_owner())
+
+    manager.reap_orphans()
+
+    job = manager.get("orphan")
+    assert job["status"] == FAILED
+    assert job["error_kind"] == "interrupted"
+    assert job["finished_at"] is not None
+
+
+def test_reap_orphans_keeps_live_owner(result_db):
+    manager = JobManager(result_db)
+    # 親プロセス（pytest を起動したシェルなど）は生きている
+    _insert_job(manager, "alive", f"{socket.gethostname()}:{os.getppid()}")
+    # 別ホストのプロセスは確認できないため生きているとみなす
+    _insert_job(manager, "remote", "other-host:1", job_text=JOB_TEXT + "（別ホスト）")
+
+    manager.reap_orphans()
+
+    assert manager.get("alive")["status"] == RUNNING
+    assert manager.get("remote")["status"] == RUNNING
+
+
+def test_reopened_manager_recovers_and_resubmits(result_db):
+    # 前のプロセスが実行中のまま終了した
+    previous = JobManager(result_db)
+    _insert_job(previous, "interrupted", _dead_owner())
+
+    manager = JobManager(result_db, workers=1)
+    submitted = manager.submit(JOB_TEXT, JOB_CATEGORY, resume=True)
+
+    # 中断されたジョブにはまとめず、失敗として記録して新しく登録する
+    assert submitted["coalesced"] is False
+    assert submitted["job_id"] != "interrupted"
+    assert manager.get("interrupted")["error_kind"] == "interrupted"
+
+    job = _wait_finished(manager, submitted["job_id"])
+    assert job["status"] == SUCCEEDED, job["error"]
+    assert job["resume"] is True
+    assert [s["stage"] for s in job["stages"]][-1] == "assemble"
+    assert manager.get(submitted["job_id"], with_output=True)["output"]
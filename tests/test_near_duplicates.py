@@ -0,0 +1,62 @@
+"""類似求人の結果の再利用（そのまま使う・差分再生成）"""
+import pytest
+
+from near_duplicates import find_similar, get_near_duplicate_index
+from pipeline import regenerate_layer3, run_pipeline, run_pipeline_delta
+from result_store import get_result_store, result_key
+
+JOB_CATEGORY = "経理"
+ORIGINAL = "【経理スタッフ】月次決算・請求書発行・経費精算をご担当いただきます。Excel・freee を使用します。月給28万円〜。"
+REPOST = "【経理スタッフ】月次決算・請求書発行・経費精算をご担当いただきます。Excel・freee を使用します。月給30万円〜。"
+
+
+@pytest.fixture
+def original(result_db):
+    run_pipeline(ORIGINAL, JOB_CATEGORY, save_result=True)
+    return result_key(ORIGINAL, JOB_CATEGORY)
+
+
+def _reuse(original_key):
+    """UI の「そのまま使う」と同じ保存"""
+    artifacts = get_result_store().load_artifacts(original_key)
+    key = get_result_store().save(
+        REPOST, JOB_CATEGORY, artifacts["final_output"], layer2=artifacts["layer2"], source_key=original_key
+    )
+    get_near_duplicate_index().add(key, REPOST, JOB_CATEGORY)
+    return key
+
+
+def test_repost_is_found(original):
+    similar = find_similar(REPOST, JOB_CATEGORY)
+    assert similar is not None
+    assert similar["result_key"] == original
+
+
+def test_reused_result_is_marked_as_borrowed(original):
+    key = _reuse(original)
+
+    artifacts = get_result_store().load_artifacts(key)
+    assert artifacts["source_key"] == original
+    assert artifacts["layer1"] is None
+    # 索引に登録され、次の再掲載の候補になる（完全一致は候補から除かれる）
+    keys = [m["result_key"] for m in get_near_duplicate_index().query(REPOST + "（再掲載）", JOB_CATEGORY, limit=5)]
+    assert key in keys
+
+
+def test_layer3_regeneration_does_not_use_borrowed_artifacts(original):
+    _reuse(original)
+
+    with pytest.raises(Exception, match="最初から生成してください"):
+        regenerate_layer3(REPOST, JOB_CATEGORY)
+
+
+def test_delta_from_borrowed_result_runs_layer3(original):
+    key = _reuse(original)
+    stages = []
+
+    output = run_pipeline_delta(
+        REPOST + "（再掲載）", JOB_CATEGORY, key, on_stage=lambda stage, *_: stages.append(stage)
+    )
+    assert output
+    # レイヤー①の比較対象が無いため、レイヤー③も実行する
+    assert set(stages) == {"layer1", "reuse_layer2", "layer3", "a_comments", "tech", "assemble"}
@@ -0,0 +1,85 @@
+"""パイプライン（pipeline）の途中からの再開"""
+import pytest
+
+from pipeline import PIPELINE_GRAPH, run_pipeline, run_pipeline_delta
+from result_store import get_result_store, result_key
+
+JOB_TEXT = "【経理スタッフ】月次決算・請求書発行・経費精算をご担当いただきます。Excel・freee を使用します。"
+JOB_CATEGORY = "経理"
+
+
+class StageFailure(Exception):
+    pass
+
+
+def _run(**kwargs):
+    stages = []
+    output = run_pipeline(JOB_TEXT, JOB_CATEGORY, on_stage=lambda stage, *_: stages.append(stage), **kwargs)
+    return output, stages
+
+
+def _fail_stage(monkeypatch, name):
+    def failing(**kwargs):
+        raise StageFailure(name)
+
+    monkeypatch.setattr(PIPELINE_GRAPH.stages[name], "func", failing)
+
+
+def test_fresh_run_executes_every_stage(result_db):
+    _, stages = _run()
+    assert sorted(stages) == sorted(PIPELINE_GRAPH.order)
+
+    # resume しない場合はチェックポイントがあってもすべて実行する
+    _, stages = _run()
+    assert sorted(stages) == sorted(PIPELINE_GRAPH.order)
+
+
+def test_resume_after_tech_failure_keeps_layer3(result_db, monkeypatch):
+    with monkeypatch.context() as m:
+        _fail_stage(m, "tech")
+        with pytest.raises(StageFailure):
+            _run()
+
+    output, stages = _run(resume=True)
+    assert output
+    # 失敗したステージとその下流だけを実行する（レイヤー③の出力は再利用する）
+    assert "layer3" not in stages
+    assert "tech" in stages and "assemble" in stages
+    assert not {"layer1", "step2_1", "search", "step2_3"} & set(stages)
+
+
+def test_resume_after_layer3_failure_skips_layer1_and_layer2(result_db, monkeypatch):
+    with monkeypatch.context() as m:
+        _fail_stage(m, "layer3")
+        with pytest.raises(StageFailure):
+            _run()
+
+    _, stages = _run(resume=True)
+    assert stages[0] == "layer3"
+    assert set(stages) == {"layer3", "a_comments", "tech", "assemble"}
+
+
+def test_delta_reuses_layer2_through_the_graph(result_db):
+    run_pipeline(JOB_TEXT, JOB_CATEGORY, save_result=True)
+    seed_key = result_key(JOB_TEXT, JOB_CATEGORY)
+    repost = JOB_TEXT + "\n・支払業務の改善"
+
+    stages = []
+    output = run_pipeline_delta(
+        repost, JOB_CATEGORY, seed_key, on_stage=lambda stage, *_: stages.append(stage), save_result=True
+    )
+    assert output
+    assert set(stages) == {"layer1", "reuse_layer2", "layer3", "a_comments", "tech", "assemble"}
+    saved = get_result_store().load_artifacts(result_key(repost, JOB_CATEGORY))
+    assert saved["layer2"]["content_a"] == saved["layer1"]
+
+
+def test_delta_with_same_layer1_skips_layer3(result_db):
+    expected = run_pipeline(JOB_TEXT, JOB_CATEGORY, save_result=True)
+
+    stages = []
+    output = run_pipeline_delta(
+        JOB_TEXT, JOB_CATEGORY, result_key(JOB_TEXT, JOB_CATEGORY), on_stage=lambda stage, *_: stages.append(stage)
+    )
+    assert stages == ["layer1", "reuse_layer2"]
+    assert output == expected
@@ -0,0 +1,102 @@
+"""検索キャッシュ（search_cache）の hit / stale / negative / miss"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import search_cache
+from config import Config
+from search_cache import SearchCache, SearchFailure, cache_key, cached_search
+
+PARAMS = {"q": "経理 業務フロー 標準的な流れ", "num": 5, "hl": "ja", "gl": "jp", "engine": "google"}
+RESULTS = [{"title": "経理の業務フロー", "snippet": "月次決算", "link": "https://example.com/a"}]
+
+
+@pytest.fixture
+def cache(result_db, monkeypatch):
+    cache = SearchCache(result_db)
+    # 本番の検索（serpapi）と同じくキャッシュを通す
+    monkeypatch.setattr(Config, "SEARCH_TRANSPORT", "serpapi")
+    monkeypatch.setattr(Config, "SEARCH_CACHE_ENABLED", True)
+    monkeypatch.setattr(search_cache, "_cache", cache)
+    return cache
+
+
+def _shift_clock(monkeypatch, **delta):
+    now = datetime.now() + timedelta(**delta)
+    monkeypatch.setattr(search_cache, "_now", lambda: now)
+
+
+def test_miss_then_hit(cache):
+    calls = []
+    fetch = lambda: calls.append(1) or RESULTS
+
+    assert cache.get(cache_key(PARAMS)) == ("miss", None)
+    assert cached_search(PARAMS, fetch) == RESULTS
+    assert cached_search(PARAMS, fetch) == RESULTS
+    assert len(calls) == 1
+    assert cache.get(cache_key(PARAMS))[0] == "hit"
+
+
+def test_key_ignores_query_spacing_and_case():
+    assert cache_key({**PARAMS, "q": "  Excel　 VBA  "}) == cache_key({**PARAMS, "q": "excel vba"})
+
+
+def test_stale_after_ttl(cache, monkeypatch):
+    key = cache_key(PARAMS)
+    cache.put(key, PARAMS["q"], RESULTS)
+
+    _shift_clock(monkeypatch, hours=Config.SEARCH_CACHE_TTL_HOURS + 1)
+    state, entry = cache.get(key)
+    assert state == "stale"
+    assert entry["results"] == RESULTS
+
+    _shift_clock(monkeypatch, hours=Config.SEARCH_CACHE_TTL_HOURS + Config.SEARCH_CACHE_STALE_HOURS + 1)
+    assert cache.get(key) == ("miss", None)
+
+
+def test_stale_returns_saved_results_and_revalidates(cache, monkeypatch):
+    key = cache_key(PARAMS)
+    cache.put(key, PARAMS["q"], RESULTS)
+    _shift_clock(monkeypatch, hours=Config.SEARCH_CACHE_TTL_HOURS + 1)
+
+    revalidated = []
+    monkeypatch.setattr(cache, "revalidate_async", lambda k, q, fetch: revalidated.append(k))
+    assert cached_search(PARAMS, lambda: pytest.fail("stale のエントリは同期で再検索しない")) == RESULTS
+    assert revalidated == [key]
+
+
+def test_negative_for_search_failure(cache):
+    def failing():
+        raise SearchFailure("HTTP 500 api_key=secret")
+
+    with pytest.raises(SearchFailure):
+        cached_search(PARAMS, failing)
+    state, entry = cache.get(cache_key(PARAMS))
+    assert state == "negative"
+    assert "secret" not in entry["error"]
+
+    # 期限内は再検索せずに保存済みの失敗を返す
+    with pytest.raises(Exception, match="再検索を見合わせます"):
+        cached_search(PARAMS, lambda: pytest.fail("ネガティブキャッシュの期限内に再検索した"))
+
+
+def test_negative_expires(cache, monkeypatch):
+    key = cache_key(PARAMS)
+    cache.put_error(key, PARAMS["q"], "HTTP 500")
+    _shift_clock(monkeypatch, seconds=Config.SEARCH_CACHE_NEGATIVE_TTL_SEC + 1)
+    assert cache.get(key) == ("miss", None)
+
+
+def test_empty_results_are_negative(cache):
+    assert cached_search(PARAMS, lambda: []) == []
+    assert cache.get(cache_key(PARAMS))[0] == "negative"
+    assert cached_search(PARAMS, lambda: pytest.fail("0件の結果の期限内に再検索した")) == []
+
+
+def test_local_errors_are_not_cached(cache):
+    def failing():
+        raise RuntimeError("ブレーカーが開いています")
+
+    with pytest.raises(RuntimeError):
+        cached_search(PARAMS, failing)
+    assert cache.get(cache_key(PARAMS)) == ("miss", None)
@@ -0,0 +1,99 @@
+"""Web検索の実行判断（search_policy）と、レイヤー②からの実績の記録"""
+import pytest
+
+import layer2
+import search_policy
+from config import Config
+from search_policy import LOW_CONFIDENCE_TRIGGER, SearchPolicy, explore_draw
+
+CATEGORY = "経理"
+STRUCTURED = {"job_title": "経理スタッフ", "tasks": ["月次決算", "請求書発行"]}
+
+
+@pytest.fixture
+def policy(result_db, monkeypatch):
+    policy = SearchPolicy(result_db)
+    # 本番の LLM と同じく実績を記録・参照する
+    monkeypatch.setattr(Config, "LLM_TRANSPORT", "openai")
+    monkeypatch.setattr(search_policy, "_policy", policy)
+    return policy
+
+
+def _comparison(confidence, uncertain=()):
+    return {"confidence_score": confidence, "uncertain_aspects": list(uncertain)}
+
+
+def _history(policy, trigger, uplift, n=Config.SEARCH_POLICY_MIN_SAMPLES):
+    for _ in range(n):
+        policy.record(CATEGORY, [trigger], 0.5, 0.5 + uplift)
+
+
+def test_explore_is_deterministic_per_posting(policy, monkeypatch):
+    _history(policy, LOW_CONFIDENCE_TRIGGER, 0.0)
+    rule = (True, "自信度 0.50 < 閾値 0.65")
+    monkeypatch.setattr(Config, "SEARCH_POLICY_EXPLORE_RATE", 0.5)
+
+    keys = [f"求人{i}" for i in range(40)]
+    first = [policy.decide(CATEGORY, [LOW_CONFIDENCE_TRIGGER], 0.5, rule, key)[0] for key in keys]
+    second = [policy.decide(CATEGORY, [LOW_CONFIDENCE_TRIGGER], 0.5, rule, key)[0] for key in keys]
+    assert first == second
+    # 求人ごとの判定値が EXPLORE_RATE の割合で探索される
+    assert first == [explore_draw(CATEGORY, key) < 0.5 for key in keys]
+    assert 0 < sum(first) < len(keys)
+
+
+def test_explore_rate_bounds(policy, monkeypatch):
+    _history(policy, LOW_CONFIDENCE_TRIGGER, 0.0)
+    rule = (True, "自信度 0.50 < 閾値 0.65")
+
+    monkeypatch.setattr(Config, "SEARCH_POLICY_EXPLORE_RATE", 0.0)
+    should_search, reason = policy.decide(CATEGORY, [LOW_CONFIDENCE_TRIGGER], 0.5, rule, "求人")
+    assert not should_search and "省略" in reason
+
+    monkeypatch.setattr(Config, "SEARCH_POLICY_EXPLORE_RATE", 1.0)
+    assert policy.decide(CATEGORY, [LOW_CONFIDENCE_TRIGGER], 0.5, rule, "求人")[0]
+
+
+def test_unknown_trigger_keeps_rule_search(policy):
+    _history(policy, LOW_CONFIDENCE_TRIGGER, 0.0)
+    should_search, _ = policy.decide(CATEGORY, [LOW_CONFIDENCE_TRIGGER, "使用技術"], 0.5, (True, "理由"), "求人")
+    assert should_search
+
+
+def test_priority_search_records_low_confidence_trigger(policy):
+    _history(policy, LOW_CONFIDENCE_TRIGGER, 0.2)
+    comparison_v1 = _comparison(Config.CONFIDENCE_THRESHOLD + 0.05)
+
+    should_search, _, triggers = layer2._decide_web_search(comparison_v1, CATEGORY, STRUCTURED)
+    assert should_search
+    assert triggers == [LOW_CONFIDENCE_TRIGGER]
+
+
+def test_no_search_has_no_triggers(policy):
+    should_search, _, triggers = layer2._decide_web_search(_comparison(0.95), CATEGORY, STRUCTURED)
+    assert not should_search
+    assert triggers == []
+
+
+def _run_step2(monkeypatch, comparison_v1, has_web_results):
+    monkeypatch.setattr(layer2, "execute_dual_search", lambda category, data: ("（検索結果なし）", has_web_results))
+    monkeypatch.setattr(layer2, "_step3_web_integration", lambda v1, context: {**v1, "confidence_score": 0.8})
+    web_context, search_record = layer2._run_web_search(comparison_v1, CATEGORY, STRUCTURED)
+    return layer2._integrate_web_search(comparison_v1, web_context, STRUCTURED, CATEGORY, search_record)
+
+
+def test_outcome_recorded_with_web_results(policy, monkeypatch):
+    comparison = _run_step2(monkeypatch, _comparison(0.5, ["使用技術が不明"]), has_web_results=True)
+
+    assert comparison["web_search_performed"]
+    stats = {r["trigger"]: r for r in policy.stats()}
+    assert set(stats) == {"使用技術", LOW_CONFIDENCE_TRIGGER}
+    assert stats["使用技術"]["mean_uplift"] == pytest.approx(0.3)
+
+
+def test_outcome_not_recorded_without_web_results(policy, monkeypatch):
+    # SerpAPI の障害・ブレーカーの即失敗・ローカル検索での代替
+    comparison = _run_step2(monkeypatch, _comparison(0.5, ["使用技術が不明"]), has_web_results=False)
+
+    assert comparison["web_search_performed"]
+    assert policy.stats() == []
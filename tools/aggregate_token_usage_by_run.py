@@ -1,87 +1,163 @@
 #!/usr/bin/env python3
-import re, json, sys
+"""
+token_usage.log を run ID ごとに集計する
+
+各レコードに付与された run_id（telemetry.run_context）でグループ化し、
+ステップ（layer1 / layer2.step1 など）別の内訳、リトライ・レート制限・キャッシュヒット、
+finish_reason の分布を出力する。ログは1行ずつ読み込むため、巨大なログでもメモリに載せない。
+
+使い方:
+    python tools/aggregate_token_usage_by_run.py
+    python tools/aggregate_token_usage_by_run.py --kind pipeline --run-id 20250126093000-1a2b3c4d
+"""
+import argparse
+import json
+import sys
 from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
 
 BASE = Path(__file__).resolve().parents[1] / 'logs'
-RECRUITER_LOG = BASE / 'recruiter_system.log'
 TOKEN_LOG = BASE / 'token_usage.log'
 OUT_JSON = BASE / 'token_usage_by_run.json'
 
-if not RECRUITER_LOG.exists() or not TOKEN_LOG.exists():
-    print('必要なログファイルが見つかりません。')
-    print(RECRUITER_LOG, RECRUITER_LOG.exists())
-    print(TOKEN_LOG, TOKEN_LOG.exists())
-    sys.exit(1)
-
-text = RECRUITER_LOG.read_text(encoding='utf-8')
-# Split into run chunks by long separator lines (===...)
-chunks = re.split(r"\n=+\n", text)
-
-# Only keep chunks that contain at least one "レイヤー" or OpenAI line
-run_chunks = []
-for ch in chunks:
-    if 'レイヤー①' in ch or '修正依頼処理 開始' in ch or 'OpenAI API呼び出し成功' in ch:
-        run_chunks.append(ch)
-
-# For each chunk, count successful OpenAI calls
-success_pattern = re.compile(r'OpenAI API呼び出し成功')
-# extract first timestamp in chunk
-ts_pattern = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})")
-
-runs = []
-for ch in run_chunks:
-    success_count = len(success_pattern.findall(ch))
-    ts_match = ts_pattern.search(ch)
-    ts = ts_match.group(1) if ts_match else None
-    runs.append({'timestamp': ts, 'success_count': success_count, 'chunk_head': ch[:200]})
-
-# Read token log lines
-token_lines = [l.strip() for l in TOKEN_LOG.read_text(encoding='utf-8').strip().splitlines() if l.strip()]
-tokens = [json.loads(l) for l in token_lines]
-
-# Assign token entries to runs sequentially based on success_count
-assignments = []
-idx = 0
-for i, r in enumerate(runs):
-    n = r['success_count']
-    if n <= 0:
-        continue
-    assigned = tokens[idx: idx + n]
-    idx += n
-    total_tokens = sum(t.get('total_tokens', 0) for t in assigned)
-    prompt_tokens = sum(t.get('prompt_tokens', 0) for t in assigned)
-    completion_tokens = sum(t.get('completion_tokens', 0) for t in assigned)
-    per_call = [t.get('total_tokens', 0) for t in assigned]
-    assignments.append({
-        'run_index': i+1,
-        'timestamp': r['timestamp'],
-        'success_count': n,
-        'total_tokens': total_tokens,
-        'prompt_tokens': prompt_tokens,
-        'completion_tokens': completion_tokens,
-        'per_call_tokens': per_call
-    })
-
-# If token lines remain unassigned, add them to a trailing 'unassigned' group
-if idx < len(tokens):
-    remaining = tokens[idx:]
-    assignments.append({
-        'run_index': len(assignments)+1,
-        'timestamp': None,
-        'success_count': len(remaining),
-        'total_tokens': sum(t.get('total_tokens',0) for t in remaining),
-        'prompt_tokens': sum(t.get('prompt_tokens',0) for t in remaining),
-        'completion_tokens': sum(t.get('completion_tokens',0) for t in remaining),
-        'per_call_tokens': [t.get('total_tokens',0) for t in remaining],
-        'note': 'remaining_unassigned'
-    })
-
-OUT_JSON.write_text(json.dumps(assignments, ensure_ascii=False, indent=2), encoding='utf-8')
-
-# Print concise summary
-print(f"Total token lines: {len(tokens)}")
-for a in assignments:
-    print('---')
-    print(f"Run #{a['run_index']}  timestamp={a['timestamp']}  calls={a['success_count']}  total_tokens={a['total_tokens']}  avg_per_call={a['total_tokens']/a['success_count'] if a['success_count']>0 else 0:.1f}")
-
-print('\n詳細は logs/token_usage_by_run.json を参照してください')
+# run_id を持たない旧形式のレコードの集計先
+UNATTRIBUTED = '(run_id なし)'
+
+
+def iter_records(path: Path) -> Iterator[Dict[str, Any]]:
+    """token_usage.log を1行ずつ読み、JSONとして解釈できた行を返す"""
+    with open(path, 'r', encoding='utf-8') as fh:
+        for line_no, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f'警告: {line_no}行目を解析できないためスキップします', file=sys.stderr)
+
+
+def resolve_run_id(record: Dict[str, Any]) -> str:
+    if record.get('run_id'):
+        return record['run_id']
+    # 旧形式のバッチ記録は batch_run_id + posting_id から復元できる
+    if record.get('batch_run_id') and record.get('posting_id'):
+        return f"batch:{record['batch_run_id']}:{record['posting_id']}"
+    return UNATTRIBUTED
+
+
+def _empty_totals() -> Dict[str, Any]:
+    return {
+        'calls': 0,
+        'failed_calls': 0,
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'total_tokens': 0,
+        'cached_tokens': 0,
+        'retries': 0,
+        'rate_limited': 0,
+        'latency_ms': 0.0
+    }
+
+
+def _add(totals: Dict[str, Any], record: Dict[str, Any]) -> None:
+    if record.get('error'):
+        totals['failed_calls'] += 1
+    else:
+        totals['calls'] += 1
+    for key in ('prompt_tokens', 'completion_tokens', 'total_tokens', 'cached_tokens', 'retries', 'rate_limited'):
+        totals[key] += record.get(key) or 0
+    totals['latency_ms'] += record.get('total_latency_ms') or record.get('latency_ms') or 0.0
+
+
+def aggregate(path: Path, run_id: Optional[str] = None, kind: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    run ID ごとに集計
+
+    Args:
+        path: token_usage.log のパス
+        run_id: 指定した run ID のみ集計
+        kind: 指定した実行種別（pipeline / modification / qa / batch）のみ集計
+
+    Returns:
+        run ID をキーとする集計結果
+    """
+    runs: Dict[str, Dict[str, Any]] = {}
+    for record in iter_records(path):
+        rid = resolve_run_id(record)
+        if run_id and rid != run_id:
+            continue
+        record_kind = record.get('run_kind') or ('batch' if record.get('batch') else None)
+        if kind and record_kind != kind:
+            continue
+
+        run = runs.get(rid)
+        if run is None:
+            run = runs[rid] = {
+                'run_id': rid,
+                'run_kind': record_kind,
+                'job_category': record.get('job_category'),
+                'first_timestamp': record.get('timestamp'),
+                'last_timestamp': record.get('timestamp'),
+                **_empty_totals(),
+                'finish_reasons': {},
+                'steps': {}
+            }
+        timestamp = record.get('timestamp')
+        if timestamp:
+            if not run['first_timestamp'] or timestamp < run['first_timestamp']:
+                run['first_timestamp'] = timestamp
+            if not run['last_timestamp'] or timestamp > run['last_timestamp']:
+                run['last_timestamp'] = timestamp
+
+        _add(run, record)
+        step_name = record.get('step') or record.get('stage') or '(ステップなし)'
+        _add(run['steps'].setdefault(step_name, _empty_totals()), record)
+        reason = record.get('finish_reason')
+        if reason:
+            run['finish_reasons'][reason] = run['finish_reasons'].get(reason, 0) + 1
+
+    for run in runs.values():
+        run['latency_ms'] = round(run['latency_ms'], 1)
+        for totals in run['steps'].values():
+            totals['latency_ms'] = round(totals['latency_ms'], 1)
+    return runs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='token_usage.log を run ID ごとに集計')
+    parser.add_argument('--log', default=str(TOKEN_LOG), help='token_usage.log のパス')
+    parser.add_argument('--out', default=str(OUT_JSON), help='集計結果（JSON）の出力先')
+    parser.add_argument('--run-id', default=None, help='指定した run ID のみ集計')
+    parser.add_argument('--kind', default=None, help='pipeline / modification / qa / batch で絞り込み')
+    args = parser.parse_args()
+
+    log_path = Path(args.log)
+    if not log_path.exists():
+        print('必要なログファイルが見つかりません。')
+        print(log_path, log_path.exists())
+        sys.exit(1)
+
+    runs = aggregate(log_path, run_id=args.run_id, kind=args.kind)
+    ordered = sorted(runs.values(), key=lambda r: (r['first_timestamp'] or '', r['run_id']))
+
+    out_path = Path(args.out)
+    out_path.write_text(json.dumps(ordered, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    # 簡潔なサマリーを表示
+    print(f"Runs: {len(ordered)}  Calls: {sum(r['calls'] for r in ordered)}")
+    for r in ordered:
+        avg = r['total_tokens'] / r['calls'] if r['calls'] else 0
+        print('---')
+        print(f"{r['run_id']}  kind={r['run_kind']}  start={r['first_timestamp']}  calls={r['calls']}  "
+              f"failed={r['failed_calls']}  total_tokens={r['total_tokens']}  avg_per_call={avg:.1f}  "
+              f"cached={r['cached_tokens']}  retries={r['retries']}  rate_limited={r['rate_limited']}")
+        for name, s in r['steps'].items():
+            print(f"    {name:<16} calls={s['calls']}  prompt={s['prompt_tokens']}  "
+                  f"completion={s['completion_tokens']}  latency_ms={s['latency_ms']}")
+
+    print(f'\n詳細は {out_path} を参照してください')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+"""
+スパントレーシング（OpenTelemetry 互換の最小実装）
+生成処理を「generate → ステージグラフの各ステージ（layer1 / step2_1 / search / step2_3 / layer3 / a_comments / tech / assemble）
+→ LLM呼び出し・検索」の階層スパンとして記録し、LLM呼び出しのリトライ試行・JSON解析のフォールバックも子スパンとして残す。
+
+出力先（Config.TRACE_EXPORTERS、カンマ区切り。既定は無効）:
+- file: logs/traces.jsonl に1スパン1行で追記
+- console: ルートスパン終了時に所要時間のツリーをログに出力
+- otlp: OTLP/HTTP（JSON）で Config.OTLP_ENDPOINT に送信（mock_openai_server の /v1/traces でも受信可能）
+
+使い方（CLI）:
+    python tracing.py show --last 3        # 直近3件のトレースをツリー表示
+    python tracing.py slowest --days 7     # スパン名ごとの所要時間 p50/p95
+"""
+import argparse
+import atexit
+import contextvars
+import functools
+import json
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+
+from config import Config
+from log_writer import AsyncLineWriter
+from telemetry import current_run_id
+
+SERVICE_NAME = "recruiter-pipeline"
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+# ==================== スパン ====================
+class Span:
+    """処理区間（開始・終了時刻と属性）"""
+
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "start_ns", "end_ns", "attributes", "status", "status_message")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else None
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.status = "OK"
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes: Any) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, error: BaseException) -> None:
+        self.status = "ERROR"
+        self.status_message = str(error)[:500]
+        self.attributes["error.type"] = type(error).__name__
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start": datetime.fromtimestamp(self.start_ns / 1e9).isoformat(timespec="milliseconds"),
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 2),
+            "status": self.status,
+            "status_message": self.status_message or None,
+            "attributes": self.attributes,
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_attribute(key: str, value: Any) -> None:
+    """現在のスパンに属性を付与（スパン外で呼ばれた場合は何もしない）"""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def set_attributes(**attributes: Any) -> None:
+    span = _current_span.get()
+    if span is not None:
+        span.set_attributes(**attributes)
+
+
+@contextmanager
+def start_span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    スパンを開始する（現在のスパンの子になる。例外は ERROR として記録し、そのまま送出）
+
+    Yields:
+        開始したスパン
+    """
+    parent = _current_span.get()
+    span = Span(name, parent, attributes)
+    if parent is None:
+        span.set_attribute("run_id", current_run_id())
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        _export(span)
+
+
+def traced(name: str) -> Callable:
+    """関数全体をスパンで囲むデコレータ"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ==================== エクスポーター ====================
+class FileSpanExporter:
+    """logs/traces.jsonl に1スパン1行で追記（書き込みはバックグラウンド）"""
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path or Config.TRACE_FILE)
+        self._writer = AsyncLineWriter(maxsize=Config.LOG_QUEUE_SIZE)
+
+    def export(self, span: Span) -> None:
+        self._writer.write(self.path, json.dumps(span.to_dict(), ensure_ascii=False))
+
+    def flush(self) -> None:
+        self._writer.flush()
+
+
+class ConsoleSpanExporter:
+    """ルートスパンの終了時に、トレース全体を所要時間付きのツリーとしてログ出力"""
+
+    def __init__(self):
+        self._spans: Dict[str, List[Span]] = {}
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self._spans.setdefault(span.trace_id, []).append(span)
+            if span.parent_span_id is not None:
+                return
+            spans = self._spans.pop(span.trace_id)
+        from utils import logger
+        logger.info("トレース:\n" + render_tree([s.to_dict() for s in spans]))
+
+    def flush(self) -> None:
+        pass
+
+
+class OTLPSpanExporter:
+    """
+    OTLP/HTTP（JSONエンコード）で送信する
+    スパンはキューに積み、バックグラウンドスレッドが一定間隔でまとめて POST する（失敗時は破棄）
+    """
+
+    def __init__(self, endpoint: str = None, interval: float = 2.0, batch_size: int = 512, maxsize: int = 10000):
+        self.endpoint = endpoint or Config.OTLP_ENDPOINT
+        self.interval = interval
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=maxsize)
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        self._send_pending()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._send_pending()
+
+    def _send_pending(self) -> None:
+        while True:
+            spans: List[Span] = []
+            try:
+                while len(spans) < self.batch_size:
+                    spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not spans:
+                return
+            try:
+                requests.post(self.endpoint, json=to_otlp(spans), timeout=5)
+            except Exception:
+                self.dropped += len(spans)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: List[Span]) -> Dict[str, Any]:
+    """スパンを OTLP/JSON の ExportTraceServiceRequest 形式に変換"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": "tracing"},
+                "spans": [{
+                    "traceId": s.trace_id,
+                    "spanId": s.span_id,
+                    "parentSpanId": s.parent_span_id or "",
+                    "name": s.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                    "status": {"code": 2 if s.status == "ERROR" else 1, "message": s.status_message},
+                } for s in spans],
+            }],
+        }]
+    }
+
+
+_EXPORTER_TYPES = {"file": FileSpanExporter, "console": ConsoleSpanExporter, "otlp": OTLPSpanExporter}
+_exporters: Optional[List[Any]] = None
+_exporters_lock = threading.Lock()
+
+
+def get_exporters() -> List[Any]:
+    """Config.TRACE_EXPORTERS に従ってエクスポーターを構築（初回のみ）"""
+    global _exporters
+    with _exporters_lock:
+        if _exporters is None:
+            names = [n.strip() for n in Config.TRACE_EXPORTERS.split(",") if n.strip()]
+            _exporters = [_EXPORTER_TYPES[n]() for n in names if n in _EXPORTER_TYPES]
+            if _exporters:
+                atexit.register(flush)
+        return _exporters
+
+
+def set_exporters(exporters: Optional[List[Any]]) -> None:
+    """エクスポーターを差し替える（None で Config に従って再構築）"""
+    global _exporters
+    with _exporters_lock:
+        _exporters = exporters
+
+
+def flush() -> None:
+    for exporter in _exporters or []:
+        try:
+            exporter.flush()
+        except Exception:
+            pass
+
+
+def _export(span: Span) -> None:
+    for exporter in get_exporters():
+        try:
+            exporter.export(span)
+        except Exception:
+            pass
+
+
+# ==================== 表示・集計 ====================
+def render_tree(spans: List[Dict[str, Any]]) -> str:
+    """1トレース分のスパン（to_dict 形式）を所要時間付きのツリー文字列にする"""
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {s["span_id"] for s in spans}
+    for s in sorted(spans, key=lambda x: x["start_ns"]):
+        parent = s["parent_span_id"] if s["parent_span_id"] in ids else None
+        children.setdefault(parent, []).append(s)
+
+    lines: List[str] = []
+
+    def walk(parent_id: Optional[str], depth: int) -> None:
+        for s in children.get(parent_id, []):
+            attrs = ", ".join(f"{k}={v}" for k, v in s["attributes"].items() if k != "run_id")
+            status = " ❌" if s["status"] == "ERROR" else ""
+            lines.append(f"{'  ' * depth}{s['name']:<{max(1, 32 - 2 * depth)}} {s['duration_ms']:>10.1f}ms{status}"
+                         + (f"  [{attrs}]" if attrs else ""))
+            walk(s["span_id"], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def _iter_spans(path: Path) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="トレース（logs/traces.jsonl）の表示・集計")
+    parser.add_argument("--file", default=str(Config.TRACE_FILE))
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_show = sub.add_parser("show", help="直近のトレースをツリー表示")
+    p_show.add_argument("--last", type=int, default=1)
+    p_show.add_argument("--run-id", default=None, help="指定した run ID のトレースのみ")
+    p_slow = sub.add_parser("slowest", help="スパン名ごとの所要時間 p50/p95")
+    p_slow.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+
+    path = Path(args.file)
+    if not path.exists():
+        print(f"トレースファイルが見つかりません: {path}")
+        return
+
+    if args.command == "show":
+        traces: Dict[str, List[Dict[str, Any]]] = {}
+        roots: List[Dict[str, Any]] = []
+        for span in _iter_spans(path):
+            traces.setdefault(span["trace_id"], []).append(span)
+            if span["parent_span_id"] is None:
+                if args.run_id and span["attributes"].get("run_id") != args.run_id:
+                    continue
+                roots.append(span)
+        for root in roots[-args.last:]:
+            print(f"=== trace {root['trace_id']}  run_id={root['attributes'].get('run_id')}  {root['start']} ===")
+            print(render_tree(traces[root["trace_id"]]))
+            print()
+        return
+
+    since = (datetime.now() - timedelta(days=args.days)).isoformat()
+    durations: Dict[str, List[float]] = {}
+    for span in _iter_spans(path):
+        if span["start"] >= since:
+            durations.setdefault(span["name"], []).append(span["duration_ms"])
+    print(f"{'span':<32} {'count':>6} {'p50_ms':>10} {'p95_ms':>10} {'total_s':>10}")
+    for name, values in sorted(durations.items(), key=lambda kv: -sum(kv[1])):
+        values.sort()
+        p50 = values[len(values) // 2]
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"{name:<32} {len(values):>6} {p50:>10.1f} {p95:>10.1f} {sum(values) / 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
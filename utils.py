@@ -5,11 +5,18 @@
 import json
 import time
 import logging
-from typing import Any, Dict, Optional, List
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, List, TypeVar
 import json as _json
 from config import Config
 from openai import OpenAI
 from config import Config
+from telemetry import RunContextFilter, current_context, current_step, install_log_record_factory, traced_run
+from log_writer import AsyncLineWriter, start_async_logging
+from tracing import current_span, set_attributes, start_span, traced
+from metrics import JSON_PARSE, LLM_IN_FLIGHT, MODEL_ESCALATIONS, QUEUE_DEPTH, QUEUE_DROPPED, observe_llm_call
+from model_routing import ROUTE_LARGE, ROUTE_SMALL, model_for, resolve_model, route_of_model
+from profiling import profiled
 
 
 # ==================== ログ設定 ====================
@@ -17,6 +24,9 @@ def setup_logger():
     """ログ設定を初期化"""
     # ログディレクトリ作成
     Config.LOG_DIR.mkdir(exist_ok=True)
+
+    # LOG_FORMAT の %(run_id)s を、フィルターの無いハンドラーのレコードでも使えるようにする
+    install_log_record_factory()
     
     # ロガー設定
     logger = logging.getLogger(__name__)
@@ -37,6 +47,22 @@ def setup_logger():
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(logging.Formatter(Config.LOG_FORMAT))
     
+    # run ID をログ行に付与（同時実行されたセッションのログを区別するため）
+    if Config.LOG_ASYNC:
+        # 書き込みはバックグラウンドスレッドで行う。run ID は contextvars から取るため呼び出し元スレッドで付与する
+        queue_handler, _ = start_async_logging(
+            logger,
+            [file_handler, console_handler],
+            maxsize=Config.LOG_QUEUE_SIZE,
+            filters=[RunContextFilter()]
+        )
+        QUEUE_DEPTH.set_function(queue_handler.queue.qsize, queue="log")
+        QUEUE_DROPPED.set_function(lambda: queue_handler.dropped, queue="log")
+        return logger
+    
+    for handler in (file_handler, console_handler):
+        handler.addFilter(RunContextFilter())
+    
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
     
@@ -68,11 +94,157 @@ def save_config_snapshot(version: str = "v2.0") -> None:
 
 
 # ==================== OpenAI API呼び出し ====================
+# JSONのみを返すよう強制するシステムメッセージ（call_openai_with_retry / バッチ処理で共通）
+JSON_SYSTEM_MESSAGE = (
+    "あなたは採用コンサルタントです。出力は厳密にJSONのみとし、"
+    "説明文・マークダウン・注釈を一切含めないでください。\n"
+    "必ず次の形式のJSONだけを返してください。例:\n"
+    '{"求人票名":"...","役割":"...","業務プロセス":"...","対象製品":"...","ステークホルダー":"...","使用技術":"..."}'
+)
+
+
+def get_openai_client() -> OpenAI:
+    """
+    Config に従って OpenAI クライアントを生成
+    OPENAI_BASE_URL が設定されている場合はそのエンドポイント（ローカルのスタンドイン等）を使用
+    """
+    if Config.OPENAI_BASE_URL:
+        return OpenAI(api_key=Config.OPENAI_API_KEY, base_url=Config.OPENAI_BASE_URL)
+    return OpenAI(api_key=Config.OPENAI_API_KEY)
+
+
+def build_chat_request_body(
+    prompt: str,
+    temperature: float,
+    max_completion_tokens: int,
+    system_message: str = None,
+    model: str = None
+) -> Dict[str, Any]:
+    """
+    chat.completions の リクエストボディを構築（同期呼び出しとBatch APIの入力行で共通）
+    
+    Args:
+        prompt: プロンプト
+        temperature: temperature値
+        max_completion_tokens: 最大トークン数
+        system_message: システムメッセージ（Noneの場合はJSON_SYSTEM_MESSAGE）
+        model: モデル名（Noneの場合はConfig.OPENAI_MODEL）
+        
+    Returns:
+        リクエストボディの辞書
+    """
+    return {
+        "model": model or Config.OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": system_message or JSON_SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": temperature,
+        "max_completion_tokens": max_completion_tokens
+    }
+
+
+_line_writer: Optional[AsyncLineWriter] = None
+
+
+def _get_line_writer() -> AsyncLineWriter:
+    """token_usage.log 用の非同期ライター（初回呼び出し時に書き込みスレッドを起動）"""
+    global _line_writer
+    if _line_writer is None:
+        _line_writer = AsyncLineWriter(maxsize=Config.LOG_QUEUE_SIZE)
+        QUEUE_DEPTH.set_function(lambda: _line_writer.pending, queue="token_log")
+        QUEUE_DROPPED.set_function(lambda: _line_writer.dropped, queue="token_log")
+    return _line_writer
+
+
+def flush_logs(timeout: float = 10.0) -> None:
+    """非同期で積まれたトークン記録・テレメトリを書き込み終えるまで待つ（CLI・ベンチマークの終了前など）"""
+    if _line_writer is not None:
+        _line_writer.flush(timeout)
+    if Config.TELEMETRY_SINK in ('sqlite', 'both'):
+        from telemetry_store import get_store
+        get_store().flush(timeout)
+
+
+def append_token_usage(record: Dict[str, Any]) -> None:
+    """
+    トークン使用量を記録（失敗してもログのみ）
+    Config.TELEMETRY_SINK に応じて logs/token_usage.log（1行JSON）と telemetry.db（バックグラウンド書き込み）に出力し、
+    メトリクス（呼び出し数・リトライ・トークン数・料金）にも反映する。
+    実行中の run ID・ステップタグ（telemetry.run_context / step）と記録時刻を自動で付与する
+    """
+    record = {'timestamp': datetime.now().isoformat(timespec='milliseconds'), **current_context(), **record}
+    span = current_span()
+    if span is not None:
+        # 呼び出し中のスパン（llm.call）にトークン数などを付与し、記録側にもトレースIDを残す
+        span.set_attributes(**{k: record.get(k) for k in (
+            'prompt_tokens', 'completion_tokens', 'cached_tokens', 'finish_reason', 'retries', 'rate_limited'
+        )})
+        record.setdefault('trace_id', span.trace_id)
+        record.setdefault('span_id', span.span_id)
+    try:
+        from telemetry_store import estimate_cost
+        observe_llm_call(record, estimate_cost(record))
+    except Exception:
+        logger.debug("メトリクスへの反映に失敗しました")
+    if Config.TELEMETRY_SINK in ('sqlite', 'both'):
+        try:
+            from telemetry_store import record_llm_call
+            record_llm_call(record)
+        except Exception:
+            logger.debug("テレメトリDBへの記録に失敗しました")
+    if Config.TELEMETRY_SINK not in ('jsonl', 'both'):
+        return
+    try:
+        token_log_path = Config.LOG_DIR / 'token_usage.log'
+        line = _json.dumps(record, ensure_ascii=False) + "\n"
+        if Config.LOG_ASYNC:
+            _get_line_writer().write(token_log_path, line)
+            return
+        Config.LOG_DIR.mkdir(parents=True, exist_ok=True)
+        with open(token_log_path, 'a', encoding='utf-8') as fh:
+            fh.write(line)
+    except Exception:
+        logger.debug("トークン使用ログの書き込みに失敗しました")
+
+
+def _extract_usage(response: Any) -> Optional[Dict[str, Any]]:
+    """
+    応答から usage を取り出す（openai SDK のオブジェクト / dict の両方に対応）
+
+    Returns:
+        prompt_tokens / completion_tokens / total_tokens / cached_tokens の辞書（usage が無い場合は None）
+    """
+    try:
+        usage = response.usage if hasattr(response, 'usage') else response.get('usage', None)
+    except Exception:
+        usage = None
+    if not usage:
+        return None
+
+    def _get(obj, key):
+        return obj.get(key) if isinstance(obj, dict) else getattr(obj, key, None)
+
+    try:
+        details = _get(usage, 'prompt_tokens_details')
+        return {
+            'prompt_tokens': _get(usage, 'prompt_tokens'),
+            'completion_tokens': _get(usage, 'completion_tokens'),
+            'total_tokens': _get(usage, 'total_tokens'),
+            'cached_tokens': (_get(details, 'cached_tokens') if details else None) or 0
+        }
+    except Exception:
+        return {'prompt_tokens': None, 'completion_tokens': None, 'total_tokens': None, 'cached_tokens': 0}
+
+
+@traced("llm.call")
 def call_openai_with_retry(
     prompt: str,
     temperature: float,
     max_completion_tokens: int,
-    max_retries: int = None
+    max_retries: int = None,
+    model: str = None,
+    escalated: bool = False
 ) -> str:
     """
     OpenAI APIをリトライ機能付きで呼び出し
@@ -82,6 +254,8 @@ def call_openai_with_retry(
         temperature: temperature値
         max_completion_tokens: 最大トークン数
         max_retries: 最大リトライ回数
+        model: モデル名（Noneの場合は実行中のステップタグから model_routing で決める）
+        escalated: 小さいモデルの応答をやり直す呼び出しかどうか（記録用）
         
     Returns:
         LLMの応答テキスト
@@ -92,29 +266,25 @@ def call_openai_with_retry(
     if max_retries is None:
         max_retries = Config.MAX_RETRIES
     
-    client = OpenAI(api_key=Config.OPENAI_API_KEY)
+    from llm_transport import get_llm_transport
+    from resilience import CircuitOpenError, openai_breaker
+    transport = get_llm_transport()
+    rate_limited = 0
+    started = time.perf_counter()
+    route, model = (route_of_model(model), model) if model else resolve_model()
+    breaker = openai_breaker(model)
+    set_attributes(model=model, route=route, prompt_chars=len(prompt), max_completion_tokens=max_completion_tokens)
     
     for attempt in range(max_retries):
         try:
             logger.info(f"OpenAI API呼び出し開始（試行 {attempt + 1}/{max_retries}）")
             
-            # 強制的にJSONのみを返すようにシステムメッセージを強化
-            system_msg = (
-                "あなたは採用コンサルタントです。出力は厳密にJSONのみとし、"
-                "説明文・マークダウン・注釈を一切含めないでください。\n"
-                "必ず次の形式のJSONだけを返してください。例:\n"
-                '{"求人票名":"...","役割":"...","業務プロセス":"...","対象製品":"...","ステークホルダー":"...","使用技術":"..."}'
-            )
-
-            response = client.chat.completions.create(
-                model=Config.OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=temperature,
-                max_completion_tokens=max_completion_tokens
-            )
+            attempt_started = time.perf_counter()
+            with start_span("llm.attempt", attempt=attempt + 1), LLM_IN_FLIGHT.track_inprogress(), breaker.guard():
+                response = transport.chat_completion(
+                    build_chat_request_body(prompt, temperature, max_completion_tokens, model=model)
+                )
+            latency_ms = round((time.perf_counter() - attempt_started) * 1000, 1)
             
             # レスポンスの詳細をログに記録
             logger.debug(f"API レスポンス全体: {response}")
@@ -160,50 +330,43 @@ def call_openai_with_retry(
 
 
             # トークン使用量が返ってくる場合はログに出力
-            try:
-                usage = response.usage if hasattr(response, 'usage') else response.get('usage', None)
-            except Exception:
-                usage = None
+            usage = _extract_usage(response)
 
             if usage:
-                try:
-                    p_t = usage.get('prompt_tokens') if isinstance(usage, dict) else getattr(usage, 'prompt_tokens', None)
-                    c_t = usage.get('completion_tokens') if isinstance(usage, dict) else getattr(usage, 'completion_tokens', None)
-                    t_t = usage.get('total_tokens') if isinstance(usage, dict) else getattr(usage, 'total_tokens', None)
-                except Exception:
-                    p_t = c_t = t_t = None
-                logger.info(f"OpenAI API呼び出し成功（応答文字数: {len(result)}）。usage: prompt={p_t}, completion={c_t}, total={t_t}")
-                # 併せて logs に詳細保存（1行JSON）
-                try:
-                    d = {
-                        'model': Config.OPENAI_MODEL,
-                        'prompt_len': len(prompt),
-                        'prompt_tokens': p_t,
-                        'completion_tokens': c_t,
-                        'total_tokens': t_t,
-                        'finish_reason': finish_reason  # ⭐⭐ 追加: finish_reasonを記録
-                    }
-                except Exception:
-                    d = None
-                try:
-                    if d:
-                        # Ensure log directory exists, then append to the token usage file
-                        Config.LOG_DIR.mkdir(parents=True, exist_ok=True)
-                        token_log_path = Config.LOG_DIR / 'token_usage.log'
-                        with open(token_log_path, 'a', encoding='utf-8') as fh:
-                            fh.write(_json.dumps(d, ensure_ascii=False) + "\n")
-                except Exception:
-                    logger.debug("トークン使用ログの書き込みに失敗しました")
+                logger.info(
+                    f"OpenAI API呼び出し成功（応答文字数: {len(result)}）。"
+                    f"usage: prompt={usage['prompt_tokens']}, completion={usage['completion_tokens']}, total={usage['total_tokens']}"
+                )
             else:
                 logger.info(f"OpenAI API呼び出し成功（応答文字数: {len(result)}）")
+            # 併せて logs に詳細保存（1行JSON）
+            append_token_usage({
+                'model': model,
+                'route': route,
+                'prompt_len': len(prompt),
+                **(usage or {}),
+                'finish_reason': finish_reason,  # ⭐⭐ 追加: finish_reasonを記録
+                'latency_ms': latency_ms,
+                'total_latency_ms': round((time.perf_counter() - started) * 1000, 1),
+                'retries': attempt,
+                'rate_limited': rate_limited,
+                **({'escalated': True} if escalated else {})
+            })
 
             return result
             
+        except CircuitOpenError as e:
+            # 障害中の依存先はリトライせずに即失敗させる（待ち時間で呼び出し元を滞留させないため）
+            logger.error(str(e))
+            _record_failed_call(prompt, started, attempt, rate_limited, "circuit_open", model)
+            raise
+            
         except Exception as e:
             error_msg = str(e)
             
             # レート制限エラーの処理
             if "rate_limit" in error_msg.lower():
+                rate_limited += 1
                 if attempt < max_retries - 1:
                     wait_time = 2 ** attempt  # 指数バックオフ
                     logger.warning(f"レート制限発生。{wait_time}秒後にリトライします")
@@ -211,6 +374,7 @@ def call_openai_with_retry(
                     continue
                 else:
                     logger.error("レート制限により処理を中断しました")
+                    _record_failed_call(prompt, started, attempt, rate_limited, "rate_limit", model)
                     raise Exception("OpenAI APIのレート制限により処理を中断しました")
             
             # その他のAPIエラー
@@ -220,88 +384,164 @@ def call_openai_with_retry(
                 continue
             else:
                 logger.error(f"OpenAI APIエラー: {error_msg}")
+                _record_failed_call(prompt, started, attempt, rate_limited, "api_error", model)
                 raise Exception(f"OpenAI APIエラー: {error_msg}")
     
     raise Exception("予期しないエラー: 最大リトライ回数に到達しました")
 
 
+def _record_failed_call(
+    prompt: str, started: float, attempt: int, rate_limited: int, error: str, model: str = None
+) -> None:
+    """リトライを使い切って失敗した呼び出しを token_usage.log に記録（トークン消費なし）"""
+    model = model or Config.OPENAI_MODEL
+    append_token_usage({
+        'model': model,
+        'route': route_of_model(model),
+        'prompt_len': len(prompt),
+        'total_latency_ms': round((time.perf_counter() - started) * 1000, 1),
+        'retries': attempt,
+        'rate_limited': rate_limited,
+        'error': error
+    })
+
+
+T = TypeVar("T")
+
+
+def call_openai_routed(
+    prompt: str,
+    temperature: float,
+    max_completion_tokens: int,
+    postprocess: Callable[[str], T],
+    escalate_if: Callable[[T], bool] = None
+) -> T:
+    """
+    ステップタグに応じたモデルで呼び出し、小さいモデルの結果が使えない場合は大きいモデルでやり直す（model_routing）
+
+    Args:
+        prompt: プロンプト
+        temperature: temperature値
+        max_completion_tokens: 最大トークン数
+        postprocess: 応答テキストの解析・検証（不正な応答では例外を送出する）
+        escalate_if: 解析結果を受け取り、大きいモデルでやり直すべきなら True を返す（自信度が低い場合など）
+
+    Returns:
+        postprocess の戻り値
+
+    Raises:
+        Exception: 大きいモデルでの呼び出し・解析に失敗した場合
+    """
+    from resilience import openai_breaker
+    route, model = resolve_model()
+    if route == ROUTE_SMALL and not openai_breaker(model).available():
+        # 小さいモデルが障害中の場合は最初から大きいモデルで呼び出す
+        logger.warning(f"小さいモデル（{model}）が障害中のため、大きいモデルで呼び出します")
+        route, model = ROUTE_LARGE, model_for(ROUTE_LARGE)
+    if route != ROUTE_SMALL:
+        return postprocess(call_openai_with_retry(prompt, temperature, max_completion_tokens, model=model))
+
+    try:
+        result = postprocess(call_openai_with_retry(prompt, temperature, max_completion_tokens, model=model))
+    except Exception as e:
+        reason = "invalid"
+        logger.warning(f"小さいモデル（{model}）の応答が使えないため、大きいモデルでやり直します: {str(e)}")
+    else:
+        if escalate_if is None or not escalate_if(result):
+            return result
+        reason = "low_confidence"
+        logger.info(f"小さいモデル（{model}）の応答の自信度が低いため、大きいモデルでやり直します")
+
+    MODEL_ESCALATIONS.inc(step=current_step() or "-", reason=reason)
+    response_text = call_openai_with_retry(
+        prompt, temperature, max_completion_tokens, model=model_for(ROUTE_LARGE), escalated=True
+    )
+    return postprocess(response_text)
+
+
+@traced("llm.call")
 def call_openai_flex(
     prompt: str,
     temperature: float,
     max_completion_tokens: int,
     system_message: str,
     max_retries: int = None,
+    model: str = None,
 ) -> str:
     """
-    柔軟なシステムメッセージを許可するOpenAI呼び出しラッパー
+    柔軟なシステムメッセージを許可するOpenAI呼び出しラッパー（model の扱いは call_openai_with_retry と同じ）
     """
     if max_retries is None:
         max_retries = Config.MAX_RETRIES
 
-    client = OpenAI(api_key=Config.OPENAI_API_KEY)
+    from llm_transport import get_llm_transport
+    from resilience import CircuitOpenError, openai_breaker
+    transport = get_llm_transport()
+    rate_limited = 0
+    started = time.perf_counter()
+    route, model = (route_of_model(model), model) if model else resolve_model()
+    breaker = openai_breaker(model)
+    set_attributes(model=model, route=route, prompt_chars=len(prompt), max_completion_tokens=max_completion_tokens, flex=True)
 
     for attempt in range(max_retries):
         try:
             logger.info(f"OpenAI API (flex) 呼び出し開始（試行 {attempt + 1}/{max_retries}）")
 
-            response = client.chat.completions.create(
-                model=Config.OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=temperature,
-                max_completion_tokens=max_completion_tokens
-            )
+            attempt_started = time.perf_counter()
+            with start_span("llm.attempt", attempt=attempt + 1), LLM_IN_FLIGHT.track_inprogress(), breaker.guard():
+                response = transport.chat_completion(
+                    build_chat_request_body(prompt, temperature, max_completion_tokens, system_message, model)
+                )
+            latency_ms = round((time.perf_counter() - attempt_started) * 1000, 1)
 
             result = response.choices[0].message.content
             # usage があればログ
-            try:
-                usage = response.usage if hasattr(response, 'usage') else response.get('usage', None)
-            except Exception:
-                usage = None
+            usage = _extract_usage(response)
 
             if usage:
-                try:
-                    p_t = usage.get('prompt_tokens') if isinstance(usage, dict) else getattr(usage, 'prompt_tokens', None)
-                    c_t = usage.get('completion_tokens') if isinstance(usage, dict) else getattr(usage, 'completion_tokens', None)
-                    t_t = usage.get('total_tokens') if isinstance(usage, dict) else getattr(usage, 'total_tokens', None)
-                except Exception:
-                    p_t = c_t = t_t = None
-                logger.info(f"OpenAI API (flex) 呼び出し成功（応答文字数: {len(result)}）。usage: prompt={p_t}, completion={c_t}, total={t_t}")
-                try:
-                    d = {
-                        'model': Config.OPENAI_MODEL,
-                        'prompt_len': len(prompt),
-                        'prompt_tokens': p_t,
-                        'completion_tokens': c_t,
-                        'total_tokens': t_t,
-                        'flex': True
-                    }
-                    Config.LOG_DIR.mkdir(parents=True, exist_ok=True)
-                    token_log_path = Config.LOG_DIR / 'token_usage.log'
-                    with open(token_log_path, 'a', encoding='utf-8') as fh:
-                        fh.write(_json.dumps(d, ensure_ascii=False) + "\n")
-                except Exception:
-                    logger.debug("トークン使用ログの書き込みに失敗しました(flex)")
+                logger.info(
+                    f"OpenAI API (flex) 呼び出し成功（応答文字数: {len(result)}）。"
+                    f"usage: prompt={usage['prompt_tokens']}, completion={usage['completion_tokens']}, total={usage['total_tokens']}"
+                )
             else:
                 logger.info(f"OpenAI API (flex) 呼び出し成功（応答文字数: {len(result)}）")
+            append_token_usage({
+                'model': model,
+                'route': route,
+                'prompt_len': len(prompt),
+                **(usage or {}),
+                'finish_reason': response.choices[0].finish_reason,
+                'latency_ms': latency_ms,
+                'total_latency_ms': round((time.perf_counter() - started) * 1000, 1),
+                'retries': attempt,
+                'rate_limited': rate_limited,
+                'flex': True
+            })
 
             return result
 
+        except CircuitOpenError as e:
+            logger.error(str(e))
+            _record_failed_call(prompt, started, attempt, rate_limited, "circuit_open", model)
+            raise
+
         except Exception as e:
             error_msg = str(e)
+            if "rate_limit" in error_msg.lower():
+                rate_limited += 1
             if attempt < max_retries - 1:
                 logger.warning(f"API (flex) エラー: {error_msg}。リトライします...")
                 time.sleep(Config.RETRY_DELAY)
                 continue
             else:
                 logger.error(f"OpenAI API (flex) エラー: {error_msg}")
+                _record_failed_call(prompt, started, attempt, rate_limited, "api_error", model)
                 raise
 
     raise Exception("予期しないエラー: 最大リトライ回数に到達しました")
 
 
+@profiled("convert_table_data")
 def _convert_table_to_table_data(obj):
     """
     LLM出力中のすべての 'table' キーを再帰的に 'table_data' に変換します。
@@ -329,6 +569,8 @@ def _convert_table_to_table_data(obj):
     return obj
 
 # ==================== JSON解析 ====================
+@traced("parse_json")
+@profiled("parse_json")
 def parse_json_with_retry(response_text: str, max_retries: int = 3) -> Dict[str, Any]:
     """
     JSON解析（失敗時は再試行）
@@ -344,6 +586,7 @@ def parse_json_with_retry(response_text: str, max_retries: int = 3) -> Dict[str,
         Exception: JSON解析に失敗した場合
     """
     original_text = response_text
+    parse_span = current_span()
     
     for attempt in range(max_retries):
         try:
@@ -351,6 +594,8 @@ def parse_json_with_retry(response_text: str, max_retries: int = 3) -> Dict[str,
             result = json.loads(response_text)
             result = _convert_table_to_table_data(result)
             logger.info("JSON解析成功")
+            parse_span.set_attributes(attempts=attempt + 1, strategy="direct" if attempt == 0 else "markdown_cleanup")
+            JSON_PARSE.inc(strategy="direct" if attempt == 0 else "markdown_cleanup")
             return result
             
         except json.JSONDecodeError as e:
@@ -358,11 +603,14 @@ def parse_json_with_retry(response_text: str, max_retries: int = 3) -> Dict[str,
             # Extra dataエラーの場合、最初のJSONオブジェクトのみを抽出
             if "Extra data" in str(e):
                 try:
-                    # JSONデコーダを使用して最初のオブジェクトを抽出
-                    decoder = json.JSONDecoder()
-                    result, idx = decoder.raw_decode(response_text)
-                    result = _convert_table_to_table_data(result)
+                    with start_span("parse_json.extra_data"):
+                        # JSONデコーダを使用して最初のオブジェクトを抽出
+                        decoder = json.JSONDecoder()
+                        result, idx = decoder.raw_decode(response_text)
+                        result = _convert_table_to_table_data(result)
                     logger.info(f"JSON解析成功（最初のオブジェクトのみ抽出、位置: {idx}）")
+                    parse_span.set_attributes(attempts=attempt + 1, strategy="extra_data")
+                    JSON_PARSE.inc(strategy="extra_data")
                     return result
                 except Exception as extract_error:
                     logger.warning(f"最初のJSONオブジェクト抽出に失敗: {str(extract_error)}")
@@ -370,18 +618,19 @@ def parse_json_with_retry(response_text: str, max_retries: int = 3) -> Dict[str,
   
             if attempt < max_retries - 1:
                 # マークダウンコードブロック除去を試みる
-                cleaned = response_text.strip()
-                
-                # ```json ... ``` 除去
-                if cleaned.startswith("```json"):
-                    cleaned = cleaned[7:]
-                elif cleaned.startswith("```"):
-                    cleaned = cleaned[3:]
+                with start_span("parse_json.markdown_cleanup", attempt=attempt + 1):
+                    cleaned = response_text.strip()
                     
-                if cleaned.endswith("```"):
-                    cleaned = cleaned[:-3]
-                
-                response_text = cleaned.strip()
+                    # ```json ... ``` 除去
+                    if cleaned.startswith("```json"):
+                        cleaned = cleaned[7:]
+                    elif cleaned.startswith("```"):
+                        cleaned = cleaned[3:]
+                        
+                    if cleaned.endswith("```"):
+                        cleaned = cleaned[:-3]
+                    
+                    response_text = cleaned.strip()
                 
                 logger.warning(f"JSON解析失敗。クリーニング後に再試行します")
                 continue
@@ -390,40 +639,44 @@ def parse_json_with_retry(response_text: str, max_retries: int = 3) -> Dict[str,
                 logger.error(f"応答内容: {response_text}")  # 応答内容をログに記録
                 # 最後の手段: 応答中の最初の'{'から対応する閉じ括弧までを抽出して再試行
                 try:
-                    text = original_text
-                    starts = [i for i, ch in enumerate(text) if ch == '{']
-                    logger.warning("複数候補のJSON抽出を試行します")
-                    for start in starts:
-                        depth = 0
-                        in_string = False
-                        escape = False
-                        for i in range(start, len(text)):
-                            ch = text[i]
-                            if ch == '\\' and not escape:
-                                escape = True
-                                continue
-                            if ch == '"' and not escape:
-                                in_string = not in_string
+                    with start_span("parse_json.candidate_extraction", text_chars=len(original_text)):
+                        text = original_text
+                        starts = [i for i, ch in enumerate(text) if ch == '{']
+                        logger.warning("複数候補のJSON抽出を試行します")
+                        for start in starts:
+                            depth = 0
+                            in_string = False
                             escape = False
-                            if not in_string:
-                                if ch == '{':
-                                    depth += 1
-                                elif ch == '}':
-                                    depth -= 1
-                                    if depth == 0:
-                                        candidate = text[start:i+1]
-                                        try:
-                                            result = json.loads(candidate)
-                                            result = _convert_table_to_table_data(result)
-                                            logger.info("JSON解析成功（候補抽出後）")
-                                            return result
-                                        except Exception:
-                                            # この候補で失敗したら次の開始位置を試す
-                                            break
-                        # 次の開始位置へ
+                            for i in range(start, len(text)):
+                                ch = text[i]
+                                if ch == '\\' and not escape:
+                                    escape = True
+                                    continue
+                                if ch == '"' and not escape:
+                                    in_string = not in_string
+                                escape = False
+                                if not in_string:
+                                    if ch == '{':
+                                        depth += 1
+                                    elif ch == '}':
+                                        depth -= 1
+                                        if depth == 0:
+                                            candidate = text[start:i+1]
+                                            try:
+                                                result = json.loads(candidate)
+                                                result = _convert_table_to_table_data(result)
+                                                logger.info("JSON解析成功（候補抽出後）")
+                                                parse_span.set_attributes(attempts=attempt + 1, strategy="candidate_extraction")
+                                                JSON_PARSE.inc(strategy="candidate_extraction")
+                                                return result
+                                            except Exception:
+                                                # この候補で失敗したら次の開始位置を試す
+                                                break
+                            # 次の開始位置へ
                 except Exception as e2:
                     logger.error(f"抽出後のJSON解析も失敗: {str(e2)}")
 
+                JSON_PARSE.inc(strategy="failed")
                 raise Exception(
                     f"JSON解析に失敗しました: {str(e)}\n"
                     f"応答: {original_text[:200]}..."
@@ -601,6 +854,7 @@ def format_confidence_score(score: float) -> tuple[str, str]:
         return ("orange", "要確認")
 
 
+@profiled("normalize_table_data")
 def normalize_table_data_structure(final_output: Dict[str, Any]) -> Dict[str, Any]:
     """
     final_output の `table_data` を期待されるフォーマットに正規化します。
@@ -748,6 +1002,7 @@ def _trim_qa_history(history: List[Dict[str, str]]) -> List[Dict[str, str]]:
     return trimmed
 
 
+@traced_run("qa")
 def answer_question(structured_data: Dict[str, Any], question: str, history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
     """
     構造化データを参照して質問に回答する。会話履歴を渡すと文脈を維持する。